@@ -1,6 +1,5 @@
 import json
 import os
-import json
 import sqlite3
 import shutil
 import tempfile
@@ -8,23 +7,34 @@ import zipfile
 from datetime import datetime, timezone
 from pathlib import Path
 
-from flask import Flask, jsonify, request, send_file, render_template_string, redirect, url_for
+from flask import Flask, Response, jsonify, request, send_file, render_template_string, redirect, url_for
 from werkzeug.utils import secure_filename
-from flask import Flask, jsonify, request, send_file
-from flask import Flask, jsonify, send_file, request
+
+from app_server import (
+    ensure_template_block_schema,
+    ensure_template_media_ref_schema,
+    media_offload_mode,
+    missing_media_references,
+    offload_media,
+    rebuild_template_media_refs,
+    replace_template_blocks,
+    snapshot_database,
+    stream_zip,
+    template_blocks,
+)
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def blocks_from_json(raw: str) -> list[dict]:
-    try:
-        payload = json.loads(raw or "{}")
-    except json.JSONDecodeError:
-        return []
-    blocks = payload.get("blocks") if isinstance(payload, dict) else None
-    return blocks if isinstance(blocks, list) else []
+def remap_block_media(conn: sqlite3.Connection, template_id: int, media_id_map: dict[str, int]) -> None:
+    # Content packs carry the exporting database's media ids; point blocks at the imported rows.
+    blocks = template_blocks(conn, template_id)
+    for block in blocks:
+        ref = block["media_item_id"]
+        block["media_item_id"] = media_id_map.get(str(ref)) if ref is not None else None
+    replace_template_blocks(conn, template_id, blocks)
 
 
 def table_exists(connection: sqlite3.Connection, name: str) -> bool:
@@ -81,15 +91,9 @@ def init_db(db_path: Path) -> None:
             )
             """
         )
-
-
-def parse_blocks(raw: str) -> list[dict]:
-    try:
-        payload = json.loads(raw or "{}")
-    except json.JSONDecodeError:
-        return []
-    blocks = payload.get("blocks") if isinstance(payload, dict) else None
-    return blocks if isinstance(blocks, list) else []
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_media_item_filename ON media_item(filename)")
+        ensure_template_block_schema(conn)
+        ensure_template_media_ref_schema(conn)
 
 
 def create_app(test_config: dict | None = None) -> Flask:
@@ -100,7 +104,8 @@ def create_app(test_config: dict | None = None) -> Flask:
         MEDIA_DIR=os.getenv("MEDIA_DIR", "instance/media"),
         VERSION=os.getenv("APP_VERSION", "0.1.0"),
         OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", ""),
-        VERSION=os.getenv("APP_VERSION", "0.1.0"),
+        MEDIA_OFFLOAD=os.getenv("MEDIA_OFFLOAD", ""),
+        MEDIA_OFFLOAD_PREFIX=os.getenv("MEDIA_OFFLOAD_PREFIX", "/protected-media/"),
     )
 
     if test_config:
@@ -190,7 +195,6 @@ def create_app(test_config: dict | None = None) -> Flask:
 
     @app.get("/content-packs")
     def content_packs_index():
-    def list_content_packs():
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
             rows = conn.execute(
@@ -262,33 +266,11 @@ def create_app(test_config: dict | None = None) -> Flask:
         return content_packs_export_internal(ids)
 
     def content_packs_export_internal(raw_ids):
-                        "id": int(row["id"]),
-                        "name": row["name"],
-                        "discipline": row["discipline"],
-                        "duration": int(row["duration_minutes"]),
-                    }
-                    for row in rows
-                ]
-            }
-        )
-
-    @app.post("/content-packs/export")
-    def content_packs_export():
-        payload = request.get_json(silent=True) or {}
-        raw_ids = payload.get("template_ids") or []
         if not isinstance(raw_ids, list):
             raw_ids = [raw_ids]
 
         template_ids = []
         for item in raw_ids:
-    def export_content_pack():
-        payload = request.get_json(silent=True) or {}
-        ids = payload.get("template_ids") or []
-        if not isinstance(ids, list):
-            ids = [ids]
-
-        template_ids = []
-        for item in ids:
             try:
                 template_ids.append(int(item))
             except (TypeError, ValueError):
@@ -301,62 +283,39 @@ def create_app(test_config: dict | None = None) -> Flask:
             conn.row_factory = sqlite3.Row
             placeholders = ",".join("?" for _ in template_ids)
             template_rows = conn.execute(
-            templates = conn.execute(
                 f"SELECT id, name, discipline, duration_minutes, json_blocks FROM session_template WHERE id IN ({placeholders}) ORDER BY id ASC",
                 tuple(template_ids),
             ).fetchall()
-
-            media_ids = set()
-            templates_payload = []
-            for row in template_rows:
-                for block in blocks_from_json(row["json_blocks"]):
-                    block_ref = block.get("media_id")
-                    if block_ref is None:
-                        block_ref = block.get("media_item_id")
-                    try:
-                        media_id = int(block_ref) if block_ref is not None else None
-                    try:
-                        media_id = int(block.get("media_item_id")) if block.get("media_item_id") is not None else None
-            template_payload = []
-            for row in templates:
-                blocks = parse_blocks(row["json_blocks"])
-                for block in blocks:
-                    try:
-                        media_id = int(block.get("media_item_id"))
-                    except (TypeError, ValueError):
-                        media_id = None
-                    if media_id:
-                        media_ids.add(media_id)
-                templates_payload.append(
-                template_payload.append(
-                    {
-                        "id": int(row["id"]),
-                        "name": row["name"],
-                        "discipline": row["discipline"],
-                        "duration": int(row["duration_minutes"]),
-                        "json_blocks": row["json_blocks"],
-                    }
-                )
-
-            media_rows = []
-            if media_ids:
-                media_placeholders = ",".join("?" for _ in media_ids)
-                media_rows = conn.execute(
-                    f"SELECT id, filename, media_type, tags FROM media_item WHERE id IN ({media_placeholders}) ORDER BY id ASC",
-                    tuple(sorted(media_ids)),
-                ).fetchall()
+            media_rows = conn.execute(
+                f"""
+                SELECT DISTINCT m.id, m.filename, m.media_type, m.tags
+                FROM template_media_ref r
+                JOIN media_item m ON m.id = r.media_item_id
+                WHERE r.template_id IN ({placeholders})
+                ORDER BY m.id ASC
+                """,
+                tuple(template_ids),
+            ).fetchall()
+            templates_payload = [
+                {
+                    "id": int(row["id"]),
+                    "name": row["name"],
+                    "discipline": row["discipline"],
+                    "duration": int(row["duration_minutes"]),
+                    "json_blocks": row["json_blocks"],
+                }
+                for row in template_rows
+            ]
 
         content_pack = {
             "version": {"app_version": app.config["VERSION"], "exported_at": utc_now_iso()},
             "templates": templates_payload,
-            "templates": template_payload,
             "media": [
                 {
                     "id": int(row["id"]),
                     "filename": row["filename"],
                     "type": row["media_type"],
                     "tags": [tag.strip() for tag in str(row["tags"] or "").split(",") if tag.strip()],
-                    "tags": row["tags"],
                 }
                 for row in media_rows
             ],
@@ -372,22 +331,11 @@ def create_app(test_config: dict | None = None) -> Flask:
                 path = media_dir / row["filename"]
                 if path.exists() and path.is_file():
                     zf.write(path, arcname=f"media/{row['filename']}")
-        temp_file = tempfile.NamedTemporaryFile(prefix="content_pack_", suffix=".zip", delete=False)
-        temp_path = Path(temp_file.name)
-        temp_file.close()
-
-        with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as archive:
-            archive.writestr("content_pack.json", json.dumps(content_pack, indent=2))
-            for row in media_rows:
-                media_path = media_dir / row["filename"]
-                if media_path.exists() and media_path.is_file():
-                    archive.write(media_path, arcname=f"media/{row['filename']}")
 
         response = send_file(temp_path, mimetype="application/zip", as_attachment=True, download_name="content_pack.zip")
 
         @response.call_on_close
         def _cleanup_temp_export() -> None:
-        def _cleanup() -> None:
             temp_path.unlink(missing_ok=True)
 
         return response
@@ -411,21 +359,30 @@ def create_app(test_config: dict | None = None) -> Flask:
                 payload = json.loads(zf.read("content_pack.json"))
 
                 with sqlite3.connect(db_path) as conn:
-                    for t in payload.get("templates") or []:
-                        conn.execute(
-                            "INSERT INTO session_template (name, discipline, duration_minutes, json_blocks) VALUES (?, ?, ?, ?)",
-                            (t.get("name") or "Imported Template", t.get("discipline") or "general", int(t.get("duration") or 0), t.get("json_blocks") or "{\"blocks\":[]}"),
-                        )
+                    media_id_map = {}
                     for m in payload.get("media") or []:
                         filename = secure_filename(str(m.get("filename") or ""))
                         if not filename:
                             continue
                         if f"media/{filename}" in zf.namelist():
                             (media_dir / filename).write_bytes(zf.read(f"media/{filename}"))
-                        conn.execute(
+                        cursor = conn.execute(
                             "INSERT INTO media_item (filename, media_type, tags) VALUES (?, ?, ?)",
                             (filename, str(m.get("type") or "other"), ", ".join(m.get("tags") or [])),
                         )
+                        media_id_map[str(m.get("id"))] = cursor.lastrowid
+                    # The insert reads json_blocks into template_block once; ids are then remapped in the table.
+                    for t in payload.get("templates") or []:
+                        cursor = conn.execute(
+                            "INSERT INTO session_template (name, discipline, duration_minutes, json_blocks) VALUES (?, ?, ?, ?)",
+                            (
+                                t.get("name") or "Imported Template",
+                                t.get("discipline") or "general",
+                                int(t.get("duration") or 0),
+                                t.get("json_blocks") or "{\"blocks\":[]}",
+                            ),
+                        )
+                        remap_block_media(conn, int(cursor.lastrowid), media_id_map)
                     conn.commit()
         return redirect(url_for("content_packs_ui"))
 
@@ -483,7 +440,6 @@ def create_app(test_config: dict | None = None) -> Flask:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
             rows = conn.execute("SELECT id, name, discipline, duration_minutes, level FROM session_template ORDER BY id DESC").fetchall()
-            rows = conn.execute("SELECT id, name, discipline, duration_minutes FROM session_template ORDER BY id DESC").fetchall()
         if not rows:
             return render_page(
                 "Templates",
@@ -504,7 +460,6 @@ def create_app(test_config: dict | None = None) -> Flask:
         items = "".join(
             f"<li><a href='/templates/builder/{int(r['id'])}'>{r['name']}</a> · {r['discipline']} · {int(r['duration_minutes'])} min · {r['level']} "
             f"<a class='cta' href='/templates/{int(r['id'])}/edit'>Edit</a></li>"
-            f"<li><a href='/templates/builder/{int(r['id'])}'>{r['name']}</a> · {r['discipline']} · {int(r['duration_minutes'])} min</li>"
             for r in rows
         )
         return render_page("Templates", f"<h1>Templates</h1><div class='card'><ul>{items}</ul></div>")
@@ -513,13 +468,12 @@ def create_app(test_config: dict | None = None) -> Flask:
     def templates_create():
         name = (request.form.get("name") or "New Template").strip()
         with sqlite3.connect(db_path) as conn:
-            conn.execute(
+            cursor = conn.execute(
                 "INSERT INTO session_template (name, discipline, duration_minutes, level, json_blocks) VALUES (?, ?, ?, ?, ?)",
-                (name, "general", 30, "all_levels", json.dumps({"blocks": [{"name": "Block 1", "minutes": 30}]})),
-                "INSERT INTO session_template (name, discipline, duration_minutes, json_blocks) VALUES (?, ?, ?, ?)",
-                (name, "general", 30, json.dumps({"blocks": [{"name": "Block 1", "minutes": 30}]})),
+                (name, "general", 30, "all_levels", '{"blocks": []}'),
             )
-            template_id = int(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+            template_id = int(cursor.lastrowid)
+            replace_template_blocks(conn, template_id, [{"name": "Block 1", "minutes": 30}])
             conn.commit()
         return redirect(url_for("template_builder", template_id=template_id))
 
@@ -528,22 +482,22 @@ def create_app(test_config: dict | None = None) -> Flask:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
             template = conn.execute(
-                "SELECT id, name, discipline, duration_minutes, level, json_blocks FROM session_template WHERE id = ?",
+                "SELECT id, name, discipline, duration_minutes, level FROM session_template WHERE id = ?",
                 (template_id,),
             ).fetchone()
             if template is None:
                 return jsonify({"error": "template_not_found"}), 404
             media_items = conn.execute("SELECT id, filename, media_type FROM media_item ORDER BY id DESC").fetchall()
+            blocks = template_blocks(conn, template_id)
 
-        blocks = blocks_from_json(template["json_blocks"])
         block_rows = []
         for idx, block in enumerate(blocks):
             options = ["<option value=''>No media</option>"]
             for item in media_items:
-                selected = "selected" if block.get("media_id") == item["id"] else ""
+                selected = "selected" if block["media_item_id"] == item["id"] else ""
                 options.append(f"<option value='{int(item['id'])}' {selected}>{item['filename']} ({item['media_type']})</option>")
             block_rows.append(
-                f"<div class='card'><strong>{block.get('name', f'Block {idx + 1}')}</strong><br/>"
+                f"<div class='card'><strong>{block['name']}</strong><br/>"
                 f"<select name='media_id_{idx}'>{''.join(options)}</select></div>"
             )
 
@@ -586,21 +540,22 @@ def create_app(test_config: dict | None = None) -> Flask:
 
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
-            template = conn.execute("SELECT id, json_blocks FROM session_template WHERE id = ?", (template_id,)).fetchone()
+            template = conn.execute("SELECT id FROM session_template WHERE id = ?", (template_id,)).fetchone()
             if template is None:
                 return jsonify({"error": "template_not_found"}), 404
 
-            blocks = blocks_from_json(template["json_blocks"])
+            blocks = template_blocks(conn, template_id)
             for idx, block in enumerate(blocks):
                 raw_media = request.form.get(f"media_id_{idx}")
                 try:
-                    block["media_id"] = int(raw_media) if raw_media else None
+                    block["media_item_id"] = int(raw_media) if raw_media else None
                 except ValueError:
-                    block["media_id"] = None
+                    block["media_item_id"] = None
 
+            replace_template_blocks(conn, template_id, blocks)
             conn.execute(
-                "UPDATE session_template SET name = ?, discipline = ?, duration_minutes = ?, level = ?, json_blocks = ? WHERE id = ?",
-                (name or "Untitled Template", discipline, duration_minutes, level, json.dumps({"blocks": blocks}), template_id),
+                "UPDATE session_template SET name = ?, discipline = ?, duration_minutes = ?, level = ? WHERE id = ?",
+                (name or "Untitled Template", discipline, duration_minutes, level, template_id),
             )
             conn.commit()
 
@@ -608,7 +563,11 @@ def create_app(test_config: dict | None = None) -> Flask:
 
     @app.get("/api/export/backup")
     def export_backup():
-        with sqlite3.connect(db_path) as conn:
+        handle = tempfile.NamedTemporaryFile(prefix="flowform_snapshot_", suffix=".db", delete=False)
+        handle.close()
+        snapshot_path = Path(handle.name)
+        snapshot_database(db_path, snapshot_path)
+        with sqlite3.connect(snapshot_path) as conn:
             conn.row_factory = sqlite3.Row
             templates = conn.execute(
                 "SELECT id, name, discipline, duration_minutes, json_blocks FROM session_template ORDER BY id ASC"
@@ -627,25 +586,21 @@ def create_app(test_config: dict | None = None) -> Flask:
             "packs_history": [dict(r) for r in packs_history_rows],
         }
 
-        temp = tempfile.NamedTemporaryFile(prefix="flowform_backup_", suffix=".zip", delete=False)
-        temp_path = Path(temp.name)
-        temp.close()
-        with zipfile.ZipFile(temp_path, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            if db_path.exists():
-                zf.write(db_path, arcname="flowform.db")
-            zf.writestr("flowform_backup.json", json.dumps(snapshot, indent=2))
-            if snapshot["packs_history"]:
-                zf.writestr("packs_history.json", json.dumps(snapshot["packs_history"], indent=2))
-            if media_dir.exists():
-                for item in media_dir.iterdir():
-                    if item.is_file():
-                        zf.write(item, arcname=f"media/{item.name}")
+        entries = [("flowform.db", snapshot_path), ("flowform_backup.json", json.dumps(snapshot, indent=2).encode("utf-8"))]
+        if snapshot["packs_history"]:
+            entries.append(("packs_history.json", json.dumps(snapshot["packs_history"], indent=2).encode("utf-8")))
+        if media_dir.exists():
+            entries += [(f"media/{item.name}", item) for item in sorted(media_dir.iterdir()) if item.is_file()]
 
-        response = send_file(temp_path, mimetype="application/zip", as_attachment=True, download_name="flowform_full_backup.zip")
+        response = Response(
+            stream_zip(entries),
+            mimetype="application/zip",
+            headers={"Content-Disposition": "attachment; filename=flowform_full_backup.zip"},
+        )
 
         @response.call_on_close
         def _cleanup_backup_temp() -> None:
-            temp_path.unlink(missing_ok=True)
+            snapshot_path.unlink(missing_ok=True)
 
         return response
 
@@ -678,31 +633,11 @@ def create_app(test_config: dict | None = None) -> Flask:
                     if item.is_file():
                         shutil.copy2(item, media_dir / item.name)
 
+            # Older backups predate template_block/template_media_ref; init_db creates and backfills them.
+            init_db(db_path)
             with sqlite3.connect(db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                media_rows = conn.execute("SELECT id, filename FROM media_item").fetchall()
-                media_lookup = {int(r["id"]): str(r["filename"]) for r in media_rows}
-                templates = conn.execute("SELECT id, json_blocks FROM session_template").fetchall()
-
-            missing = []
-            for row in templates:
-                for block in blocks_from_json(row["json_blocks"]):
-                    if block.get("media_id") is None and block.get("media_item_id") is None:
-                        continue
-                    media_ref = block.get("media_id") if block.get("media_id") is not None else block.get("media_item_id")
-                    if media_ref is None:
-                        continue
-                    try:
-                        media_id = int(media_ref)
-                    except (TypeError, ValueError):
-                        missing.append({"template_id": int(row["id"]), "media_id": media_ref, "reason": "invalid_media_id"})
-                        continue
-                    filename = media_lookup.get(media_id)
-                    if not filename:
-                        missing.append({"template_id": int(row["id"]), "media_id": media_id, "reason": "media_row_missing"})
-                        continue
-                    if not (media_dir / filename).exists():
-                        missing.append({"template_id": int(row["id"]), "media_id": media_id, "filename": filename, "reason": "media_file_missing"})
+                rebuild_template_media_refs(conn)
+                missing = missing_media_references(conn, media_dir)
 
             if missing:
                 warnings.append({"code": "missing_media_references", "items": missing})
@@ -718,7 +653,7 @@ def create_app(test_config: dict | None = None) -> Flask:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
             template = conn.execute(
-                "SELECT id, name, json_blocks FROM session_template WHERE id = ?",
+                "SELECT id, name FROM session_template WHERE id = ?",
                 (template_id,),
             ).fetchone()
             if template is None:
@@ -726,8 +661,8 @@ def create_app(test_config: dict | None = None) -> Flask:
             media_items = conn.execute(
                 "SELECT id, filename, media_type, tags FROM media_item ORDER BY id DESC"
             ).fetchall()
+            blocks = template_blocks(conn, template_id)
 
-        blocks = blocks_from_json(template["json_blocks"])
         if not media_items:
             no_media_cta = "<p class='muted'>No media yet. <a class='cta' href='/media'>Upload media</a> before attaching it to blocks.</p>"
         else:
@@ -735,10 +670,10 @@ def create_app(test_config: dict | None = None) -> Flask:
         block_forms = "".join(
             f"""
             <div class='card'>
-              <strong>{block.get('name', 'Block')}</strong>
+              <strong>{block['name']}</strong>
               <select name='media_id_{idx}'>
                 <option value=''>No media</option>
-                {''.join([f"<option value='{int(item['id'])}' {'selected' if block.get('media_id') == item['id'] else ''}>{item['filename']} ({item['media_type']})</option>" for item in media_items])}
+                {''.join([f"<option value='{int(item['id'])}' {'selected' if block['media_item_id'] == item['id'] else ''}>{item['filename']} ({item['media_type']})</option>" for item in media_items])}
               </select>
             </div>
             """
@@ -754,29 +689,6 @@ def create_app(test_config: dict | None = None) -> Flask:
               <button class='cta' type='submit'>Save Attachments</button>
             </form>
             """,
-        return render_template_string(
-            """
-            <h1>Template Builder: {{ template['name'] }}</h1>
-            <form method="post" action="{{ url_for('template_builder_save', template_id=template['id']) }}">
-            {% for block in blocks %}
-              <div>
-                <strong>{{ block.get('name', 'Block') }}</strong>
-                <select name="media_id_{{ loop.index0 }}">
-                  <option value="">No media</option>
-                  {% for item in media_items %}
-                    <option value="{{ item['id'] }}" {% if block.get('media_id') == item['id'] %}selected{% endif %}>
-                      {{ item['filename'] }} ({{ item['media_type'] }})
-                    </option>
-                  {% endfor %}
-                </select>
-              </div>
-            {% endfor %}
-              <button type="submit">Save</button>
-            </form>
-            """,
-            template=template,
-            blocks=blocks,
-            media_items=media_items,
         )
 
     @app.post("/templates/builder/<int:template_id>/save")
@@ -784,24 +696,21 @@ def create_app(test_config: dict | None = None) -> Flask:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
             template = conn.execute(
-                "SELECT id, json_blocks FROM session_template WHERE id = ?",
+                "SELECT id FROM session_template WHERE id = ?",
                 (template_id,),
             ).fetchone()
             if template is None:
                 return jsonify({"error": "template_not_found"}), 404
 
-            blocks = blocks_from_json(template["json_blocks"])
+            blocks = template_blocks(conn, template_id)
             for idx, block in enumerate(blocks):
                 raw_media = request.form.get(f"media_id_{idx}")
                 try:
-                    block["media_id"] = int(raw_media) if raw_media else None
+                    block["media_item_id"] = int(raw_media) if raw_media else None
                 except ValueError:
-                    block["media_id"] = None
+                    block["media_item_id"] = None
 
-            conn.execute(
-                "UPDATE session_template SET json_blocks = ? WHERE id = ?",
-                (json.dumps({"blocks": blocks}), template_id),
-            )
+            replace_template_blocks(conn, template_id, blocks)
             conn.commit()
 
         return redirect(url_for("template_builder", template_id=template_id))
@@ -811,9 +720,14 @@ def create_app(test_config: dict | None = None) -> Flask:
         safe_name = secure_filename(filename)
         if not safe_name:
             return jsonify({"error": "invalid_filename"}), 400
+        with sqlite3.connect(db_path) as conn:
+            registered = conn.execute("SELECT 1 FROM media_item WHERE filename = ? LIMIT 1", (safe_name,)).fetchone()
         path = media_dir / safe_name
-        if not path.exists() or not path.is_file():
+        if registered is None or not path.is_file():
             return jsonify({"error": "media_not_found"}), 404
+        offload = media_offload_mode(app.config["MEDIA_OFFLOAD"])
+        if offload:
+            return offload_media(path, safe_name, offload, app.config["MEDIA_OFFLOAD_PREFIX"])
         return send_file(path)
 
     @app.get("/session/player/<int:template_id>")
@@ -821,17 +735,12 @@ def create_app(test_config: dict | None = None) -> Flask:
         with sqlite3.connect(db_path) as conn:
             conn.row_factory = sqlite3.Row
             template = conn.execute(
-                "SELECT id, name, json_blocks FROM session_template WHERE id = ?",
+                "SELECT id, name FROM session_template WHERE id = ?",
                 (template_id,),
             ).fetchone()
             if template is None:
                 return jsonify({"error": "template_not_found"}), 404
-            media_rows = conn.execute("SELECT id, filename, media_type FROM media_item").fetchall()
-        media_map = {int(r["id"]): dict(r) for r in media_rows}
-        blocks = blocks_from_json(template["json_blocks"])
-        for block in blocks:
-            media_id = block.get("media_id")
-            block["media"] = media_map.get(int(media_id)) if media_id else None
+            blocks = template_blocks(conn, template_id, with_media=True)
 
         sections = []
         for block in blocks:
@@ -846,33 +755,11 @@ def create_app(test_config: dict | None = None) -> Flask:
                     media_html += f"<div><audio controls src='{file_url}'></audio></div>"
                 else:
                     media_html += f"<div><img alt='preview' width='240' src='{file_url}' /></div>"
-            sections.append(f"<section class='card'><h2>{block.get('name', 'Block')}</h2>{media_html}</section>")
+            sections.append(f"<section class='card'><h2>{block['name']}</h2>{media_html}</section>")
 
         return render_page(
             "Session Player",
             f"<h1>Session Player: {template['name']}</h1>{''.join(sections)}",
-        return render_template_string(
-            """
-            <h1>Session Player: {{ template['name'] }}</h1>
-            {% for block in blocks %}
-              <section>
-                <h2>{{ block.get('name', 'Block') }}</h2>
-                {% if block.get('media') %}
-                  <div>Attached media: {{ block['media']['filename'] }}</div>
-                  <a href="{{ url_for('media_file', filename=block['media']['filename']) }}">Download</a>
-                  {% if block['media']['media_type'] == 'video' %}
-                    <video controls width="320" src="{{ url_for('media_file', filename=block['media']['filename']) }}"></video>
-                  {% elif block['media']['media_type'] == 'audio' %}
-                    <audio controls src="{{ url_for('media_file', filename=block['media']['filename']) }}"></audio>
-                  {% else %}
-                    <img alt="preview" width="240" src="{{ url_for('media_file', filename=block['media']['filename']) }}" />
-                  {% endif %}
-                {% endif %}
-              </section>
-            {% endfor %}
-            """,
-            template=template,
-            blocks=blocks,
         )
 
     return app
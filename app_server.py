@@ -9,18 +9,29 @@ import os
 import sqlite3
 import subprocess
 import io
+import bisect
 import zipfile
 import tempfile
 import shutil
+import threading
+import time
 import csv
 import urllib.request
 import urllib.error
+from urllib.parse import quote
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as futures_wait
 from datetime import date, datetime, timedelta, timezone
 from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from functools import wraps
+from typing import Callable
 
-from flask import Flask, jsonify, make_response, redirect, render_template, request, send_file, url_for, session
+from flask import Flask, Response, current_app, g, jsonify, make_response, redirect, render_template, request, send_file, url_for, session
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 
@@ -34,6 +45,7 @@ LOG_DIR = ROOT_DIR / "logs"
 DEFAULT_DB_PATH = DATA_DIR / "flowform.db"
 INSTANCE_DIR = ROOT_DIR / "instance"
 MEDIA_DIR = INSTANCE_DIR / "media"
+UPLOAD_DIR = INSTANCE_DIR / "uploads"
 
 DISCIPLINES = ["strength", "cardio", "mobility", "recovery", "conditioning", "endurance"]
 GOAL_DEFAULTS = {
@@ -92,6 +104,14 @@ def utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def iso_day(value) -> str | None:
+    # Rows written before dates were validated may hold timestamps or junk; keep the day part when it parses.
+    try:
+        return date.fromisoformat(str(value)[:10]).isoformat()
+    except ValueError:
+        return None
+
+
 def git_hash() -> str:
     git_dir = ROOT_DIR / ".git"
     if not git_dir.exists():
@@ -128,6 +148,84 @@ def first_check_state(app: Flask) -> dict:
 def is_api_request() -> bool:
     return request.path.startswith('/api/')
 
+SQLITE_STATEMENT_CACHE = 256
+SQLITE_POOL_MAX_IDLE = max(1, int(os.getenv("SQLITE_POOL_MAX_IDLE", "8")))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def open_tuned_connection(db_path: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(db_path, cached_statements=SQLITE_STATEMENT_CACHE, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+def sqlite_sidecar_paths(db_path: Path) -> list[Path]:
+    return [db_path.with_name(db_path.name + suffix) for suffix in ("-wal", "-shm")]
+
+
+class SQLiteConnectionPool:
+    # Warm, pragma-tuned connections shared by every thread. The threaded dev server runs each
+    # request on a fresh thread, so idle connections sit in one LIFO stack (the warmest is reused
+    # first) capped at max_idle. A connection is only used by one thread at a time, but
+    # invalidate() may close it from another thread.
+
+    def __init__(self, db_path: Path, max_idle: int = SQLITE_POOL_MAX_IDLE) -> None:
+        self.db_path = Path(db_path)
+        self.max_idle = max(0, int(max_idle))
+        self._lock = threading.Lock()
+        self._idle: list[tuple[int, sqlite3.Connection]] = []
+        self._generation = 0
+        self._checked_out: dict[int, int] = {}
+
+    def idle_count(self) -> int:
+        with self._lock:
+            return len(self._idle)
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            while self._idle:
+                generation, connection = self._idle.pop()
+                if generation == self._generation:
+                    self._checked_out[id(connection)] = generation
+                    return connection
+                connection.close()
+            generation = self._generation
+        connection = open_tuned_connection(self.db_path)
+        with self._lock:
+            self._checked_out[id(connection)] = generation
+        return connection
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        if connection.in_transaction:
+            connection.rollback()
+        connection.row_factory = None
+        with self._lock:
+            generation = self._checked_out.pop(id(connection), None)
+            if generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append((generation, connection))
+                return
+        connection.close()
+
+    def invalidate(self) -> None:
+        # Called before the database file is swapped (restore): idle connections are
+        # closed now, checked-out ones are closed when they are released.
+        with self._lock:
+            self._generation += 1
+            stale = [connection for _, connection in self._idle]
+            self._idle.clear()
+        for connection in stale:
+            connection.close()
+
+
 def column_exists(connection: sqlite3.Connection, table: str, column: str) -> bool:
     rows = connection.execute(f"PRAGMA table_info({table})").fetchall()
     return any(row[1] == column for row in rows)
@@ -138,9 +236,8 @@ def ensure_column(connection: sqlite3.Connection, table: str, column: str, defin
         connection.execute(f"ALTER TABLE {table} ADD COLUMN {definition_sql}")
 
 
-def apply_schema_migrations(connection: sqlite3.Connection) -> None:
-    now = utc_now_iso()
-
+def migrate_0001_base_schema(connection: sqlite3.Connection) -> None:
+    # Idempotent on purpose: databases created before versioning start at user_version 0.
     connection.execute(
         """
         CREATE TABLE IF NOT EXISTS users (
@@ -337,7 +434,357 @@ def apply_schema_migrations(connection: sqlite3.Connection) -> None:
         )
         """
     )
-    connection.execute("INSERT INTO _healthcheck(checked_at) VALUES (?)", (now,))
+
+
+def migrate_0002_prune_healthcheck(connection: sqlite3.Connection) -> None:
+    # Older builds appended a row on every boot; keep only the latest one.
+    connection.execute("DELETE FROM _healthcheck WHERE id < (SELECT MAX(id) FROM _healthcheck)")
+
+
+def migrate_0003_hot_query_indexes(connection: sqlite3.Connection) -> None:
+    # Composite/covering indexes for the per-user "latest row" lookups and the plan/analytics joins.
+    statements = [
+        "CREATE INDEX IF NOT EXISTS idx_plan_user ON plan(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_profile_user ON profile(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_plan_day_plan_week ON plan_day(plan_id, week, day_index, template_id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_completion_plan_day ON session_completion(plan_day_id, completed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_session_completion_completed_at ON session_completion(completed_at, rpe)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_recovery_checkin_user_date
+        ON recovery_checkin(user_id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10)
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_media_item_user ON media_item(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions(user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_assistant_message_user ON assistant_message(user_id, id)",
+    ]
+    for statement in statements:
+        connection.execute(statement)
+
+
+def migrate_0004_user_daily_stats(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            completions INTEGER NOT NULL DEFAULT 0,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            rpe_sum INTEGER NOT NULL DEFAULT 0,
+            rpe_count INTEGER NOT NULL DEFAULT 0,
+            readiness_score INTEGER,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        """
+    )
+
+    # Backfill from history so the rollup is authoritative from the first request.
+    rebuild_user_daily_stats(connection)
+
+
+def migrate_0005_streak_and_week_counters(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_streak (
+            user_id INTEGER PRIMARY KEY,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            last_active_day TEXT,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS plan_week_progress (
+            plan_id INTEGER NOT NULL,
+            week INTEGER NOT NULL,
+            total_days INTEGER NOT NULL DEFAULT 0,
+            completed_days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (plan_id, week)
+        ) WITHOUT ROWID
+        """
+    )
+    rebuild_user_streaks(connection)
+    rebuild_plan_week_progress(connection)
+
+
+def migrate_0006_plan_spec(connection: sqlite3.Connection) -> None:
+    # Plans without a spec row (created before this migration) are treated as fully materialized.
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS plan_spec (
+            plan_id INTEGER PRIMARY KEY,
+            disciplines TEXT NOT NULL,
+            days_per_week INTEGER NOT NULL,
+            minutes_per_session INTEGER NOT NULL,
+            seed INTEGER NOT NULL DEFAULT 0,
+            template_version INTEGER NOT NULL DEFAULT 0,
+            materialized_through INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(plan_id) REFERENCES plan(id)
+        )
+        """
+    )
+
+
+def migrate_0007_template_block(connection: sqlite3.Connection) -> None:
+    ensure_template_block_schema(connection)
+
+
+def migrate_0008_template_media_ref(connection: sqlite3.Connection) -> None:
+    ensure_template_media_ref_schema(connection)
+
+
+def migrate_0009_media_blob(connection: sqlite3.Connection) -> None:
+    # Files uploaded before this migration keep their own names and a NULL content_sha256.
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_blob (
+            sha256 TEXT PRIMARY KEY,
+            filename TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    ensure_column(connection, "media_item", "content_sha256", "content_sha256 TEXT")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_media_item_sha256 ON media_item(content_sha256)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_media_item_filename ON media_item(filename)")
+
+
+def migrate_0010_upload_session(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS upload_session (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            original_name TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            tags TEXT NOT NULL DEFAULT '',
+            duration_sec INTEGER,
+            total_bytes INTEGER NOT NULL,
+            received_bytes INTEGER NOT NULL DEFAULT 0,
+            expected_sha256 TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+        """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_upload_session_updated_at ON upload_session(updated_at)")
+
+
+def migrate_0011_media_job(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_job (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_item_id INTEGER NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'derivatives',
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            FOREIGN KEY(media_item_id) REFERENCES media_item(id)
+        )
+        """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_media_job_status ON media_job(status, id)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_media_job_media ON media_job(media_item_id)")
+    ensure_column(connection, "media_item", "thumb_filename", "thumb_filename TEXT")
+    ensure_column(connection, "media_item", "width", "width INTEGER")
+    ensure_column(connection, "media_item", "height", "height INTEGER")
+    ensure_column(connection, "media_item", "size_bytes", "size_bytes INTEGER")
+
+
+# parse_tags joins with ", " and never emits an empty tag, so the JSON-quoted string splits cleanly.
+MEDIA_TAG_PROJECTION = """
+    INSERT OR IGNORE INTO media_tag (user_id, tag, media_item_id)
+    SELECT NEW.user_id, value, NEW.id
+    FROM json_each('[' || replace(json_quote(NEW.tags), ', ', '", "') || ']')
+    WHERE value != '';
+"""
+
+
+def migrate_0012_media_tag(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS media_tag (
+            user_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            media_item_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, tag, media_item_id)
+        ) WITHOUT ROWID
+        """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_media_tag_media ON media_tag(media_item_id)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_media_item_user_type ON media_item(user_id, media_type, id)")
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS media_item_tags_insert AFTER INSERT ON media_item BEGIN {MEDIA_TAG_PROJECTION} END"
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS media_item_tags_update AFTER UPDATE OF tags, user_id ON media_item
+        BEGIN
+            DELETE FROM media_tag WHERE media_item_id = OLD.id;
+            {MEDIA_TAG_PROJECTION}
+        END
+        """
+    )
+    connection.execute(
+        "CREATE TRIGGER IF NOT EXISTS media_item_tags_delete AFTER DELETE ON media_item BEGIN DELETE FROM media_tag WHERE media_item_id = OLD.id; END"
+    )
+    connection.execute("UPDATE media_item SET tags = tags")
+
+
+# Which user a row's change belongs to, as the SELECT feeding user_data_version. Shared rows
+# bump user 0, which every user's version includes.
+DATA_VERSION_SOURCES = {
+    "profile": "SELECT {row}.user_id, 1 WHERE {row}.user_id IS NOT NULL",
+    "plan": "SELECT {row}.user_id, 1 WHERE {row}.user_id IS NOT NULL",
+    "recovery_checkin": "SELECT {row}.user_id, 1 WHERE {row}.user_id IS NOT NULL",
+    "media_item": "SELECT {row}.user_id, 1 WHERE {row}.user_id IS NOT NULL",
+    "plan_day": "SELECT p.user_id, 1 FROM plan p WHERE p.id = {row}.plan_id",
+    "plan_spec": "SELECT p.user_id, 1 FROM plan p WHERE p.id = {row}.plan_id",
+    "session_completion": "SELECT p.user_id, 1 FROM plan_day pd JOIN plan p ON p.id = pd.plan_id WHERE pd.id = {row}.plan_day_id",
+    "session_template": "SELECT 0, 1 WHERE true",
+    "app_state": "SELECT 0, 1 WHERE true",
+}
+
+
+def migrate_0013_export_job(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_data_version (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for table, source in DATA_VERSION_SOURCES.items():
+        for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            connection.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_data_version_{event.lower()} AFTER {event} ON {table}
+                BEGIN
+                    INSERT INTO user_data_version (user_id, version) {source.format(row=row)}
+                    ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+                END
+                """
+            )
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS export_job (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            data_version INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            artifact TEXT,
+            download_name TEXT,
+            mimetype TEXT,
+            size_bytes INTEGER,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_export_job_key ON export_job(user_id, kind, params, data_version)")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_export_job_status ON export_job(user_id, status)")
+
+
+def migrate_0014_plan_spec_pins(connection: sqlite3.Connection) -> None:
+    # Existing specs are pinned to the catalog as it is now; they were unpinned before.
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(plan_spec)")}
+    if "template_ids" not in columns:
+        connection.execute("ALTER TABLE plan_spec ADD COLUMN template_ids TEXT")
+    rows = connection.execute(TEMPLATE_CATALOG_SQL).fetchall()
+    if not rows:
+        return
+    index = TemplateIndex(rows, template_catalog_version(rows))
+    specs = connection.execute(
+        """
+        SELECT s.plan_id, s.disciplines, s.days_per_week, s.minutes_per_session, s.seed, p.weeks
+        FROM plan_spec s JOIN plan p ON p.id = s.plan_id
+        WHERE s.template_ids IS NULL
+        """
+    ).fetchall()
+    for plan_id, disciplines, days_per_week, minutes_per_session, seed, weeks in specs:
+        settings = {"disciplines": json.loads(disciplines), "days_per_week": int(days_per_week), "minutes_per_session": int(minutes_per_session)}
+        connection.execute(
+            "UPDATE plan_spec SET template_ids = ?, template_version = ? WHERE plan_id = ?",
+            (pinned_template_ids(index, settings, int(seed), int(weeks)), index.version, plan_id),
+        )
+
+
+def migrate_0015_template_block_source(connection: sqlite3.Connection) -> None:
+    # template_block becomes authoritative: stop re-reading json_blocks on update and rewrite every
+    # template's JSON in the single serializer format.
+    ensure_template_block_schema(connection)
+    rewrite_template_json(connection)
+
+
+def migrate_0016_upload_session_status(connection: sqlite3.Connection) -> None:
+    # 'finalizing' is held by the one finalize request that claimed the session.
+    ensure_column(connection, "upload_session", "status", "status TEXT NOT NULL DEFAULT 'open'")
+
+
+SCHEMA_MIGRATIONS: list[tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "base_schema", migrate_0001_base_schema),
+    (2, "prune_healthcheck", migrate_0002_prune_healthcheck),
+    (3, "hot_query_indexes", migrate_0003_hot_query_indexes),
+    (4, "user_daily_stats", migrate_0004_user_daily_stats),
+    (5, "streak_and_week_counters", migrate_0005_streak_and_week_counters),
+    (6, "plan_spec", migrate_0006_plan_spec),
+    (7, "template_block", migrate_0007_template_block),
+    (8, "template_media_ref", migrate_0008_template_media_ref),
+    (9, "media_blob", migrate_0009_media_blob),
+    (10, "upload_session", migrate_0010_upload_session),
+    (11, "media_job", migrate_0011_media_job),
+    (12, "media_tag", migrate_0012_media_tag),
+    (13, "export_job", migrate_0013_export_job),
+    (14, "plan_spec_pins", migrate_0014_plan_spec_pins),
+    (15, "template_block_source", migrate_0015_template_block_source),
+    (16, "upload_session_status", migrate_0016_upload_session_status),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+
+def schema_version(connection: sqlite3.Connection) -> int:
+    return int(connection.execute("PRAGMA user_version").fetchone()[0])
+
+
+def pending_migrations(connection: sqlite3.Connection) -> list[tuple[int, str]]:
+    current = schema_version(connection)
+    return [(version, name) for version, name, _ in SCHEMA_MIGRATIONS if version > current]
+
+
+def apply_schema_migrations(connection: sqlite3.Connection) -> list[int]:
+    if schema_version(connection) >= SCHEMA_VERSION:
+        return []
+
+    applied = []
+    for version, name, migrate in SCHEMA_MIGRATIONS:
+        # BEGIN IMMEDIATE serializes concurrent boots; re-read the version once the lock is held.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(connection) >= version:
+                connection.rollback()
+                continue
+            migrate(connection)
+            connection.execute(f"PRAGMA user_version = {int(version)}")
+            connection.commit()
+        except sqlite3.Error:
+            connection.rollback()
+            raise
+        logging.getLogger(__name__).info("Applied schema migration %s (%s)", version, name)
+        applied.append(version)
+    return applied
 
 
 def seed_templates(connection: sqlite3.Connection) -> None:
@@ -481,69 +928,145 @@ def preferred_disciplines(payload: dict) -> list[str]:
     return deduped or GOAL_DEFAULTS["hybrid"]
 
 
-def fetch_template_pool(connection: sqlite3.Connection, ordered_disciplines: list[str], target_minutes: int, limit_templates: int | None = None) -> list[dict]:
-    rows = connection.execute(
-        """
-        SELECT id, name, discipline, duration_minutes, level
-        FROM session_template
-        ORDER BY id ASC
-        """
-    ).fetchall()
-    if not rows:
-        return []
+def plan_settings_from_payload(payload: dict) -> dict:
+    goal_raw = str(payload.get("goal", "hybrid")).strip().lower().replace(" ", "_")
+    injury_flags = str(payload.get("injury_flags", "")).strip()
+    extra_constraints = str(payload.get("constraints", "")).strip()
+    return {
+        "goal": goal_raw if goal_raw in GOAL_DEFAULTS else "hybrid",
+        "days_per_week": clamp_int(int(payload.get("days_per_week", 4)), 2, 6),
+        "minutes_per_session": clamp_int(int(payload.get("minutes_per_session", 50)), 30, 75),
+        "weeks": clamp_int(int(payload.get("weeks", PLAN_WEEKS_DEFAULT)), PLAN_WEEKS_MIN, PLAN_WEEKS_MAX),
+        "seed": clamp_int(int(payload["seed"]), 0, 65535) if str(payload.get("seed", "")).strip() else None,
+        "disciplines": preferred_disciplines(payload),
+        "equipment": str(payload.get("equipment", "")).strip(),
+        "constraints": "; ".join(part for part in [injury_flags, extra_constraints] if part),
+    }
 
-    priority = {discipline: idx for idx, discipline in enumerate(ordered_disciplines)}
 
-    mapped = [
-        {
-            "id": int(row[0]),
-            "name": row[1],
-            "discipline": row[2],
-            "duration": int(row[3]),
-            "level": row[4],
-        }
-        for row in rows
-    ]
+class TemplateIndex:
+    """Session templates bucketed by discipline and sorted by duration for nearest-duration picks."""
 
-    mapped.sort(
-        key=lambda item: (
-            priority.get(item["discipline"], 999),
-            abs(item["duration"] - target_minutes),
-            item["id"],
-        )
-    )
-    if limit_templates is not None:
-        return mapped[: max(1, int(limit_templates))]
-    return mapped
+    def __init__(self, rows: list[tuple], version: int) -> None:
+        self.version = version
+        self.templates = [
+            {
+                "id": int(row[0]),
+                "name": row[1],
+                "discipline": row[2],
+                "duration": int(row[3]),
+                "level": row[4],
+            }
+            for row in rows
+        ]
+        grouped: dict[str, list[dict]] = {}
+        for item in self.templates:
+            grouped.setdefault(item["discipline"], []).append(item)
+        self.by_id = {item["id"]: item for item in self.templates}
+        self._all = self._bucket(self.templates)
+        self._by_discipline = {discipline: self._bucket(items) for discipline, items in grouped.items()}
+
+    @staticmethod
+    def _bucket(items: list[dict]) -> tuple[list[int], list[list[dict]], int]:
+        by_duration: dict[int, list[dict]] = {}
+        for item in items:
+            by_duration.setdefault(item["duration"], []).append(item)
+        durations = sorted(by_duration)
+        groups = [sorted(by_duration[duration], key=lambda item: item["id"]) for duration in durations]
+        return durations, groups, len(items)
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    # Versions hash the catalog rows, so an index can stand in for its catalog version in cache keys.
+    def __hash__(self) -> int:
+        return hash(self.version)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, TemplateIndex) and other.version == self.version
+
+    def nearest(self, discipline: str, target_minutes: int, offset: int) -> dict:
+        # Same ranking as sorting by (|duration - target|, id), walked outward from the bisection point.
+        durations, groups, count = self._by_discipline.get(discipline) or self._all
+        rank = offset % count
+        right = bisect.bisect_left(durations, target_minutes)
+        left = right - 1
+        while True:
+            left_gap = target_minutes - durations[left] if left >= 0 else None
+            right_gap = durations[right] - target_minutes if right < len(durations) else None
+            if left_gap is None or (right_gap is not None and right_gap < left_gap):
+                group = groups[right]
+                right += 1
+            elif right_gap is None or left_gap < right_gap:
+                group = groups[left]
+                left -= 1
+            else:
+                group = sorted(groups[left] + groups[right], key=lambda item: item["id"])
+                left -= 1
+                right += 1
+            if rank < len(group):
+                return group[rank]
+            rank -= len(group)
+
+
+_TEMPLATE_INDEXES: dict[str, TemplateIndex] = {}
+_TEMPLATE_INDEX_LOCK = threading.Lock()
+TEMPLATE_CATALOG_SQL = "SELECT id, name, discipline, duration_minutes, level, updated_at FROM session_template ORDER BY id ASC"
+
+
+def template_catalog_version(rows: list[tuple]) -> int:
+    # Same rows, same version in every process; 56 bits keeps it a positive SQLite INTEGER.
+    digest = hashlib.sha256(json.dumps([list(row) for row in rows]).encode("utf-8")).digest()
+    return int.from_bytes(digest[:7], "big")
 
 
-def choose_template_for_day(pool: list[dict], discipline: str, target_minutes: int, offset: int) -> dict:
-    discipline_pool = [item for item in pool if item["discipline"] == discipline]
-    candidate_pool = discipline_pool if discipline_pool else pool
-    ranked = sorted(candidate_pool, key=lambda item: (abs(item["duration"] - target_minutes), item["id"]))
-    return ranked[offset % len(ranked)]
+def template_index(connection: sqlite3.Connection, db_path: Path) -> TemplateIndex:
+    key = str(db_path)
+    index = _TEMPLATE_INDEXES.get(key)
+    if index is not None:
+        return index
+    with _TEMPLATE_INDEX_LOCK:
+        index = _TEMPLATE_INDEXES.get(key)
+        if index is None:
+            rows = connection.execute(TEMPLATE_CATALOG_SQL).fetchall()
+            index = TemplateIndex(rows, template_catalog_version(rows))
+            _TEMPLATE_INDEXES[key] = index
+    return index
+
+
+def connection_db_path(connection: sqlite3.Connection) -> Path:
+    return Path(connection.execute("PRAGMA database_list").fetchone()[2])
+
+
+def invalidate_template_index(db_path: Path) -> None:
+    # Call after the template write has committed so a concurrent rebuild cannot cache stale rows.
+    with _TEMPLATE_INDEX_LOCK:
+        _TEMPLATE_INDEXES.pop(str(db_path), None)
 
 
 def build_plan_structure(
-    pool: list[dict],
+    index: TemplateIndex,
     ordered_disciplines: list[str],
     days_per_week: int,
     minutes_per_session: int,
     weeks: int,
+    first_week: int = 1,
+    seed: int = 0,
 ) -> list[dict]:
     items: list[dict] = []
-    for week in range(1, weeks + 1):
-        # Progressive structure: weeks 1-3 build, week 4 deload.
-        if week <= 2:
+    for week in range(max(1, first_week), weeks + 1):
+        # Progressive 4-week blocks: weeks 1-3 build, week 4 deload; longer plans repeat the block.
+        block_week = (week - 1) % 4 + 1
+        if block_week <= 2:
             target = minutes_per_session
-        elif week == 3:
+        elif block_week == 3:
             target = clamp_int(minutes_per_session + 5, 30, 75)
         else:
             target = clamp_int(minutes_per_session - 5, 30, 75)
 
         for day_index in range(1, days_per_week + 1):
             discipline = ordered_disciplines[(day_index - 1) % len(ordered_disciplines)]
-            choice = choose_template_for_day(pool, discipline, target, offset=week + day_index)
+            choice = index.nearest(discipline, target, offset=seed + week + day_index)
             items.append(
                 {
                     "week": week,
@@ -555,2297 +1078,4310 @@ def build_plan_structure(
     return items
 
 
-def current_plan_record(connection: sqlite3.Connection, user_id: int) -> sqlite3.Row | None:
-    connection.row_factory = sqlite3.Row
+PLAN_WEEKS_DEFAULT = 4
+PLAN_WEEKS_MIN = 4
+PLAN_WEEKS_MAX = 52
+# Weeks stored as plan_day rows at creation / on view: the current week plus this many ahead.
+PLAN_WEEKS_AHEAD = 1
+
+
+def new_plan_seed() -> int:
+    return int.from_bytes(os.urandom(2), "big")
+
+
+def plan_spec(connection: sqlite3.Connection, plan_id: int) -> dict | None:
     row = connection.execute(
         """
-        SELECT id, user_id, name, start_date, weeks, status
-        FROM plan
-        WHERE user_id = ?
-        ORDER BY id DESC
-        LIMIT 1
+        SELECT plan_id, disciplines, days_per_week, minutes_per_session, seed, template_version, materialized_through, template_ids
+        FROM plan_spec
+        WHERE plan_id = ?
         """,
-        (user_id,),
+        (plan_id,),
     ).fetchone()
-    return row
+    if row is None:
+        return None
+    return {
+        "plan_id": int(row[0]),
+        "disciplines": json.loads(row[1]),
+        "days_per_week": int(row[2]),
+        "minutes_per_session": int(row[3]),
+        "seed": int(row[4]),
+        "template_version": int(row[5]),
+        "materialized_through": int(row[6]),
+        "template_ids": json.loads(row[7]) if row[7] else [],
+    }
 
 
-def write_audit(connection: sqlite3.Connection, event: str, payload: dict) -> None:
+def pinned_template_ids(index: TemplateIndex, settings: dict, seed: int, weeks: int) -> str:
+    # The picks for every week, fixed when the spec is written: later catalog edits must not
+    # reshuffle weeks the user has already been shown.
+    pins = [[0] * settings["days_per_week"] for _ in range(weeks)]
+    for item in build_plan_structure(
+        index, settings["disciplines"], settings["days_per_week"], settings["minutes_per_session"], weeks=weeks, seed=seed
+    ):
+        pins[item["week"] - 1][item["day_index"] - 1] = item["template_id"]
+    return json.dumps(pins, separators=(",", ":"))
+
+
+def write_plan_spec(
+    connection: sqlite3.Connection,
+    plan_id: int,
+    settings: dict,
+    seed: int,
+    index: TemplateIndex,
+    weeks: int,
+    materialized_through: int,
+) -> None:
     now = utc_now_iso()
     connection.execute(
         """
-        INSERT INTO audit_log (event, payload_json, created_at, updated_at)
-        VALUES (?, ?, ?, ?)
+        INSERT INTO plan_spec (plan_id, disciplines, days_per_week, minutes_per_session, seed, template_version,
+                               template_ids, materialized_through, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(plan_id) DO UPDATE SET
+            disciplines = excluded.disciplines,
+            days_per_week = excluded.days_per_week,
+            minutes_per_session = excluded.minutes_per_session,
+            template_version = excluded.template_version,
+            template_ids = excluded.template_ids,
+            materialized_through = MAX(plan_spec.materialized_through, excluded.materialized_through),
+            updated_at = excluded.updated_at
         """,
-        (event, json.dumps(payload), now, now),
+        (
+            plan_id, json.dumps(settings["disciplines"]), settings["days_per_week"], settings["minutes_per_session"],
+            seed, index.version, pinned_template_ids(index, settings, seed, weeks), materialized_through, now, now,
+        ),
     )
 
 
+def spec_plan_items(index: TemplateIndex, spec: dict, first_week: int, last_week: int) -> list[dict]:
+    # Pinned picks win; a pick whose template has since been deleted is re-chosen from the live catalog.
+    pins = spec.get("template_ids") or []
+    computed: dict[tuple[int, int], dict] | None = None
+    items: list[dict] = []
+    for week in range(max(1, first_week), last_week + 1):
+        for day_index in range(1, spec["days_per_week"] + 1):
+            row = pins[week - 1] if week <= len(pins) else []
+            template = index.by_id.get(row[day_index - 1]) if day_index <= len(row) else None
+            if template is not None:
+                items.append(
+                    {
+                        "week": week,
+                        "day_index": day_index,
+                        "template_id": template["id"],
+                        "title": f"Week {week} Day {day_index}: {template['name']}",
+                    }
+                )
+                continue
+            if computed is None:
+                computed = {
+                    (item["week"], item["day_index"]): item
+                    for item in build_plan_structure(
+                        index,
+                        spec["disciplines"],
+                        spec["days_per_week"],
+                        spec["minutes_per_session"],
+                        weeks=last_week,
+                        first_week=first_week,
+                        seed=spec["seed"],
+                    )
+                }
+            items.append(computed[(week, day_index)])
+    return items
+
+
+def materialize_plan_weeks(connection: sqlite3.Connection, index: TemplateIndex, plan_id: int, through_week: int) -> int:
+    spec = plan_spec(connection, plan_id)
+    if spec is None or through_week <= spec["materialized_through"]:
+        return 0
+
+    first_week = spec["materialized_through"] + 1
+    present = {
+        (int(row[0]), int(row[1]))
+        for row in connection.execute(
+            "SELECT week, day_index FROM plan_day WHERE plan_id = ? AND week BETWEEN ? AND ?",
+            (plan_id, first_week, through_week),
+        )
+    }
+    now = utc_now_iso()
+    rows = [
+        (plan_id, item["week"], item["day_index"], item["template_id"], item["title"], now, now)
+        for item in spec_plan_items(index, spec, first_week, through_week)
+        if (item["week"], item["day_index"]) not in present
+    ]
+    connection.executemany(
+        """
+        INSERT INTO plan_day (plan_id, week, day_index, template_id, title, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    connection.execute(
+        "UPDATE plan_spec SET materialized_through = ?, updated_at = ? WHERE plan_id = ?",
+        (through_week, now, plan_id),
+    )
+    rebuild_plan_week_progress(connection, plan_id)
+    return len(rows)
+
+
+def materialize_plan_day(connection: sqlite3.Connection, index: TemplateIndex, plan_id: int, week: int, day_index: int) -> int | None:
+    row = connection.execute(
+        "SELECT id FROM plan_day WHERE plan_id = ? AND week = ? AND day_index = ? ORDER BY id LIMIT 1",
+        (plan_id, week, day_index),
+    ).fetchone()
+    if row is not None:
+        return int(row[0])
+    spec = plan_spec(connection, plan_id)
+    if spec is None:
+        return None
+    item = next(
+        (item for item in spec_plan_items(index, spec, week, week) if item["day_index"] == day_index),
+        None,
+    )
+    if item is None:
+        return None
+    now = utc_now_iso()
+    cursor = connection.execute(
+        """
+        INSERT INTO plan_day (plan_id, week, day_index, template_id, title, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (plan_id, week, day_index, item["template_id"], item["title"], now, now),
+    )
+    rebuild_plan_week_progress(connection, plan_id)
+    return int(cursor.lastrowid)
 
-def blocks_from_json(raw: str) -> list[dict]:
-    try:
-        payload = json.loads(raw)
-    except Exception:
-        return []
-    blocks = payload.get("blocks") if isinstance(payload, dict) else None
-    if not isinstance(blocks, list):
-        return []
 
-    normalized = []
-    for idx, block in enumerate(blocks, start=1):
-        if not isinstance(block, dict):
+def with_spec_days(index: TemplateIndex, spec: dict | None, total_weeks: int, rows: list[dict]) -> list[dict]:
+    # Stored rows win; weeks past the materialized horizon are filled in from the spec without writing.
+    if spec is None or spec["materialized_through"] >= total_weeks:
+        return rows
+    present = {(int(row["week"]), int(row["day_index"])) for row in rows}
+    merged = list(rows)
+    for item in spec_plan_items(index, spec, spec["materialized_through"] + 1, total_weeks):
+        if (item["week"], item["day_index"]) in present:
             continue
-        name = str(block.get("name", f"Block {idx}")).strip() or f"Block {idx}"
-        minutes = block.get("minutes", 0)
-        try:
-            minutes_int = max(0, int(minutes))
-        except (TypeError, ValueError):
-            minutes_int = 0
-        media_item_id = block.get("media_item_id")
-        media_id = block.get("media_id")
-        if media_item_id is None and media_id is not None:
-            media_item_id = media_id
-        try:
-            media_item_id = int(media_item_id) if media_item_id is not None else None
-        except (TypeError, ValueError):
-            media_item_id = None
-        normalized.append({
-            "name": name,
-            "minutes": minutes_int,
-            "seconds": minutes_int * 60,
-            "media_item_id": media_item_id,
-            "media_id": media_item_id,
-        })
-    return normalized
+        template = index.by_id.get(item["template_id"], {})
+        merged.append(
+            {
+                "id": None,
+                "plan_id": spec["plan_id"],
+                "week": item["week"],
+                "day_index": item["day_index"],
+                "title": item["title"],
+                "template_id": item["template_id"],
+                "template_name": template.get("name"),
+                "discipline": template.get("discipline"),
+                "duration_minutes": template.get("duration"),
+                "materialized": False,
+            }
+        )
+    merged.sort(key=lambda row: (int(row["week"]), int(row["day_index"])))
+    return merged
 
 
-def parse_tags(raw: str) -> str:
-    parts = [item.strip().lower() for item in str(raw or "").split(",") if item.strip()]
-    deduped = []
-    for item in parts:
-        if item not in deduped:
-            deduped.append(item)
-    return ", ".join(deduped)
+PLAN_PREVIEW_CACHE_SIZE = 512
+# Keyed on the catalog version rather than the index, so superseded indexes are not kept alive.
+_PLAN_PREVIEW_CACHE: dict[tuple, str] = {}
+_PLAN_PREVIEW_STATS = {"hits": 0, "misses": 0}
+_PLAN_PREVIEW_LOCK = threading.Lock()
 
 
-def detect_media_type(filename: str, mimetype_header: str | None) -> str:
-    mime = (mimetype_header or "").lower()
-    if mime.startswith("image/"):
-        return "image"
-    if mime.startswith("video/"):
-        return "video"
-    if mime.startswith("audio/"):
-        return "audio"
-    guessed, _ = mimetypes.guess_type(filename)
-    guessed = (guessed or "").lower()
-    if guessed.startswith("image/"):
-        return "image"
-    if guessed.startswith("video/"):
-        return "video"
-    if guessed.startswith("audio/"):
-        return "audio"
-    return "other"
-
-
-def enrich_blocks_with_media(connection: sqlite3.Connection, blocks: list[dict]) -> list[dict]:
-    media_ids = sorted({int(b.get("media_item_id") or b.get("media_id")) for b in blocks if (b.get("media_item_id") or b.get("media_id"))})
-    media_map: dict[int, dict] = {}
-    if media_ids:
-        placeholders = ",".join("?" for _ in media_ids)
-        connection.row_factory = sqlite3.Row
-        rows = connection.execute(
-            f"SELECT id, filename, original_name, media_type, tags, duration_sec FROM media_item WHERE id IN ({placeholders})",
-            tuple(media_ids),
-        ).fetchall()
-        media_map = {int(r["id"]): dict(r) for r in rows}
-
-    hydrated = []
-    for block in blocks:
-        item = dict(block)
-        mid = item.get("media_item_id") or item.get("media_id")
-        item["media_item_id"] = int(mid) if mid else None
-        item["media_id"] = int(mid) if mid else None
-        item["media"] = media_map.get(int(mid)) if mid else None
-        hydrated.append(item)
-    return hydrated
+def plan_preview_json(
+    index: TemplateIndex,
+    disciplines: tuple[str, ...],
+    days_per_week: int,
+    minutes_per_session: int,
+    weeks: int,
+    seed: int,
+) -> str:
+    # Pure function of the normalized wizard inputs and the template catalog; cached pre-serialized.
+    key = (index.version, disciplines, days_per_week, minutes_per_session, weeks, seed)
+    with _PLAN_PREVIEW_LOCK:
+        body = _PLAN_PREVIEW_CACHE.pop(key, None)
+        if body is not None:
+            _PLAN_PREVIEW_CACHE[key] = body
+            _PLAN_PREVIEW_STATS["hits"] += 1
+            return body
+        _PLAN_PREVIEW_STATS["misses"] += 1
+    body = render_plan_preview(index, disciplines, days_per_week, minutes_per_session, weeks, seed)
+    with _PLAN_PREVIEW_LOCK:
+        _PLAN_PREVIEW_CACHE[key] = body
+        while len(_PLAN_PREVIEW_CACHE) > PLAN_PREVIEW_CACHE_SIZE:
+            del _PLAN_PREVIEW_CACHE[next(iter(_PLAN_PREVIEW_CACHE))]
+    return body
+
+
+def plan_preview_cache_info() -> dict:
+    with _PLAN_PREVIEW_LOCK:
+        return {**_PLAN_PREVIEW_STATS, "size": len(_PLAN_PREVIEW_CACHE)}
+
+
+def plan_preview_cache_clear() -> None:
+    with _PLAN_PREVIEW_LOCK:
+        _PLAN_PREVIEW_CACHE.clear()
+        _PLAN_PREVIEW_STATS.update(hits=0, misses=0)
+
+
+def render_plan_preview(
+    index: TemplateIndex,
+    disciplines: tuple[str, ...],
+    days_per_week: int,
+    minutes_per_session: int,
+    weeks: int,
+    seed: int,
+) -> str:
+    items = build_plan_structure(index, list(disciplines), days_per_week, minutes_per_session, weeks=weeks, seed=seed)
+    weeks_map: dict[int, list[dict]] = {}
+    for item in items:
+        template = index.by_id.get(item["template_id"], {})
+        weeks_map.setdefault(item["week"], []).append(
+            {
+                "day_index": item["day_index"],
+                "template_id": item["template_id"],
+                "title": item["title"],
+                "template_name": template.get("name"),
+                "discipline": template.get("discipline"),
+                "duration_minutes": template.get("duration"),
+            }
+        )
+    return json.dumps(
+        {
+            "ok": True,
+            "template_version": index.version,
+            "seed": seed,
+            "settings": {
+                "disciplines": list(disciplines),
+                "days_per_week": days_per_week,
+                "minutes_per_session": minutes_per_session,
+                "weeks": weeks,
+            },
+            "weeks": [{"week": week, "days": days} for week, days in sorted(weeks_map.items())],
+        }
+    )
 
-def compute_readiness_score(sleep_hours: float, stress: int, soreness: int, mood: int) -> tuple[int, str]:
-    # Explainable weighted score out of 100.
-    sleep_component = max(0.0, min(1.0, sleep_hours / 8.0)) * 40.0
-    stress_component = ((11 - stress) / 10.0) * 20.0
-    soreness_component = ((11 - soreness) / 10.0) * 20.0
-    mood_component = (mood / 10.0) * 20.0
-    score = int(round(max(0.0, min(100.0, sleep_component + stress_component + soreness_component + mood_component))))
 
-    explanation = (
-        f"sleep({sleep_hours}h)->{sleep_component:.1f}/40, "
-        f"stress({stress})->{stress_component:.1f}/20, "
-        f"soreness({soreness})->{soreness_component:.1f}/20, "
-        f"mood({mood})->{mood_component:.1f}/20"
-    )
-    return score, explanation
+def plan_current_week(plan: sqlite3.Row | dict) -> int:
+    elapsed = max(0, (date.today() - date.fromisoformat(plan["start_date"])).days)
+    return min(int(plan["weeks"]), (elapsed // 7) + 1)
 
 
-def readiness_label(score: int) -> str:
-    if score >= 75:
-        return "high"
-    if score >= 55:
-        return "moderate"
-    return "low"
+def profile_plan_settings(connection: sqlite3.Connection, user_id: int) -> dict:
+    profile = connection.execute(
+        "SELECT goal, days_per_week, minutes FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (user_id,),
+    ).fetchone()
+    goal = (profile[0] if profile and profile[0] else "hybrid").strip().lower().replace(" ", "_")
+    return {
+        "days_per_week": clamp_int(int(profile[1]) if profile and profile[1] else 4, 2, 6),
+        "minutes_per_session": clamp_int(int(profile[2]) if profile and profile[2] else 50, 30, 75),
+        "disciplines": GOAL_DEFAULTS.get(goal, GOAL_DEFAULTS["hybrid"]),
+    }
 
 
-def suggestion_for_low_readiness(connection: sqlite3.Connection, minutes: int | None = None) -> dict | None:
-    target = int(minutes or 35)
-    row = connection.execute(
+def replan_weeks(
+    connection: sqlite3.Connection,
+    index: TemplateIndex,
+    plan_id: int,
+    first_week: int,
+    last_week: int,
+    settings: dict,
+    dry_run: bool = False,
+    seed: int = 0,
+    insert_through: int | None = None,
+) -> dict:
+    # Diff the regenerated weeks against the stored rows: completed days are never touched, matching
+    # rows are left alone, and only the remainder is inserted/updated/deleted in bulk. Weeks past
+    # insert_through are not materialized; only rows already stored there are reconciled.
+    desired = {
+        (item["week"], item["day_index"]): item
+        for item in build_plan_structure(
+            index,
+            settings["disciplines"],
+            settings["days_per_week"],
+            settings["minutes_per_session"],
+            weeks=last_week,
+            first_week=first_week,
+            seed=seed,
+        )
+    }
+    existing: dict[tuple[int, int], list[tuple]] = {}
+    for row in connection.execute(
         """
-        SELECT id, name, discipline, duration_minutes
-        FROM session_template
-        WHERE discipline IN ('mobility', 'recovery')
-        ORDER BY ABS(duration_minutes - ?), duration_minutes ASC
-        LIMIT 1
+        SELECT pd.id, pd.week, pd.day_index, pd.template_id, pd.title,
+               EXISTS (SELECT 1 FROM session_completion sc WHERE sc.plan_day_id = pd.id)
+        FROM plan_day pd
+        WHERE pd.plan_id = ? AND pd.week BETWEEN ? AND ?
+        ORDER BY pd.id ASC
         """,
-        (target,),
-    ).fetchone()
-    if row is None:
-        return None
-    return {"id": int(row[0]), "name": row[1], "discipline": row[2], "duration_minutes": int(row[3])}
+        (plan_id, first_week, last_week),
+    ):
+        existing.setdefault((int(row[1]), int(row[2])), []).append(row)
+
+    inserts: list[dict] = []
+    updates: list[tuple[int, dict]] = []
+    deletes: list[int] = []
+    unchanged = 0
+    kept_completed = 0
+    for key in sorted(set(desired) | set(existing)):
+        rows = existing.get(key, [])
+        completed = [row for row in rows if row[5]]
+        open_rows = [row for row in rows if not row[5]]
+        item = desired.get(key)
+        if completed:
+            kept_completed += len(completed)
+            deletes.extend(int(row[0]) for row in open_rows)
+        elif item is None:
+            deletes.extend(int(row[0]) for row in open_rows)
+        elif not open_rows:
+            if insert_through is None or key[0] <= insert_through:
+                inserts.append(item)
+        else:
+            keep, extra = open_rows[0], open_rows[1:]
+            deletes.extend(int(row[0]) for row in extra)
+            if keep[3] == item["template_id"] and keep[4] == item["title"]:
+                unchanged += 1
+            else:
+                updates.append((int(keep[0]), item))
 
+    if not dry_run and (inserts or updates or deletes):
+        now = utc_now_iso()
+        connection.executemany("DELETE FROM plan_day WHERE id = ?", [(plan_day_id,) for plan_day_id in deletes])
+        connection.executemany(
+            "UPDATE plan_day SET template_id = ?, title = ?, updated_at = ? WHERE id = ?",
+            [(item["template_id"], item["title"], now, plan_day_id) for plan_day_id, item in updates],
+        )
+        connection.executemany(
+            """
+            INSERT INTO plan_day (plan_id, week, day_index, template_id, title, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(plan_id, item["week"], item["day_index"], item["template_id"], item["title"], now, now) for item in inserts],
+        )
+        rebuild_plan_week_progress(connection, plan_id)
 
+    return {
+        "plan_id": plan_id,
+        "weeks": [first_week, last_week],
+        "dry_run": dry_run,
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "unchanged": unchanged,
+        "kept_completed": kept_completed,
+        "changes": (
+            [{"action": "insert", **item} for item in inserts]
+            + [{"action": "update", "plan_day_id": plan_day_id, **item} for plan_day_id, item in updates]
+            + [{"action": "delete", "plan_day_id": plan_day_id} for plan_day_id in deletes]
+        ),
+    }
 
-def analytics_snapshot(connection: sqlite3.Connection, user_id: int) -> dict:
-    # Distinct completion dates for streak math.
-    completion_dates = [
-        row[0]
-        for row in connection.execute(
-            """
-            SELECT DISTINCT DATE(completed_at) AS day
-            FROM session_completion
-            ORDER BY day DESC
-            """
-        ).fetchall()
-        if row[0]
-    ]
 
-    streak = 0
-    if completion_dates:
-        today = date.today()
-        date_set = {date.fromisoformat(item) for item in completion_dates}
-        cursor = today
-        while cursor in date_set:
-            streak += 1
-            cursor -= timedelta(days=1)
+COHORT_CHUNK_SIZE = 200
 
-    # Weekly completion rate for current week of active plan.
-    plan = current_plan_record(connection, user_id)
-    weekly_completion_rate = 0
-    if plan is not None and plan["start_date"]:
-        start = date.fromisoformat(plan["start_date"])
-        elapsed = max(0, (date.today() - start).days)
-        current_week = min(int(plan["weeks"]), (elapsed // 7) + 1)
 
-        totals = connection.execute(
-            "SELECT COUNT(*) FROM plan_day WHERE plan_id = ? AND week = ?",
-            (int(plan["id"]), current_week),
-        ).fetchone()[0]
-        completed = connection.execute(
-            """
-            SELECT COUNT(DISTINCT pd.id)
-            FROM plan_day pd
-            JOIN session_completion sc ON sc.plan_day_id = pd.id
-            WHERE pd.plan_id = ? AND pd.week = ?
-            """,
-            (int(plan["id"]), current_week),
-        ).fetchone()[0]
-        if totals > 0:
-            weekly_completion_rate = int(round((completed / totals) * 100))
+def resolve_cohort_users(connection: sqlite3.Connection, profiles: list[dict]) -> list[int | None]:
+    ids = {int(p["user_id"]) for p in profiles if str(p.get("user_id", "")).strip().isdigit()}
+    emails = {str(p["email"]).strip().lower() for p in profiles if p.get("email")}
+    known_ids: set[int] = set()
+    by_email: dict[str, int] = {}
+    if ids:
+        marks = ",".join("?" for _ in ids)
+        known_ids = {int(row[0]) for row in connection.execute(f"SELECT id FROM users WHERE id IN ({marks})", tuple(ids))}
+    if emails:
+        marks = ",".join("?" for _ in emails)
+        by_email = {
+            str(row[1]).lower(): int(row[0])
+            for row in connection.execute(f"SELECT id, email FROM users WHERE lower(email) IN ({marks})", tuple(emails))
+        }
 
-    avg_rpe = {}
-    for days in (7, 14, 30):
-        row = connection.execute(
-            """
-            SELECT AVG(rpe)
-            FROM session_completion
-            WHERE completed_at >= datetime('now', ?)
-            """,
-            (f"-{days} days",),
-        ).fetchone()
-        avg_rpe[str(days)] = round(float(row[0]), 2) if row and row[0] is not None else None
+    resolved: list[int | None] = []
+    for profile in profiles:
+        raw_id = str(profile.get("user_id", "")).strip()
+        if raw_id.isdigit():
+            resolved.append(int(raw_id) if int(raw_id) in known_ids else None)
+        else:
+            resolved.append(by_email.get(str(profile.get("email", "")).strip().lower()))
+    return resolved
+
+
+def create_cohort_plans(
+    connection: sqlite3.Connection,
+    index: TemplateIndex,
+    profiles: list[dict],
+    chunk_size: int = COHORT_CHUNK_SIZE,
+) -> dict:
+    # One BEGIN IMMEDIATE transaction per chunk; a failing chunk is rolled back and reported without
+    # affecting the chunks already committed.
+    results: list[dict] = []
+    chunks: list[dict] = []
+    seen: set[int] = set()
+    chunk_size = max(1, int(chunk_size))
+
+    for start in range(0, len(profiles), chunk_size):
+        batch = profiles[start:start + chunk_size]
+        user_ids = resolve_cohort_users(connection, batch)
+        now = utc_now_iso()
+        today = date.today().isoformat()
 
-    readiness_rows = connection.execute(
-        """
-        SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10
-        FROM recovery_checkin
-        WHERE user_id = ?
-        ORDER BY date DESC
-        LIMIT 14
-        """,
-        (user_id,),
-    ).fetchall()
+        planned: list[dict] = []
+        for position, (profile, user_id) in enumerate(zip(batch, user_ids), start=start):
+            result = {"index": position, "user_id": user_id, "email": profile.get("email")}
+            results.append(result)
+            if user_id is None:
+                result.update(ok=False, error="user_not_found")
+                continue
+            if user_id in seen:
+                result.update(ok=False, error="duplicate_user")
+                continue
+            seen.add(user_id)
+            started = time.perf_counter()
+            try:
+                settings = plan_settings_from_payload(profile)
+            except (TypeError, ValueError):
+                result.update(ok=False, error="invalid_profile")
+                continue
+            seed = settings["seed"] if settings["seed"] is not None else new_plan_seed()
+            materialized_through = min(settings["weeks"], 1 + PLAN_WEEKS_AHEAD)
+            items = build_plan_structure(
+                index,
+                settings["disciplines"],
+                settings["days_per_week"],
+                settings["minutes_per_session"],
+                weeks=materialized_through,
+                seed=seed,
+            )
+            result["build_ms"] = round((time.perf_counter() - started) * 1000, 3)
+            planned.append(
+                {
+                    "result": result,
+                    "user_id": user_id,
+                    "settings": settings,
+                    "seed": seed,
+                    "materialized_through": materialized_through,
+                    "items": items,
+                }
+            )
 
-    readiness_trend = []
-    for row in reversed(readiness_rows):
-        score, _ = compute_readiness_score(
-            float(row[1] or 0),
-            int(row[2] or 5),
-            int(row[3] or 5),
-            int(row[4] or 5),
-        )
-        readiness_trend.append({"date": row[0], "score": score})
+        if not planned:
+            continue
 
-    # Card takeaways
-    streak_takeaway = "Excellent momentum — keep the chain alive today." if streak >= 3 else "Start or restart the streak with one focused session today."
-    weekly_takeaway = (
-        "On track this week — maintain your rhythm." if weekly_completion_rate >= 70
-        else "Below target this week — schedule one catch-up session."
-    )
+        started = time.perf_counter()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            marks = ",".join("?" for _ in planned)
+            latest_profiles = {
+                int(row[0]): int(row[1])
+                for row in connection.execute(
+                    f"SELECT user_id, MAX(id) FROM profile WHERE user_id IN ({marks}) GROUP BY user_id",
+                    tuple(entry["user_id"] for entry in planned),
+                )
+            }
+            connection.executemany(
+                """
+                UPDATE profile
+                SET goal = ?, days_per_week = ?, minutes = ?, equipment = ?, constraints = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                [
+                    (
+                        entry["settings"]["goal"], entry["settings"]["days_per_week"], entry["settings"]["minutes_per_session"],
+                        entry["settings"]["equipment"], entry["settings"]["constraints"], now, latest_profiles[entry["user_id"]],
+                    )
+                    for entry in planned
+                    if entry["user_id"] in latest_profiles
+                ],
+            )
+            connection.executemany(
+                """
+                INSERT INTO profile (user_id, goal, days_per_week, minutes, equipment, constraints, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        entry["user_id"], entry["settings"]["goal"], entry["settings"]["days_per_week"],
+                        entry["settings"]["minutes_per_session"], entry["settings"]["equipment"], entry["settings"]["constraints"], now, now,
+                    )
+                    for entry in planned
+                    if entry["user_id"] not in latest_profiles
+                ],
+            )
+            connection.executemany(
+                "UPDATE plan SET status = 'archived', updated_at = ? WHERE user_id = ? AND status = 'active'",
+                [(now, entry["user_id"]) for entry in planned],
+            )
 
-    rpe_7 = avg_rpe.get("7")
-    if rpe_7 is None:
-        rpe_takeaway = "No recent RPE data yet — finish a session to start insights."
-    elif rpe_7 >= 8:
-        rpe_takeaway = "Recent effort is high — consider extra recovery emphasis."
-    elif rpe_7 <= 5:
-        rpe_takeaway = "Recent effort is moderate/low — safe room to push when ready."
-    else:
-        rpe_takeaway = "Recent effort is balanced — keep progressive overload steady."
+            # Ids are assigned up front (the write lock is held) so plans can go through executemany too.
+            next_id = connection.execute(
+                """
+                SELECT MAX(
+                    COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'plan'), 0),
+                    COALESCE((SELECT MAX(id) FROM plan), 0)
+                )
+                """
+            ).fetchone()[0]
+            for offset, entry in enumerate(planned, start=1):
+                entry["plan_id"] = int(next_id) + offset
+            connection.executemany(
+                """
+                INSERT INTO plan (id, user_id, name, start_date, weeks, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, 'active', ?, ?)
+                """,
+                [
+                    (
+                        entry["plan_id"], entry["user_id"],
+                        f"{entry['settings']['goal'].replace('_', ' ').title()} {entry['settings']['weeks']}-Week Plan",
+                        today, entry["settings"]["weeks"], now, now,
+                    )
+                    for entry in planned
+                ],
+            )
+            connection.executemany(
+                """
+                INSERT INTO plan_spec (plan_id, disciplines, days_per_week, minutes_per_session, seed, template_version,
+                                       template_ids, materialized_through, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        entry["plan_id"], json.dumps(entry["settings"]["disciplines"]), entry["settings"]["days_per_week"],
+                        entry["settings"]["minutes_per_session"], entry["seed"], index.version,
+                        pinned_template_ids(index, entry["settings"], entry["seed"], entry["settings"]["weeks"]),
+                        entry["materialized_through"], now, now,
+                    )
+                    for entry in planned
+                ],
+            )
+            connection.executemany(
+                """
+                INSERT INTO plan_day (plan_id, week, day_index, template_id, title, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (entry["plan_id"], item["week"], item["day_index"], item["template_id"], item["title"], now, now)
+                    for entry in planned
+                    for item in entry["items"]
+                ],
+            )
+            week_totals: dict[tuple[int, int], int] = {}
+            for entry in planned:
+                for item in entry["items"]:
+                    key = (entry["plan_id"], item["week"])
+                    week_totals[key] = week_totals.get(key, 0) + 1
+            connection.executemany(
+                "INSERT INTO plan_week_progress (plan_id, week, total_days, completed_days) VALUES (?, ?, ?, 0)",
+                [(plan_id, week, total) for (plan_id, week), total in week_totals.items()],
+            )
+            write_audit(
+                connection,
+                "cohort_plans_created",
+                {"plan_ids": [entry["plan_id"] for entry in planned], "template_index_version": index.version},
+            )
+            connection.commit()
+        except sqlite3.Error as exc:
+            connection.rollback()
+            for entry in planned:
+                entry["result"].update(ok=False, error=str(exc))
+            chunks.append({"start": start, "users": len(planned), "ok": False, "write_ms": None})
+            continue
 
-    if readiness_trend:
-        latest = readiness_trend[-1]["score"]
-        readiness_takeaway = "Recovery trend is low — choose a lighter session suggestion today." if latest < 55 else "Recovery trend is supportive — proceed with planned intensity."
-    else:
-        readiness_takeaway = "No readiness trend yet — add daily recovery check-ins."
+        write_ms = round((time.perf_counter() - started) * 1000, 3)
+        chunks.append({"start": start, "users": len(planned), "ok": True, "write_ms": write_ms})
+        for entry in planned:
+            entry["result"].update(ok=True, plan_id=entry["plan_id"], days=len(entry["items"]), chunk_write_ms=write_ms)
 
     return {
-        "streak": streak,
-        "weekly_completion_rate": weekly_completion_rate,
-        "avg_rpe": avg_rpe,
-        "readiness_trend": readiness_trend,
-        "takeaways": {
-            "streak": streak_takeaway,
-            "weekly": weekly_takeaway,
-            "rpe": rpe_takeaway,
-            "readiness": readiness_takeaway,
-        },
+        "created": sum(1 for result in results if result.get("ok")),
+        "failed": sum(1 for result in results if not result.get("ok")),
+        "results": results,
+        "chunks": chunks,
     }
 
 
-def assistant_disclaimer() -> str:
-    return "I’m a digital coach, not a healthcare professional. This guidance is educational, not medical advice."
-
-
-def has_medical_risk_signal(text: str) -> bool:
-    needles = [
-        "injury", "injured", "severe", "chest pain", "faint", "fainted", "dizzy", "dizziness",
-        "bleeding", "concussion", "fracture", "cannot breathe", "shortness of breath",
-    ]
-    low = str(text or "").lower()
-    return any(n in low for n in needles)
-
-
-def assistant_context(connection: sqlite3.Connection, user_id: int) -> dict:
+def current_plan_record(connection: sqlite3.Connection, user_id: int) -> sqlite3.Row | None:
     connection.row_factory = sqlite3.Row
-    plan = current_plan_record(connection, user_id)
-    profile = connection.execute(
-        "SELECT goal, days_per_week, minutes, equipment, constraints FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
-        (user_id,),
-    ).fetchone()
-    recovery = connection.execute(
-        "SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes FROM recovery_checkin WHERE user_id = ? ORDER BY date DESC LIMIT 1",
-        (user_id,),
-    ).fetchone()
-    completions_7d = connection.execute(
+    row = connection.execute(
         """
-        SELECT COUNT(*)
-        FROM session_completion sc
-        JOIN plan_day pd ON pd.id = sc.plan_day_id
-        JOIN plan p ON p.id = pd.plan_id
-        WHERE p.user_id = ? AND sc.completed_at >= datetime('now', '-7 days')
+        SELECT id, user_id, name, start_date, weeks, status
+        FROM plan
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT 1
         """,
         (user_id,),
-    ).fetchone()[0]
+    ).fetchone()
+    return row
 
-    readiness = None
-    if recovery is not None:
-        score, explanation = compute_readiness_score(
-            float(recovery["sleep_hours"] or 0),
-            int(recovery["stress_1_10"] or 5),
-            int(recovery["soreness_1_10"] or 5),
-            int(recovery["mood_1_10"] or 5),
-        )
-        readiness = {"score": score, "label": readiness_label(score), "explanation": explanation}
 
-    return {
-        "plan": dict(plan) if plan else None,
-        "profile": dict(profile) if profile else None,
-        "recovery": dict(recovery) if recovery else None,
-        "completions_7d": int(completions_7d),
-        "readiness": readiness,
-    }
+def write_audit(connection: sqlite3.Connection, event: str, payload: dict) -> None:
+    now = utc_now_iso()
+    connection.execute(
+        """
+        INSERT INTO audit_log (event, payload_json, created_at, updated_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        (event, json.dumps(payload), now, now),
+    )
 
 
-def assistant_rules_reply(action: str, message: str, ctx: dict) -> tuple[str, str]:
-    if has_medical_risk_signal(message):
-        return (
-            "Your message suggests injury or severe symptoms. Consider seeking medical advice promptly. If symptoms are urgent or worsening, seek immediate care.",
-            "escalation",
-        )
 
-    readiness = (ctx.get("readiness") or {}).get("score")
-    goal = ((ctx.get("profile") or {}).get("goal") or "hybrid").replace("_", " ")
-    completions = int(ctx.get("completions_7d") or 0)
+# template_block is the source of truth for blocks; session_template.json_blocks is a compatibility
+# copy rewritten from it by replace_template_blocks. Templates inserted with JSON (seeds, content
+# packs, older databases, direct SQL) are read into the table once, here. Older writers used
+# "media_item_id" for the media key.
+def template_block_projection(row: str, source: str = "") -> str:
+    return f"""
+    INSERT INTO template_block (template_id, position, name, minutes, media_item_id)
+    SELECT
+        {row}.id,
+        CAST(key AS INTEGER) + 1,
+        COALESCE(NULLIF(TRIM(CAST(json_extract(value, '$.name') AS TEXT)), ''), 'Block ' || (CAST(key AS INTEGER) + 1)),
+        MAX(0, CAST(COALESCE(json_extract(value, '$.minutes'), 0) AS INTEGER)),
+        NULLIF(CAST(COALESCE(json_extract(value, '$.media_id'), json_extract(value, '$.media_item_id')) AS INTEGER), 0)
+    FROM {source} json_each(
+        CASE WHEN json_valid({row}.json_blocks) THEN
+            CASE WHEN json_type({row}.json_blocks, '$.blocks') = 'array' THEN {row}.json_blocks END
+        END,
+        '$.blocks'
+    )
+    WHERE type = 'object';
+"""
 
-    if action == "plan_tweak":
-        if readiness is not None and readiness < 55:
-            return ("Readiness looks low. Keep the next 1-2 sessions lighter, reduce volume by ~20%, and prioritize mobility/recovery.", "rules")
-        return (f"For your {goal} goal: keep core structure, add one progressive overload day, and one technique/recovery day this week.", "rules")
-    if action == "substitution":
-        if readiness is not None and readiness < 55:
-            return ("Suggested substitution: switch today to a 30-35 minute recovery/mobility template at RPE 4-5.", "rules")
-        return ("Suggested substitution: pick the same discipline with ~10% lower duration while maintaining form quality.", "rules")
-    if action == "recovery":
-        if readiness is not None and readiness < 55:
-            return ("Recovery advice: hydrate, optimize sleep tonight, and avoid max-effort work today.", "rules")
-        return ("Recovery advice: maintain sleep rhythm and complete planned work at controlled effort.", "rules")
-    if action == "motivation":
-        if completions >= 3:
-            return ("You’re building consistency—protect your streak with a focused, realistic session today.", "rules")
-        return ("Momentum starts small. Finish a short session today and let consistency compound.", "rules")
 
-    return ("I can help with plan tweaks, substitutions, recovery advice, and motivation using your recent plan/recovery context.", "rules")
+def ensure_template_block_schema(connection: sqlite3.Connection) -> None:
+    created = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'template_block'"
+    ).fetchone() is None
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS template_block (
+            template_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            minutes INTEGER NOT NULL DEFAULT 0,
+            media_item_id INTEGER,
+            PRIMARY KEY (template_id, position)
+        ) WITHOUT ROWID
+        """
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_template_block_media ON template_block(media_item_id) WHERE media_item_id IS NOT NULL"
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS session_template_blocks_insert AFTER INSERT ON session_template
+        BEGIN
+            {template_block_projection("NEW")}
+        END
+        """
+    )
+    # Earlier schemas re-read json_blocks on every update; blocks are now written to the table directly.
+    connection.execute("DROP TRIGGER IF EXISTS session_template_blocks_update")
+    connection.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS session_template_blocks_delete AFTER DELETE ON session_template
+        BEGIN
+            DELETE FROM template_block WHERE template_id = OLD.id;
+        END
+        """
+    )
+    if created:
+        connection.execute(template_block_projection("st", "session_template st,"))
 
 
-def assistant_llm_reply(api_key: str, action: str, message: str, ctx: dict) -> str:
-    system = (
-        "You are a concise fitness coach. Never provide medical diagnosis. "
-        "For injury/severe symptoms, advise seeking medical care. Provide practical, safe guidance in <=6 sentences."
+def ensure_template_media_ref_schema(connection: sqlite3.Connection) -> None:
+    # Reverse index media -> templates, maintained from template_block so every template write
+    # (builder, content-pack import, restored databases after a rebuild) keeps it current.
+    created = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'template_media_ref'"
+    ).fetchone() is None
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS template_media_ref (
+            media_item_id INTEGER NOT NULL,
+            template_id INTEGER NOT NULL,
+            block_count INTEGER NOT NULL,
+            PRIMARY KEY (media_item_id, template_id)
+        ) WITHOUT ROWID
+        """
     )
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps({"action": action, "message": message, "context": ctx}, ensure_ascii=False)},
-        ],
-        "temperature": 0.3,
-        "max_tokens": 240,
-    }
-    req = urllib.request.Request(
-        "https://api.openai.com/v1/chat/completions",
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-        method="POST",
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS idx_template_media_ref_template ON template_media_ref(template_id, media_item_id)"
     )
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
-    return str(data["choices"][0]["message"]["content"]).strip()
-
+    add_ref = """
+        INSERT INTO template_media_ref (media_item_id, template_id, block_count)
+        SELECT NEW.media_item_id, NEW.template_id, 1 WHERE NEW.media_item_id IS NOT NULL
+        ON CONFLICT(media_item_id, template_id) DO UPDATE SET block_count = block_count + 1;
+    """
+    drop_ref = """
+        UPDATE template_media_ref SET block_count = block_count - 1
+        WHERE media_item_id = OLD.media_item_id AND template_id = OLD.template_id;
+        DELETE FROM template_media_ref
+        WHERE media_item_id = OLD.media_item_id AND template_id = OLD.template_id AND block_count <= 0;
+    """
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS template_block_ref_insert AFTER INSERT ON template_block BEGIN {add_ref} END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS template_block_ref_delete AFTER DELETE ON template_block BEGIN {drop_ref} END"
+    )
+    connection.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS template_block_ref_update AFTER UPDATE OF template_id, media_item_id ON template_block
+        BEGIN {drop_ref} {add_ref} END
+        """
+    )
+    if created:
+        rebuild_template_media_refs(connection)
 
-def export_snapshot(connection: sqlite3.Connection, user_id: int) -> dict:
-    connection.row_factory = sqlite3.Row
-    plan = current_plan_record(connection, user_id)
 
-    profile = connection.execute(
+def rebuild_template_media_refs(connection: sqlite3.Connection) -> None:
+    connection.execute("DELETE FROM template_media_ref")
+    connection.execute(
         """
-        SELECT goal, days_per_week, minutes, equipment, constraints, created_at, updated_at
-        FROM profile
-        WHERE user_id = ?
-        ORDER BY id DESC
-        LIMIT 1
-        """,
-        (user_id,),
-    ).fetchone()
-
-    plan_days = []
-    completions = []
-    if plan is not None:
-        plan_days = [
-            dict(row)
-            for row in connection.execute(
-                """
-                SELECT pd.id, pd.plan_id, pd.week, pd.day_index, pd.title, pd.created_at, pd.updated_at,
-                       st.id AS template_id, st.name AS template_name, st.discipline, st.duration_minutes
-                FROM plan_day pd
-                LEFT JOIN session_template st ON st.id = pd.template_id
-                WHERE pd.plan_id = ?
-                ORDER BY pd.week ASC, pd.day_index ASC
-                """,
-                (int(plan["id"]),),
-            ).fetchall()
-        ]
+        INSERT INTO template_media_ref (media_item_id, template_id, block_count)
+        SELECT media_item_id, template_id, COUNT(*)
+        FROM template_block
+        WHERE media_item_id IS NOT NULL
+        GROUP BY media_item_id, template_id
+        """
+    )
 
-        completions = [
-            dict(row)
-            for row in connection.execute(
-                """
-                SELECT sc.id, sc.plan_day_id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done, sc.created_at, sc.updated_at
-                FROM session_completion sc
-                JOIN plan_day pd ON pd.id = sc.plan_day_id
-                WHERE pd.plan_id = ?
-                ORDER BY sc.completed_at DESC
-                """,
-                (int(plan["id"]),),
-            ).fetchall()
-        ]
 
-    templates = [
-        dict(row)
+def media_usage(connection: sqlite3.Connection, media_item_id: int) -> list[dict]:
+    return [
+        {"template_id": int(row[0]), "name": row[1], "blocks": int(row[2])}
         for row in connection.execute(
             """
-            SELECT id, name, discipline, duration_minutes, level, json_blocks, created_at, updated_at
-            FROM session_template
-            ORDER BY id ASC
-            """
-        ).fetchall()
+            SELECT r.template_id, st.name, r.block_count
+            FROM template_media_ref r
+            JOIN session_template st ON st.id = r.template_id
+            WHERE r.media_item_id = ?
+            ORDER BY r.template_id
+            """,
+            (media_item_id,),
+        )
     ]
 
-    recovery = [
-        dict(row)
+
+def orphan_media(connection: sqlite3.Connection, user_id: int | None = None) -> list[dict]:
+    where, params = ("WHERE m.user_id = ? AND", (user_id,)) if user_id is not None else ("WHERE", ())
+    return [
+        {"id": int(row[0]), "filename": row[1]}
         for row in connection.execute(
-            """
-            SELECT id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes, created_at, updated_at
-            FROM recovery_checkin
-            WHERE user_id = ?
-            ORDER BY date DESC
+            f"""
+            SELECT m.id, m.filename
+            FROM media_item m
+            {where} NOT EXISTS (SELECT 1 FROM template_media_ref r WHERE r.media_item_id = m.id)
+            ORDER BY m.id
             """,
-            (user_id,),
-        ).fetchall()
+            params,
+        )
     ]
 
+
+MEDIA_PAGE_SIZE = 50
+MEDIA_TYPES = ("image", "video", "audio")
+
+
+def media_page(
+    connection: sqlite3.Connection,
+    user_id: int,
+    columns: str,
+    before: int | None = None,
+    tag: str | None = None,
+    media_type: str | None = None,
+    limit: int = MEDIA_PAGE_SIZE,
+) -> tuple[list, int | None]:
+    # Keyset pagination, newest first: each page is one index range read, however deep it is.
+    # A tag filter walks media_tag's (user_id, tag, media_item_id) key instead of media_item.
+    if tag:
+        source, conditions, params = "media_tag t JOIN media_item m ON m.id = t.media_item_id", ["t.user_id = ?", "t.tag = ?"], [user_id, tag]
+        key = "t.media_item_id"
+    else:
+        source, conditions, params, key = "media_item m", ["m.user_id = ?"], [user_id], "m.id"
+    if media_type:
+        conditions.append("m.media_type = ?")
+        params.append(media_type)
+    if before is not None:
+        conditions.append(f"{key} < ?")
+        params.append(before)
+    rows = connection.execute(
+        f"SELECT {columns} FROM {source} WHERE {' AND '.join(conditions)} ORDER BY {key} DESC LIMIT ?",
+        (*params, limit + 1),
+    ).fetchall()
+    if len(rows) > limit:
+        return rows[:limit], int(rows[limit - 1]["id"])
+    return rows, None
+
+
+def media_page_args(args) -> dict:
+    try:
+        before = int(args["before"]) if args.get("before") else None
+    except ValueError:
+        before = None
+    media_type = str(args.get("type") or "").strip().lower()
     return {
-        "exported_at": utc_now_iso(),
-        "app": {"name": APP_NAME, "version": APP_VERSION},
-        "user": {"id": user_id},
-        "profile": dict(profile) if profile else None,
-        "plan": dict(plan) if plan else None,
-        "plan_days": plan_days,
-        "templates": templates,
-        "completions": completions,
-        "recovery": recovery,
+        "before": before,
+        "tag": parse_tags(str(args.get("tag") or "")).split(", ")[0] or None,
+        "media_type": media_type if media_type in MEDIA_TYPES else None,
     }
 
 
-def render_plan_export_html(payload: dict) -> str:
-    plan = payload.get("plan") or {}
-    profile = payload.get("profile") or {}
-    days = payload.get("plan_days") or []
-    completions = {item["plan_day_id"]: item for item in (payload.get("completions") or [])}
+def media_tag_counts(connection: sqlite3.Connection, user_id: int) -> list[dict]:
+    return [
+        {"tag": row[0], "count": int(row[1])}
+        for row in connection.execute("SELECT tag, COUNT(*) FROM media_tag WHERE user_id = ? GROUP BY tag ORDER BY tag", (user_id,))
+    ]
 
-    rows = []
-    for item in days:
-        status = "Completed" if item["id"] in completions else "Pending"
-        rows.append(
-            f"<tr><td>{item['week']}</td><td>{item['day_index']}</td><td>{item.get('title','')}</td><td>{item.get('template_name','')}</td><td>{item.get('discipline','')}</td><td>{item.get('duration_minutes','')}</td><td>{status}</td></tr>"
+
+def missing_media_references(connection: sqlite3.Connection, media_dir: Path) -> list[dict]:
+    missing = []
+    rows = connection.execute(
+        """
+        SELECT r.template_id, r.media_item_id, m.filename
+        FROM template_media_ref r
+        LEFT JOIN media_item m ON m.id = r.media_item_id
+        ORDER BY r.template_id, r.media_item_id
+        """
+    )
+    present: dict[str, bool] = {}
+    for template_id, media_id, filename in rows:
+        if filename is None:
+            missing.append({"template_id": int(template_id), "media_id": int(media_id), "reason": "media_row_missing"})
+            continue
+        if filename not in present:
+            present[filename] = (media_dir / filename).is_file()
+        if not present[filename]:
+            missing.append({"template_id": int(template_id), "media_id": int(media_id), "filename": filename, "reason": "media_file_missing"})
+    return missing
+
+
+def block_row_to_dict(row: tuple) -> dict:
+    return {
+        "name": row[1],
+        "minutes": int(row[2]),
+        "seconds": int(row[2]) * 60,
+        "media_item_id": int(row[3]) if row[3] is not None else None,
+    }
+
+
+def template_blocks(connection: sqlite3.Connection, template_id: int, with_media: bool = False) -> list[dict]:
+    if not with_media:
+        return [
+            block_row_to_dict(row)
+            for row in connection.execute(
+                "SELECT position, name, minutes, media_item_id FROM template_block WHERE template_id = ? ORDER BY position",
+                (template_id,),
+            )
+        ]
+
+    cursor = connection.execute(
+        """
+        SELECT tb.position, tb.name, tb.minutes, tb.media_item_id, m.*
+        FROM template_block tb
+        LEFT JOIN media_item m ON m.id = tb.media_item_id
+        WHERE tb.template_id = ?
+        ORDER BY tb.position
+        """,
+        (template_id,),
+    )
+    media_columns = [column[0] for column in cursor.description[4:]]
+    blocks = []
+    for row in cursor:
+        block = block_row_to_dict(tuple(row))
+        media = dict(zip(media_columns, tuple(row)[4:]))
+        block["media"] = media if media["id"] is not None else None
+        blocks.append(block)
+    return blocks
+
+
+def blocks_by_template(connection: sqlite3.Connection, template_ids: list[int] | None = None) -> dict[int, list[dict]]:
+    if template_ids is None:
+        rows = connection.execute(
+            "SELECT template_id, position, name, minutes, media_item_id FROM template_block ORDER BY template_id, position"
+        )
+    else:
+        marks = ",".join("?" for _ in template_ids) or "NULL"
+        rows = connection.execute(
+            f"""
+            SELECT template_id, position, name, minutes, media_item_id
+            FROM template_block
+            WHERE template_id IN ({marks})
+            ORDER BY template_id, position
+            """,
+            tuple(template_ids),
         )
+    grouped: dict[int, list[dict]] = {}
+    for row in rows:
+        grouped.setdefault(int(row[0]), []).append(block_row_to_dict(row[1:]))
+    return grouped
 
-    rows_html = "".join(rows) if rows else '<tr><td colspan="7">No plan days available.</td></tr>'
 
-    return f"""<!doctype html>
-<html><head><meta charset='utf-8'><title>FlowForm Plan Export</title>
-<style>body{{font-family:Arial,sans-serif;margin:24px}}table{{border-collapse:collapse;width:100%}}th,td{{border:1px solid #ccc;padding:8px;text-align:left}}</style>
-</head><body>
-<h1>FlowForm Plan Export</h1>
-<p><strong>Generated:</strong> {payload.get('exported_at','')}</p>
-<p><strong>Plan:</strong> {plan.get('name','N/A')} | Start: {plan.get('start_date','N/A')} | Weeks: {plan.get('weeks','N/A')}</p>
-<p><strong>Profile:</strong> Goal {profile.get('goal','N/A')} · Days/week {profile.get('days_per_week','N/A')} · Minutes {profile.get('minutes','N/A')}</p>
-<p><strong>Safety disclaimer:</strong> Training guidance is informational and not medical advice.</p>
-<h2>Plan days</h2>
-<table><thead><tr><th>Week</th><th>Day</th><th>Title</th><th>Template</th><th>Discipline</th><th>Minutes</th><th>Status</th></tr></thead><tbody>{rows_html}</tbody></table>
-</body></html>
-"""
+def blocks_to_json(blocks: list[dict]) -> str:
+    # The one serializer for json_blocks.
+    return json.dumps(
+        {"blocks": [{"name": b["name"], "minutes": int(b["minutes"]), "media_id": b.get("media_item_id")} for b in blocks]}
+    )
 
 
-def _pdf_escape(text: str) -> str:
-    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+def replace_template_blocks(connection: sqlite3.Connection, template_id: int, blocks: list[dict]) -> None:
+    connection.execute("DELETE FROM template_block WHERE template_id = ?", (template_id,))
+    connection.executemany(
+        "INSERT INTO template_block (template_id, position, name, minutes, media_item_id) VALUES (?, ?, ?, ?, ?)",
+        [
+            (template_id, position, block["name"], max(0, int(block["minutes"])), block.get("media_item_id"))
+            for position, block in enumerate(blocks, start=1)
+        ],
+    )
+    connection.execute("UPDATE session_template SET json_blocks = ? WHERE id = ?", (blocks_to_json(blocks), template_id))
 
 
-def build_simple_pdf(lines: list[str], title: str = "FlowForm Export") -> bytes:
-    safe_lines = [title, ""] + [str(line)[:180] for line in lines]
-    y = 780
-    content_lines = ["BT", "/F1 12 Tf"]
-    for idx, line in enumerate(safe_lines):
-        if idx == 0:
-            content_lines.append(f"72 {y} Td ({_pdf_escape(line)}) Tj")
-        else:
-            content_lines.append("0 -16 Td")
-            content_lines.append(f"({_pdf_escape(line)}) Tj")
-    content_lines.append("ET")
-    content = "\n".join(content_lines).encode("latin-1", errors="replace")
+def rewrite_template_json(connection: sqlite3.Connection) -> None:
+    grouped = blocks_by_template(connection)
+    connection.executemany(
+        "UPDATE session_template SET json_blocks = ? WHERE id = ?",
+        [(blocks_to_json(grouped.get(int(template_id), [])), int(template_id)) for (template_id,) in connection.execute("SELECT id FROM session_template").fetchall()],
+    )
 
-    objects: list[bytes] = []
-    objects.append(b"1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n")
-    objects.append(b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n")
-    objects.append(b"3 0 obj << /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >> endobj\n")
-    objects.append(b"4 0 obj << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> endobj\n")
-    objects.append(f"5 0 obj << /Length {len(content)} >> stream\n".encode("latin-1") + content + b"\nendstream endobj\n")
 
-    out = bytearray(b"%PDF-1.4\n")
-    offsets = [0]
-    for obj in objects:
-        offsets.append(len(out))
-        out.extend(obj)
-    xref_pos = len(out)
-    out.extend(f"xref\n0 {len(objects) + 1}\n".encode("latin-1"))
-    out.extend(b"0000000000 65535 f \n")
-    for off in offsets[1:]:
-        out.extend(f"{off:010d} 00000 n \n".encode("latin-1"))
-    out.extend(
-        (
-            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
-            f"startxref\n{xref_pos}\n%%EOF\n"
-        ).encode("latin-1")
-    )
-    return bytes(out)
+def parse_tags(raw: str) -> str:
+    parts = [item.strip().lower() for item in str(raw or "").split(",") if item.strip()]
+    deduped = []
+    for item in parts:
+        if item not in deduped:
+            deduped.append(item)
+    return ", ".join(deduped)
 
 
-def backup_manifest(connection: sqlite3.Connection) -> dict:
-    counts = {
-        "plans": connection.execute("SELECT COUNT(*) FROM plan").fetchone()[0],
-        "plan_days": connection.execute("SELECT COUNT(*) FROM plan_day").fetchone()[0],
-        "templates": connection.execute("SELECT COUNT(*) FROM session_template").fetchone()[0],
-        "completions": connection.execute("SELECT COUNT(*) FROM session_completion").fetchone()[0],
-        "recovery": connection.execute("SELECT COUNT(*) FROM recovery_checkin").fetchone()[0],
-    }
-    media_count = 0
-    if MEDIA_DIR.exists():
-        media_count = sum(1 for p in MEDIA_DIR.iterdir() if p.is_file())
-    return {
-        "created_at": utc_now_iso(),
-        "counts": counts,
-        "media_files": media_count,
-        "warning": "Restoring this backup overwrites current database and media files.",
-    }
+MEDIA_MAX_BYTES = 250 * 1024 * 1024
+# Resumable sessions exist for full-length class recordings, so they get their own, larger cap.
+MEDIA_RESUMABLE_MAX_BYTES = int(os.getenv("MEDIA_RESUMABLE_MAX_BYTES", str(4 * 1024 * 1024 * 1024)))
+# Room for the multipart boundaries and the small form fields sent alongside the file.
+MEDIA_FORM_OVERHEAD_BYTES = 64 * 1024
+MEDIA_CHUNK_BYTES = 1024 * 1024
 
 
-def validate_backup_zip_names(names: set[str]) -> tuple[bool, str]:
-    if "flowform.db" not in names:
-        return False, "flowform.db_missing"
-    allowed_top_level = {"flowform.db", "flowform_backup.json", "settings.json", "manifest.json"}
-    for name in names:
-        if name.endswith("/"):
-            continue
-        normalized = name.replace("\\", "/")
-        if normalized.startswith("/") or ".." in normalized.split("/"):
-            return False, "invalid_zip_path"
-        if normalized in allowed_top_level:
-            continue
-        if normalized.startswith("media/") and len(normalized.split("/")) == 2:
-            continue
-        return False, "unexpected_zip_entry"
-    return True, "ok"
+def stream_to_temp(stream, directory: Path, limit: int) -> tuple[Path | None, str, int]:
+    # Copies in fixed-size chunks, hashing as it goes; returns (None, "", size) once the limit is crossed.
+    directory.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    handle = tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+    temp_path = Path(handle.name)
+    try:
+        with handle:
+            while True:
+                chunk = stream.read(MEDIA_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    temp_path.unlink(missing_ok=True)
+                    return None, "", size
+                digest.update(chunk)
+                handle.write(chunk)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return temp_path, digest.hexdigest(), size
 
 
-def build_zip_manifest(file_payloads: dict[str, bytes]) -> dict:
-    files = []
-    for path in sorted(file_payloads.keys()):
-        blob = file_payloads[path]
-        files.append({
-            "path": path,
-            "bytes": len(blob),
-            "sha256": hashlib.sha256(blob).hexdigest(),
-        })
-    return {
-        "created_at": utc_now_iso(),
-        "files": files,
-    }
+MEDIA_MIGRATION_BATCH = 500
 
 
-def normalize_issue_ref(raw: str | None) -> str:
-    if raw is None:
-        return "FLOWFORM-LOCAL"
-    value = str(raw).strip()
-    return value or "FLOWFORM-LOCAL"
+def media_relpath(name: str, key: str | None = None) -> str:
+    # Two-level fan-out (ab/cd/<name>) keeps every directory small; the key is the content hash
+    # when known so a blob's location follows from its name.
+    key = key or media_content_hash(Path(name)) or hashlib.sha256(name.encode("utf-8")).hexdigest()
+    return f"{key[0:2]}/{key[2:4]}/{name}"
 
 
-def create_app(port: int | None = None) -> Flask:
-    load_env_file(ROOT_DIR / ".env")
-    configure_logging()
+def is_safe_media_relpath(filename: str) -> bool:
+    parts = filename.split("/")
+    if len(parts) not in (1, 3):
+        return False
+    return all(part and not part.startswith(".") and secure_filename(part) == part for part in parts)
 
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-    app = Flask(__name__)
 
-    resolved_port = int(port if port is not None else os.getenv("PORT", "5203"))
-    db_path = Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve()
-    db_path.parent.mkdir(parents=True, exist_ok=True)
+def media_name_candidates(filename: str) -> tuple[str, str]:
+    # The name as given and its spelling in the other layout (flat <-> fan-out).
+    base = filename.rsplit("/", 1)[-1]
+    return filename, base if "/" in filename else media_relpath(base)
 
-    app.config.update(
-        APP_NAME=APP_NAME,
-        VERSION=APP_VERSION,
-        PORT=resolved_port,
-        DB_PATH=str(db_path),
-        BUILD_DATE=BUILD_DATE,
-        GIT_HASH=git_hash(),
-        FIRST_CHECK={"ok": True, "message": ""},
-        ENABLE_AUTH=env_flag_true(os.getenv("ENABLE_AUTH")),
-        ENABLE_AUTH=str(os.getenv("ENABLE_AUTH", "false")).lower() == "true",
+
+def resolve_media_path(filename: str) -> Path | None:
+    # Try the stored name, then the other layout, so reads never race the online layout migration.
+    if not is_safe_media_relpath(filename):
+        return None
+    for candidate in media_name_candidates(filename):
+        path = MEDIA_DIR / candidate
+        if path.is_file():
+            return path
+    return None
+
+
+def backup_media_files(connection: sqlite3.Connection) -> list[tuple[str, Path]]:
+    # Driven by media_item rather than a directory walk; returns (relative name, path) pairs.
+    files = []
+    for (filename,) in connection.execute("SELECT DISTINCT filename FROM media_item ORDER BY filename"):
+        path = resolve_media_path(filename)
+        if path is not None:
+            files.append((path.relative_to(MEDIA_DIR).as_posix(), path))
+    return files
+
+
+def migrate_media_layout(connection: sqlite3.Connection, batch_size: int = MEDIA_MIGRATION_BATCH) -> dict:
+    # Online: each file is hard-linked into place before its rows switch (one short write
+    # transaction per batch), and the flat name is removed only after the commit.
+    summary = {"moved": 0, "missing": 0, "batches": 0}
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            "SELECT id, filename FROM media_item WHERE id > ? AND instr(filename, '/') = 0 ORDER BY id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            return summary
+        last_id = int(rows[-1][0])
+        moves = []
+        for filename in sorted({str(row[1]) for row in rows}):
+            old = MEDIA_DIR / filename
+            relpath = media_relpath(filename)
+            new = MEDIA_DIR / relpath
+            if not new.is_file():
+                if not old.is_file() or not is_safe_media_relpath(filename):
+                    summary["missing"] += 1
+                    continue
+                new.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(old, new)
+                except OSError:
+                    shutil.copy2(old, new)
+            moves.append((filename, relpath))
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for filename, relpath in moves:
+                connection.execute("UPDATE media_item SET filename = ? WHERE filename = ?", (relpath, filename))
+                connection.execute("UPDATE media_blob SET filename = ? WHERE filename = ?", (relpath, filename))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        for filename, _ in moves:
+            (MEDIA_DIR / filename).unlink(missing_ok=True)
+        summary["moved"] += len(moves)
+        summary["batches"] += 1
+
+
+def store_media_blob(connection: sqlite3.Connection, temp_path: Path, sha256: str, size: int, suffix: str) -> str:
+    # Content-addressed: identical bytes map to one file no matter who uploads them or under which name.
+    row = connection.execute("SELECT filename FROM media_blob WHERE sha256 = ?", (sha256,)).fetchone()
+    filename = row[0] if row is not None else media_relpath(f"{sha256}{suffix.lower()}", sha256)
+    # Registering first takes the write lock, which unlink_released_media holds while it deletes:
+    # the file is checked only once a concurrent delete can no longer remove it.
+    connection.execute(
+        "INSERT OR IGNORE INTO media_blob (sha256, filename, size_bytes, created_at) VALUES (?, ?, ?, ?)",
+        (sha256, filename, size, utc_now_iso()),
     )
-    app.secret_key = os.getenv("SECRET_KEY", "flowform-dev-secret")
+    target = resolve_media_path(filename)
+    if target is not None:
+        temp_path.unlink(missing_ok=True)
+    else:
+        target = MEDIA_DIR / filename
+        target.parent.mkdir(parents=True, exist_ok=True)
+        temp_path.replace(target)
+    return filename
 
-    app.logger.info("FlowForm boot config: port=%s db=%s", resolved_port, db_path)
 
-    def auth_enabled() -> bool:
-        return bool(app.config.get("ENABLE_AUTH", False))
+UPLOAD_STALE_HOURS = 24
 
-    def project_is_approved(connection: sqlite3.Connection) -> bool:
-        row = connection.execute("SELECT value FROM app_state WHERE key = 'project_approved' LIMIT 1").fetchone()
-        if not row:
-            return False
-        return env_flag_true(row[0])
 
-    def set_project_approved(connection: sqlite3.Connection, approved: bool) -> None:
-        now = utc_now_iso()
-        value = "true" if approved else "false"
-        connection.execute(
-            """
-            INSERT INTO app_state (key, value, created_at, updated_at)
-            VALUES ('project_approved', ?, ?, ?)
-            ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
-            """,
-            (value, now, now),
-        )
+def upload_part_path(upload_id: str) -> Path:
+    return UPLOAD_DIR / f"{upload_id}.part"
 
-    def current_user_id(connection: sqlite3.Connection) -> int:
-        if not auth_enabled():
-            return get_or_create_founder_user(connection)
-        user_id = session.get("user_id")
-        if not user_id:
-            return 0
-        row = connection.execute("SELECT id, enabled FROM users WHERE id = ?", (int(user_id),)).fetchone()
-        if not row or int(row[1]) == 0:
-            session.clear()
-            return 0
-        return int(row[0])
 
-    def require_login(view):
-        @wraps(view)
-        def wrapped(*args, **kwargs):
-            if not auth_enabled():
-                return view(*args, **kwargs)
-            connection = sqlite3.connect(db_path)
-            uid = current_user_id(connection)
-            connection.close()
-            if uid <= 0:
-                if is_api_request():
-                    return jsonify({"error": "auth_required"}), 401
-                return redirect(url_for("login_page"))
-            return view(*args, **kwargs)
+def write_upload_chunk(stream, path: Path, offset: int, limit: int) -> int | None:
+    # Writes the request body at offset (dropping anything past it from an interrupted attempt);
+    # returns the new offset, or None with the file cut back to offset if the body overruns limit.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "r+b" if path.exists() else "w+b") as handle:
+        handle.truncate(offset)
+        handle.seek(offset)
+        position = offset
+        while True:
+            chunk = stream.read(MEDIA_CHUNK_BYTES)
+            if not chunk:
+                break
+            position += len(chunk)
+            if position > limit:
+                handle.truncate(offset)
+                return None
+            handle.write(chunk)
+    return position
 
-        return wrapped
 
-    @app.context_processor
-    def inject_auth_flags():
-        return {
-            "auth_enabled": auth_enabled(),
-            "current_session_user_id": session.get("user_id"),
-        }
-            connection = sqlite3.connect(db_path)
-            uid = current_user_id(connection)
-            connection.close()
-            if uid <= 0:
-                if is_api_request():
-                    return jsonify({"error": "auth_required"}), 401
-                return redirect(url_for("login_page"))
-            return view(*args, **kwargs)
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(MEDIA_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-        return wrapped
 
-    @app.context_processor
-    def inject_auth_flags():
-        return {
-            "auth_enabled": auth_enabled(),
-            "current_session_user_id": session.get("user_id"),
-        }
+def gc_stale_uploads(connection: sqlite3.Connection, max_age_hours: int = UPLOAD_STALE_HOURS) -> int:
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=max_age_hours)).isoformat()
+    stale = [row[0] for row in connection.execute("SELECT id FROM upload_session WHERE updated_at < ?", (cutoff,))]
+    for upload_id in stale:
+        connection.execute("DELETE FROM upload_session WHERE id = ?", (upload_id,))
+        upload_part_path(upload_id).unlink(missing_ok=True)
+    return len(stale)
 
-            connection = sqlite3.connect(db_path)
-            uid = current_user_id(connection)
-            connection.close()
-            if uid <= 0:
-                if is_api_request():
-                    return jsonify({"error": "auth_required"}), 401
-                return redirect(url_for("login_page"))
-            return view(*args, **kwargs)
 
-        return wrapped
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 3600
+MEDIA_MAX_RANGES = 16
 
-    @app.context_processor
-    def inject_auth_flags():
-        return {
-            "auth_enabled": auth_enabled(),
-            "current_session_user_id": session.get("user_id"),
-        }
-            connection = sqlite3.connect(db_path)
-            uid = current_user_id(connection)
-            connection.close()
-            if uid <= 0:
-                if is_api_request():
-                    return jsonify({"error": "auth_required"}), 401
-                return redirect(url_for("login_page"))
-            return view(*args, **kwargs)
 
-        return wrapped
+def parse_byte_ranges(header: str | None, size: int) -> list[tuple[int, int]] | None:
+    # Returns [start, end) spans sorted and coalesced; None means "ignore the header and send
+    # everything" (absent, malformed or too many ranges), [] means nothing is satisfiable (416).
+    if not header or not header.strip().lower().startswith("bytes="):
+        return None
+    specs = [part.strip() for part in header.split("=", 1)[1].split(",") if part.strip()]
+    if not specs or len(specs) > MEDIA_MAX_RANGES:
+        return None
+    spans = []
+    for spec in specs:
+        first, sep, last = spec.partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size
+            else:
+                start = int(first)
+                end = min(size, int(last) + 1) if last else size
+                if int(first) < 0 or (last and int(last) < start):
+                    return None
+        except ValueError:
+            return None
+        if start < end:
+            spans.append((start, end))
+    spans.sort()
+    merged: list[tuple[int, int]] = []
+    for start, end in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
 
-    @app.context_processor
-    def inject_auth_flags():
-        return {
-            "auth_enabled": auth_enabled(),
-            "current_session_user_id": session.get("user_id"),
-        }
-            connection = sqlite3.connect(db_path)
-            uid = current_user_id(connection)
-            connection.close()
-            if uid <= 0:
-                if is_api_request():
-                    return jsonify({"error": "auth_required"}), 401
-                return redirect(url_for("login_page"))
-            return view(*args, **kwargs)
 
-        return wrapped
+def read_file_span(path: Path, start: int, end: int):
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = handle.read(min(MEDIA_CHUNK_BYTES, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
 
-    @app.context_processor
-    def inject_auth_flags():
-        return {
-            "auth_enabled": auth_enabled(),
-            "current_session_user_id": session.get("user_id"),
-        }
-            connection = sqlite3.connect(db_path)
-            uid = current_user_id(connection)
-            connection.close()
-            if uid <= 0:
-                if is_api_request():
-                    return jsonify({"error": "auth_required"}), 401
-                return redirect(url_for("login_page"))
-            return view(*args, **kwargs)
 
-        return wrapped
+def media_content_hash(path: Path, content_sha256: str | None = None) -> str | None:
+    # Blob names are <sha256><ext>, so the hash is known without reading the file.
+    stem = path.name.split(".", 1)[0]
+    if not content_sha256 and len(stem) == 64 and all(ch in "0123456789abcdef" for ch in stem):
+        return stem
+    return content_sha256 or None
 
-    @app.context_processor
-    def inject_auth_flags():
-        return {
-            "auth_enabled": auth_enabled(),
-            "current_session_user_id": session.get("user_id"),
-        }
 
-    def init_db_safely() -> dict:
-        try:
-            connection = sqlite3.connect(db_path)
-            apply_schema_migrations(connection)
-            get_or_create_founder_user(connection)
-            seed_templates(connection)
-            connection.commit()
-            connection.close()
-            return {"ok": True, "message": "db_ready"}
-        except sqlite3.Error as exc:
-            app.logger.warning("SQLite init degraded: %s", exc)
-            return {"ok": False, "message": f"SQLite init degraded: {exc}"}
+MEDIA_OFFLOAD_HEADERS = {"x-accel": "X-Accel-Redirect", "x-sendfile": "X-Sendfile"}
 
-    def init_db_safely() -> dict:
-        try:
-            connection = sqlite3.connect(db_path)
-            apply_schema_migrations(connection)
-            get_or_create_founder_user(connection)
-            seed_templates(connection)
-            connection.commit()
-            connection.close()
-            return {"ok": True, "message": "db_ready"}
-        except sqlite3.Error as exc:
-            app.logger.warning("SQLite init degraded: %s", exc)
-            return {"ok": False, "message": f"SQLite init degraded: {exc}"}
 
-    app.config["FIRST_CHECK"] = init_db_safely()
+def media_offload_mode(value: str | None) -> str:
+    mode = str(value or "").strip().lower()
+    return mode if mode in MEDIA_OFFLOAD_HEADERS else ""
 
-    @app.errorhandler(404)
-    def handle_not_found(_: Exception):
-        if is_api_request():
-            return jsonify({"error": "not_found"}), 404
-        return render_template("friendly_error.html", code=404, title="Page not found", message="The page you requested does not exist."), 404
 
-    @app.errorhandler(500)
-    def handle_server_error(error: Exception):
-        app.logger.exception("Unhandled server error: %s", error)
-        if is_api_request():
-            return jsonify({"error": "internal_server_error"}), 500
-        return render_template(
-            "friendly_error.html",
-            code=500,
-            title="Something went wrong",
-            message="An unexpected error occurred. Please retry or return to Ready.",
-        ), 500
-
-    @app.get("/")
-    def root():
-        check = first_check_state(app)
-        if not check.get("ok", False):
-            return render_template("first_run_error.html", error_message=check.get("message", "Unknown startup check failure")), 500
-        if auth_enabled() and not session.get("user_id"):
-            return redirect(url_for("login_page"))
-        return redirect(url_for("ready"))
+def offload_media(path: Path, relative_name: str, mode: str, prefix: str) -> Response:
+    # Empty body plus an internal-redirect header: the front proxy streams the file itself
+    # (and handles Range there), the worker only did the lookup and auth.
+    response = Response(status=200, mimetype=mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+    if mode == "x-accel":
+        response.headers["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{quote(relative_name)}"
+    else:
+        response.headers["X-Sendfile"] = str(path.resolve())
+    return response
+
+
+def media_derivative_etag(path: Path) -> str:
+    # Thumbnails share the source's hash in their name but are rebuilt in place: validate them by their own stat.
+    stat = path.stat()
+    return f"thumb-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def media_response(path: Path, content_sha256: str | None = None, etag: str | None = None) -> Response:
+    stat = path.stat()
+    size = stat.st_size
+    digest = None if etag else media_content_hash(path, content_sha256)
+    etag = etag or digest or f"{stat.st_mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    mimetype = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+    def finish(response: Response) -> Response:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.headers["Accept-Ranges"] = "bytes"
+        immutable = ", immutable" if digest else ""
+        response.headers["Cache-Control"] = f"private, max-age={MEDIA_CACHE_MAX_AGE}{immutable}"
+        return response
 
-    @app.get("/signup")
-    def signup_page():
-        if not auth_enabled():
-            return render_template("signup.html", auth_disabled_note=True)
-        return render_template("signup.html", auth_disabled_note=False)
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return finish(Response(status=304))
+    elif request.if_modified_since is not None and last_modified <= request.if_modified_since:
+        return finish(Response(status=304))
+
+    offload = current_app.config.get("MEDIA_OFFLOAD", "")
+    if offload:
+        relative_name = path.relative_to(MEDIA_DIR).as_posix() if path.is_relative_to(MEDIA_DIR) else path.name
+        return finish(offload_media(path, relative_name, offload, current_app.config["MEDIA_OFFLOAD_PREFIX"]))
+
+    ranges = parse_byte_ranges(request.headers.get("Range"), size)
+    if ranges is not None and request.headers.get("If-Range"):
+        # A stale validator means the client's partial copy is from another version: send it all.
+        if_range = request.if_range
+        if not (if_range.etag == etag or (if_range.date is not None and if_range.date >= last_modified)):
+            ranges = None
+
+    if ranges is None:
+        response = Response(read_file_span(path, 0, size), mimetype=mimetype, direct_passthrough=True)
+        response.content_length = size
+        return finish(response)
+    if not ranges:
+        response = Response(status=416)
+        response.headers["Content-Range"] = f"bytes */{size}"
+        return finish(response)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response = Response(read_file_span(path, start, end), status=206, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = end - start
+        response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        return finish(response)
+
+    boundary = uuid.uuid4().hex
+    heads = [
+        (f"--{boundary}\r\nContent-Type: {mimetype}\r\nContent-Range: bytes {start}-{end - 1}/{size}\r\n\r\n").encode("ascii")
+        for start, end in ranges
+    ]
+    tail = f"\r\n--{boundary}--\r\n".encode("ascii")
 
-    @app.post("/signup")
-    def signup_submit():
-        if not auth_enabled():
-            return render_template("signup.html", auth_disabled_note=True, error="Auth disabled."), 200
-        email = str(request.form.get("email", "")).strip().lower()
-        password = str(request.form.get("password", "")).strip()
-        display_name = str(request.form.get("display_name", "")).strip() or "User"
-        if not email or not password:
-            return render_template("signup.html", error="Email and password are required."), 400
+    def multipart():
+        for index, (start, end) in enumerate(ranges):
+            yield (b"\r\n" if index else b"") + heads[index]
+            yield from read_file_span(path, start, end)
+        yield tail
 
-        connection = sqlite3.connect(db_path)
-        exists = connection.execute("SELECT id FROM users WHERE lower(email) = ?", (email,)).fetchone()
-        if exists:
-            connection.close()
-            return render_template("signup.html", error="Email already registered."), 400
-        now = utc_now_iso()
-        cursor = connection.execute(
-            """
-            INSERT INTO users (email, display_name, password_hash, role, enabled, created_at, updated_at)
-            VALUES (?, ?, ?, 'member', 1, ?, ?)
-            """,
-            (email, display_name, generate_password_hash(password), now, now),
-        )
-        user_id = int(cursor.lastrowid)
-        ensure_subscription_row(connection, user_id)
-        connection.commit()
-        connection.close()
-        session["user_id"] = user_id
-        return redirect(url_for("ready"))
+    response = Response(multipart(), status=206, mimetype=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+    response.content_length = sum(len(head) for head in heads) + sum(end - start for start, end in ranges) + 2 * (len(ranges) - 1) + len(tail)
+    return finish(response)
 
-    @app.get("/login")
-    def login_page():
-        if not auth_enabled():
-            return render_template("login.html", auth_disabled_note=True)
-        return render_template("login.html", auth_disabled_note=False)
 
-    @app.post("/login")
-    def login_submit():
-        if not auth_enabled():
-            return render_template("login.html", auth_disabled_note=True, error="Auth disabled."), 200
-        email = str(request.form.get("email", "")).strip().lower()
-        password = str(request.form.get("password", "")).strip()
-        connection = sqlite3.connect(db_path)
-        row = connection.execute(
-            "SELECT id, password_hash, enabled FROM users WHERE lower(email) = ?",
-            (email,),
-        ).fetchone()
-        connection.close()
-        if (not row) or int(row[2]) == 0 or not check_password_hash(str(row[1] or ""), password):
-            return render_template("login.html", error="Invalid credentials."), 401
-        session["user_id"] = int(row[0])
-        return redirect(url_for("ready"))
+def release_media_file(connection: sqlite3.Connection, filename: str) -> list[str]:
+    # Called in the transaction that deletes a media_item row. Returns the files no other row shares;
+    # pass them to unlink_released_media once that transaction has committed.
+    if connection.execute("SELECT 1 FROM media_item WHERE filename = ? LIMIT 1", (filename,)).fetchone() is not None:
+        return []
+    connection.execute("DELETE FROM media_blob WHERE filename = ?", (filename,))
+    return [filename]
 
-    @app.get("/logout")
-    def logout():
-        session.clear()
-        return redirect(url_for("login_page") if auth_enabled() else url_for("ready"))
-        return render_template("ready.html")
 
-    @app.get("/signup")
-    def signup_page():
-        if not auth_enabled():
-            return redirect(url_for("ready"))
-        return render_template("signup.html")
+def unlink_released_media(connection: sqlite3.Connection, filenames: list[str]) -> None:
+    # Under the write lock, so an upload deduplicating against the same blob has either registered
+    # it again already (the file stays) or will find it gone and write its own copy.
+    if not filenames:
+        return
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for filename in filenames:
+            if connection.execute(
+                "SELECT 1 FROM media_blob WHERE filename = ? UNION ALL SELECT 1 FROM media_item WHERE filename = ? LIMIT 1",
+                (filename, filename),
+            ).fetchone() is not None:
+                continue
+            for relpath in (filename, media_thumb_relpath(filename)):
+                path = resolve_media_path(relpath)
+                if path is not None:
+                    path.unlink(missing_ok=True)
+    finally:
+        connection.commit()
 
-    @app.post("/signup")
-    def signup_submit():
-        if not auth_enabled():
-            return redirect(url_for("ready"))
-        email = str(request.form.get("email", "")).strip().lower()
-        password = str(request.form.get("password", "")).strip()
-        display_name = str(request.form.get("display_name", "")).strip() or "User"
-        if not email or not password:
-            return render_template("signup.html", error="Email and password are required."), 400
 
-        connection = sqlite3.connect(db_path)
-        exists = connection.execute("SELECT id FROM users WHERE lower(email) = ?", (email,)).fetchone()
-        if exists:
-            connection.close()
-            return render_template("signup.html", error="Email already registered."), 400
-        now = utc_now_iso()
-        cursor = connection.execute(
+THUMB_MAX_EDGE = 320
+THUMB_MAX_SOURCE_PIXELS = 4_000_000
+MEDIA_JOB_WORKERS = max(1, int(os.getenv("MEDIA_JOB_WORKERS", "2")))
+_MEDIA_JOB_POOL: ProcessPoolExecutor | None = None
+_MEDIA_JOB_LOCK = threading.Lock()
+_MEDIA_JOB_FUTURES: set = set()
+
+def media_thumb_relpath(filename: str) -> str:
+    # Derivatives sit next to their source in the fan-out tree, so they follow the blob's lifetime.
+    directory, _, base = filename.rpartition("/")
+    thumb = f"{base.split('.', 1)[0]}.thumb.png"
+    return f"{directory}/{thumb}" if directory else media_relpath(thumb)
+
+
+def image_dimensions(head: bytes) -> tuple[int, int] | None:
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return int.from_bytes(head[6:8], "little"), int.from_bytes(head[8:10], "little")
+    if head.startswith(b"\xff\xd8"):
+        index = 2
+        while index + 9 < len(head) and head[index] == 0xFF:
+            marker = head[index + 1]
+            length = int.from_bytes(head[index + 2:index + 4], "big")
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return int.from_bytes(head[index + 7:index + 9], "big"), int.from_bytes(head[index + 5:index + 7], "big")
+            index += 2 + length
+    return None
+
+
+MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = (44100, 48000, 32000)
+PROBE_WINDOW_BYTES = 64 * 1024
+
+
+def mp4_boxes(handle, start: int, end: int):
+    position = start
+    while position + 8 <= end:
+        handle.seek(position)
+        header = handle.read(8)
+        if len(header) < 8:
+            return
+        size, kind, header_size = int.from_bytes(header[:4], "big"), header[4:8], 8
+        if size == 1:
+            size, header_size = int.from_bytes(handle.read(8), "big"), 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            return
+        yield kind, position + header_size, position + size
+        position += size
+
+
+def probe_mp4(handle, file_size: int) -> dict:
+    # Only the moov box is read; mdat (the media payload) is skipped by seeking past it.
+    result = {}
+    for kind, body, end in mp4_boxes(handle, 0, file_size):
+        if kind != b"moov":
+            continue
+        for child, child_body, child_end in mp4_boxes(handle, body, end):
+            if child == b"mvhd":
+                handle.seek(child_body)
+                data = handle.read(32)
+                if data[:1] == b"\x01":
+                    timescale, duration = int.from_bytes(data[20:24], "big"), int.from_bytes(data[24:32], "big")
+                else:
+                    timescale, duration = int.from_bytes(data[12:16], "big"), int.from_bytes(data[16:20], "big")
+                if timescale:
+                    result["duration"] = duration / timescale
+            elif child == b"trak" and "width" not in result:
+                for track_box, _, track_end in mp4_boxes(handle, child_body, child_end):
+                    if track_box == b"tkhd":
+                        # Width and height are the last two 16.16 fixed-point fields.
+                        handle.seek(track_end - 8)
+                        data = handle.read(8)
+                        width, height = int.from_bytes(data[:4], "big") >> 16, int.from_bytes(data[4:], "big") >> 16
+                        if width and height:
+                            result["width"], result["height"] = width, height
+        break
+    return result
+
+
+def probe_wav(handle, file_size: int) -> dict:
+    position, byte_rate = 12, 0
+    while position + 8 <= file_size:
+        handle.seek(position)
+        header = handle.read(8)
+        kind, size = header[:4], int.from_bytes(header[4:8], "little")
+        if kind == b"fmt ":
+            byte_rate = int.from_bytes(handle.read(12)[8:12], "little")
+        elif kind == b"data":
+            # A streamed WAV may carry a placeholder size; the bytes actually present win.
+            size = min(size, file_size - position - 8)
+            return {"duration": size / byte_rate} if byte_rate else {}
+        position += 8 + size + (size & 1)
+    return {}
+
+
+def mp3_frame_header(data: bytes, index: int) -> dict | None:
+    if data[index] != 0xFF or data[index + 1] & 0xE0 != 0xE0:
+        return None
+    version_bits, layer_bits = (data[index + 1] >> 3) & 3, (data[index + 1] >> 1) & 3
+    bitrate_index, rate_index = data[index + 2] >> 4, (data[index + 2] >> 2) & 3
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    version, layer = (1 if version_bits == 3 else 2), 4 - layer_bits
+    sample_rate = MP3_SAMPLE_RATES[rate_index] // {3: 1, 2: 2, 0: 4}[version_bits]
+    bitrate = MP3_BITRATES[(version, min(layer, 2) if version == 2 else layer)][bitrate_index] * 1000
+    samples = 384 if layer == 1 else (576 if layer == 3 and version == 2 else 1152)
+    return {"version": version, "layer": layer, "sample_rate": sample_rate, "bitrate": bitrate, "samples": samples, "mono": data[index + 3] >> 6 == 3}
+
+
+def probe_mp3(handle, file_size: int) -> dict:
+    handle.seek(0)
+    head = handle.read(10)
+    start = 0
+    if head.startswith(b"ID3") and len(head) == 10:
+        # ID3v2 sizes are syncsafe: 7 bits per byte.
+        start = 10 + sum((head[6 + i] & 0x7F) << (7 * (3 - i)) for i in range(4)) + (10 if head[5] & 0x10 else 0)
+    handle.seek(start)
+    window = handle.read(PROBE_WINDOW_BYTES)
+    for index in range(max(0, len(window) - 4)):
+        frame = mp3_frame_header(window, index)
+        if frame is not None:
+            break
+    else:
+        return {}
+    end = file_size
+    handle.seek(max(0, file_size - 128))
+    if handle.read(3) == b"TAG":
+        end -= 128
+    # VBR files announce their frame count in a Xing/Info or VBRI header inside the first frame.
+    side_info = (32 if not frame["mono"] else 17) if frame["version"] == 1 else (17 if not frame["mono"] else 9)
+    for offset, tag, count_at in ((4 + side_info, (b"Xing", b"Info"), 8), (36, (b"VBRI",), 14)):
+        marker = window[index + offset:index + offset + 4]
+        if marker in tag:
+            fields = window[index + offset:index + offset + 18]
+            if tag[0] == b"VBRI" or int.from_bytes(fields[4:8], "big") & 1:
+                frames = int.from_bytes(fields[count_at:count_at + 4], "big")
+                if frames:
+                    return {"duration": frames * frame["samples"] / frame["sample_rate"]}
+    return {"duration": (end - start - index) * 8 / frame["bitrate"]}
+
+
+def probe_ogg(handle, file_size: int) -> dict:
+    handle.seek(0)
+    head = handle.read(PROBE_WINDOW_BYTES)
+    if len(head) < 28:
+        return {}
+    packet = head[27 + head[26]:]
+    if packet.startswith(b"\x01vorbis"):
+        rate, skip = int.from_bytes(packet[12:16], "little"), 0
+    elif packet.startswith(b"OpusHead"):
+        # Opus granule positions always count 48 kHz samples.
+        rate, skip = 48000, int.from_bytes(packet[10:12], "little")
+    else:
+        return {}
+    # Duration is the granule position of the last page, found in the file's tail.
+    handle.seek(max(0, file_size - PROBE_WINDOW_BYTES))
+    tail = handle.read(PROBE_WINDOW_BYTES)
+    index = tail.rfind(b"OggS")
+    while index >= 0:
+        granule = int.from_bytes(tail[index + 6:index + 14], "little", signed=True)
+        if granule >= 0 and len(tail) >= index + 14:
+            return {"duration": max(0, granule - skip) / rate} if rate else {}
+        index = tail.rfind(b"OggS", 0, index)
+    return {}
+
+
+def probe_media(path: Path | None) -> dict:
+    # Reads container headers only (plus an MP3/OGG tail), never the whole payload.
+    result = {"duration_sec": None, "width": None, "height": None}
+    if path is None:
+        return result
+    try:
+        with open(path, "rb") as handle:
+            file_size = os.fstat(handle.fileno()).st_size
+            head = handle.read(64)
+            if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+                found = probe_mp4(handle, file_size)
+            elif head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+                found = probe_wav(handle, file_size)
+            elif head.startswith(b"OggS"):
+                found = probe_ogg(handle, file_size)
+            elif head.startswith(b"ID3") or mp3_frame_header(head, 0) is not None:
+                found = probe_mp3(handle, file_size)
+            else:
+                handle.seek(0)
+                dimensions = image_dimensions(handle.read(PROBE_WINDOW_BYTES))
+                found = {"width": dimensions[0], "height": dimensions[1]} if dimensions else {}
+    except (OSError, ValueError, IndexError, KeyError, ZeroDivisionError):
+        # A truncated or odd header just leaves the fields for the user to fill in.
+        return result
+    if found.get("duration"):
+        result["duration_sec"] = max(1, round(found["duration"]))
+    result["width"], result["height"] = found.get("width"), found.get("height")
+    return result
+
+
+def backfill_media_probe(connection: sqlite3.Connection, batch_size: int = MEDIA_MIGRATION_BATCH) -> dict:
+    # Files are probed outside the write transaction; each batch then commits in one short step.
+    summary = {"probed": 0, "updated": 0, "batches": 0}
+    last_id = 0
+    while True:
+        rows = connection.execute(
             """
-            INSERT INTO users (email, display_name, password_hash, role, enabled, created_at, updated_at)
-            VALUES (?, ?, ?, 'member', 1, ?, ?)
+            SELECT id, filename FROM media_item
+            WHERE id > ?
+              AND ((media_type IN ('audio', 'video') AND duration_sec IS NULL) OR (media_type IN ('image', 'video') AND width IS NULL))
+            ORDER BY id
+            LIMIT ?
             """,
-            (email, display_name, generate_password_hash(password), now, now),
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            return summary
+        last_id = int(rows[-1][0])
+        updates = []
+        for media_id, filename in rows:
+            probe = probe_media(resolve_media_path(str(filename)))
+            summary["probed"] += 1
+            if any(value is not None for value in probe.values()):
+                updates.append((probe["duration_sec"], probe["width"], probe["height"], utc_now_iso(), int(media_id)))
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                """
+                UPDATE media_item
+                SET duration_sec = COALESCE(duration_sec, ?), width = COALESCE(width, ?), height = COALESCE(height, ?), updated_at = ?
+                WHERE id = ?
+                """,
+                updates,
+            )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        summary["updated"] += len(updates)
+        summary["batches"] += 1
+
+
+def build_media_derivatives(source: str, thumb: str, media_type: str, max_edge: int = THUMB_MAX_EDGE) -> dict:
+    # Runs in a worker process: only paths in, a small dict out.
+    source_path, thumb_path = Path(source), Path(thumb)
+    with open(source_path, "rb") as handle:
+        head = handle.read(64 * 1024)
+    result = {"size_bytes": source_path.stat().st_size, "width": None, "height": None, "thumb": False}
+    if media_type == "image":
+        dimensions = image_dimensions(head)
+        if dimensions:
+            result["width"], result["height"] = dimensions
+        try:
+            with Image.open(source_path) as image:
+                # open() only parses the header: refuse oversized sources before any pixels are decoded.
+                if image.width * image.height <= THUMB_MAX_SOURCE_PIXELS:
+                    image.draft("RGB", (max_edge, max_edge))
+                    image.thumbnail((max_edge, max_edge))
+                    if image.mode not in ("1", "L", "LA", "P", "RGB", "RGBA"):
+                        image = image.convert("RGBA")
+                    thumb_path.parent.mkdir(parents=True, exist_ok=True)
+                    image.save(thumb_path, format="PNG", optimize=True)
+                    result["thumb"] = True
+        except (OSError, Image.DecompressionBombError):
+            pass
+    elif media_type == "video" and shutil.which("ffmpeg"):
+        thumb_path.parent.mkdir(parents=True, exist_ok=True)
+        completed = subprocess.run(
+            ["ffmpeg", "-loglevel", "error", "-y", "-ss", "1", "-i", str(source_path), "-frames:v", "1",
+             "-vf", f"scale='min({max_edge},iw)':-2", str(thumb_path)],
+            capture_output=True,
+            timeout=120,
         )
-        user_id = int(cursor.lastrowid)
-        ensure_subscription_row(connection, user_id)
-        connection.commit()
-        connection.close()
-        session["user_id"] = user_id
-        return redirect(url_for("ready"))
+        result["thumb"] = completed.returncode == 0 and thumb_path.is_file()
+    return result
 
-    @app.get("/login")
-    def login_page():
-        if not auth_enabled():
-            return redirect(url_for("ready"))
-        return render_template("login.html")
 
-    @app.post("/login")
-    def login_submit():
-        if not auth_enabled():
-            return redirect(url_for("ready"))
-        email = str(request.form.get("email", "")).strip().lower()
-        password = str(request.form.get("password", "")).strip()
-        connection = sqlite3.connect(db_path)
-        row = connection.execute(
-            "SELECT id, password_hash, enabled FROM users WHERE lower(email) = ?",
-            (email,),
-        ).fetchone()
-        connection.close()
-        if (not row) or int(row[2]) == 0 or not check_password_hash(str(row[1] or ""), password):
-            return render_template("login.html", error="Invalid credentials."), 401
-        session["user_id"] = int(row[0])
-        return redirect(url_for("ready"))
+def media_job_pool() -> ProcessPoolExecutor:
+    global _MEDIA_JOB_POOL
+    with _MEDIA_JOB_LOCK:
+        if _MEDIA_JOB_POOL is None:
+            # spawn: the parent runs threads (pool, watchdog), which fork() does not copy safely.
+            _MEDIA_JOB_POOL = ProcessPoolExecutor(max_workers=MEDIA_JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _MEDIA_JOB_POOL
 
-    @app.get("/logout")
-    def logout():
-        session.clear()
-        return redirect(url_for("login_page") if auth_enabled() else url_for("ready"))
 
-    @app.get("/health")
-    def health():
-        snapshot = db_integrity_snapshot(db_path)
-        return jsonify(
-            {
-                "status": "ok" if snapshot["db_ok"] else "degraded",
-                "version": app.config["VERSION"],
-                "time": utc_now_iso(),
-                "db_ok": snapshot["db_ok"],
-                "template_count": snapshot["template_count"],
-                "provider_status": provider_status(),
-            }
+def enqueue_media_job(connection: sqlite3.Connection, media_item_id: int) -> int | None:
+    # Another row sharing the same blob already has derivatives: copy them instead of queueing work.
+    done = connection.execute(
+        """
+        SELECT other.thumb_filename, other.width, other.height, other.size_bytes
+        FROM media_item m
+        JOIN media_item other ON other.filename = m.filename AND other.id != m.id AND other.size_bytes IS NOT NULL
+        WHERE m.id = ?
+        LIMIT 1
+        """,
+        (media_item_id,),
+    ).fetchone()
+    if done is not None:
+        connection.execute(
+            "UPDATE media_item SET thumb_filename = ?, width = ?, height = ?, size_bytes = ? WHERE id = ?",
+            (*done, media_item_id),
         )
+        return None
+    now = utc_now_iso()
+    cursor = connection.execute(
+        "INSERT INTO media_job (media_item_id, kind, status, created_at, updated_at) VALUES (?, 'derivatives', 'queued', ?, ?)",
+        (media_item_id, now, now),
+    )
+    return int(cursor.lastrowid)
 
-    @app.get("/api/health")
-    def api_health():
-        snapshot = db_integrity_snapshot(db_path)
-        is_db_ok = snapshot["db_ok"] and bool(first_check_state(app).get("ok", False))
-        return jsonify(
-            {
-                "status": "ok" if is_db_ok else "degraded",
-                "port": app.config["PORT"],
-                "db_ok": is_db_ok,
-                "template_count": snapshot["template_count"],
-                "version": app.config["VERSION"],
-            }
-        )
 
-    @app.get("/version")
-    def version():
-        return jsonify(
-            {
-                "app_name": app.config["APP_NAME"],
-                "semantic_version": app.config["VERSION"],
-                "build_date": app.config["BUILD_DATE"],
-                "git_hash": app.config["GIT_HASH"],
-            }
-        )
+def dispatch_media_jobs(db_path: Path, job_ids: list[int]) -> None:
+    # Call after the enqueueing transaction commits; returns immediately.
+    if not job_ids:
+        return
+    connection = open_tuned_connection(db_path)
+    try:
+        for job_id in job_ids:
+            row = connection.execute(
+                """
+                SELECT m.id, m.filename, m.media_type
+                FROM media_job j
+                JOIN media_item m ON m.id = j.media_item_id
+                WHERE j.id = ? AND j.status = 'queued'
+                """,
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                continue
+            source = resolve_media_path(row[1])
+            if source is None:
+                connection.execute(
+                    "UPDATE media_job SET status = 'failed', error = 'source_missing', updated_at = ? WHERE id = ?",
+                    (utc_now_iso(), job_id),
+                )
+                continue
+            thumb_relpath = media_thumb_relpath(row[1])
+            connection.execute(
+                "UPDATE media_job SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (utc_now_iso(), job_id),
+            )
+            # A warm pool can finish before add_done_callback, which then runs the callback here:
+            # it must not wait on this connection's write lock.
+            connection.commit()
+            future = media_job_pool().submit(build_media_derivatives, str(source), str(MEDIA_DIR / thumb_relpath), row[2])
+            with _MEDIA_JOB_LOCK:
+                _MEDIA_JOB_FUTURES.add(future)
+            future.add_done_callback(
+                lambda done, job_id=job_id, media_id=int(row[0]), thumb=thumb_relpath: finish_media_job(db_path, job_id, media_id, thumb, done)
+            )
+        connection.commit()
+    finally:
+        connection.close()
 
-    @app.get("/plan/wizard")
-    @require_login
-    def plan_wizard():
-        return render_template("plan_wizard.html", disciplines=DISCIPLINES)
 
-    @app.post("/api/plan/create")
-    @require_login
-    def api_plan_create():
-        payload = request.get_json(silent=True) or request.form.to_dict()
+def finish_media_job(db_path: Path, job_id: int, media_item_id: int, thumb_relpath: str, future) -> None:
+    connection = open_tuned_connection(db_path)
+    try:
+        now = utc_now_iso()
+        error = future.exception()
+        if error is not None:
+            connection.execute(
+                "UPDATE media_job SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (f"{type(error).__name__}: {error}"[:500], now, job_id),
+            )
+        else:
+            result = future.result()
+            connection.execute(
+                "UPDATE media_item SET thumb_filename = ?, width = COALESCE(?, width), height = COALESCE(?, height), size_bytes = ? WHERE id = ?",
+                (thumb_relpath if result["thumb"] else None, result["width"], result["height"], result["size_bytes"], media_item_id),
+            )
+            connection.execute("UPDATE media_job SET status = 'done', error = NULL, updated_at = ? WHERE id = ?", (now, job_id))
+        connection.commit()
+    finally:
+        connection.close()
+        with _MEDIA_JOB_LOCK:
+            _MEDIA_JOB_FUTURES.discard(future)
+
+
+def drain_media_jobs(timeout: float = 60.0) -> bool:
+    # Futures leave the set only after their callback has written the result.
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with _MEDIA_JOB_LOCK:
+            pending = set(_MEDIA_JOB_FUTURES)
+        if not pending:
+            return True
+        futures_wait(pending, timeout=max(0.0, deadline - time.monotonic()))
+        time.sleep(0.01)
+    return False
+
+
+def run_media_jobs(db_path: Path) -> dict:
+    # Backfill/recovery: queue media without derivatives, retry jobs a dead process left running.
+    connection = open_tuned_connection(db_path)
+    try:
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("UPDATE media_job SET status = 'queued', updated_at = ? WHERE status = 'running'", (utc_now_iso(),))
+        missing = connection.execute(
+            """
+            SELECT m.id FROM media_item m
+            WHERE m.size_bytes IS NULL
+              AND NOT EXISTS (SELECT 1 FROM media_job j WHERE j.media_item_id = m.id AND j.status = 'queued')
+            ORDER BY m.id
+            """
+        ).fetchall()
+        for (media_id,) in missing:
+            enqueue_media_job(connection, int(media_id))
+        connection.commit()
+        queued = [int(row[0]) for row in connection.execute("SELECT id FROM media_job WHERE status = 'queued' ORDER BY id")]
+    finally:
+        connection.close()
+    dispatch_media_jobs(db_path, queued)
+    drain_media_jobs(timeout=3600)
+    connection = open_tuned_connection(db_path)
+    try:
+        counts = dict(connection.execute("SELECT status, COUNT(*) FROM media_job WHERE id IN (SELECT value FROM json_each(?)) GROUP BY status", (json.dumps(queued),)).fetchall())
+    finally:
+        connection.close()
+    return {"jobs": len(queued), "done": counts.get("done", 0), "failed": counts.get("failed", 0)}
 
-        goal_raw = str(payload.get("goal", "hybrid")).strip().lower().replace(" ", "_")
-        goal = goal_raw if goal_raw in GOAL_DEFAULTS else "hybrid"
-        days_per_week = clamp_int(int(payload.get("days_per_week", 4)), 2, 6)
-        minutes_per_session = clamp_int(int(payload.get("minutes_per_session", 50)), 30, 75)
 
-        ordered_disciplines = preferred_disciplines(payload)
-        injury_flags = str(payload.get("injury_flags", "")).strip()
-        equipment = str(payload.get("equipment", "")).strip()
-        extra_constraints = str(payload.get("constraints", "")).strip()
-        combined_constraints = "; ".join(part for part in [injury_flags, extra_constraints] if part)
+def detect_media_type(filename: str, mimetype_header: str | None) -> str:
+    mime = (mimetype_header or "").lower()
+    if mime.startswith("image/"):
+        return "image"
+    if mime.startswith("video/"):
+        return "video"
+    if mime.startswith("audio/"):
+        return "audio"
+    guessed, _ = mimetypes.guess_type(filename)
+    guessed = (guessed or "").lower()
+    if guessed.startswith("image/"):
+        return "image"
+    if guessed.startswith("video/"):
+        return "video"
+    if guessed.startswith("audio/"):
+        return "audio"
+    return "other"
 
-        now = utc_now_iso()
-        today = date.today().isoformat()
 
-        connection = sqlite3.connect(db_path)
-        connection.execute("PRAGMA foreign_keys = ON")
-        try:
-            user_id = current_user_id(connection)
-            if user_id <= 0:
-                raise sqlite3.IntegrityError("auth_required")
-            sub = user_subscription(connection, user_id)
-            is_paid = sub.get("plan") == "paid" and sub.get("status") == "active"
-            if not is_paid:
-                existing_plans = connection.execute(
-                    "SELECT COUNT(*) FROM plan WHERE user_id = ? AND status != 'archived'",
-                    (user_id,),
-                ).fetchone()[0]
-                if int(existing_plans) >= 1:
-                    connection.close()
-                    return jsonify({
-                        "ok": False,
-                        "error": "free_tier_limit_reached",
-                        "message": "Free tier allows 1 active plan. Upgrade for unlimited plans.",
-                        "benefits": ["unlimited_plans", "priority_support", "early_access_ai"],
-                        "pay_now_link": None,
-                    }), 403
-            user_id = get_or_create_founder_user(connection)
+def compute_readiness_score(sleep_hours: float, stress: int, soreness: int, mood: int) -> tuple[int, str]:
+    # Explainable weighted score out of 100.
+    sleep_component = max(0.0, min(1.0, sleep_hours / 8.0)) * 40.0
+    stress_component = ((11 - stress) / 10.0) * 20.0
+    soreness_component = ((11 - soreness) / 10.0) * 20.0
+    mood_component = (mood / 10.0) * 20.0
+    score = int(round(max(0.0, min(100.0, sleep_component + stress_component + soreness_component + mood_component))))
+
+    explanation = (
+        f"sleep({sleep_hours}h)->{sleep_component:.1f}/40, "
+        f"stress({stress})->{stress_component:.1f}/20, "
+        f"soreness({soreness})->{soreness_component:.1f}/20, "
+        f"mood({mood})->{mood_component:.1f}/20"
+    )
+    return score, explanation
+
+
+def readiness_label(score: int) -> str:
+    if score >= 75:
+        return "high"
+    if score >= 55:
+        return "moderate"
+    return "low"
+
+
+def suggestion_for_low_readiness(connection: sqlite3.Connection, minutes: int | None = None) -> dict | None:
+    target = int(minutes or 35)
+    row = connection.execute(
+        """
+        SELECT id, name, discipline, duration_minutes
+        FROM session_template
+        WHERE discipline IN ('mobility', 'recovery')
+        ORDER BY ABS(duration_minutes - ?), duration_minutes ASC
+        LIMIT 1
+        """,
+        (target,),
+    ).fetchone()
+    if row is None:
+        return None
+    return {"id": int(row[0]), "name": row[1], "discipline": row[2], "duration_minutes": int(row[3])}
+
+
+
+def record_daily_completion(connection: sqlite3.Connection, user_id: int, day: str, minutes: int, rpe: int) -> None:
+    connection.execute(
+        """
+        INSERT INTO user_daily_stats (user_id, day, completions, minutes, rpe_sum, rpe_count, updated_at)
+        VALUES (?, ?, 1, ?, ?, 1, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            completions = completions + 1,
+            minutes = minutes + excluded.minutes,
+            rpe_sum = rpe_sum + excluded.rpe_sum,
+            rpe_count = rpe_count + 1,
+            updated_at = excluded.updated_at
+        """,
+        (user_id, day, minutes, rpe, utc_now_iso()),
+    )
+
+
+def record_daily_readiness(connection: sqlite3.Connection, user_id: int, day: str, score: int) -> None:
+    connection.execute(
+        """
+        INSERT INTO user_daily_stats (user_id, day, readiness_score, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            readiness_score = excluded.readiness_score,
+            updated_at = excluded.updated_at
+        """,
+        (user_id, day, score, utc_now_iso()),
+    )
+
+
+def record_streak_activity(connection: sqlite3.Connection, user_id: int, day: str) -> None:
+    row = connection.execute(
+        "SELECT current_streak, longest_streak, last_active_day FROM user_streak WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+    current, longest, last_active = (int(row[0]), int(row[1]), row[2]) if row else (0, 0, None)
+    if last_active == day:
+        return
+    if last_active and date.fromisoformat(last_active) == date.fromisoformat(day) - timedelta(days=1):
+        current += 1
+    else:
+        current = 1
+    connection.execute(
+        """
+        INSERT INTO user_streak (user_id, current_streak, longest_streak, last_active_day, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            current_streak = excluded.current_streak,
+            longest_streak = excluded.longest_streak,
+            last_active_day = excluded.last_active_day,
+            updated_at = excluded.updated_at
+        """,
+        (user_id, current, max(longest, current), day, utc_now_iso()),
+    )
+
+
+def record_plan_day_completed(connection: sqlite3.Connection, plan_id: int, week: int) -> None:
+    connection.execute(
+        "UPDATE plan_week_progress SET completed_days = completed_days + 1 WHERE plan_id = ? AND week = ?",
+        (plan_id, week),
+    )
+
+
+def rebuild_user_daily_stats(connection: sqlite3.Connection) -> None:
+    now = utc_now_iso()
+    connection.execute("DELETE FROM user_daily_stats")
+    connection.execute(
+        """
+        INSERT INTO user_daily_stats (user_id, day, completions, minutes, rpe_sum, rpe_count, updated_at)
+        SELECT p.user_id, DATE(sc.completed_at), COUNT(*), COALESCE(SUM(sc.minutes_done), 0),
+               COALESCE(SUM(sc.rpe), 0), COUNT(sc.rpe), ?
+        FROM session_completion sc
+        JOIN plan_day pd ON pd.id = sc.plan_day_id
+        JOIN plan p ON p.id = pd.plan_id
+        WHERE p.user_id IS NOT NULL AND sc.completed_at IS NOT NULL
+        GROUP BY p.user_id, DATE(sc.completed_at)
+        """,
+        (now,),
+    )
+    checkins = connection.execute(
+        """
+        SELECT user_id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10
+        FROM recovery_checkin
+        WHERE user_id IS NOT NULL AND date IS NOT NULL
+        """
+    ).fetchall()
+    for user_id, day, sleep_hours, stress, soreness, mood in checkins:
+        day = iso_day(day)
+        if day is None:
+            continue
+        score, _ = compute_readiness_score(float(sleep_hours or 0), int(stress or 5), int(soreness or 5), int(mood or 5))
+        record_daily_readiness(connection, int(user_id), day, score)
+
+
+def rebuild_user_streaks(connection: sqlite3.Connection) -> None:
+    connection.execute("DELETE FROM user_streak")
+    rows = connection.execute(
+        """
+        SELECT DISTINCT p.user_id, DATE(sc.completed_at) AS day
+        FROM session_completion sc
+        JOIN plan_day pd ON pd.id = sc.plan_day_id
+        JOIN plan p ON p.id = pd.plan_id
+        WHERE p.user_id IS NOT NULL AND sc.completed_at IS NOT NULL
+        ORDER BY p.user_id, day
+        """
+    ).fetchall()
+    for user_id, day in rows:
+        record_streak_activity(connection, int(user_id), day)
+
+
+def rebuild_plan_week_progress(connection: sqlite3.Connection, plan_id: int | None = None) -> None:
+    if plan_id is None:
+        connection.execute("DELETE FROM plan_week_progress")
+        where, params = "", ()
+    else:
+        connection.execute("DELETE FROM plan_week_progress WHERE plan_id = ?", (plan_id,))
+        where, params = "WHERE pd.plan_id = ?", (plan_id,)
+    connection.execute(
+        f"""
+        INSERT INTO plan_week_progress (plan_id, week, total_days, completed_days)
+        SELECT pd.plan_id, pd.week, COUNT(*),
+               SUM(EXISTS (SELECT 1 FROM session_completion sc WHERE sc.plan_day_id = pd.id))
+        FROM plan_day pd
+        {where}
+        GROUP BY pd.plan_id, pd.week
+        """,
+        params,
+    )
+
+
+COUNTER_TABLES = {
+    "user_daily_stats": "SELECT user_id, day, completions, minutes, rpe_sum, rpe_count, readiness_score FROM user_daily_stats",
+    "user_streak": "SELECT user_id, current_streak, longest_streak, last_active_day FROM user_streak",
+    "plan_week_progress": "SELECT plan_id, week, total_days, completed_days FROM plan_week_progress",
+    "template_media_ref": "SELECT media_item_id, template_id, block_count FROM template_media_ref",
+}
+
+
+def reconcile_counters(connection: sqlite3.Connection) -> dict[str, int]:
+    # Rebuild every write-maintained counter from raw rows; returns how many rows drifted per table.
+    before = {name: set(connection.execute(sql).fetchall()) for name, sql in COUNTER_TABLES.items()}
+    rebuild_user_daily_stats(connection)
+    rebuild_user_streaks(connection)
+    rebuild_plan_week_progress(connection)
+    rebuild_template_media_refs(connection)
+    after = {name: set(connection.execute(sql).fetchall()) for name, sql in COUNTER_TABLES.items()}
+    return {name: len(before[name] ^ after[name]) for name in COUNTER_TABLES}
+
+
+def analytics_snapshot(connection: sqlite3.Connection, user_id: int) -> dict:
+    today = date.today()
+    streak_row = connection.execute(
+        "SELECT current_streak, longest_streak, last_active_day FROM user_streak WHERE user_id = ?",
+        (user_id,),
+    ).fetchone()
+    streak = 0
+    longest_streak = 0
+    if streak_row is not None:
+        longest_streak = int(streak_row[1])
+        if streak_row[2] == today.isoformat():
+            streak = int(streak_row[0])
+
+    # One bounded range scan over the rollup yields all RPE windows.
+    windows = (7, 14, 30)
+    rpe_totals = {days: [0, 0] for days in windows}
+    rows = connection.execute(
+        """
+        SELECT day, rpe_sum, rpe_count
+        FROM user_daily_stats
+        WHERE user_id = ? AND day >= ?
+        """,
+        (user_id, (today - timedelta(days=max(windows))).isoformat()),
+    )
+    for day_text, rpe_sum, rpe_count in rows:
+        day = iso_day(day_text)
+        if day is None:
+            continue
+        age = (today - date.fromisoformat(day)).days
+        for days in windows:
+            if age <= days:
+                rpe_totals[days][0] += int(rpe_sum)
+                rpe_totals[days][1] += int(rpe_count)
+
+    avg_rpe = {
+        str(days): round(total / count, 2) if count else None
+        for days, (total, count) in rpe_totals.items()
+    }
+
+    # Weekly completion rate for current week of active plan.
+    plan = current_plan_record(connection, user_id)
+    weekly_completion_rate = 0
+    if plan is not None and plan["start_date"]:
+        start = date.fromisoformat(plan["start_date"])
+        elapsed = max(0, (date.today() - start).days)
+        current_week = min(int(plan["weeks"]), (elapsed // 7) + 1)
+
+        progress = connection.execute(
+            "SELECT total_days, completed_days FROM plan_week_progress WHERE plan_id = ? AND week = ?",
+            (int(plan["id"]), current_week),
+        ).fetchone()
+        totals, completed = (int(progress[0]), int(progress[1])) if progress else (0, 0)
+        spec = plan_spec(connection, int(plan["id"]))
+        if spec is not None and current_week > spec["materialized_through"]:
+            # Week not stored yet: the spec still defines how many sessions it holds.
+            totals = max(totals, spec["days_per_week"])
+        if totals > 0:
+            weekly_completion_rate = int(round((completed / totals) * 100))
+
+    readiness_rows = connection.execute(
+        """
+        SELECT day, readiness_score
+        FROM user_daily_stats
+        WHERE user_id = ? AND readiness_score IS NOT NULL
+        ORDER BY day DESC
+        LIMIT 14
+        """,
+        (user_id,),
+    ).fetchall()
+    readiness_trend = [{"date": row[0], "score": int(row[1])} for row in reversed(readiness_rows)]
+
+    # Card takeaways
+    streak_takeaway = "Excellent momentum — keep the chain alive today." if streak >= 3 else "Start or restart the streak with one focused session today."
+    weekly_takeaway = (
+        "On track this week — maintain your rhythm." if weekly_completion_rate >= 70
+        else "Below target this week — schedule one catch-up session."
+    )
+
+    rpe_7 = avg_rpe.get("7")
+    if rpe_7 is None:
+        rpe_takeaway = "No recent RPE data yet — finish a session to start insights."
+    elif rpe_7 >= 8:
+        rpe_takeaway = "Recent effort is high — consider extra recovery emphasis."
+    elif rpe_7 <= 5:
+        rpe_takeaway = "Recent effort is moderate/low — safe room to push when ready."
+    else:
+        rpe_takeaway = "Recent effort is balanced — keep progressive overload steady."
+
+    if readiness_trend:
+        latest = readiness_trend[-1]["score"]
+        readiness_takeaway = "Recovery trend is low — choose a lighter session suggestion today." if latest < 55 else "Recovery trend is supportive — proceed with planned intensity."
+    else:
+        readiness_takeaway = "No readiness trend yet — add daily recovery check-ins."
+
+    return {
+        "streak": streak,
+        "longest_streak": longest_streak,
+        "weekly_completion_rate": weekly_completion_rate,
+        "avg_rpe": avg_rpe,
+        "readiness_trend": readiness_trend,
+        "takeaways": {
+            "streak": streak_takeaway,
+            "weekly": weekly_takeaway,
+            "rpe": rpe_takeaway,
+            "readiness": readiness_takeaway,
+        },
+    }
+
+
+def assistant_disclaimer() -> str:
+    return "I’m a digital coach, not a healthcare professional. This guidance is educational, not medical advice."
+
+
+def has_medical_risk_signal(text: str) -> bool:
+    needles = [
+        "injury", "injured", "severe", "chest pain", "faint", "fainted", "dizzy", "dizziness",
+        "bleeding", "concussion", "fracture", "cannot breathe", "shortness of breath",
+    ]
+    low = str(text or "").lower()
+    return any(n in low for n in needles)
+
+
+def assistant_context(connection: sqlite3.Connection, user_id: int) -> dict:
+    connection.row_factory = sqlite3.Row
+    plan = current_plan_record(connection, user_id)
+    profile = connection.execute(
+        "SELECT goal, days_per_week, minutes, equipment, constraints FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (user_id,),
+    ).fetchone()
+    recovery = connection.execute(
+        "SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes FROM recovery_checkin WHERE user_id = ? ORDER BY date DESC LIMIT 1",
+        (user_id,),
+    ).fetchone()
+    completions_7d = connection.execute(
+        """
+        SELECT COUNT(*)
+        FROM session_completion sc
+        JOIN plan_day pd ON pd.id = sc.plan_day_id
+        JOIN plan p ON p.id = pd.plan_id
+        WHERE p.user_id = ? AND sc.completed_at >= datetime('now', '-7 days')
+        """,
+        (user_id,),
+    ).fetchone()[0]
+
+    readiness = None
+    if recovery is not None:
+        score, explanation = compute_readiness_score(
+            float(recovery["sleep_hours"] or 0),
+            int(recovery["stress_1_10"] or 5),
+            int(recovery["soreness_1_10"] or 5),
+            int(recovery["mood_1_10"] or 5),
+        )
+        readiness = {"score": score, "label": readiness_label(score), "explanation": explanation}
+
+    return {
+        "plan": dict(plan) if plan else None,
+        "profile": dict(profile) if profile else None,
+        "recovery": dict(recovery) if recovery else None,
+        "completions_7d": int(completions_7d),
+        "readiness": readiness,
+    }
+
+
+def assistant_rules_reply(action: str, message: str, ctx: dict) -> tuple[str, str]:
+    if has_medical_risk_signal(message):
+        return (
+            "Your message suggests injury or severe symptoms. Consider seeking medical advice promptly. If symptoms are urgent or worsening, seek immediate care.",
+            "escalation",
+        )
+
+    readiness = (ctx.get("readiness") or {}).get("score")
+    goal = ((ctx.get("profile") or {}).get("goal") or "hybrid").replace("_", " ")
+    completions = int(ctx.get("completions_7d") or 0)
+
+    if action == "plan_tweak":
+        if readiness is not None and readiness < 55:
+            return ("Readiness looks low. Keep the next 1-2 sessions lighter, reduce volume by ~20%, and prioritize mobility/recovery.", "rules")
+        return (f"For your {goal} goal: keep core structure, add one progressive overload day, and one technique/recovery day this week.", "rules")
+    if action == "substitution":
+        if readiness is not None and readiness < 55:
+            return ("Suggested substitution: switch today to a 30-35 minute recovery/mobility template at RPE 4-5.", "rules")
+        return ("Suggested substitution: pick the same discipline with ~10% lower duration while maintaining form quality.", "rules")
+    if action == "recovery":
+        if readiness is not None and readiness < 55:
+            return ("Recovery advice: hydrate, optimize sleep tonight, and avoid max-effort work today.", "rules")
+        return ("Recovery advice: maintain sleep rhythm and complete planned work at controlled effort.", "rules")
+    if action == "motivation":
+        if completions >= 3:
+            return ("You’re building consistency—protect your streak with a focused, realistic session today.", "rules")
+        return ("Momentum starts small. Finish a short session today and let consistency compound.", "rules")
+
+    return ("I can help with plan tweaks, substitutions, recovery advice, and motivation using your recent plan/recovery context.", "rules")
+
+
+def assistant_llm_reply(api_key: str, action: str, message: str, ctx: dict) -> str:
+    system = (
+        "You are a concise fitness coach. Never provide medical diagnosis. "
+        "For injury/severe symptoms, advise seeking medical care. Provide practical, safe guidance in <=6 sentences."
+    )
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": json.dumps({"action": action, "message": message, "context": ctx}, ensure_ascii=False)},
+        ],
+        "temperature": 0.3,
+        "max_tokens": 240,
+    }
+    req = urllib.request.Request(
+        "https://api.openai.com/v1/chat/completions",
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=10) as resp:
+        data = json.loads(resp.read().decode("utf-8"))
+    return str(data["choices"][0]["message"]["content"]).strip()
+
+
+def export_snapshot(connection: sqlite3.Connection, user_id: int) -> dict:
+    connection.row_factory = sqlite3.Row
+    plan = current_plan_record(connection, user_id)
+
+    profile = connection.execute(
+        """
+        SELECT goal, days_per_week, minutes, equipment, constraints, created_at, updated_at
+        FROM profile
+        WHERE user_id = ?
+        ORDER BY id DESC
+        LIMIT 1
+        """,
+        (user_id,),
+    ).fetchone()
 
-            profile_row = connection.execute(
-                "SELECT id FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
-                (user_id,),
-            ).fetchone()
-            if profile_row:
-                connection.execute(
-                    """
-                    UPDATE profile
-                    SET goal = ?, days_per_week = ?, minutes = ?, equipment = ?, constraints = ?, updated_at = ?
-                    WHERE id = ?
-                    """,
-                    (goal, days_per_week, minutes_per_session, equipment, combined_constraints, now, profile_row[0]),
-                )
+    plan_days = []
+    completions = []
+    if plan is not None:
+        plan_days = [
+            dict(row)
+            for row in connection.execute(
+                """
+                SELECT pd.id, pd.plan_id, pd.week, pd.day_index, pd.title, pd.created_at, pd.updated_at,
+                       st.id AS template_id, st.name AS template_name, st.discipline, st.duration_minutes
+                FROM plan_day pd
+                LEFT JOIN session_template st ON st.id = pd.template_id
+                WHERE pd.plan_id = ?
+                ORDER BY pd.week ASC, pd.day_index ASC
+                """,
+                (int(plan["id"]),),
+            ).fetchall()
+        ]
+        spec = plan_spec(connection, int(plan["id"]))
+        if spec is not None:
+            index = template_index(connection, connection_db_path(connection))
+            plan_days = with_spec_days(index, spec, int(plan["weeks"]), plan_days)
+
+        completions = [
+            dict(row)
+            for row in connection.execute(
+                """
+                SELECT sc.id, sc.plan_day_id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done, sc.created_at, sc.updated_at
+                FROM session_completion sc
+                JOIN plan_day pd ON pd.id = sc.plan_day_id
+                WHERE pd.plan_id = ?
+                ORDER BY sc.completed_at DESC
+                """,
+                (int(plan["id"]),),
+            ).fetchall()
+        ]
+
+    templates = [
+        dict(row)
+        for row in connection.execute(
+            """
+            SELECT id, name, discipline, duration_minutes, level, json_blocks, created_at, updated_at
+            FROM session_template
+            ORDER BY id ASC
+            """
+        ).fetchall()
+    ]
+
+    recovery = [
+        dict(row)
+        for row in connection.execute(
+            """
+            SELECT id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes, created_at, updated_at
+            FROM recovery_checkin
+            WHERE user_id = ?
+            ORDER BY date DESC
+            """,
+            (user_id,),
+        ).fetchall()
+    ]
+
+    return {
+        "exported_at": utc_now_iso(),
+        "app": {"name": APP_NAME, "version": APP_VERSION},
+        "user": {"id": user_id},
+        "profile": dict(profile) if profile else None,
+        "plan": dict(plan) if plan else None,
+        "plan_days": plan_days,
+        "templates": templates,
+        "completions": completions,
+        "recovery": recovery,
+    }
+
+
+def render_plan_export_html(payload: dict) -> str:
+    plan = payload.get("plan") or {}
+    profile = payload.get("profile") or {}
+    days = payload.get("plan_days") or []
+    completions = {item["plan_day_id"]: item for item in (payload.get("completions") or [])}
+
+    rows = []
+    for item in days:
+        status = "Completed" if item["id"] in completions else "Pending"
+        rows.append(
+            f"<tr><td>{item['week']}</td><td>{item['day_index']}</td><td>{item.get('title','')}</td><td>{item.get('template_name','')}</td><td>{item.get('discipline','')}</td><td>{item.get('duration_minutes','')}</td><td>{status}</td></tr>"
+        )
+
+    rows_html = "".join(rows) if rows else '<tr><td colspan="7">No plan days available.</td></tr>'
+
+    return f"""<!doctype html>
+<html><head><meta charset='utf-8'><title>FlowForm Plan Export</title>
+<style>body{{font-family:Arial,sans-serif;margin:24px}}table{{border-collapse:collapse;width:100%}}th,td{{border:1px solid #ccc;padding:8px;text-align:left}}</style>
+</head><body>
+<h1>FlowForm Plan Export</h1>
+<p><strong>Generated:</strong> {payload.get('exported_at','')}</p>
+<p><strong>Plan:</strong> {plan.get('name','N/A')} | Start: {plan.get('start_date','N/A')} | Weeks: {plan.get('weeks','N/A')}</p>
+<p><strong>Profile:</strong> Goal {profile.get('goal','N/A')} · Days/week {profile.get('days_per_week','N/A')} · Minutes {profile.get('minutes','N/A')}</p>
+<p><strong>Safety disclaimer:</strong> Training guidance is informational and not medical advice.</p>
+<h2>Plan days</h2>
+<table><thead><tr><th>Week</th><th>Day</th><th>Title</th><th>Template</th><th>Discipline</th><th>Minutes</th><th>Status</th></tr></thead><tbody>{rows_html}</tbody></table>
+</body></html>
+"""
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def build_simple_pdf(lines: list[str], title: str = "FlowForm Export") -> bytes:
+    safe_lines = [title, ""] + [str(line)[:180] for line in lines]
+    y = 780
+    content_lines = ["BT", "/F1 12 Tf"]
+    for idx, line in enumerate(safe_lines):
+        if idx == 0:
+            content_lines.append(f"72 {y} Td ({_pdf_escape(line)}) Tj")
+        else:
+            content_lines.append("0 -16 Td")
+            content_lines.append(f"({_pdf_escape(line)}) Tj")
+    content_lines.append("ET")
+    content = "\n".join(content_lines).encode("latin-1", errors="replace")
+
+    objects: list[bytes] = []
+    objects.append(b"1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n")
+    objects.append(b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n")
+    objects.append(b"3 0 obj << /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >> endobj\n")
+    objects.append(b"4 0 obj << /Type /Font /Subtype /Type1 /BaseFont /Helvetica >> endobj\n")
+    objects.append(f"5 0 obj << /Length {len(content)} >> stream\n".encode("latin-1") + content + b"\nendstream endobj\n")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = [0]
+    for obj in objects:
+        offsets.append(len(out))
+        out.extend(obj)
+    xref_pos = len(out)
+    out.extend(f"xref\n0 {len(objects) + 1}\n".encode("latin-1"))
+    out.extend(b"0000000000 65535 f \n")
+    for off in offsets[1:]:
+        out.extend(f"{off:010d} 00000 n \n".encode("latin-1"))
+    out.extend(
+        (
+            f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref_pos}\n%%EOF\n"
+        ).encode("latin-1")
+    )
+    return bytes(out)
+
+
+# Already-compressed formats gain nothing from deflate; they are stored to save CPU.
+ZIP_STORED_SUFFIXES = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic",
+    ".mp4", ".m4v", ".mov", ".webm", ".mkv", ".avi",
+    ".mp3", ".m4a", ".aac", ".ogg", ".oga", ".opus", ".flac",
+    ".zip", ".gz",
+}
+
+
+class ZipStreamSink:
+    # Write-only, non-seekable target: zipfile then emits data descriptors and never seeks back.
+    def __init__(self) -> None:
+        self.chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(entries: list[tuple[str, Path | bytes | tuple[Path, int, int]]], chunk_size: int = MEDIA_CHUNK_BYTES):
+    # Yields the archive as it is written: local headers and data per entry, then the central
+    # directory on close. Memory stays around one chunk no matter how large the files are.
+    # A (path, offset, length) source is a slice of a file, read only when its turn comes.
+    sink = ZipStreamSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+        for arcname, source in entries:
+            if isinstance(source, bytes):
+                zf.writestr(arcname, source)
+            elif isinstance(source, tuple):
+                path, offset, length = source
+                with open(path, "rb") as handle:
+                    handle.seek(offset)
+                    zf.writestr(arcname, handle.read(length))
             else:
-                connection.execute(
-                    """
-                    INSERT INTO profile (user_id, goal, days_per_week, minutes, equipment, constraints, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (user_id, goal, days_per_week, minutes_per_session, equipment, combined_constraints, now, now),
-                )
+                info = zipfile.ZipInfo.from_file(source, arcname)
+                info.compress_type = zipfile.ZIP_STORED if source.suffix.lower() in ZIP_STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+                with open(source, "rb") as handle, zf.open(info, mode="w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as target:
+                    while chunk := handle.read(chunk_size):
+                        target.write(chunk)
+                        if sink.chunks:
+                            yield sink.drain()
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+BACKUP_PAGES_PER_STEP = 256
+
+
+def snapshot_database(source_path: Path, target_path: Path, pages: int = BACKUP_PAGES_PER_STEP) -> None:
+    # The open read transaction pins one WAL snapshot for the whole copy, so commits made
+    # meanwhile neither tear it nor restart it, and writers are never blocked. Copying in
+    # page batches releases the GIL and the source between steps.
+    source = sqlite3.connect(source_path, timeout=5)
+    target = sqlite3.connect(target_path)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(0))
+        source.rollback()
+        # A single self-contained file: no -wal sidecar to carry into the archive.
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+
+
+def backup_manifest(connection: sqlite3.Connection) -> dict:
+    counts = {
+        "plans": connection.execute("SELECT COUNT(*) FROM plan").fetchone()[0],
+        "plan_days": connection.execute("SELECT COUNT(*) FROM plan_day").fetchone()[0],
+        "templates": connection.execute("SELECT COUNT(*) FROM session_template").fetchone()[0],
+        "completions": connection.execute("SELECT COUNT(*) FROM session_completion").fetchone()[0],
+        "recovery": connection.execute("SELECT COUNT(*) FROM recovery_checkin").fetchone()[0],
+    }
+    return {
+        "created_at": utc_now_iso(),
+        "counts": counts,
+        "media_files": len(backup_media_files(connection)),
+        "warning": "Restoring this backup overwrites current database and media files.",
+    }
+
+
+BACKUP_MANIFEST_DIR = INSTANCE_DIR / "backups"
+BACKUP_MANIFEST_KEEP = 8
+BACKUP_DB_CHUNK_BYTES = 64 * 1024
+
+
+def database_chunk_hashes(path: Path, chunk_bytes: int = BACKUP_DB_CHUNK_BYTES) -> list[str]:
+    # Fixed-size chunks are page-aligned (SQLite pages are at most 64 KiB), so a changed row
+    # only changes the hashes of the chunks holding its pages.
+    with open(path, "rb") as handle:
+        return [hashlib.sha256(chunk).hexdigest() for chunk in iter(lambda: handle.read(chunk_bytes), b"")]
+
+
+def media_file_hashes(connection: sqlite3.Connection, previous: dict | None = None) -> tuple[dict[str, str], dict[str, list[int]]]:
+    # Content-addressed uploads already carry their hash. Legacy files are read only when their
+    # mtime or size differs from what the previous manifest recorded for them.
+    hashes, stats = {}, {}
+    known_hashes = (previous or {}).get("media") or {}
+    known_stats = (previous or {}).get("media_stat") or {}
+    for filename, content_sha256 in connection.execute(
+        "SELECT filename, MAX(content_sha256) FROM media_item GROUP BY filename ORDER BY filename"
+    ):
+        path = resolve_media_path(filename)
+        if path is None:
+            continue
+        relpath = path.relative_to(MEDIA_DIR).as_posix()
+        if content_sha256:
+            hashes[relpath] = content_sha256
+            continue
+        stat = path.stat()
+        stats[relpath] = [stat.st_mtime_ns, stat.st_size]
+        if known_stats.get(relpath) == stats[relpath] and relpath in known_hashes:
+            hashes[relpath] = known_hashes[relpath]
+        else:
+            hashes[relpath] = file_sha256(path)
+    return hashes, stats
+
+
+def backup_manifest_dir(db_path: Path) -> Path:
+    # One manifest store per database, so a chain never picks up another database's base.
+    return BACKUP_MANIFEST_DIR / hashlib.sha256(str(Path(db_path).resolve()).encode("utf-8")).hexdigest()[:16]
+
+
+def save_backup_manifest(db_path: Path, manifest: dict) -> None:
+    directory = backup_manifest_dir(db_path)
+    directory.mkdir(parents=True, exist_ok=True)
+    target = directory / f"{manifest['backup_id']}.json"
+    temp = target.with_suffix(".tmp")
+    temp.write_text(json.dumps(manifest), encoding="utf-8")
+    temp.replace(target)
+    (directory / "latest").write_text(manifest["backup_id"], encoding="utf-8")
+    prune_backup_manifests(directory)
+
+
+def prune_backup_manifests(directory: Path) -> None:
+    # The newest manifests stay available as bases, along with every ancestor their chains restore from.
+    paths = sorted(directory.glob("*.json"), key=lambda path: path.stat().st_mtime_ns, reverse=True)
+    bases = {}
+    for path in paths:
+        try:
+            bases[path.stem] = json.loads(path.read_text(encoding="utf-8")).get("base_id")
+        except (OSError, ValueError):
+            continue
+    needed = set()
+    for path in paths[:BACKUP_MANIFEST_KEEP]:
+        backup_id = path.stem
+        while backup_id in bases and backup_id not in needed:
+            needed.add(backup_id)
+            backup_id = bases[backup_id]
+    for path in paths:
+        if path.stem in bases and path.stem not in needed:
+            path.unlink(missing_ok=True)
+
+
+def load_backup_manifest(db_path: Path, backup_id: str | None = None) -> dict | None:
+    directory = backup_manifest_dir(db_path)
+    if backup_id is None:
+        pointer = directory / "latest"
+        if not pointer.is_file():
+            return None
+        backup_id = pointer.read_text(encoding="utf-8").strip()
+    if not backup_id or not all(ch in "0123456789abcdef" for ch in backup_id):
+        return None
+    path = directory / f"{backup_id}.json"
+    return json.loads(path.read_text(encoding="utf-8")) if path.is_file() else None
+
+
+def backup_archive_entries(snapshot_path: Path, manifest: dict, base: dict | None) -> list[tuple[str, Path | tuple[Path, int, int]]]:
+    # Full: the snapshot and every media file. Incremental: only database chunks and media the
+    # base does not already hold; restore takes everything else from earlier archives in the chain.
+    media = [(f"media/{relpath}", MEDIA_DIR / relpath) for relpath in manifest["media"]]
+    if base is None:
+        return [("flowform.db", snapshot_path), *media]
+    chunk_bytes = manifest["db"]["chunk_bytes"]
+    known = set(base["db"]["chunks"]) if base["db"]["chunk_bytes"] == chunk_bytes else set()
+    entries = []
+    for index, digest in enumerate(manifest["db"]["chunks"]):
+        if digest not in known:
+            known.add(digest)
+            entries.append((f"db_chunks/{digest}", (snapshot_path, index * chunk_bytes, chunk_bytes)))
+    base_media = base.get("media") or {}
+    return entries + [entry for entry, (relpath, digest) in zip(media, manifest["media"].items()) if base_media.get(relpath) != digest]
+
+
+def backup_chain(archives: list[tuple[zipfile.ZipFile, dict]]) -> list[tuple[zipfile.ZipFile, dict]]:
+    # Orders uploaded archives from the full backup to the newest incremental; every link
+    # between them must be present.
+    if len(archives) == 1 and not archives[0][1].get("base_id"):
+        if "flowform.db" not in archives[0][0].namelist():
+            raise ValueError("flowform.db_missing")
+        return archives
+    by_id = {}
+    for archive in archives:
+        backup_id = archive[1].get("backup_id")
+        if not backup_id or backup_id in by_id:
+            raise ValueError("backup_chain_invalid")
+        by_id[backup_id] = archive
+    bases = {archive[1].get("base_id") for archive in archives}
+    heads = [archive for backup_id, archive in by_id.items() if backup_id not in bases]
+    if len(heads) != 1:
+        raise ValueError("backup_chain_incomplete" if bases - set(by_id) - {None} else "backup_chain_invalid")
+    chain = [heads[0]]
+    while chain[-1][1].get("base_id"):
+        base = by_id.get(chain[-1][1]["base_id"])
+        if base is None:
+            raise ValueError("backup_chain_incomplete")
+        chain.append(base)
+    if len(chain) != len(archives):
+        raise ValueError("backup_chain_invalid")
+    if "flowform.db" not in chain[-1][0].namelist():
+        raise ValueError("backup_chain_incomplete")
+    return chain[::-1]
+
+
+def extract_zip_member(archive: zipfile.ZipFile, name: str, target: Path) -> None:
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with archive.open(name) as source, open(target, "wb") as out:
+        shutil.copyfileobj(source, out, MEDIA_CHUNK_BYTES)
+
+
+def stage_backup_chain(chain: list[tuple[zipfile.ZipFile, dict]], stage_db: Path, stage_media: Path) -> None:
+    head_zip, head = chain[-1]
+    if "flowform.db" in head_zip.namelist():
+        extract_zip_member(head_zip, "flowform.db", stage_db)
+        for name in head_zip.namelist():
+            if name.startswith("media/") and not name.endswith("/"):
+                extract_zip_member(head_zip, name, stage_media / name[len("media/"):])
+        return
+
+    # Rebuild the database chunk by chunk: from the newest archive that emitted the chunk,
+    # else from its position in the full backup's database.
+    chunk_bytes = int(head["db"]["chunk_bytes"])
+    full_zip, full = chain[0]
+    base_db = stage_db.with_name("base.db")
+    extract_zip_member(full_zip, "flowform.db", base_db)
+    sources: dict[str, tuple[zipfile.ZipFile | None, str | int]] = {}
+    if int((full.get("db") or {}).get("chunk_bytes") or 0) == chunk_bytes:
+        for index, digest in enumerate(full["db"]["chunks"]):
+            sources.setdefault(digest, (None, index * chunk_bytes))
+    for archive, _ in chain[1:]:
+        for name in archive.namelist():
+            if name.startswith("db_chunks/"):
+                sources[name[len("db_chunks/"):]] = (archive, name)
+    with open(stage_db, "wb") as out, open(base_db, "rb") as base_handle:
+        for digest in head["db"]["chunks"]:
+            if digest not in sources:
+                raise ValueError("backup_chunk_missing")
+            archive, where = sources[digest]
+            if archive is None:
+                base_handle.seek(where)
+                data = base_handle.read(chunk_bytes)
+            else:
+                data = archive.read(where)
+            if hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError("backup_chunk_corrupt")
+            out.write(data)
+    base_db.unlink()
+
+    # Only media the newest manifest lists is restored; files deleted since the full backup stay gone.
+    # A listed file no archive carries is left missing for verify_staged_backup to report.
+    media_sources = {}
+    for archive, _ in chain:
+        for name in archive.namelist():
+            if name.startswith("media/") and not name.endswith("/"):
+                media_sources[name[len("media/"):]] = archive
+    for relpath in head.get("media") or {}:
+        if relpath in media_sources:
+            extract_zip_member(media_sources[relpath], f"media/{relpath}", stage_media / relpath)
+
+
+RESTORE_VERIFY_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def verify_staged_backup(manifest: dict, stage_db: Path, stage_media: Path) -> list[str]:
+    # Hashes every staged file against manifest.json in a thread pool (hashlib releases the GIL
+    # on large buffers); returns the names that do not match. Older manifests carry no hashes.
+    checks = []
+    db_info = manifest.get("db") or {}
+    if db_info.get("chunks"):
+        checks.append(("flowform.db", lambda: database_chunk_hashes(stage_db, int(db_info["chunk_bytes"])) == db_info["chunks"]))
+    for relpath, digest in (manifest.get("media") or {}).items():
+        # A file the manifest lists but no archive in the chain carried counts as a mismatch too.
+        path = stage_media / relpath
+        checks.append((f"media/{relpath}", lambda path=path, digest=digest: path.is_file() and file_sha256(path) == digest))
+    if not checks:
+        return []
+    with ThreadPoolExecutor(max_workers=RESTORE_VERIFY_WORKERS) as executor:
+        results = list(executor.map(lambda check: check[1](), checks))
+    return [name for (name, _), ok in zip(checks, results) if not ok]
+
+
+def is_sha256_name(name: str) -> bool:
+    return len(name) == 64 and all(ch in "0123456789abcdef" for ch in name)
+
+
+def validate_backup_zip_names(names: set[str]) -> tuple[bool, str]:
+    # Incremental archives carry db_chunks/ instead of flowform.db; their manifest says so.
+    if "flowform.db" not in names and "manifest.json" not in names:
+        return False, "flowform.db_missing"
+    allowed_top_level = {"flowform.db", "flowform_backup.json", "settings.json", "manifest.json"}
+    for name in names:
+        if name.endswith("/"):
+            continue
+        normalized = name.replace("\\", "/")
+        if normalized.startswith("/") or ".." in normalized.split("/"):
+            return False, "invalid_zip_path"
+        if normalized in allowed_top_level:
+            continue
+        if normalized.startswith("media/") and is_safe_media_relpath(normalized[len("media/"):]):
+            continue
+        if normalized.startswith("db_chunks/") and is_sha256_name(normalized[len("db_chunks/"):]):
+            continue
+        return False, "unexpected_zip_entry"
+    return True, "ok"
+
+
+def build_zip_manifest(file_payloads: dict[str, bytes]) -> dict:
+    files = []
+    for path in sorted(file_payloads.keys()):
+        blob = file_payloads[path]
+        files.append({
+            "path": path,
+            "bytes": len(blob),
+            "sha256": hashlib.sha256(blob).hexdigest(),
+        })
+    return {
+        "created_at": utc_now_iso(),
+        "files": files,
+    }
+
+
+def normalize_issue_ref(raw: str | None) -> str:
+    if raw is None:
+        return "FLOWFORM-LOCAL"
+    value = str(raw).strip()
+    return value or "FLOWFORM-LOCAL"
+
+
+EXPORT_DIR = INSTANCE_DIR / "exports"
+EXPORT_JOB_WORKERS = max(1, int(os.getenv("EXPORT_JOB_WORKERS", "2")))
+EXPORT_JOB_MAX_PENDING = 3
+EXPORT_JOB_STALE_SECONDS = 900
+EXPORT_JOB_HEARTBEAT_SECONDS = 30
+EXPORT_JOB_TTL_SECONDS = 24 * 3600
+# Each job kind replays one synchronous export route. "global" kinds read every user's rows,
+# so their cache key is the sum of all data versions.
+EXPORT_JOB_KINDS = {
+    "backup": {"path": "/api/export/backup", "params": ("mode", "base"), "scope": "global"},
+    "json": {"path": "/api/export/json", "params": (), "scope": "user"},
+    "zip": {"path": "/api/export/zip", "params": ("force", "issue_ref"), "scope": "user"},
+    "plan": {"path": "/api/export/plan", "params": (), "scope": "user"},
+    "history_csv": {"path": "/api/export/history.csv", "params": (), "scope": "user"},
+    "plan_pdf": {"path": "/api/export/plan_pdf/{plan_id}", "params": ("plan_id",), "scope": "user"},
+    "session_summary": {"path": "/api/export/session_summary/{completion_id}", "params": ("completion_id",), "scope": "user"},
+}
+_EXPORT_JOB_POOL: ThreadPoolExecutor | None = None
+_EXPORT_JOB_LOCK = threading.Lock()
+_EXPORT_JOB_FUTURES: dict = {}
+
+
+def data_version(connection: sqlite3.Connection, user_id: int | None) -> int:
+    # Row 0 counts shared rows (templates, app_state); None sums everyone.
+    if user_id is None:
+        row = connection.execute("SELECT COALESCE(SUM(version), 0) FROM user_data_version").fetchone()
+    else:
+        row = connection.execute("SELECT COALESCE(SUM(version), 0) FROM user_data_version WHERE user_id IN (0, ?)", (user_id,)).fetchone()
+    return int(row[0])
+
 
+def export_job_params(kind: str, raw) -> dict:
+    spec = EXPORT_JOB_KINDS[kind]
+    if raw is None:
+        raw = {}
+    if not isinstance(raw, dict):
+        raise ValueError("invalid_export_params")
+    params = {}
+    for key, value in raw.items():
+        if key not in spec["params"] or value is None or isinstance(value, (dict, list)):
+            raise ValueError("invalid_export_params")
+        params[key] = str(value).strip()
+    for key in spec["params"]:
+        if "{" + key + "}" in spec["path"] and not params.get(key, "").isdigit():
+            raise ValueError("invalid_export_params")
+    return params
+
+
+def export_job_cacheable(kind: str, params: dict) -> bool:
+    # A backup also carries users, subscriptions, assistant messages and the audit log, which no
+    # data version tracks (and an incremental one depends on the last backup): always rebuild it.
+    return kind != "backup"
+
+
+def prune_export_jobs(connection: sqlite3.Connection) -> int:
+    # Finished, failed and superseded jobs live for EXPORT_JOB_TTL_SECONDS whatever their params;
+    # files no live job points at (parts left by a dead worker) age out the same way.
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=EXPORT_JOB_TTL_SECONDS)
+    rows = connection.execute(
+        "SELECT id, artifact FROM export_job WHERE status IN ('done', 'expired', 'failed') AND updated_at < ?",
+        (cutoff.isoformat(),),
+    ).fetchall()
+    connection.executemany("DELETE FROM export_job WHERE id = ?", [(row[0],) for row in rows])
+    connection.commit()
+    for _, artifact in rows:
+        if artifact:
+            (EXPORT_DIR / artifact).unlink(missing_ok=True)
+    if EXPORT_DIR.is_dir():
+        live = {row[0] for row in connection.execute("SELECT artifact FROM export_job WHERE artifact IS NOT NULL")}
+        for path in EXPORT_DIR.iterdir():
+            if path.name not in live and path.is_file() and path.stat().st_mtime < cutoff.timestamp():
+                path.unlink(missing_ok=True)
+    return len(rows)
+
+
+def export_job_pool() -> ThreadPoolExecutor:
+    global _EXPORT_JOB_POOL
+    with _EXPORT_JOB_LOCK:
+        if _EXPORT_JOB_POOL is None:
+            _EXPORT_JOB_POOL = ThreadPoolExecutor(max_workers=EXPORT_JOB_WORKERS, thread_name_prefix="export-job")
+        return _EXPORT_JOB_POOL
+
+
+def submit_export_job(app: Flask, job_id: str) -> None:
+    # Call after the enqueueing transaction commits.
+    with _EXPORT_JOB_LOCK:
+        if job_id in _EXPORT_JOB_FUTURES:
+            return
+    future = export_job_pool().submit(run_export_job, app, job_id)
+    with _EXPORT_JOB_LOCK:
+        _EXPORT_JOB_FUTURES[job_id] = future
+    future.add_done_callback(lambda _: _discard_export_future(job_id, future))
+
+
+def _discard_export_future(job_id: str, future) -> None:
+    with _EXPORT_JOB_LOCK:
+        if _EXPORT_JOB_FUTURES.get(job_id) is future:
+            del _EXPORT_JOB_FUTURES[job_id]
+
+
+def export_job_in_flight(job_id: str) -> bool:
+    with _EXPORT_JOB_LOCK:
+        return job_id in _EXPORT_JOB_FUTURES
+
+
+def run_export_job(app: Flask, job_id: str) -> None:
+    db_path = Path(app.config["DB_PATH"])
+    connection = open_tuned_connection(db_path)
+    try:
+        # The conditional UPDATE is the claim: a second worker given the same id does nothing.
+        claimed = connection.execute(
+            "UPDATE export_job SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+            (utc_now_iso(), job_id),
+        ).rowcount
+        connection.commit()
+        if not claimed:
+            return
+        prune_export_jobs(connection)
+        user_id, kind, params_json = connection.execute("SELECT user_id, kind, params FROM export_job WHERE id = ?", (job_id,)).fetchone()
+        spec = EXPORT_JOB_KINDS[kind]
+        params = json.loads(params_json)
+        path = spec["path"].format(**params)
+        query = {key: value for key, value in params.items() if "{" + key + "}" not in spec["path"]}
+        EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+        # Per attempt: a stale job re-queued while its old worker still writes never shares the file.
+        partial = EXPORT_DIR / f"{job_id}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with app.test_request_context(path, query_string=query):
+                g.user_id = int(user_id)
+                response = app.full_dispatch_request()
+                try:
+                    if response.status_code != 200:
+                        body = response.get_json(silent=True) or {}
+                        raise ValueError(body.get("error") or f"http_{response.status_code}")
+                    heartbeat = time.monotonic()
+                    with open(partial, "wb") as handle:
+                        for chunk in response.iter_encoded():
+                            handle.write(chunk)
+                            # Keeps updated_at fresh so a long export is not mistaken for a dead one.
+                            if time.monotonic() - heartbeat >= EXPORT_JOB_HEARTBEAT_SECONDS:
+                                connection.execute(
+                                    "UPDATE export_job SET updated_at = ? WHERE id = ? AND status = 'running'", (utc_now_iso(), job_id)
+                                )
+                                connection.commit()
+                                heartbeat = time.monotonic()
+                finally:
+                    response.close()
+            _, options = parse_options_header(response.headers.get("Content-Disposition", ""))
+            download_name = options.get("filename") or f"flowform_{kind}"
+            artifact = f"{job_id}{Path(download_name).suffix}"
+            partial.replace(EXPORT_DIR / artifact)
+        except Exception as exc:
+            partial.unlink(missing_ok=True)
+            app.logger.warning("Export job %s (%s) failed: %s", job_id, kind, exc)
             connection.execute(
-                "UPDATE plan SET status = 'archived', updated_at = ? WHERE user_id = ? AND status = 'active'",
-                (now, user_id),
+                "UPDATE export_job SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (f"{exc}"[:500] if isinstance(exc, ValueError) else f"{type(exc).__name__}: {exc}"[:500], utc_now_iso(), job_id),
             )
+            connection.commit()
+            return
+        now = utc_now_iso()
+        connection.execute(
+            """
+            UPDATE export_job
+            SET status = 'done', artifact = ?, download_name = ?, mimetype = ?, size_bytes = ?, error = NULL, updated_at = ?
+            WHERE id = ?
+            """,
+            (artifact, download_name, response.mimetype, (EXPORT_DIR / artifact).stat().st_size, now, job_id),
+        )
+        # Older artifacts for the same export can never be served again once a newer one exists.
+        superseded = connection.execute(
+            """
+            SELECT id, artifact FROM export_job
+            WHERE user_id = ? AND kind = ? AND params = ? AND status = 'done' AND id != ?
+            """,
+            (user_id, kind, params_json, job_id),
+        ).fetchall()
+        for old_id, old_artifact in superseded:
+            connection.execute("UPDATE export_job SET status = 'expired', artifact = NULL, updated_at = ? WHERE id = ?", (now, old_id))
+            if old_artifact:
+                (EXPORT_DIR / old_artifact).unlink(missing_ok=True)
+        connection.commit()
+    finally:
+        connection.close()
 
-            plan_name = f"{goal.replace('_', ' ').title()} 4-Week Plan"
-            cursor = connection.execute(
-                """
-                INSERT INTO plan (user_id, name, start_date, weeks, status, created_at, updated_at)
-                VALUES (?, ?, ?, 4, 'active', ?, ?)
-                """,
-                (user_id, plan_name, today, now, now),
-            )
-            plan_id = int(cursor.lastrowid)
 
-            pool = fetch_template_pool(connection, ordered_disciplines, minutes_per_session, None if is_paid else 3)
-            pool = fetch_template_pool(connection, ordered_disciplines, minutes_per_session)
-            if not pool:
-                raise sqlite3.IntegrityError("session_template empty; cannot generate plan")
-            items = build_plan_structure(pool, ordered_disciplines, days_per_week, minutes_per_session, weeks=4)
+def drain_export_jobs(timeout: float = 60.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with _EXPORT_JOB_LOCK:
+            pending = set(_EXPORT_JOB_FUTURES.values())
+        if not pending:
+            return True
+        futures_wait(pending, timeout=max(0.0, deadline - time.monotonic()))
+        time.sleep(0.01)
+    return False
 
-            connection.executemany(
-                """
-                INSERT INTO plan_day (plan_id, week, day_index, template_id, title, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                [
-                    (plan_id, item["week"], item["day_index"], item["template_id"], item["title"], now, now)
-                    for item in items
-                ],
-            )
 
-            write_audit(
-                connection,
-                "plan_created",
-                {
-                    "plan_id": plan_id,
-                    "goal": goal,
-                    "days_per_week": days_per_week,
-                    "minutes_per_session": minutes_per_session,
-                    "disciplines": ordered_disciplines,
-                },
-            )
+def create_app(port: int | None = None) -> Flask:
+    load_env_file(ROOT_DIR / ".env")
+    configure_logging()
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+    app = Flask(__name__)
+
+    resolved_port = int(port if port is not None else os.getenv("PORT", "5203"))
+    db_path = Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve()
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+
+    app.config.update(
+        APP_NAME=APP_NAME,
+        VERSION=APP_VERSION,
+        PORT=resolved_port,
+        DB_PATH=str(db_path),
+        BUILD_DATE=BUILD_DATE,
+        GIT_HASH=git_hash(),
+        FIRST_CHECK={"ok": True, "message": ""},
+        ENABLE_AUTH=env_flag_true(os.getenv("ENABLE_AUTH")),
+        MEDIA_OFFLOAD=media_offload_mode(os.getenv("MEDIA_OFFLOAD")),
+        MEDIA_OFFLOAD_PREFIX=os.getenv("MEDIA_OFFLOAD_PREFIX", "/protected-media/"),
+    )
+    app.secret_key = os.getenv("SECRET_KEY", "flowform-dev-secret")
+
+    app.logger.info("FlowForm boot config: port=%s db=%s", resolved_port, db_path)
+
+    pool = SQLiteConnectionPool(db_path)
+    app.extensions["sqlite_pool"] = pool
+
+    def db() -> sqlite3.Connection:
+        # One pooled connection per request, shared by require_login and the view.
+        if "db" not in g:
+            g.db = pool.acquire()
+        return g.db
+
+    @app.teardown_appcontext
+    def release_db(_: BaseException | None = None) -> None:
+        connection = g.pop("db", None)
+        if connection is not None:
+            pool.release(connection)
+
+    def auth_enabled() -> bool:
+        return bool(app.config.get("ENABLE_AUTH", False))
+
+    def project_is_approved(connection: sqlite3.Connection) -> bool:
+        row = connection.execute("SELECT value FROM app_state WHERE key = 'project_approved' LIMIT 1").fetchone()
+        if not row:
+            return False
+        return env_flag_true(row[0])
+
+    def set_project_approved(connection: sqlite3.Connection, approved: bool) -> None:
+        now = utc_now_iso()
+        value = "true" if approved else "false"
+        connection.execute(
+            """
+            INSERT INTO app_state (key, value, created_at, updated_at)
+            VALUES ('project_approved', ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at
+            """,
+            (value, now, now),
+        )
+
+    def current_user_id(connection: sqlite3.Connection) -> int:
+        if "user_id" not in g:
+            g.user_id = resolve_user_id(connection)
+        return g.user_id
+
+    def resolve_user_id(connection: sqlite3.Connection) -> int:
+        if not auth_enabled():
+            return get_or_create_founder_user(connection)
+        user_id = session.get("user_id")
+        if not user_id:
+            return 0
+        row = connection.execute("SELECT id, enabled FROM users WHERE id = ?", (int(user_id),)).fetchone()
+        if not row or int(row[1]) == 0:
+            session.clear()
+            return 0
+        return int(row[0])
+
+    def require_login(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not auth_enabled():
+                return view(*args, **kwargs)
+            uid = current_user_id(db())
+            if uid <= 0:
+                if is_api_request():
+                    return jsonify({"error": "auth_required"}), 401
+                return redirect(url_for("login_page"))
+            return view(*args, **kwargs)
+
+        return wrapped
+
+    @app.context_processor
+    def inject_auth_flags():
+        return {
+            "auth_enabled": auth_enabled(),
+            "current_session_user_id": session.get("user_id"),
+        }
 
+    def init_db_safely() -> dict:
+        try:
+            connection = open_tuned_connection(db_path)
+            apply_schema_migrations(connection)
+            get_or_create_founder_user(connection)
+            seed_templates(connection)
             connection.commit()
-        except (sqlite3.Error, ValueError) as exc:
-            connection.rollback()
             connection.close()
-            return jsonify({"ok": False, "error": str(exc)}), 400
-        connection.close()
+            invalidate_template_index(db_path)
+            return {"ok": True, "message": "db_ready"}
+        except sqlite3.Error as exc:
+            app.logger.warning("SQLite init degraded: %s", exc)
+            return {"ok": False, "message": f"SQLite init degraded: {exc}"}
 
-        if request.is_json:
-            return jsonify({"ok": True, "plan_id": plan_id, "redirect": "/plan/current"})
-        return redirect(url_for("plan_current"))
+    app.config["FIRST_CHECK"] = init_db_safely()
 
-    @app.post("/api/plan/regenerate-next-week")
-    @require_login
-    def api_plan_regenerate_next_week():
-        connection = sqlite3.connect(db_path)
-        connection.execute("PRAGMA foreign_keys = ON")
+    @app.errorhandler(404)
+    def handle_not_found(_: Exception):
+        if is_api_request():
+            return jsonify({"error": "not_found"}), 404
+        return render_template("friendly_error.html", code=404, title="Page not found", message="The page you requested does not exist."), 404
+
+    @app.errorhandler(500)
+    def handle_server_error(error: Exception):
+        app.logger.exception("Unhandled server error: %s", error)
+        if is_api_request():
+            return jsonify({"error": "internal_server_error"}), 500
+        return render_template(
+            "friendly_error.html",
+            code=500,
+            title="Something went wrong",
+            message="An unexpected error occurred. Please retry or return to Ready.",
+        ), 500
+
+    @app.get("/")
+    def root():
+        check = first_check_state(app)
+        if not check.get("ok", False):
+            return render_template("first_run_error.html", error_message=check.get("message", "Unknown startup check failure")), 500
+        if auth_enabled() and not session.get("user_id"):
+            return redirect(url_for("login_page"))
+        return redirect(url_for("ready"))
+
+    @app.get("/signup")
+    def signup_page():
+        if not auth_enabled():
+            return render_template("signup.html", auth_disabled_note=True)
+        return render_template("signup.html", auth_disabled_note=False)
+
+    @app.post("/signup")
+    def signup_submit():
+        if not auth_enabled():
+            return render_template("signup.html", auth_disabled_note=True, error="Auth disabled."), 200
+        email = str(request.form.get("email", "")).strip().lower()
+        password = str(request.form.get("password", "")).strip()
+        display_name = str(request.form.get("display_name", "")).strip() or "User"
+        if not email or not password:
+            return render_template("signup.html", error="Email and password are required."), 400
+
+        connection = db()
+        exists = connection.execute("SELECT id FROM users WHERE lower(email) = ?", (email,)).fetchone()
+        if exists:
+            return render_template("signup.html", error="Email already registered."), 400
         now = utc_now_iso()
-        try:
-            user_id = current_user_id(connection)
-            user_id = get_or_create_founder_user(connection)
-            row = current_plan_record(connection, user_id)
-            if row is None:
-                raise sqlite3.IntegrityError("No plan found")
+        cursor = connection.execute(
+            """
+            INSERT INTO users (email, display_name, password_hash, role, enabled, created_at, updated_at)
+            VALUES (?, ?, ?, 'member', 1, ?, ?)
+            """,
+            (email, display_name, generate_password_hash(password), now, now),
+        )
+        user_id = int(cursor.lastrowid)
+        ensure_subscription_row(connection, user_id)
+        connection.commit()
+        session["user_id"] = user_id
+        return redirect(url_for("ready"))
 
-            plan_id = int(row["id"])
-            total_weeks = int(row["weeks"])
-            start = date.fromisoformat(row["start_date"])
-            elapsed = max(0, (date.today() - start).days)
-            current_week = min(total_weeks, (elapsed // 7) + 1)
-            next_week = min(total_weeks, current_week + 1)
+    @app.get("/login")
+    def login_page():
+        if not auth_enabled():
+            return render_template("login.html", auth_disabled_note=True)
+        return render_template("login.html", auth_disabled_note=False)
 
-            profile = connection.execute(
-                "SELECT goal, days_per_week, minutes FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
-                (user_id,),
-            ).fetchone()
-            days_per_week = clamp_int(int(profile[1]) if profile and profile[1] else 4, 2, 6)
-            minutes_per_session = clamp_int(int(profile[2]) if profile and profile[2] else 50, 30, 75)
-            goal = (profile[0] if profile and profile[0] else "hybrid").strip().lower().replace(" ", "_")
-            ordered_disciplines = GOAL_DEFAULTS.get(goal, GOAL_DEFAULTS["hybrid"])
-
-            completed_day_ids = {
-                int(item[0])
-                for item in connection.execute(
-                    """
-                    SELECT sc.plan_day_id
-                    FROM session_completion sc
-                    JOIN plan_day pd ON pd.id = sc.plan_day_id
-                    WHERE pd.plan_id = ? AND pd.week = ?
-                    """,
-                    (plan_id, next_week),
-                ).fetchall()
+    @app.post("/login")
+    def login_submit():
+        if not auth_enabled():
+            return render_template("login.html", auth_disabled_note=True, error="Auth disabled."), 200
+        email = str(request.form.get("email", "")).strip().lower()
+        password = str(request.form.get("password", "")).strip()
+        connection = db()
+        row = connection.execute(
+            "SELECT id, password_hash, enabled FROM users WHERE lower(email) = ?",
+            (email,),
+        ).fetchone()
+        if (not row) or int(row[2]) == 0 or not check_password_hash(str(row[1] or ""), password):
+            return render_template("login.html", error="Invalid credentials."), 401
+        session["user_id"] = int(row[0])
+        return redirect(url_for("ready"))
+
+    @app.get("/logout")
+    def logout():
+        session.clear()
+        return redirect(url_for("login_page") if auth_enabled() else url_for("ready"))
+
+    @app.get("/health")
+    def health():
+        snapshot = db_integrity_snapshot(db_path)
+        return jsonify(
+            {
+                "status": "ok" if snapshot["db_ok"] else "degraded",
+                "version": app.config["VERSION"],
+                "time": utc_now_iso(),
+                "db_ok": snapshot["db_ok"],
+                "template_count": snapshot["template_count"],
+                "provider_status": provider_status(),
             }
+        )
 
-            existing_rows = connection.execute(
-                "SELECT id FROM plan_day WHERE plan_id = ? AND week = ?",
-                (plan_id, next_week),
-            ).fetchall()
-            for item in existing_rows:
-                plan_day_id = int(item[0])
-                if plan_day_id not in completed_day_ids:
-                    connection.execute("DELETE FROM plan_day WHERE id = ?", (plan_day_id,))
-
-            pool = fetch_template_pool(connection, ordered_disciplines, minutes_per_session)
-            week_items = [
-                item
-                for item in build_plan_structure(pool, ordered_disciplines, days_per_week, minutes_per_session, weeks=next_week)
-                if item["week"] == next_week
-            ]
-
-            existing_day_indexes = {
-                int(row[0])
-                for row in connection.execute(
-                    "SELECT day_index FROM plan_day WHERE plan_id = ? AND week = ?",
-                    (plan_id, next_week),
-                ).fetchall()
+    @app.get("/api/health")
+    def api_health():
+        snapshot = db_integrity_snapshot(db_path)
+        is_db_ok = snapshot["db_ok"] and bool(first_check_state(app).get("ok", False))
+        return jsonify(
+            {
+                "status": "ok" if is_db_ok else "degraded",
+                "port": app.config["PORT"],
+                "db_ok": is_db_ok,
+                "template_count": snapshot["template_count"],
+                "version": app.config["VERSION"],
             }
+        )
 
-            for item in week_items:
-                if item["day_index"] in existing_day_indexes:
-                    continue
-                connection.execute(
-                    """
-                    INSERT INTO plan_day (plan_id, week, day_index, template_id, title, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """,
-                    (plan_id, item["week"], item["day_index"], item["template_id"], item["title"], now, now),
-                )
-
-            write_audit(connection, "plan_week_regenerated", {"plan_id": plan_id, "week": next_week})
-            connection.commit()
-            payload = {"ok": True, "plan_id": plan_id, "week": next_week}
-        except (sqlite3.Error, ValueError) as exc:
-            connection.rollback()
-            payload = {"ok": False, "error": str(exc)}
-        connection.close()
-
-        if request.is_json:
-            return jsonify(payload), (200 if payload.get("ok") else 400)
-        return redirect(url_for("plan_current"))
+    @app.get("/version")
+    def version():
+        return jsonify(
+            {
+                "app_name": app.config["APP_NAME"],
+                "semantic_version": app.config["VERSION"],
+                "build_date": app.config["BUILD_DATE"],
+                "git_hash": app.config["GIT_HASH"],
+            }
+        )
 
-    @app.get("/recovery")
+    @app.get("/plan/wizard")
     @require_login
-    def recovery():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-    def recovery():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = get_or_create_founder_user(connection)
-        rows = connection.execute(
-            """
-            SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes
-            FROM recovery_checkin
-            WHERE user_id = ?
-            ORDER BY date DESC
-            LIMIT 14
-            """,
-            (user_id,),
-        ).fetchall()
-        connection.close()
-
-        entries = [dict(row) for row in rows]
-        latest = entries[0] if entries else None
-        readiness = None
-        if latest is not None:
-            score, explanation = compute_readiness_score(
-                float(latest["sleep_hours"] or 0),
-                int(latest["stress_1_10"] or 5),
-                int(latest["soreness_1_10"] or 5),
-                int(latest["mood_1_10"] or 5),
-            )
-            readiness = {"score": score, "label": readiness_label(score), "explanation": explanation}
-
-        return render_template("recovery.html", entries=entries, readiness=readiness, today=date.today().isoformat())
+    def plan_wizard():
+        return render_template("plan_wizard.html", disciplines=DISCIPLINES, seed=new_plan_seed())
 
-    @app.post("/api/recovery/checkin")
+    @app.post("/api/plan/create")
     @require_login
-    def api_recovery_checkin():
+    def api_plan_create():
         payload = request.get_json(silent=True) or request.form.to_dict()
         try:
-            checkin_date = str(payload.get("date") or date.today().isoformat())
-            sleep_hours = max(0.0, min(24.0, float(payload.get("sleep_hours", 0))))
-            stress = clamp_int(int(payload.get("stress_1_10", 5)), 1, 10)
-            soreness = clamp_int(int(payload.get("soreness_1_10", 5)), 1, 10)
-            mood = clamp_int(int(payload.get("mood_1_10", 5)), 1, 10)
-            notes = str(payload.get("notes", "")).strip()
+            settings = plan_settings_from_payload(payload)
         except (TypeError, ValueError):
             return jsonify({"ok": False, "error": "invalid_payload"}), 400
+        goal = settings["goal"]
+        days_per_week = settings["days_per_week"]
+        minutes_per_session = settings["minutes_per_session"]
+        ordered_disciplines = settings["disciplines"]
+        equipment = settings["equipment"]
+        combined_constraints = settings["constraints"]
 
-        score, explanation = compute_readiness_score(sleep_hours, stress, soreness, mood)
-        notes_with_readiness = (notes + "\n" if notes else "") + f"Readiness {score}/100 | {explanation}"
         now = utc_now_iso()
+        today = date.today().isoformat()
 
-        connection = sqlite3.connect(db_path)
+        connection = db()
         try:
             user_id = current_user_id(connection)
-            user_id = get_or_create_founder_user(connection)
-            existing = connection.execute(
-                "SELECT id FROM recovery_checkin WHERE user_id = ? AND date = ?",
-                (user_id, checkin_date),
+            if user_id <= 0:
+                raise sqlite3.IntegrityError("auth_required")
+            sub = user_subscription(connection, user_id)
+            is_paid = sub.get("plan") == "paid" and sub.get("status") == "active"
+            if not is_paid:
+                existing_plans = connection.execute(
+                    "SELECT COUNT(*) FROM plan WHERE user_id = ? AND status != 'archived'",
+                    (user_id,),
+                ).fetchone()[0]
+                if int(existing_plans) >= 1:
+                    return jsonify({
+                        "ok": False,
+                        "error": "free_tier_limit_reached",
+                        "message": "Free tier allows 1 active plan. Upgrade for unlimited plans.",
+                        "benefits": ["unlimited_plans", "priority_support", "early_access_ai"],
+                        "pay_now_link": None,
+                    }), 403
+
+            profile_row = connection.execute(
+                "SELECT id FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+                (user_id,),
             ).fetchone()
-            if existing:
+            if profile_row:
                 connection.execute(
                     """
-                    UPDATE recovery_checkin
-                    SET sleep_hours=?, stress_1_10=?, soreness_1_10=?, mood_1_10=?, notes=?, updated_at=?
-                    WHERE id=?
+                    UPDATE profile
+                    SET goal = ?, days_per_week = ?, minutes = ?, equipment = ?, constraints = ?, updated_at = ?
+                    WHERE id = ?
                     """,
-                    (sleep_hours, stress, soreness, mood, notes_with_readiness, now, int(existing[0])),
+                    (goal, days_per_week, minutes_per_session, equipment, combined_constraints, now, profile_row[0]),
                 )
             else:
                 connection.execute(
                     """
-                    INSERT INTO recovery_checkin (user_id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes, created_at, updated_at)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    INSERT INTO profile (user_id, goal, days_per_week, minutes, equipment, constraints, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                     """,
-                    (user_id, checkin_date, sleep_hours, stress, soreness, mood, notes_with_readiness, now, now),
+                    (user_id, goal, days_per_week, minutes_per_session, equipment, combined_constraints, now, now),
                 )
-            write_audit(connection, "recovery_checkin", {"date": checkin_date, "readiness_score": score})
-            connection.commit()
-        except sqlite3.Error as exc:
-            connection.rollback()
-            connection.close()
-            return jsonify({"ok": False, "error": str(exc)}), 400
-        connection.close()
-
-        if request.is_json:
-            return jsonify({"ok": True, "readiness_score": score, "readiness_label": readiness_label(score)})
-        return redirect(url_for("plan_current"))
-
-    @app.get("/plan/current")
-    @require_login
-    def plan_current():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-    def plan_current():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = get_or_create_founder_user(connection)
-        plan = current_plan_record(connection, user_id)
-        if plan is None:
-            connection.close()
-            return render_template("plan_current.html", plan=None, weeks=[], today_week=1, today_day=1)
-
-        rows = connection.execute(
-            """
-            SELECT
-                pd.id, pd.week, pd.day_index, pd.title, st.name AS template_name, st.discipline, st.duration_minutes,
-                MAX(sc.id) AS completion_id
-            FROM plan_day pd
-            LEFT JOIN session_template st ON st.id = pd.template_id
-            LEFT JOIN session_completion sc ON sc.plan_day_id = pd.id
-            WHERE pd.plan_id = ?
-            GROUP BY pd.id, pd.week, pd.day_index, pd.title, st.name, st.discipline, st.duration_minutes
-            SELECT pd.id, pd.week, pd.day_index, pd.title, st.name AS template_name, st.discipline, st.duration_minutes
-            FROM plan_day pd
-            LEFT JOIN session_template st ON st.id = pd.template_id
-            WHERE pd.plan_id = ?
-            ORDER BY pd.week ASC, pd.day_index ASC
-            """,
-            (int(plan["id"]),),
-        ).fetchall()
-
-        recent = connection.execute(
-            """
-            SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes
-            FROM recovery_checkin
-            WHERE user_id = ?
-            ORDER BY date DESC
-            LIMIT 1
-            """,
-            (user_id,),
-        ).fetchone()
-
-        readiness = None
-        suggestion = None
-        if recent is not None:
-            score, explanation = compute_readiness_score(
-                float(recent["sleep_hours"] or 0),
-                int(recent["stress_1_10"] or 5),
-                int(recent["soreness_1_10"] or 5),
-                int(recent["mood_1_10"] or 5),
-            )
-            readiness = {
-                "score": score,
-                "label": readiness_label(score),
-                "explanation": explanation,
-                "date": recent["date"],
-            }
-            if score < 55:
-                suggestion = suggestion_for_low_readiness(connection)
 
-        connection.close()
-
-        weeks_map: dict[int, list[dict]] = {}
-        for row in rows:
-            weeks_map.setdefault(int(row["week"]), []).append(
-                {
-                    "id": int(row["id"]),
-                    "day_index": int(row["day_index"]),
-                    "title": row["title"],
-                    "template_name": row["template_name"],
-                    "discipline": row["discipline"],
-                    "duration_minutes": row["duration_minutes"],
-                    "completed": row["completion_id"] is not None,
-                    "completion_id": row["completion_id"],
-                }
+            connection.execute(
+                "UPDATE plan SET status = 'archived', updated_at = ? WHERE user_id = ? AND status = 'active'",
+                (now, user_id),
             )
 
-        start = date.fromisoformat(plan["start_date"])
-        elapsed = max(0, (date.today() - start).days)
-        today_week = min(int(plan["weeks"]), (elapsed // 7) + 1)
-        today_day = (elapsed % 7) + 1
-
-        week_cards = [{"week": week, "days": days} for week, days in sorted(weeks_map.items())]
-        today_plan_day_id = None
-        for week in week_cards:
-            if week["week"] != today_week:
-                continue
-            for day in week["days"]:
-                if day["day_index"] == today_day:
-                    today_plan_day_id = day["id"]
-                    break
-
-        return render_template(
-            "plan_current.html",
-            plan=plan,
-            weeks=week_cards,
-            today_week=today_week,
-            today_day=today_day,
-            today_plan_day_id=today_plan_day_id,
-            readiness=readiness,
-            suggestion=suggestion,
-        )
-
-    @app.get("/media")
-    @require_login
-    def media_library():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-        items = connection.execute(
-            """
-            SELECT id, filename, original_name, media_type, tags, duration_sec, uploaded_at
-            FROM media_item
-            WHERE user_id = ?
-            ORDER BY id DESC
-            """,
-            (user_id,),
-        ).fetchall()
-        connection.close()
-        return render_template("media.html", items=[dict(r) for r in items])
-
-    @app.post("/media/upload")
-    @require_login
-    def media_upload():
-        upload = request.files.get("file")
-        if upload is None or not upload.filename:
-            return redirect(url_for("media_library"))
+            weeks = settings["weeks"]
+            plan_name = f"{goal.replace('_', ' ').title()} {weeks}-Week Plan"
+            cursor = connection.execute(
+                """
+                INSERT INTO plan (user_id, name, start_date, weeks, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'active', ?, ?)
+                """,
+                (user_id, plan_name, today, weeks, now, now),
+            )
+            plan_id = int(cursor.lastrowid)
 
-        safe_name = secure_filename(upload.filename)
-        if not safe_name:
-            return redirect(url_for("media_library"))
+            index = template_index(connection, db_path)
+            if not index:
+                raise sqlite3.IntegrityError("session_template empty; cannot generate plan")
+            seed = settings["seed"] if settings["seed"] is not None else new_plan_seed()
+            write_plan_spec(connection, plan_id, settings, seed, index, weeks, materialized_through=0)
+            materialize_plan_weeks(connection, index, plan_id, min(weeks, 1 + PLAN_WEEKS_AHEAD))
 
-        blob = upload.read()
-        if len(blob) > 250 * 1024 * 1024:
-            return jsonify({"ok": False, "error": "file_too_large", "message": "Max file size is 250MB."}), 400
+            write_audit(
+                connection,
+                "plan_created",
+                {
+                    "plan_id": plan_id,
+                    "goal": goal,
+                    "days_per_week": days_per_week,
+                    "minutes_per_session": minutes_per_session,
+                    "weeks": weeks,
+                    "disciplines": ordered_disciplines,
+                },
+            )
 
-        media_type = detect_media_type(safe_name, upload.mimetype)
-        if media_type == "other":
-            return jsonify({"ok": False, "error": "unsupported_media_type", "message": "Only image/audio/video uploads are supported."}), 400
+            connection.commit()
+        except (sqlite3.Error, ValueError) as exc:
+            connection.rollback()
+            return jsonify({"ok": False, "error": str(exc)}), 400
 
-        MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-        unique_name = f"{int(datetime.now(timezone.utc).timestamp())}_{safe_name}"
-        path = MEDIA_DIR / unique_name
-        path.write_bytes(blob)
+        if request.is_json:
+            return jsonify({"ok": True, "plan_id": plan_id, "redirect": "/plan/current"})
+        return redirect(url_for("plan_current"))
 
-        tags = parse_tags(request.form.get("tags", ""))
-        duration_raw = request.form.get("duration_sec")
+    def replan_current_plan(first_week: int | None, last_week: int | None, dry_run: bool) -> dict:
+        connection = db()
         try:
-            duration_sec = int(duration_raw) if duration_raw else None
-        except ValueError:
-            duration_sec = None
-
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        now = utc_now_iso()
-        connection.execute(
-            """
-            INSERT INTO media_item (user_id, filename, original_name, media_type, tags, duration_sec, uploaded_at, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, unique_name, upload.filename, media_type, tags, duration_sec, now, now, now),
-        )
-        connection.commit()
-        connection.close()
-        return redirect(url_for("media_library"))
+            user_id = current_user_id(connection)
+            row = current_plan_record(connection, user_id)
+            if row is None:
+                raise sqlite3.IntegrityError("No plan found")
 
-    @app.post("/media/<int:media_id>/delete")
-    @require_login
-    def media_delete(media_id: int):
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-        row = connection.execute("SELECT id, filename FROM media_item WHERE id = ? AND user_id = ?", (media_id, user_id)).fetchone()
-        if row is None:
-            connection.close()
-            return jsonify({"ok": False, "error": "media_not_found"}), 404
+            plan_id = int(row["id"])
+            total_weeks = int(row["weeks"])
+            next_week = min(total_weeks, plan_current_week(row) + 1)
+            first = clamp_int(first_week if first_week is not None else next_week, 1, total_weeks)
+            last = clamp_int(last_week if last_week is not None else first, first, total_weeks)
 
-        connection.execute("DELETE FROM media_item WHERE id = ?", (media_id,))
-        connection.commit()
-        connection.close()
+            index = template_index(connection, db_path)
+            if not index:
+                raise sqlite3.IntegrityError("session_template empty; cannot generate plan")
+            settings = profile_plan_settings(connection, user_id)
+            spec = plan_spec(connection, plan_id)
+            if spec is None:
+                diff = replan_weeks(connection, index, plan_id, first, last, settings, dry_run=dry_run)
+            else:
+                # Keep the plan's discipline order and seed; only the profile's days/minutes feed the re-plan.
+                settings["disciplines"] = spec["disciplines"]
+                diff = replan_weeks(
+                    connection, index, plan_id, first, last, settings,
+                    dry_run=dry_run, seed=spec["seed"], insert_through=spec["materialized_through"],
+                )
+            if dry_run:
+                connection.rollback()
+                return {"ok": True, **diff}
 
-        media_path = MEDIA_DIR / row["filename"]
-        if media_path.exists():
-            media_path.unlink(missing_ok=True)
-        return redirect(url_for("media_library"))
+            if spec is not None:
+                write_plan_spec(connection, plan_id, settings, spec["seed"], index, total_weeks, spec["materialized_through"])
+            write_audit(
+                connection,
+                "plan_weeks_replanned",
+                {"plan_id": plan_id, "weeks": [first, last], "inserted": diff["inserted"], "updated": diff["updated"], "deleted": diff["deleted"]},
+            )
+            connection.commit()
+            return {"ok": True, **diff}
+        except (sqlite3.Error, ValueError) as exc:
+            connection.rollback()
+            return {"ok": False, "error": str(exc)}
 
-    @app.post("/media/<int:media_id>/tags")
+    @app.post("/api/plan/preview")
     @require_login
-    def media_update_tags(media_id: int):
-        tags = parse_tags(request.form.get("tags", ""))
-        duration_raw = request.form.get("duration_sec")
+    def api_plan_preview():
+        payload = request.get_json(silent=True) or request.form.to_dict()
         try:
-            duration_sec = int(duration_raw) if duration_raw else None
-        except ValueError:
-            duration_sec = None
+            settings = plan_settings_from_payload(payload)
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid_payload"}), 400
 
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        updated = connection.execute(
-            "UPDATE media_item SET tags = ?, duration_sec = ?, updated_at = ? WHERE id = ? AND user_id = ?",
-            (tags, duration_sec, utc_now_iso(), media_id, user_id),
-        ).rowcount
-        connection.commit()
-        connection.close()
-        if updated == 0:
-            return jsonify({"ok": False, "error": "media_not_found"}), 404
-        return redirect(url_for("media_library"))
+        index = template_index(db(), db_path)
+        if not index:
+            return jsonify({"ok": False, "error": "session_template empty; cannot generate plan"}), 400
+        body = plan_preview_json(
+            index,
+            tuple(settings["disciplines"]),
+            settings["days_per_week"],
+            settings["minutes_per_session"],
+            settings["weeks"],
+            # Without a seed one is drawn here, as /api/plan/create would; the response carries it so
+            # the client can create exactly the plan it was shown.
+            settings["seed"] if settings["seed"] is not None else new_plan_seed(),
+        )
+        return app.response_class(body, mimetype="application/json")
 
-    @app.get("/media/file/<path:filename>")
+    @app.post("/api/plan/regenerate-next-week")
     @require_login
-    def media_file(filename: str):
-        safe = secure_filename(filename)
-        if not safe:
-            return jsonify({"error": "invalid_filename"}), 400
-        path = MEDIA_DIR / safe
-        if not path.exists() or not path.is_file():
-            return jsonify({"error": "media_not_found"}), 404
-        return send_file(path)
+    def api_plan_regenerate_next_week():
+        payload = request.get_json(silent=True) or request.form.to_dict() or {}
+        result = replan_current_plan(None, None, env_flag_true(str(payload.get("dry_run", "false"))))
+        if result.get("ok"):
+            result["week"] = result["weeks"][0]
 
-    @app.get("/media/<int:media_id>")
-    @require_login
-    def media_file_by_id(media_id: int):
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-        row = connection.execute(
-            "SELECT id, filename FROM media_item WHERE id = ? AND user_id = ?",
-            (media_id, user_id),
-        ).fetchone()
-        connection.close()
-        if row is None:
-            return jsonify({"error": "media_not_found"}), 404
-        path = MEDIA_DIR / row["filename"]
-        if not path.exists() or not path.is_file():
-            return jsonify({"error": "media_not_found"}), 404
-        return send_file(path)
+        if request.is_json:
+            return jsonify(result), (200 if result.get("ok") else 400)
+        return redirect(url_for("plan_current"))
 
-    @app.get("/templates")
+    @app.post("/api/plan/replan")
     @require_login
-    def templates_catalog():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
+    def api_plan_replan():
+        payload = request.get_json(silent=True) or request.form.to_dict() or {}
+        try:
+            first_week = int(payload["from_week"]) if payload.get("from_week") not in (None, "") else None
+            last_week = int(payload["to_week"]) if payload.get("to_week") not in (None, "") else None
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid_payload"}), 400
+        result = replan_current_plan(first_week, last_week, env_flag_true(str(payload.get("dry_run", "false"))))
+        return jsonify(result), (200 if result.get("ok") else 400)
 
-        limit_templates = None
-        if user_id > 0 and not has_paid_access(connection, user_id):
-            limit_templates = 3
+    @app.post("/api/plan/cohort")
+    @require_login
+    def api_plan_cohort():
+        payload = request.get_json(silent=True) or {}
+        profiles = payload.get("profiles")
+        if not isinstance(profiles, list) or not profiles or not all(isinstance(item, dict) for item in profiles):
+            return jsonify({"ok": False, "error": "profiles_required"}), 400
+        try:
+            chunk_size = clamp_int(int(payload.get("chunk_size", COHORT_CHUNK_SIZE)), 1, 1000)
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid_payload"}), 400
 
-        sql = """
-            SELECT id, name, discipline, duration_minutes, level
-            FROM session_template
-            ORDER BY discipline ASC, duration_minutes ASC, id ASC
-        """
-        if limit_templates is not None:
-            sql += f"\nLIMIT {int(limit_templates)}"
+        connection = db()
+        actor_id = current_user_id(connection)
+        role = connection.execute("SELECT role FROM users WHERE id = ?", (actor_id,)).fetchone()
+        if not role or role[0] != "admin":
+            return jsonify({"ok": False, "error": "admin_only"}), 403
 
-        rows = connection.execute(sql).fetchall()
-        media_count = connection.execute("SELECT COUNT(*) FROM media_item WHERE user_id = ?", (user_id,)).fetchone()[0]
-        connection.close()
-        return render_template("templates_catalog.html", templates=[dict(r) for r in rows], media_count=int(media_count))
+        index = template_index(connection, db_path)
+        if not index:
+            return jsonify({"ok": False, "error": "session_template empty; cannot generate plan"}), 400
+        summary = create_cohort_plans(connection, index, profiles, chunk_size)
+        return jsonify({"ok": summary["failed"] == 0, **summary})
 
-    @app.get("/templates/builder/<int:template_id>")
+    @app.get("/recovery")
     @require_login
-    def template_builder(template_id: int):
-        connection = sqlite3.connect(db_path)
+    def recovery():
+        connection = db()
         connection.row_factory = sqlite3.Row
         user_id = current_user_id(connection)
-        template_row = connection.execute(
-            "SELECT id, name, discipline, duration_minutes, level, json_blocks FROM session_template WHERE id = ?",
-            (template_id,),
-        ).fetchone()
-        if template_row is None:
-            connection.close()
-            return jsonify({"error": "template_not_found"}), 404
-
-        media_items = connection.execute(
-            "SELECT id, original_name, media_type, tags FROM media_item WHERE user_id = ? ORDER BY id DESC",
+        rows = connection.execute(
+            """
+            SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes
+            FROM recovery_checkin
+            WHERE user_id = ?
+            ORDER BY date DESC
+            LIMIT 14
+            """,
             (user_id,),
         ).fetchall()
-        blocks = blocks_from_json(template_row["json_blocks"] or "")
-        blocks = enrich_blocks_with_media(connection, blocks)
-        connection.close()
-        return render_template(
-            "template_builder.html",
-            template=dict(template_row),
-            blocks=blocks,
-            media_items=[dict(r) for r in media_items],
-        )
 
-    @app.post("/templates/builder/<int:template_id>/save")
+        entries = [dict(row) for row in rows]
+        latest = entries[0] if entries else None
+        readiness = None
+        if latest is not None:
+            score, explanation = compute_readiness_score(
+                float(latest["sleep_hours"] or 0),
+                int(latest["stress_1_10"] or 5),
+                int(latest["soreness_1_10"] or 5),
+                int(latest["mood_1_10"] or 5),
+            )
+            readiness = {"score": score, "label": readiness_label(score), "explanation": explanation}
+
+        return render_template("recovery.html", entries=entries, readiness=readiness, today=date.today().isoformat())
+
+    @app.post("/api/recovery/checkin")
     @require_login
-    def template_builder_save(template_id: int):
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        template_row = connection.execute(
-            "SELECT id, json_blocks FROM session_template WHERE id = ?",
-            (template_id,),
-        ).fetchone()
-        if template_row is None:
-            connection.close()
-            return jsonify({"ok": False, "error": "template_not_found"}), 404
+    def api_recovery_checkin():
+        payload = request.get_json(silent=True) or request.form.to_dict()
+        try:
+            checkin_date = date.fromisoformat(str(payload.get("date") or date.today().isoformat())).isoformat()
+            sleep_hours = max(0.0, min(24.0, float(payload.get("sleep_hours", 0))))
+            stress = clamp_int(int(payload.get("stress_1_10", 5)), 1, 10)
+            soreness = clamp_int(int(payload.get("soreness_1_10", 5)), 1, 10)
+            mood = clamp_int(int(payload.get("mood_1_10", 5)), 1, 10)
+            notes = str(payload.get("notes", "")).strip()
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid_payload"}), 400
 
-        blocks = blocks_from_json(template_row["json_blocks"] or "")
-        for idx, block in enumerate(blocks):
-            media_value = request.form.get(f"media_item_id_{idx}", "")
-            try:
-                media_id = int(media_value) if media_value else None
-            except ValueError:
-                media_id = None
-            block["media_item_id"] = media_id
-            block.pop("seconds", None)
+        score, explanation = compute_readiness_score(sleep_hours, stress, soreness, mood)
+        notes_with_readiness = (notes + "\n" if notes else "") + f"Readiness {score}/100 | {explanation}"
+        now = utc_now_iso()
 
-        payload = {"blocks": blocks}
-        connection.execute(
-            "UPDATE session_template SET json_blocks = ?, updated_at = ? WHERE id = ?",
-            (json.dumps(payload), utc_now_iso(), template_id),
-        )
-        connection.commit()
-        connection.close()
-        return redirect(url_for("template_builder", template_id=template_id))
-        user_id = current_user_id(connection)
-        limit_clause = ""
-        if user_id > 0 and not has_paid_access(connection, user_id):
-            limit_clause = "LIMIT 3"
-        connection.row_factory = sqlite3.Row
-        rows = connection.execute(
-            f"""
-            SELECT id, name, discipline, duration_minutes, level
-            FROM session_template
-            ORDER BY discipline ASC, duration_minutes ASC, id ASC
-            {limit_clause}
-    def templates_catalog():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        rows = connection.execute(
-            """
-            SELECT id, name, discipline, duration_minutes, level
-            FROM session_template
-            ORDER BY discipline ASC, duration_minutes ASC, id ASC
-            """
-        ).fetchall()
-        connection.close()
-        return render_template("templates_catalog.html", templates=[dict(r) for r in rows])
+        connection = db()
+        try:
+            user_id = current_user_id(connection)
+            existing = connection.execute(
+                "SELECT id FROM recovery_checkin WHERE user_id = ? AND date = ?",
+                (user_id, checkin_date),
+            ).fetchone()
+            if existing:
+                connection.execute(
+                    """
+                    UPDATE recovery_checkin
+                    SET sleep_hours=?, stress_1_10=?, soreness_1_10=?, mood_1_10=?, notes=?, updated_at=?
+                    WHERE id=?
+                    """,
+                    (sleep_hours, stress, soreness, mood, notes_with_readiness, now, int(existing[0])),
+                )
+            else:
+                connection.execute(
+                    """
+                    INSERT INTO recovery_checkin (user_id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (user_id, checkin_date, sleep_hours, stress, soreness, mood, notes_with_readiness, now, now),
+                )
+            record_daily_readiness(connection, user_id, checkin_date, score)
+            write_audit(connection, "recovery_checkin", {"date": checkin_date, "readiness_score": score})
+            connection.commit()
+        except sqlite3.Error as exc:
+            connection.rollback()
+            return jsonify({"ok": False, "error": str(exc)}), 400
 
-    @app.get("/analytics")
-    @require_login
-    def analytics():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-        snapshot = analytics_snapshot(connection, user_id)
-        connection.close()
-        return render_template("analytics.html", analytics=snapshot)
-        data = analytics_snapshot(connection, user_id)
-        connection.close()
-        return render_template("analytics.html", analytics=data)
+        if request.is_json:
+            return jsonify({"ok": True, "readiness_score": score, "readiness_label": readiness_label(score)})
+        return redirect(url_for("plan_current"))
 
-    @app.get("/assistant")
+    @app.get("/plan/current")
     @require_login
-    def assistant_page():
-        connection = sqlite3.connect(db_path)
+    def plan_current():
+        connection = db()
         connection.row_factory = sqlite3.Row
         user_id = current_user_id(connection)
+        plan = current_plan_record(connection, user_id)
+        if plan is None:
+            return render_template("plan_current.html", plan=None, weeks=[], today_week=1, today_day=1)
+
+        index = template_index(connection, db_path)
+        today_week = plan_current_week(plan)
+        if materialize_plan_weeks(connection, index, int(plan["id"]), min(int(plan["weeks"]), today_week + PLAN_WEEKS_AHEAD)):
+            connection.commit()
+        spec = plan_spec(connection, int(plan["id"]))
+
         rows = connection.execute(
             """
-            SELECT prompt, response, mode, created_at
-            FROM assistant_message
-            WHERE user_id = ?
-            ORDER BY id DESC
-            LIMIT 20
+            SELECT
+                pd.id, pd.week, pd.day_index, pd.title, st.name AS template_name, st.discipline, st.duration_minutes,
+                MAX(sc.id) AS completion_id
+            FROM plan_day pd
+            LEFT JOIN session_template st ON st.id = pd.template_id
+            LEFT JOIN session_completion sc ON sc.plan_day_id = pd.id
+            WHERE pd.plan_id = ?
+            GROUP BY pd.id, pd.week, pd.day_index, pd.title, st.name, st.discipline, st.duration_minutes
+            ORDER BY pd.week ASC, pd.day_index ASC
             """,
-            (user_id,),
+            (int(plan["id"]),),
         ).fetchall()
-        connection.close()
-        return render_template("assistant.html", messages=[dict(r) for r in rows], disclaimer=assistant_disclaimer())
-
-    @app.post("/api/assistant/chat")
-    @require_login
-    def api_assistant_chat():
-        payload = request.get_json(silent=True) or request.form.to_dict()
-        message = str(payload.get("message", "")).strip()
-        action = str(payload.get("action", "custom")).strip()
-        if not message and action == "custom":
-            return jsonify({"ok": False, "error": "message_required"}), 400
-
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        ctx = assistant_context(connection, user_id)
-        mode = "rules"
-
-        if has_medical_risk_signal(message):
-            body = "Your message suggests injury or severe symptoms. Consider seeking medical advice. If symptoms are urgent, seek immediate care."
-            mode = "escalation"
-        else:
-            api_key = os.getenv("OPENAI_API_KEY", "").strip()
-            if api_key:
-                try:
-                    body = assistant_llm_reply(api_key, action, message or action, ctx)
-                    mode = "llm"
-                except (urllib.error.URLError, urllib.error.HTTPError, TimeoutError, KeyError, ValueError, json.JSONDecodeError):
-                    body, mode = assistant_rules_reply(action, message, ctx)
-            else:
-                body, mode = assistant_rules_reply(action, message, ctx)
 
-        response_text = f"{assistant_disclaimer()}\n\n{body}"
-        now = utc_now_iso()
-        connection.execute(
-            """
-            INSERT INTO assistant_message (user_id, prompt, response, mode, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (user_id, message or action, response_text, mode, now, now),
-        )
-        connection.execute(
+        recent = connection.execute(
             """
-            DELETE FROM assistant_message
+            SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes
+            FROM recovery_checkin
             WHERE user_id = ?
-              AND id NOT IN (
-                SELECT id FROM assistant_message WHERE user_id = ? ORDER BY id DESC LIMIT 20
-              )
+            ORDER BY date DESC
+            LIMIT 1
             """,
-            (user_id, user_id),
-        )
-        connection.commit()
-        connection.close()
-        return jsonify({"ok": True, "response": response_text, "mode": mode})
-    def analytics():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = get_or_create_founder_user(connection)
-        data = analytics_snapshot(connection, user_id)
-        connection.close()
-        return render_template("analytics.html", analytics=data)
-
-    @app.get("/settings/profile")
-    @require_login
-    def settings_profile():
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        user_id = current_user_id(connection)
-        user = connection.execute("SELECT id, email, display_name, role FROM users WHERE id = ?", (user_id,)).fetchone()
-        profile = connection.execute(
-            "SELECT goal, days_per_week, minutes, equipment, constraints FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
             (user_id,),
         ).fetchone()
-        sub = user_subscription(connection, user_id)
-        connection.close()
-        return render_template("settings_profile.html", user=user, profile=profile, subscription=sub, auth_enabled=auth_enabled())
-
-    @app.post("/settings/profile")
-    @require_login
-    def settings_profile_submit():
-        payload = request.form
-        display_name = str(payload.get("display_name", "")).strip() or "User"
-        goal = str(payload.get("goal", "hybrid")).strip().lower().replace(" ", "_")
-        days_per_week = clamp_int(int(payload.get("days_per_week", 4)), 2, 6)
-        minutes = clamp_int(int(payload.get("minutes", 45)), 30, 75)
-        equipment = str(payload.get("equipment", "")).strip()
-        constraints = str(payload.get("constraints", "")).strip()
-        now = utc_now_iso()
 
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        connection.execute("UPDATE users SET display_name = ?, updated_at = ? WHERE id = ?", (display_name, now, user_id))
-        row = connection.execute("SELECT id FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
-        if row:
-            connection.execute(
-                "UPDATE profile SET goal = ?, days_per_week = ?, minutes = ?, equipment = ?, constraints = ?, updated_at = ? WHERE id = ?",
-                (goal, days_per_week, minutes, equipment, constraints, now, row[0]),
-            )
-        else:
-            connection.execute(
-                "INSERT INTO profile (user_id, goal, days_per_week, minutes, equipment, constraints, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (user_id, goal, days_per_week, minutes, equipment, constraints, now, now),
+        readiness = None
+        suggestion = None
+        if recent is not None:
+            score, explanation = compute_readiness_score(
+                float(recent["sleep_hours"] or 0),
+                int(recent["stress_1_10"] or 5),
+                int(recent["soreness_1_10"] or 5),
+                int(recent["mood_1_10"] or 5),
             )
-        connection.commit()
-        connection.close()
-        return redirect(url_for("settings_profile"))
+            readiness = {
+                "score": score,
+                "label": readiness_label(score),
+                "explanation": explanation,
+                "date": recent["date"],
+            }
+            if score < 55:
+                suggestion = suggestion_for_low_readiness(connection)
 
-    @app.get("/api/billing/checkout")
-    @require_login
-    def billing_checkout_stub():
-        return jsonify(
+
+        days = [
             {
-                "ok": True,
-                "provider": "stripe_stub",
-                "message": "Payment link intentionally unimplemented for safety.",
-                "pay_now_link": None,
-                "paid_benefits": ["unlimited_plans", "priority_support", "early_access_ai"],
+                "id": int(row["id"]),
+                "week": int(row["week"]),
+                "day_index": int(row["day_index"]),
+                "title": row["title"],
+                "template_name": row["template_name"],
+                "discipline": row["discipline"],
+                "duration_minutes": row["duration_minutes"],
+                "completed": row["completion_id"] is not None,
+                "completion_id": row["completion_id"],
             }
+            for row in rows
+        ]
+        weeks_map: dict[int, list[dict]] = {}
+        for day in with_spec_days(index, spec, int(plan["weeks"]), days):
+            day.setdefault("completed", False)
+            day.setdefault("completion_id", None)
+            weeks_map.setdefault(int(day["week"]), []).append(day)
+
+        elapsed = max(0, (date.today() - date.fromisoformat(plan["start_date"])).days)
+        today_day = (elapsed % 7) + 1
+
+        week_cards = [{"week": week, "days": days} for week, days in sorted(weeks_map.items())]
+        today_plan_day_id = None
+        for week in week_cards:
+            if week["week"] != today_week:
+                continue
+            for day in week["days"]:
+                if day["day_index"] == today_day:
+                    today_plan_day_id = day["id"]
+                    break
+
+        return render_template(
+            "plan_current.html",
+            plan=plan,
+            weeks=week_cards,
+            today_week=today_week,
+            today_day=today_day,
+            today_plan_day_id=today_plan_day_id,
+            readiness=readiness,
+            suggestion=suggestion,
         )
 
-    @app.get("/admin")
+    @app.get("/media")
     @require_login
-    def admin_dashboard():
-        connection = sqlite3.connect(db_path)
+    def media_library():
+        connection = db()
         connection.row_factory = sqlite3.Row
-        actor_id = current_user_id(connection)
-        actor = connection.execute("SELECT role FROM users WHERE id = ?", (actor_id,)).fetchone()
-        if not actor or actor[0] != "admin":
-            connection.close()
-            return jsonify({"error": "admin_only"}), 403
-        rows = connection.execute(
+        user_id = current_user_id(connection)
+        filters = media_page_args(request.args)
+        items, next_before = media_page(
+            connection,
+            user_id,
             """
-            SELECT u.id, u.email, u.display_name, u.role, u.enabled,
-                   COALESCE(s.plan, 'free') AS subscription_plan,
-                   COALESCE(s.status, 'active') AS subscription_status
-            FROM users u
-            LEFT JOIN subscriptions s ON s.user_id = u.id
-            ORDER BY u.id ASC
+            m.id, m.filename, m.original_name, m.media_type, m.tags, m.duration_sec, m.uploaded_at,
+            m.thumb_filename, m.width, m.height, m.size_bytes,
+            (SELECT COUNT(*) FROM template_media_ref r WHERE r.media_item_id = m.id) AS used_by
+            """,
+            **filters,
+        )
+        return render_template(
+            "media.html",
+            items=[dict(r) for r in items],
+            filters=filters,
+            next_before=next_before,
+            tags=media_tag_counts(connection, user_id),
+            media_types=MEDIA_TYPES,
+        )
+
+    @app.post("/media/upload")
+    @require_login
+    def media_upload():
+        # Werkzeug parses (and spools) the whole multipart body on first access to request.files, so
+        # the cap has to be in place before that to stop an oversized upload while it arrives.
+        request.max_content_length = MEDIA_MAX_BYTES + MEDIA_FORM_OVERHEAD_BYTES
+        try:
+            upload = request.files.get("file")
+        except RequestEntityTooLarge:
+            return jsonify({"ok": False, "error": "file_too_large", "message": "Max file size is 250MB."}), 400
+        if upload is None or not upload.filename:
+            return redirect(url_for("media_library"))
+
+        safe_name = secure_filename(upload.filename)
+        if not safe_name:
+            return redirect(url_for("media_library"))
+
+        media_type = detect_media_type(safe_name, upload.mimetype)
+        if media_type == "other":
+            return jsonify({"ok": False, "error": "unsupported_media_type", "message": "Only image/audio/video uploads are supported."}), 400
+
+        temp_path, sha256, size = stream_to_temp(upload.stream, MEDIA_DIR, MEDIA_MAX_BYTES)
+        if temp_path is None:
+            return jsonify({"ok": False, "error": "file_too_large", "message": "Max file size is 250MB."}), 400
+
+        tags = parse_tags(request.form.get("tags", ""))
+        duration_raw = request.form.get("duration_sec")
+        try:
+            duration_sec = int(duration_raw) if duration_raw else None
+        except ValueError:
+            duration_sec = None
+
+        connection = db()
+        user_id = current_user_id(connection)
+        now = utc_now_iso()
+        filename = store_media_blob(connection, temp_path, sha256, size, Path(safe_name).suffix)
+        probe = probe_media(resolve_media_path(filename))
+        cursor = connection.execute(
             """
-        ).fetchall()
-        connection.close()
-        return render_template("admin.html", users=[dict(r) for r in rows])
+            INSERT INTO media_item (user_id, filename, original_name, media_type, tags, duration_sec, width, height, uploaded_at, created_at, updated_at, content_sha256)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, filename, upload.filename, media_type, tags, duration_sec or probe["duration_sec"], probe["width"], probe["height"], now, now, now, sha256),
+        )
+        job_id = enqueue_media_job(connection, int(cursor.lastrowid))
+        connection.commit()
+        dispatch_media_jobs(db_path, [job_id] if job_id else [])
+        return redirect(url_for("media_library"))
 
-    @app.post("/admin/users/<int:user_id>/toggle")
+    @app.post("/media/<int:media_id>/delete")
     @require_login
-    def admin_toggle_user(user_id: int):
-        connection = sqlite3.connect(db_path)
-        actor_id = current_user_id(connection)
-        role = connection.execute("SELECT role FROM users WHERE id = ?", (actor_id,)).fetchone()
-        if not role or role[0] != "admin":
-            connection.close()
-            return jsonify({"error": "admin_only"}), 403
-        row = connection.execute("SELECT enabled FROM users WHERE id = ?", (user_id,)).fetchone()
+    def media_delete(media_id: int):
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+        row = connection.execute("SELECT id, filename FROM media_item WHERE id = ? AND user_id = ?", (media_id, user_id)).fetchone()
         if row is None:
-            connection.close()
-            return jsonify({"error": "user_not_found"}), 404
-        new_state = 0 if int(row[0]) else 1
-        connection.execute("UPDATE users SET enabled = ?, updated_at = ? WHERE id = ?", (new_state, utc_now_iso(), user_id))
+            return jsonify({"ok": False, "error": "media_not_found"}), 404
+
+        usage = media_usage(connection, media_id)
+        force = str(request.form.get("force") or "").lower() in {"true", "1", "yes"}
+        if usage and not force:
+            return jsonify({"ok": False, "error": "media_in_use", "templates": usage}), 409
+
+        # Detach the media from every block that uses it before the row goes away.
+        for item in usage:
+            blocks = template_blocks(connection, item["template_id"])
+            for block in blocks:
+                if block["media_item_id"] == media_id:
+                    block["media_item_id"] = None
+            replace_template_blocks(connection, item["template_id"], blocks)
+            connection.execute("UPDATE session_template SET updated_at = ? WHERE id = ?", (utc_now_iso(), item["template_id"]))
+        connection.execute("DELETE FROM media_job WHERE media_item_id = ?", (media_id,))
+        connection.execute("DELETE FROM media_item WHERE id = ?", (media_id,))
+        released = release_media_file(connection, row["filename"])
         connection.commit()
-        connection.close()
-        return redirect(url_for("admin_dashboard"))
+        unlink_released_media(connection, released)
+        return redirect(url_for("media_library"))
 
-    @app.get("/session/start/<int:plan_day_id>")
-    @require_login
-    @app.get("/session/start/<int:plan_day_id>")
-    def session_start(plan_day_id: int):
-        connection = sqlite3.connect(db_path)
+    def owned_upload(connection: sqlite3.Connection, upload_id: str):
         connection.row_factory = sqlite3.Row
-        row = connection.execute(
+        return connection.execute(
+            "SELECT * FROM upload_session WHERE id = ? AND user_id = ?",
+            (upload_id, current_user_id(connection)),
+        ).fetchone()
+
+    def upload_state(row: sqlite3.Row) -> dict:
+        return {
+            "ok": True,
+            "upload_id": row["id"],
+            "offset": int(row["received_bytes"]),
+            "size": int(row["total_bytes"]),
+            "chunk_bytes": MEDIA_CHUNK_BYTES,
+        }
+
+    @app.post("/api/media/uploads")
+    @require_login
+    def api_upload_create():
+        payload = request.get_json(silent=True) or {}
+        safe_name = secure_filename(str(payload.get("filename") or ""))
+        if not safe_name:
+            return jsonify({"ok": False, "error": "filename_required"}), 400
+        try:
+            size = int(payload.get("size"))
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "size_required"}), 400
+        if size <= 0 or size > MEDIA_RESUMABLE_MAX_BYTES:
+            message = f"Max file size is {MEDIA_RESUMABLE_MAX_BYTES // (1024 * 1024)}MB."
+            return jsonify({"ok": False, "error": "file_too_large", "message": message}), 400
+        media_type = detect_media_type(safe_name, payload.get("content_type"))
+        if media_type == "other":
+            return jsonify({"ok": False, "error": "unsupported_media_type", "message": "Only image/audio/video uploads are supported."}), 400
+        try:
+            duration_sec = int(payload["duration_sec"]) if payload.get("duration_sec") not in (None, "") else None
+        except (TypeError, ValueError):
+            duration_sec = None
+        expected = str(payload.get("sha256") or "").strip().lower() or None
+
+        connection = db()
+        user_id = current_user_id(connection)
+        gc_stale_uploads(connection)
+        upload_id = uuid.uuid4().hex
+        now = utc_now_iso()
+        connection.execute(
             """
-            SELECT pd.id AS plan_day_id, pd.title, pd.week, pd.day_index, st.name AS template_name,
-                   st.duration_minutes, st.json_blocks
-            FROM plan_day pd
-            LEFT JOIN session_template st ON st.id = pd.template_id
-            WHERE pd.id = ?
+            INSERT INTO upload_session (id, user_id, original_name, media_type, tags, duration_sec, total_bytes, expected_sha256, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            (plan_day_id,),
-        ).fetchone()
+            (upload_id, user_id, str(payload.get("filename")), media_type, parse_tags(str(payload.get("tags") or "")), duration_sec, size, expected, now, now),
+        )
+        connection.commit()
+        upload_part_path(upload_id).parent.mkdir(parents=True, exist_ok=True)
+        upload_part_path(upload_id).touch()
+        return jsonify(upload_state(owned_upload(connection, upload_id))), 201
 
+    @app.get("/api/media/uploads/<upload_id>")
+    @require_login
+    def api_upload_status(upload_id: str):
+        row = owned_upload(db(), upload_id)
         if row is None:
-            connection.close()
-        connection.close()
+            return jsonify({"ok": False, "error": "upload_not_found"}), 404
+        return jsonify(upload_state(row))
 
+    @app.put("/api/media/uploads/<upload_id>")
+    @require_login
+    def api_upload_chunk(upload_id: str):
+        connection = db()
+        row = owned_upload(connection, upload_id)
         if row is None:
-            return jsonify({"error": "plan_day_not_found"}), 404
-
-        blocks = blocks_from_json(row["json_blocks"] or "")
-        if not blocks:
-            duration = int(row["duration_minutes"] or 30)
-            blocks = [{"name": row["template_name"] or "Session", "minutes": duration, "seconds": duration * 60, "media_item_id": None}]
-        blocks = enrich_blocks_with_media(connection, blocks)
-        connection.close()
-            blocks = [{"name": row["template_name"] or "Session", "minutes": duration, "seconds": duration * 60}]
-
-        return render_template(
-            "session_start.html",
-            session={
-                "plan_day_id": int(row["plan_day_id"]),
-                "title": row["title"] or row["template_name"] or "Session",
-                "template_name": row["template_name"] or "Session",
-                "week": int(row["week"]),
-                "day_index": int(row["day_index"]),
-                "blocks": blocks,
-            },
+            return jsonify({"ok": False, "error": "upload_not_found"}), 404
+        if row["status"] != "open":
+            return jsonify({"ok": False, "error": "upload_finalizing"}), 409
+        try:
+            offset = int(request.args.get("offset", request.headers.get("Upload-Offset", "")))
+        except ValueError:
+            return jsonify({"ok": False, "error": "offset_required"}), 400
+        # Resending from an earlier offset is allowed (the client lost our reply); gaps are not.
+        if offset < 0 or offset > int(row["received_bytes"]):
+            return jsonify({"ok": False, "error": "offset_mismatch", "offset": int(row["received_bytes"])}), 409
+
+        received = write_upload_chunk(request.stream, upload_part_path(upload_id), offset, int(row["total_bytes"]))
+        if received is None:
+            received = offset
+            error = {"ok": False, "error": "chunk_exceeds_size", "offset": offset}
+        else:
+            error = None
+        connection.execute(
+            "UPDATE upload_session SET received_bytes = ?, updated_at = ? WHERE id = ?",
+            (received, utc_now_iso(), upload_id),
         )
+        connection.commit()
+        if error is not None:
+            return jsonify(error), 400
+        return jsonify(upload_state(owned_upload(connection, upload_id)))
 
-    @app.post("/api/session/finish")
+    @app.post("/api/media/uploads/<upload_id>/finalize")
     @require_login
-    def api_session_finish():
-        payload = request.get_json(silent=True) or request.form.to_dict()
-        try:
-            plan_day_id = int(payload.get("plan_day_id"))
-            rpe = clamp_int(int(payload.get("rpe", 5)), 1, 10)
-            notes = str(payload.get("notes", "")).strip()
-            minutes_done = clamp_int(int(payload.get("minutes_done", 0)), 0, 300)
-        except (TypeError, ValueError):
-            return jsonify({"ok": False, "error": "invalid_payload"}), 400
+    def api_upload_finalize(upload_id: str):
+        connection = db()
+        row = owned_upload(connection, upload_id)
+        if row is None:
+            return jsonify({"ok": False, "error": "upload_not_found"}), 404
+        if int(row["received_bytes"]) != int(row["total_bytes"]):
+            return jsonify({"ok": False, "error": "upload_incomplete", "offset": int(row["received_bytes"])}), 409
+
+        part = upload_part_path(upload_id)
+        payload = request.get_json(silent=True) or {}
+        expected = str(payload.get("sha256") or row["expected_sha256"] or "").strip().lower()
+        if not expected:
+            return jsonify({"ok": False, "error": "checksum_required"}), 400
+        # The conditional UPDATE is the claim: a repeated or concurrent finalize (and any chunk
+        # write) is refused until this one stores the file or reopens the session.
+        claimed = connection.execute(
+            """
+            UPDATE upload_session SET status = 'finalizing', updated_at = ?
+            WHERE id = ? AND status = 'open' AND received_bytes = total_bytes
+            """,
+            (utc_now_iso(), upload_id),
+        ).rowcount
+        connection.commit()
+        if not claimed:
+            return jsonify({"ok": False, "error": "upload_finalizing"}), 409
 
-        now = utc_now_iso()
-        connection = sqlite3.connect(db_path)
         try:
-            exists = connection.execute("SELECT id FROM plan_day WHERE id = ?", (plan_day_id,)).fetchone()
-            if not exists:
-                return jsonify({"ok": False, "error": "plan_day_not_found"}), 404
+            sha256 = file_sha256(part)
+            if sha256 != expected:
+                # The bytes on disk are unusable; restart the session from zero.
+                part.write_bytes(b"")
+                connection.execute(
+                    "UPDATE upload_session SET status = 'open', received_bytes = 0, updated_at = ? WHERE id = ?", (utc_now_iso(), upload_id)
+                )
+                connection.commit()
+                return jsonify({"ok": False, "error": "checksum_mismatch", "sha256": sha256, "offset": 0}), 400
 
+            now = utc_now_iso()
+            filename = store_media_blob(connection, part, sha256, int(row["total_bytes"]), Path(secure_filename(row["original_name"])).suffix)
+            probe = probe_media(resolve_media_path(filename))
             cursor = connection.execute(
                 """
-                INSERT INTO session_completion (plan_day_id, completed_at, rpe, notes, minutes_done, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO media_item (user_id, filename, original_name, media_type, tags, duration_sec, width, height, uploaded_at, created_at, updated_at, content_sha256)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (plan_day_id, now, rpe, notes, minutes_done, now, now),
+                (
+                    row["user_id"], filename, row["original_name"], row["media_type"], row["tags"],
+                    row["duration_sec"] or probe["duration_sec"], probe["width"], probe["height"], now, now, now, sha256,
+                ),
             )
-            completion_id = int(cursor.lastrowid)
-            write_audit(connection, "session_completed", {"completion_id": completion_id, "plan_day_id": plan_day_id})
+            connection.execute("DELETE FROM upload_session WHERE id = ?", (upload_id,))
+            job_id = enqueue_media_job(connection, int(cursor.lastrowid))
             connection.commit()
-        except sqlite3.Error as exc:
+        except Exception:
             connection.rollback()
-            connection.close()
-            return jsonify({"ok": False, "error": str(exc)}), 400
-        connection.close()
-
-        return jsonify({"ok": True, "completion_id": completion_id, "redirect": f"/session/summary/{completion_id}"})
+            # Reopen the session; if the part already moved into the media tree, the client starts over.
+            connection.execute(
+                "UPDATE upload_session SET status = 'open', received_bytes = CASE WHEN ? THEN received_bytes ELSE 0 END, updated_at = ? WHERE id = ?",
+                (part.is_file(), utc_now_iso(), upload_id),
+            )
+            connection.commit()
+            raise
+        dispatch_media_jobs(db_path, [job_id] if job_id else [])
+        return jsonify({"ok": True, "media_id": int(cursor.lastrowid), "filename": filename, "sha256": sha256})
 
-    @app.get("/session/summary/<int:completion_id>")
+    @app.delete("/api/media/uploads/<upload_id>")
     @require_login
-    def session_summary(completion_id: int):
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
-        row = connection.execute(
-            """
-            SELECT sc.id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done,
-                   pd.title, pd.week, pd.day_index, st.name AS template_name
-            FROM session_completion sc
-            JOIN plan_day pd ON pd.id = sc.plan_day_id
-            LEFT JOIN session_template st ON st.id = pd.template_id
-            WHERE sc.id = ?
-            """,
-            (completion_id,),
-        ).fetchone()
-        connection.close()
+    def api_upload_abort(upload_id: str):
+        connection = db()
+        if owned_upload(connection, upload_id) is None:
+            return jsonify({"ok": False, "error": "upload_not_found"}), 404
+        connection.execute("DELETE FROM upload_session WHERE id = ?", (upload_id,))
+        connection.commit()
+        upload_part_path(upload_id).unlink(missing_ok=True)
+        return jsonify({"ok": True})
 
+    @app.get("/api/media/<int:media_id>/usage")
+    @require_login
+    def api_media_usage(media_id: int):
+        connection = db()
+        user_id = current_user_id(connection)
+        row = connection.execute("SELECT id FROM media_item WHERE id = ? AND user_id = ?", (media_id, user_id)).fetchone()
         if row is None:
-            return jsonify({"error": "completion_not_found"}), 404
-
-        return render_template("session_summary.html", completion=row)
-
-        )
-
-    @app.post("/api/timeline/update")
-    def api_timeline_update():
-        return jsonify({"ok": True, "route": "/api/timeline/update"})
-
-    @app.post("/api/timeline/regenerate")
-    def api_timeline_regenerate():
-        return jsonify({"ok": True, "route": "/api/timeline/regenerate"})
-
-    @app.post("/api/timeline/apply_global")
-    def api_timeline_apply_global():
-        return jsonify({"ok": True, "route": "/api/timeline/apply_global"})
+            return jsonify({"ok": False, "error": "media_not_found"}), 404
+        return jsonify({"ok": True, "media_id": media_id, "templates": media_usage(connection, media_id)})
 
-    @app.post("/api/critic/run")
-    def api_critic_run():
-        return jsonify({"ok": True, "route": "/api/critic/run"})
+    @app.get("/api/media/orphans")
+    @require_login
+    def api_media_orphans():
+        connection = db()
+        user_id = current_user_id(connection)
+        return jsonify({"ok": True, "orphans": orphan_media(connection, user_id)})
 
-    @app.post("/api/approve")
+    @app.post("/media/<int:media_id>/tags")
     @require_login
-    def api_approve():
-        payload = request.get_json(silent=True) or request.form.to_dict() or {}
-        approved = env_flag_true(str(payload.get("approved", "true")))
+    def media_update_tags(media_id: int):
+        tags = parse_tags(request.form.get("tags", ""))
+        duration_raw = request.form.get("duration_sec")
+        try:
+            duration_sec = int(duration_raw) if duration_raw else None
+        except ValueError:
+            duration_sec = None
 
-        connection = sqlite3.connect(db_path)
+        connection = db()
         user_id = current_user_id(connection)
-        set_project_approved(connection, approved)
-        write_audit(connection, "project_approval_updated", {"approved": approved, "user_id": user_id})
+        updated = connection.execute(
+            "UPDATE media_item SET tags = ?, duration_sec = ?, updated_at = ? WHERE id = ? AND user_id = ?",
+            (tags, duration_sec, utc_now_iso(), media_id, user_id),
+        ).rowcount
         connection.commit()
-        connection.close()
+        if updated == 0:
+            return jsonify({"ok": False, "error": "media_not_found"}), 404
+        return redirect(url_for("media_library"))
 
-        return jsonify({"ok": True, "approved": approved, "route": "/api/approve"})
+    @app.get("/media/file/<path:filename>")
+    @require_login
+    def media_file(filename: str):
+        if not is_safe_media_relpath(filename):
+            return jsonify({"error": "invalid_filename"}), 400
+        # Same ownership rule as /media/<id>: only files behind one of the caller's media_item rows,
+        # checked before anything (including an offload header) is sent.
+        connection = db()
+        user_id = current_user_id(connection)
+        names = media_name_candidates(filename)
+        row = connection.execute(
+            "SELECT content_sha256 FROM media_item WHERE filename IN (?, ?) AND user_id = ? LIMIT 1",
+            (*names, user_id),
+        ).fetchone()
+        if row is None:
+            owned_thumb = connection.execute(
+                "SELECT 1 FROM media_item WHERE user_id = ? AND thumb_filename IN (?, ?) LIMIT 1",
+                (user_id, *names),
+            ).fetchone()
+            if owned_thumb is None:
+                return jsonify({"error": "media_not_found"}), 404
+        path = resolve_media_path(filename)
+        if path is None:
+            return jsonify({"error": "media_not_found"}), 404
+        if row is None:
+            return media_response(path, etag=media_derivative_etag(path))
+        return media_response(path, row[0])
 
-    @app.get("/exports")
+    @app.get("/media/<int:media_id>")
     @require_login
-    def exports_page():
-        connection = sqlite3.connect(db_path)
+    def media_file_by_id(media_id: int):
+        connection = db()
         connection.row_factory = sqlite3.Row
         user_id = current_user_id(connection)
-
-        plan = connection.execute(
-            """
-            SELECT id, name
-            FROM plan
-            WHERE user_id = ?
-            ORDER BY CASE WHEN status = 'active' THEN 0 ELSE 1 END, id DESC
-            LIMIT 1
-            """,
-            (user_id,),
+        row = connection.execute(
+            "SELECT id, filename, content_sha256, thumb_filename FROM media_item WHERE id = ? AND user_id = ?",
+            (media_id, user_id),
         ).fetchone()
-        completion = connection.execute(
-            """
-            SELECT sc.id
-            FROM session_completion sc
-            JOIN plan_day pd ON pd.id = sc.plan_day_id
-            JOIN plan p ON p.id = pd.plan_id
-            WHERE p.user_id = ?
-            ORDER BY sc.id DESC
-            LIMIT 1
-            """,
-            (user_id,),
+        if row is None:
+            return jsonify({"error": "media_not_found"}), 404
+        if request.args.get("variant") == "thumb" and row["thumb_filename"]:
+            thumb = resolve_media_path(row["thumb_filename"])
+            if thumb is not None:
+                return media_response(thumb, etag=media_derivative_etag(thumb))
+        path = resolve_media_path(row["filename"])
+        if path is None:
+            return jsonify({"error": "media_not_found"}), 404
+        return media_response(path, row["content_sha256"])
+
+    @app.get("/templates")
+    @require_login
+    def templates_catalog():
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+
+        limit_templates = None
+        if user_id > 0 and not has_paid_access(connection, user_id):
+            limit_templates = 3
+
+        sql = """
+            SELECT id, name, discipline, duration_minutes, level
+            FROM session_template
+            ORDER BY discipline ASC, duration_minutes ASC, id ASC
+        """
+        if limit_templates is not None:
+            sql += f"\nLIMIT {int(limit_templates)}"
+
+        rows = connection.execute(sql).fetchall()
+        media_count = connection.execute("SELECT COUNT(*) FROM media_item WHERE user_id = ?", (user_id,)).fetchone()[0]
+        return render_template("templates_catalog.html", templates=[dict(r) for r in rows], media_count=int(media_count))
+
+    @app.get("/templates/builder/<int:template_id>")
+    @require_login
+    def template_builder(template_id: int):
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+        template_row = connection.execute(
+            "SELECT id, name, discipline, duration_minutes, level FROM session_template WHERE id = ?",
+            (template_id,),
         ).fetchone()
-        connection.close()
+        if template_row is None:
+            return jsonify({"error": "template_not_found"}), 404
 
+        filters = media_page_args(request.args)
+        page, next_before = media_page(connection, user_id, "m.id, m.original_name, m.media_type, m.tags", **filters)
+        media_items = [dict(r) for r in page]
+        blocks = template_blocks(connection, template_id, with_media=True)
+        # Media already attached stays selectable even when it is not on the current page.
+        listed = {item["id"] for item in media_items}
+        for block in blocks:
+            media = block.get("media")
+            if media and media["id"] not in listed:
+                listed.add(media["id"])
+                media_items.append({key: media[key] for key in ("id", "original_name", "media_type", "tags")})
         return render_template(
-            "exports.html",
-            current_plan_id=int(plan["id"]) if plan else None,
-            current_plan_name=(plan["name"] if plan else None),
-            latest_completion_id=int(completion["id"]) if completion else None,
+            "template_builder.html",
+            template=dict(template_row),
+            blocks=blocks,
+            media_items=media_items,
+            filters=filters,
+            next_before=next_before,
+            tags=media_tag_counts(connection, user_id),
+            media_types=MEDIA_TYPES,
         )
 
-    @app.get("/restore")
+    @app.post("/templates/builder/<int:template_id>/save")
     @require_login
-    def restore_page():
-        return render_template("restore.html")
+    def template_builder_save(template_id: int):
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        template_row = connection.execute(
+            "SELECT id FROM session_template WHERE id = ?",
+            (template_id,),
+        ).fetchone()
+        if template_row is None:
+            return jsonify({"ok": False, "error": "template_not_found"}), 404
 
-    @app.get("/api/export/plan")
-    @require_login
-    def api_export_plan():
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        payload = export_snapshot(connection, user_id)
-        connection.close()
+        blocks = template_blocks(connection, template_id)
+        for idx, block in enumerate(blocks):
+            media_value = request.form.get(f"media_item_id_{idx}", "")
+            try:
+                media_id = int(media_value) if media_value else None
+            except ValueError:
+                media_id = None
+            block["media_item_id"] = media_id
 
-        html = render_plan_export_html(payload)
-        response = make_response(html)
-        response.headers["Content-Type"] = "text/html; charset=utf-8"
-        response.headers["Content-Disposition"] = "attachment; filename=flowform_plan_export.html"
-        return response
+        replace_template_blocks(connection, template_id, blocks)
+        connection.execute("UPDATE session_template SET updated_at = ? WHERE id = ?", (utc_now_iso(), template_id))
+        connection.commit()
+        invalidate_template_index(db_path)
+        return redirect(url_for("template_builder", template_id=template_id))
 
-    @app.get("/api/export/history.csv")
+    @app.get("/analytics")
     @require_login
-    def api_export_history_csv():
-        connection = sqlite3.connect(db_path)
+    def analytics():
+        connection = db()
         connection.row_factory = sqlite3.Row
         user_id = current_user_id(connection)
+        snapshot = analytics_snapshot(connection, user_id)
+        return render_template("analytics.html", analytics=snapshot)
 
-        completions = connection.execute(
-            """
-            SELECT sc.id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done,
-                   pd.week, pd.day_index, pd.title
-            FROM session_completion sc
-            JOIN plan_day pd ON pd.id = sc.plan_day_id
-            JOIN plan p ON p.id = pd.plan_id
-            WHERE p.user_id = ?
-            ORDER BY sc.completed_at DESC
-            """,
-            (user_id,),
-        ).fetchall()
-        recovery = connection.execute(
+    @app.get("/assistant")
+    @require_login
+    def assistant_page():
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+        rows = connection.execute(
             """
-            SELECT id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes
-            FROM recovery_checkin
+            SELECT prompt, response, mode, created_at
+            FROM assistant_message
             WHERE user_id = ?
-            ORDER BY date DESC
+            ORDER BY id DESC
+            LIMIT 20
             """,
             (user_id,),
         ).fetchall()
-        connection.close()
-
-        stream = io.StringIO()
-        writer = csv.writer(stream)
-        writer.writerow(["section", "id", "date", "week", "day", "title", "rpe", "minutes_done", "sleep_hours", "stress", "soreness", "mood", "notes"])
-        for row in completions:
-            writer.writerow([
-                "completion",
-                row["id"],
-                row["completed_at"],
-                row["week"],
-                row["day_index"],
-                row["title"] or "",
-                row["rpe"],
-                row["minutes_done"],
-                "", "", "", "",
-                row["notes"] or "",
-            ])
-        for row in recovery:
-            writer.writerow([
-                "recovery",
-                row["id"],
-                row["date"],
-                "", "", "", "", "",
-                row["sleep_hours"],
-                row["stress_1_10"],
-                row["soreness_1_10"],
-                row["mood_1_10"],
-                row["notes"] or "",
-            ])
-
-        response = make_response(stream.getvalue())
-        response.headers["Content-Type"] = "text/csv; charset=utf-8"
-        response.headers["Content-Disposition"] = "attachment; filename=flowform_history.csv"
-        return response
-
-    @app.get("/api/export/json")
-    @require_login
-    def api_export_json():
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        payload = export_snapshot(connection, user_id)
-        connection.close()
-
-        response = make_response(json.dumps(payload, indent=2))
-        response.headers["Content-Type"] = "application/json"
-        response.headers["Content-Disposition"] = "attachment; filename=flowform_backup.json"
-        return response
+        return render_template("assistant.html", messages=[dict(r) for r in rows], disclaimer=assistant_disclaimer())
 
-    @app.get("/api/export/zip")
+    @app.post("/api/assistant/chat")
     @require_login
-    def api_export_zip():
-        force = env_flag_true(request.args.get("force"))
-        issue_ref = normalize_issue_ref(request.args.get("issue_ref"))
+    def api_assistant_chat():
+        payload = request.get_json(silent=True) or request.form.to_dict()
+        message = str(payload.get("message", "")).strip()
+        action = str(payload.get("action", "custom")).strip()
+        if not message and action == "custom":
+            return jsonify({"ok": False, "error": "message_required"}), 400
 
-        connection = sqlite3.connect(db_path)
-        connection.row_factory = sqlite3.Row
+        connection = db()
         user_id = current_user_id(connection)
-        approved = project_is_approved(connection)
-        if not approved and not force:
-            connection.close()
-            return jsonify({
-                "ok": False,
-                "error": "project_not_approved",
-                "message": "Project must be approved before export. Call POST /api/approve or retry with ?force=true.",
-            }), 403
-
-        payload = export_snapshot(connection, user_id)
-        active_plan = payload.get("plan") or {}
-        plan_id = active_plan.get("id")
-        template_count = len(payload.get("templates") or [])
-        plan_day_count = len(payload.get("plan_days") or [])
-        completion_count = len(payload.get("completions") or [])
-        recovery_count = len(payload.get("recovery") or [])
-
-        project_payload = {
-            "app": app.config.get("APP_NAME"),
-            "version": app.config.get("VERSION"),
-            "issue_ref": issue_ref,
-            "approved": approved,
-            "exported_at": utc_now_iso(),
-            "project": {
-                "plan_id": plan_id,
-                "plan_name": active_plan.get("name"),
-                "status": active_plan.get("status"),
-            },
-        }
-        pilot_pack_payload = {
-            "issue_ref": issue_ref,
-            "plan": active_plan,
-            "profile": payload.get("profile") or {},
-            "plan_days": payload.get("plan_days") or [],
-            "templates": payload.get("templates") or [],
-            "completions": payload.get("completions") or [],
-            "recovery": payload.get("recovery") or [],
-        }
-        export_meta_payload = {
-            "exported_at": utc_now_iso(),
-            "export_type": "studio_hub_zip",
-            "approved": approved,
-            "force": force,
-            "issue_ref": issue_ref,
-            "counts": {
-                "templates": template_count,
-                "plan_days": plan_day_count,
-                "completions": completion_count,
-                "recovery": recovery_count,
-            },
-            "app": {
-                "name": app.config.get("APP_NAME"),
-                "version": app.config.get("VERSION"),
-                "git_hash": app.config.get("GIT_HASH"),
-            },
-        }
-        workflow_markdown = """# Workflow
-
-1. Open `project.json` to identify pack metadata and approval state.
-2. Load `pilot_pack.json` for plan days, templates, completions, and recovery records.
-3. Verify all file hashes using `manifest.json` before import.
-4. Use `export_meta.json` for export provenance, app version, and row counts.
-5. Read `issue_ref.txt` to map this bundle to the upstream issue/work item.
-"""
+        ctx = assistant_context(connection, user_id)
+        mode = "rules"
 
-        file_payloads: dict[str, bytes] = {
-            "issue_ref.txt": (issue_ref + "\n").encode("utf-8"),
-            "project.json": json.dumps(project_payload, indent=2).encode("utf-8"),
-            "pilot_pack.json": json.dumps(pilot_pack_payload, indent=2).encode("utf-8"),
-            "export_meta.json": json.dumps(export_meta_payload, indent=2).encode("utf-8"),
-            "WORKFLOW.md": workflow_markdown.encode("utf-8"),
-        }
-        manifest = build_zip_manifest(file_payloads)
-        manifest["files"].append({"path": "manifest.json", "bytes": 0, "sha256": ""})
-        manifest_blob = json.dumps(manifest, indent=2).encode("utf-8")
-        manifest["files"][-1] = {
-            "path": "manifest.json",
-            "bytes": len(manifest_blob),
-            "sha256": hashlib.sha256(manifest_blob).hexdigest(),
-        }
-        file_payloads["manifest.json"] = json.dumps(manifest, indent=2).encode("utf-8")
+        if has_medical_risk_signal(message):
+            body = "Your message suggests injury or severe symptoms. Consider seeking medical advice. If symptoms are urgent, seek immediate care."
+            mode = "escalation"
+        else:
+            api_key = os.getenv("OPENAI_API_KEY", "").strip()
+            if api_key:
+                try:
+                    body = assistant_llm_reply(api_key, action, message or action, ctx)
+                    mode = "llm"
+                except (urllib.error.URLError, urllib.error.HTTPError, TimeoutError, KeyError, ValueError, json.JSONDecodeError):
+                    body, mode = assistant_rules_reply(action, message, ctx)
+            else:
+                body, mode = assistant_rules_reply(action, message, ctx)
 
-        write_audit(connection, "export_zip", {
-            "approved": approved,
-            "force": force,
-            "issue_ref": issue_ref,
-            "files": sorted(file_payloads.keys()),
-        })
+        response_text = f"{assistant_disclaimer()}\n\n{body}"
+        now = utc_now_iso()
+        connection.execute(
+            """
+            INSERT INTO assistant_message (user_id, prompt, response, mode, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, message or action, response_text, mode, now, now),
+        )
+        connection.execute(
+            """
+            DELETE FROM assistant_message
+            WHERE user_id = ?
+              AND id NOT IN (
+                SELECT id FROM assistant_message WHERE user_id = ? ORDER BY id DESC LIMIT 20
+              )
+            """,
+            (user_id, user_id),
+        )
         connection.commit()
-        connection.close()
+        return jsonify({"ok": True, "response": response_text, "mode": mode})
 
-        memory = io.BytesIO()
-        with zipfile.ZipFile(memory, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            for path, blob in file_payloads.items():
-                zf.writestr(path, blob)
-        memory.seek(0)
+    @app.get("/settings/profile")
+    @require_login
+    def settings_profile():
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+        user = connection.execute("SELECT id, email, display_name, role FROM users WHERE id = ?", (user_id,)).fetchone()
+        profile = connection.execute(
+            "SELECT goal, days_per_week, minutes, equipment, constraints FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+            (user_id,),
+        ).fetchone()
+        sub = user_subscription(connection, user_id)
+        return render_template("settings_profile.html", user=user, profile=profile, subscription=sub, auth_enabled=auth_enabled())
 
-        return send_file(
-            memory,
-            mimetype="application/zip",
-            as_attachment=True,
-            download_name="flowform_export_bundle.zip",
+    @app.post("/settings/profile")
+    @require_login
+    def settings_profile_submit():
+        payload = request.form
+        display_name = str(payload.get("display_name", "")).strip() or "User"
+        goal = str(payload.get("goal", "hybrid")).strip().lower().replace(" ", "_")
+        days_per_week = clamp_int(int(payload.get("days_per_week", 4)), 2, 6)
+        minutes = clamp_int(int(payload.get("minutes", 45)), 30, 75)
+        equipment = str(payload.get("equipment", "")).strip()
+        constraints = str(payload.get("constraints", "")).strip()
+        now = utc_now_iso()
+
+        connection = db()
+        user_id = current_user_id(connection)
+        connection.execute("UPDATE users SET display_name = ?, updated_at = ? WHERE id = ?", (display_name, now, user_id))
+        row = connection.execute("SELECT id FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1", (user_id,)).fetchone()
+        if row:
+            connection.execute(
+                "UPDATE profile SET goal = ?, days_per_week = ?, minutes = ?, equipment = ?, constraints = ?, updated_at = ? WHERE id = ?",
+                (goal, days_per_week, minutes, equipment, constraints, now, row[0]),
+            )
+        else:
+            connection.execute(
+                "INSERT INTO profile (user_id, goal, days_per_week, minutes, equipment, constraints, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, goal, days_per_week, minutes, equipment, constraints, now, now),
+            )
+        connection.commit()
+        return redirect(url_for("settings_profile"))
+
+    @app.get("/api/billing/checkout")
+    @require_login
+    def billing_checkout_stub():
+        return jsonify(
+            {
+                "ok": True,
+                "provider": "stripe_stub",
+                "message": "Payment link intentionally unimplemented for safety.",
+                "pay_now_link": None,
+                "paid_benefits": ["unlimited_plans", "priority_support", "early_access_ai"],
+            }
         )
 
-    @app.get("/api/export/backup")
+    @app.get("/admin")
     @require_login
-    def api_export_backup():
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-        payload = export_snapshot(connection, user_id)
-        manifest = backup_manifest(connection)
-        connection.close()
+    def admin_dashboard():
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        actor_id = current_user_id(connection)
+        actor = connection.execute("SELECT role FROM users WHERE id = ?", (actor_id,)).fetchone()
+        if not actor or actor[0] != "admin":
+            return jsonify({"error": "admin_only"}), 403
+        rows = connection.execute(
+            """
+            SELECT u.id, u.email, u.display_name, u.role, u.enabled,
+                   COALESCE(s.plan, 'free') AS subscription_plan,
+                   COALESCE(s.status, 'active') AS subscription_status
+            FROM users u
+            LEFT JOIN subscriptions s ON s.user_id = u.id
+            ORDER BY u.id ASC
+            """
+        ).fetchall()
+        return render_template("admin.html", users=[dict(r) for r in rows])
 
-        settings_payload = {
-            "app_name": app.config.get("APP_NAME"),
-            "version": app.config.get("VERSION"),
-            "port": app.config.get("PORT"),
-            "build_date": app.config.get("BUILD_DATE"),
-        }
+    @app.post("/admin/users/<int:user_id>/toggle")
+    @require_login
+    def admin_toggle_user(user_id: int):
+        connection = db()
+        actor_id = current_user_id(connection)
+        role = connection.execute("SELECT role FROM users WHERE id = ?", (actor_id,)).fetchone()
+        if not role or role[0] != "admin":
+            return jsonify({"error": "admin_only"}), 403
+        row = connection.execute("SELECT enabled FROM users WHERE id = ?", (user_id,)).fetchone()
+        if row is None:
+            return jsonify({"error": "user_not_found"}), 404
+        new_state = 0 if int(row[0]) else 1
+        connection.execute("UPDATE users SET enabled = ?, updated_at = ? WHERE id = ?", (new_state, utc_now_iso(), user_id))
+        connection.commit()
+        return redirect(url_for("admin_dashboard"))
 
-        memory = io.BytesIO()
-        with zipfile.ZipFile(memory, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            if Path(app.config["DB_PATH"]).exists():
-                zf.write(app.config["DB_PATH"], arcname="flowform.db")
-            zf.writestr("flowform_backup.json", json.dumps(payload, indent=2))
-            zf.writestr("settings.json", json.dumps(settings_payload, indent=2))
-            zf.writestr("manifest.json", json.dumps(manifest, indent=2))
-            if MEDIA_DIR.exists():
-                for item in MEDIA_DIR.iterdir():
-                    if item.is_file():
-                        zf.write(item, arcname=f"media/{item.name}")
-        memory.seek(0)
-        return send_file(memory, mimetype="application/zip", as_attachment=True, download_name="flowform_full_backup.zip")
+    @app.get("/plan/current/week/<int:week>/day/<int:day_index>/start")
+    @require_login
+    def plan_day_start(week: int, day_index: int):
+        connection = db()
+        plan = current_plan_record(connection, current_user_id(connection))
+        if plan is None or not 1 <= week <= int(plan["weeks"]):
+            return jsonify({"ok": False, "error": "plan_day_not_found"}), 404
+        plan_day_id = materialize_plan_day(connection, template_index(connection, db_path), int(plan["id"]), week, day_index)
+        if plan_day_id is None:
+            connection.rollback()
+            return jsonify({"ok": False, "error": "plan_day_not_found"}), 404
+        connection.commit()
+        return redirect(url_for("session_start", plan_day_id=plan_day_id))
 
-    @app.get("/api/export/plan_pdf/<int:plan_id>")
+    @app.get("/session/start/<int:plan_day_id>")
     @require_login
-    def api_export_plan_pdf(plan_id: int):
-        connection = sqlite3.connect(db_path)
+    def session_start(plan_day_id: int):
+        connection = db()
         connection.row_factory = sqlite3.Row
-        plan = connection.execute("SELECT id, name, start_date, weeks, status FROM plan WHERE id = ?", (plan_id,)).fetchone()
-        if plan is None:
-            connection.close()
-            return jsonify({"error": "plan_not_found"}), 404
-        days = connection.execute(
+        row = connection.execute(
             """
-            SELECT pd.week, pd.day_index, pd.title, st.name AS template_name, st.discipline, st.duration_minutes
+            SELECT pd.id AS plan_day_id, pd.title, pd.week, pd.day_index, st.id AS template_id, st.name AS template_name,
+                   st.duration_minutes
             FROM plan_day pd
             LEFT JOIN session_template st ON st.id = pd.template_id
-            WHERE pd.plan_id = ?
-            ORDER BY pd.week ASC, pd.day_index ASC
+            WHERE pd.id = ?
             """,
-            (plan_id,),
-        ).fetchall()
-        connection.close()
+            (plan_day_id,),
+        ).fetchone()
 
-        lines = [
-            f"Plan: {plan['name']} (status: {plan['status']})",
-            f"Start: {plan['start_date']} | Weeks: {plan['weeks']}",
-            "",
-            "4-week schedule:",
-        ]
-        for row in days:
-            lines.append(
-                f"W{row['week']} D{row['day_index']} | {row['title'] or row['template_name'] or 'Session'} | {row['discipline'] or '-'} | {row['duration_minutes'] or 0} min"
+        if row is None:
+            return jsonify({"error": "plan_day_not_found"}), 404
+
+        blocks = template_blocks(connection, int(row["template_id"]), with_media=True) if row["template_id"] is not None else []
+        if not blocks:
+            duration = int(row["duration_minutes"] or 30)
+            blocks = [{"name": row["template_name"] or "Session", "minutes": duration, "seconds": duration * 60, "media_item_id": None, "media": None}]
+
+        return render_template(
+            "session_start.html",
+            session={
+                "plan_day_id": int(row["plan_day_id"]),
+                "title": row["title"] or row["template_name"] or "Session",
+                "template_name": row["template_name"] or "Session",
+                "week": int(row["week"]),
+                "day_index": int(row["day_index"]),
+                "blocks": blocks,
+            },
+        )
+
+    @app.post("/api/session/finish")
+    @require_login
+    def api_session_finish():
+        payload = request.get_json(silent=True) or request.form.to_dict()
+        try:
+            plan_day_id = int(payload.get("plan_day_id"))
+            rpe = clamp_int(int(payload.get("rpe", 5)), 1, 10)
+            notes = str(payload.get("notes", "")).strip()
+            minutes_done = clamp_int(int(payload.get("minutes_done", 0)), 0, 300)
+        except (TypeError, ValueError):
+            return jsonify({"ok": False, "error": "invalid_payload"}), 400
+
+        now = utc_now_iso()
+        connection = db()
+        try:
+            exists = connection.execute(
+                """
+                SELECT pd.id, p.user_id, pd.plan_id, pd.week,
+                       EXISTS (SELECT 1 FROM session_completion sc WHERE sc.plan_day_id = pd.id)
+                FROM plan_day pd
+                JOIN plan p ON p.id = pd.plan_id
+                WHERE pd.id = ?
+                """,
+                (plan_day_id,),
+            ).fetchone()
+            if not exists:
+                return jsonify({"ok": False, "error": "plan_day_not_found"}), 404
+
+            cursor = connection.execute(
+                """
+                INSERT INTO session_completion (plan_day_id, completed_at, rpe, notes, minutes_done, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (plan_day_id, now, rpe, notes, minutes_done, now, now),
             )
-        pdf = build_simple_pdf(lines, title="FlowForm Plan PDF Export")
-        return send_file(io.BytesIO(pdf), mimetype="application/pdf", as_attachment=True, download_name=f"flowform_plan_{plan_id}.pdf")
+            completion_id = int(cursor.lastrowid)
+            if exists[1] is not None:
+                record_daily_completion(connection, int(exists[1]), now[:10], minutes_done, rpe)
+                record_streak_activity(connection, int(exists[1]), now[:10])
+            if not exists[4]:
+                record_plan_day_completed(connection, int(exists[2]), int(exists[3]))
+            write_audit(connection, "session_completed", {"completion_id": completion_id, "plan_day_id": plan_day_id})
+            connection.commit()
+        except sqlite3.Error as exc:
+            connection.rollback()
+            return jsonify({"ok": False, "error": str(exc)}), 400
 
-    @app.get("/api/export/session_summary/<int:completion_id>")
+        return jsonify({"ok": True, "completion_id": completion_id, "redirect": f"/session/summary/{completion_id}"})
+
+    @app.get("/session/summary/<int:completion_id>")
     @require_login
-    def api_export_session_summary_pdf(completion_id: int):
-        connection = sqlite3.connect(db_path)
+    def session_summary(completion_id: int):
+        connection = db()
         connection.row_factory = sqlite3.Row
         row = connection.execute(
             """
             SELECT sc.id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done,
-                   pd.title, pd.week, pd.day_index, st.name AS template_name, st.json_blocks
+                   pd.title, pd.week, pd.day_index, st.name AS template_name
             FROM session_completion sc
             JOIN plan_day pd ON pd.id = sc.plan_day_id
             LEFT JOIN session_template st ON st.id = pd.template_id
@@ -2853,128 +5389,78 @@ def create_app(port: int | None = None) -> Flask:
             """,
             (completion_id,),
         ).fetchone()
-        connection.close()
+
         if row is None:
             return jsonify({"error": "completion_not_found"}), 404
 
-        blocks = blocks_from_json(row["json_blocks"] or "")
-        lines = [
-            f"Session title: {row['title'] or row['template_name'] or 'Session'}",
-            f"Completed at: {row['completed_at']}",
-            f"Week/Day: W{row['week']} D{row['day_index']}",
-            f"RPE: {row['rpe']} | Minutes: {row['minutes_done']}",
-            f"Notes: {row['notes'] or ''}",
-            "",
-            "Blocks:",
-        ]
-        for block in blocks:
-            lines.append(f"- {block.get('name', 'Block')} ({block.get('minutes', 0)} min)")
-        pdf = build_simple_pdf(lines, title="FlowForm Session Summary PDF")
-        return send_file(io.BytesIO(pdf), mimetype="application/pdf", as_attachment=True, download_name=f"flowform_session_{completion_id}.pdf")
-
-    @app.post("/api/import/backup")
-    @require_login
-    def api_import_backup():
-        upload = request.files.get("file")
-        if upload is None or not upload.filename:
-            return jsonify({"ok": False, "error": "file_required"}), 400
-
-        should_confirm = str((request.form.get("confirm_overwrite") or "false")).lower() in {"true", "1", "yes"}
-        raw = upload.read()
-        try:
-            zf = zipfile.ZipFile(io.BytesIO(raw))
-        except zipfile.BadZipFile:
-            return jsonify({"ok": False, "error": "invalid_zip"}), 400
-
-        names = set(zf.namelist())
-        ok, error_code = validate_backup_zip_names(names)
-        if not ok:
-            return jsonify({"ok": False, "error": error_code, "message": "Backup ZIP contains invalid or unsafe paths."}), 400
-
-        manifest = {}
-        if "manifest.json" in names:
-            try:
-                manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
-            except Exception:
-                manifest = {}
+        return render_template("session_summary.html", completion=row)
 
-        summary = {
-            "plans": int((manifest.get("counts") or {}).get("plans", 0)),
-            "templates": int((manifest.get("counts") or {}).get("templates", 0)),
-            "completions": int((manifest.get("counts") or {}).get("completions", 0)),
-            "recovery": int((manifest.get("counts") or {}).get("recovery", 0)),
-            "media_files": int(manifest.get("media_files", 0)),
-            "warning": "Restoring this backup will overwrite current data.",
-        }
+    @app.post("/api/timeline/update")
+    def api_timeline_update():
+        return jsonify({"ok": True, "route": "/api/timeline/update"})
 
-        if not should_confirm:
-            return jsonify({"ok": True, "requires_confirmation": True, "summary": summary})
+    @app.post("/api/timeline/regenerate")
+    def api_timeline_regenerate():
+        return jsonify({"ok": True, "route": "/api/timeline/regenerate"})
 
-        db_target = Path(app.config["DB_PATH"])
-        db_target.parent.mkdir(parents=True, exist_ok=True)
-        MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+    @app.post("/api/timeline/apply_global")
+    def api_timeline_apply_global():
+        return jsonify({"ok": True, "route": "/api/timeline/apply_global"})
 
-        temp_dir = Path(tempfile.mkdtemp(prefix="flowform-restore-"))
-        stage_db = temp_dir / "flowform.db"
-        stage_media = temp_dir / "media"
-        stage_media.mkdir(exist_ok=True)
-        old_db = db_target.with_suffix(".pre_restore.bak")
-        old_media = MEDIA_DIR.parent / "media_pre_restore"
+    @app.post("/api/critic/run")
+    def api_critic_run():
+        return jsonify({"ok": True, "route": "/api/critic/run"})
 
-        try:
-            stage_db.write_bytes(zf.read("flowform.db"))
-            for name in names:
-                if name.startswith("media/") and not name.endswith("/"):
-                    out = stage_media / Path(name).name
-                    out.write_bytes(zf.read(name))
-
-            probe = sqlite3.connect(stage_db)
-            required = {"plan", "plan_day", "session_template", "session_completion", "recovery_checkin"}
-            existing = {r[0] for r in probe.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
-            probe.close()
-            if not required.issubset(existing):
-                raise ValueError("backup_database_schema_invalid")
-
-            if db_target.exists():
-                shutil.copy2(db_target, old_db)
-
-            tmp_live_db = db_target.with_suffix(".restore_tmp")
-            shutil.copy2(stage_db, tmp_live_db)
-            tmp_live_db.replace(db_target)
-
-            if old_media.exists():
-                shutil.rmtree(old_media)
-            if MEDIA_DIR.exists():
-                MEDIA_DIR.replace(old_media)
-            shutil.copytree(stage_media, MEDIA_DIR, dirs_exist_ok=True)
-            if old_media.exists():
-                shutil.rmtree(old_media)
-            if old_db.exists():
-                old_db.unlink(missing_ok=True)
+    @app.post("/api/approve")
+    @require_login
+    def api_approve():
+        payload = request.get_json(silent=True) or request.form.to_dict() or {}
+        approved = env_flag_true(str(payload.get("approved", "true")))
 
-        except Exception as exc:
-            if old_db.exists():
-                try:
-                    shutil.copy2(old_db, db_target)
-                except Exception:
-                    pass
-            if old_media.exists():
-                try:
-                    if MEDIA_DIR.exists():
-                        shutil.rmtree(MEDIA_DIR)
-                    old_media.replace(MEDIA_DIR)
-                except Exception:
-                    pass
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            return jsonify({"ok": False, "error": "restore_failed", "message": str(exc)}), 400
+        connection = db()
+        user_id = current_user_id(connection)
+        set_project_approved(connection, approved)
+        write_audit(connection, "project_approval_updated", {"approved": approved, "user_id": user_id})
+        connection.commit()
 
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        return jsonify({"ok": True, "restored": summary})
+        return jsonify({"ok": True, "approved": approved, "route": "/api/approve"})
 
     @app.get("/exports")
     @require_login
     def exports_page():
-        return render_template("exports.html")
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+
+        plan = connection.execute(
+            """
+            SELECT id, name
+            FROM plan
+            WHERE user_id = ?
+            ORDER BY CASE WHEN status = 'active' THEN 0 ELSE 1 END, id DESC
+            LIMIT 1
+            """,
+            (user_id,),
+        ).fetchone()
+        completion = connection.execute(
+            """
+            SELECT sc.id
+            FROM session_completion sc
+            JOIN plan_day pd ON pd.id = sc.plan_day_id
+            JOIN plan p ON p.id = pd.plan_id
+            WHERE p.user_id = ?
+            ORDER BY sc.id DESC
+            LIMIT 1
+            """,
+            (user_id,),
+        ).fetchone()
+
+        return render_template(
+            "exports.html",
+            current_plan_id=int(plan["id"]) if plan else None,
+            current_plan_name=(plan["name"] if plan else None),
+            latest_completion_id=int(completion["id"]) if completion else None,
+        )
 
     @app.get("/restore")
     @require_login
@@ -2984,13 +5470,9 @@ def create_app(port: int | None = None) -> Flask:
     @app.get("/api/export/plan")
     @require_login
     def api_export_plan():
-        connection = sqlite3.connect(db_path)
+        connection = db()
         user_id = current_user_id(connection)
-    def api_export_plan():
-        connection = sqlite3.connect(db_path)
-        user_id = get_or_create_founder_user(connection)
         payload = export_snapshot(connection, user_id)
-        connection.close()
 
         html = render_plan_export_html(payload)
         response = make_response(html)
@@ -3001,7 +5483,7 @@ def create_app(port: int | None = None) -> Flask:
     @app.get("/api/export/history.csv")
     @require_login
     def api_export_history_csv():
-        connection = sqlite3.connect(db_path)
+        connection = db()
         connection.row_factory = sqlite3.Row
         user_id = current_user_id(connection)
 
@@ -3026,7 +5508,6 @@ def create_app(port: int | None = None) -> Flask:
             """,
             (user_id,),
         ).fetchall()
-        connection.close()
 
         stream = io.StringIO()
         writer = csv.writer(stream)
@@ -3065,13 +5546,9 @@ def create_app(port: int | None = None) -> Flask:
     @app.get("/api/export/json")
     @require_login
     def api_export_json():
-        connection = sqlite3.connect(db_path)
+        connection = db()
         user_id = current_user_id(connection)
-    def api_export_json():
-        connection = sqlite3.connect(db_path)
-        user_id = get_or_create_founder_user(connection)
         payload = export_snapshot(connection, user_id)
-        connection.close()
 
         response = make_response(json.dumps(payload, indent=2))
         response.headers["Content-Type"] = "application/json"
@@ -3081,23 +5558,105 @@ def create_app(port: int | None = None) -> Flask:
     @app.get("/api/export/zip")
     @require_login
     def api_export_zip():
-        connection = sqlite3.connect(db_path)
+        force = env_flag_true(request.args.get("force"))
+        issue_ref = normalize_issue_ref(request.args.get("issue_ref"))
+
+        connection = db()
+        connection.row_factory = sqlite3.Row
         user_id = current_user_id(connection)
-    def api_export_zip():
-        connection = sqlite3.connect(db_path)
-        user_id = get_or_create_founder_user(connection)
+        approved = project_is_approved(connection)
+        if not approved and not force:
+            return jsonify({
+                "ok": False,
+                "error": "project_not_approved",
+                "message": "Project must be approved before export. Call POST /api/approve or retry with ?force=true.",
+            }), 403
+
         payload = export_snapshot(connection, user_id)
-        connection.close()
+        active_plan = payload.get("plan") or {}
+        plan_id = active_plan.get("id")
+        template_count = len(payload.get("templates") or [])
+        plan_day_count = len(payload.get("plan_days") or [])
+        completion_count = len(payload.get("completions") or [])
+        recovery_count = len(payload.get("recovery") or [])
 
-        html = render_plan_export_html(payload)
-        json_blob = json.dumps(payload, indent=2)
+        project_payload = {
+            "app": app.config.get("APP_NAME"),
+            "version": app.config.get("VERSION"),
+            "issue_ref": issue_ref,
+            "approved": approved,
+            "exported_at": utc_now_iso(),
+            "project": {
+                "plan_id": plan_id,
+                "plan_name": active_plan.get("name"),
+                "status": active_plan.get("status"),
+            },
+        }
+        pilot_pack_payload = {
+            "issue_ref": issue_ref,
+            "plan": active_plan,
+            "profile": payload.get("profile") or {},
+            "plan_days": payload.get("plan_days") or [],
+            "templates": payload.get("templates") or [],
+            "completions": payload.get("completions") or [],
+            "recovery": payload.get("recovery") or [],
+        }
+        export_meta_payload = {
+            "exported_at": utc_now_iso(),
+            "export_type": "studio_hub_zip",
+            "approved": approved,
+            "force": force,
+            "issue_ref": issue_ref,
+            "counts": {
+                "templates": template_count,
+                "plan_days": plan_day_count,
+                "completions": completion_count,
+                "recovery": recovery_count,
+            },
+            "app": {
+                "name": app.config.get("APP_NAME"),
+                "version": app.config.get("VERSION"),
+                "git_hash": app.config.get("GIT_HASH"),
+            },
+        }
+        workflow_markdown = """# Workflow
+
+1. Open `project.json` to identify pack metadata and approval state.
+2. Load `pilot_pack.json` for plan days, templates, completions, and recovery records.
+3. Verify all file hashes using `manifest.json` before import.
+4. Use `export_meta.json` for export provenance, app version, and row counts.
+5. Read `issue_ref.txt` to map this bundle to the upstream issue/work item.
+"""
+
+        file_payloads: dict[str, bytes] = {
+            "issue_ref.txt": (issue_ref + "\n").encode("utf-8"),
+            "project.json": json.dumps(project_payload, indent=2).encode("utf-8"),
+            "pilot_pack.json": json.dumps(pilot_pack_payload, indent=2).encode("utf-8"),
+            "export_meta.json": json.dumps(export_meta_payload, indent=2).encode("utf-8"),
+            "WORKFLOW.md": workflow_markdown.encode("utf-8"),
+        }
+        manifest = build_zip_manifest(file_payloads)
+        manifest["files"].append({"path": "manifest.json", "bytes": 0, "sha256": ""})
+        manifest_blob = json.dumps(manifest, indent=2).encode("utf-8")
+        manifest["files"][-1] = {
+            "path": "manifest.json",
+            "bytes": len(manifest_blob),
+            "sha256": hashlib.sha256(manifest_blob).hexdigest(),
+        }
+        file_payloads["manifest.json"] = json.dumps(manifest, indent=2).encode("utf-8")
+
+        write_audit(connection, "export_zip", {
+            "approved": approved,
+            "force": force,
+            "issue_ref": issue_ref,
+            "files": sorted(file_payloads.keys()),
+        })
+        connection.commit()
 
         memory = io.BytesIO()
         with zipfile.ZipFile(memory, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr("flowform_plan_export.html", html)
-            zf.writestr("flowform_backup.json", json_blob)
-            if Path(app.config["DB_PATH"]).exists():
-                zf.write(app.config["DB_PATH"], arcname="flowform.db")
+            for path, blob in file_payloads.items():
+                zf.writestr(path, blob)
         memory.seek(0)
 
         return send_file(
@@ -3110,14 +5669,36 @@ def create_app(port: int | None = None) -> Flask:
     @app.get("/api/export/backup")
     @require_login
     def api_export_backup():
-        connection = sqlite3.connect(db_path)
-        user_id = current_user_id(connection)
-    def api_export_backup():
-        connection = sqlite3.connect(db_path)
-        user_id = get_or_create_founder_user(connection)
-        payload = export_snapshot(connection, user_id)
-        manifest = backup_manifest(connection)
-        connection.close()
+        user_id = current_user_id(db())
+        base = None
+        if request.args.get("mode") == "incremental":
+            # Defaults to the last backup taken; pass base=<backup_id> for the last one actually kept.
+            base = load_backup_manifest(db_path, request.args.get("base") or None)
+            if base is None and request.args.get("base"):
+                return jsonify({"ok": False, "error": "backup_base_not_found"}), 404
+        handle = tempfile.NamedTemporaryFile(prefix="flowform-snapshot-", suffix=".db", delete=False)
+        handle.close()
+        snapshot_path = Path(handle.name)
+        snapshot_database(db_path, snapshot_path)
+        # JSON, manifest and media list all come from the snapshot, so they agree with the archived database.
+        snapshot = sqlite3.connect(snapshot_path)
+        try:
+            payload = export_snapshot(snapshot, user_id)
+            manifest = backup_manifest(snapshot)
+            manifest["media"], manifest["media_stat"] = media_file_hashes(snapshot, base or load_backup_manifest(db_path))
+        finally:
+            snapshot.close()
+        manifest.update(
+            backup_id=uuid.uuid4().hex,
+            base_id=base["backup_id"] if base else None,
+            kind="incremental" if base else "full",
+            media_files=len(manifest["media"]),
+            db={
+                "chunk_bytes": BACKUP_DB_CHUNK_BYTES,
+                "size": snapshot_path.stat().st_size,
+                "chunks": database_chunk_hashes(snapshot_path),
+            },
+        )
 
         settings_payload = {
             "app_name": app.config.get("APP_NAME"),
@@ -3126,28 +5707,39 @@ def create_app(port: int | None = None) -> Flask:
             "build_date": app.config.get("BUILD_DATE"),
         }
 
-        memory = io.BytesIO()
-        with zipfile.ZipFile(memory, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-            if Path(app.config["DB_PATH"]).exists():
-                zf.write(app.config["DB_PATH"], arcname="flowform.db")
-            zf.writestr("flowform_backup.json", json.dumps(payload, indent=2))
-            zf.writestr("settings.json", json.dumps(settings_payload, indent=2))
-            zf.writestr("manifest.json", json.dumps(manifest, indent=2))
-            if MEDIA_DIR.exists():
-                for item in MEDIA_DIR.iterdir():
-                    if item.is_file():
-                        zf.write(item, arcname=f"media/{item.name}")
-        memory.seek(0)
-        return send_file(memory, mimetype="application/zip", as_attachment=True, download_name="flowform_full_backup.zip")
+        entries: list = [
+            ("flowform_backup.json", json.dumps(payload, indent=2).encode("utf-8")),
+            ("settings.json", json.dumps(settings_payload, indent=2).encode("utf-8")),
+            ("manifest.json", json.dumps(manifest, indent=2).encode("utf-8")),
+        ]
+        entries += backup_archive_entries(snapshot_path, manifest, base)
+        # Everything the archive needs from the database is gathered above; the generator only reads files.
+        download_name = "flowform_full_backup.zip" if base is None else f"flowform_incremental_backup_{manifest['backup_id'][:12]}.zip"
+
+        def stream_backup():
+            yield from stream_zip(entries)
+            # Only an archive that streamed to the end may become the base of the next incremental.
+            save_backup_manifest(db_path, manifest)
+
+        response = Response(
+            stream_backup(),
+            mimetype="application/zip",
+            headers={"Content-Disposition": f"attachment; filename={download_name}", "X-Backup-Id": manifest["backup_id"]},
+        )
+
+        @response.call_on_close
+        def _cleanup_snapshot() -> None:
+            snapshot_path.unlink(missing_ok=True)
+
+        return response
 
     @app.get("/api/export/plan_pdf/<int:plan_id>")
     @require_login
     def api_export_plan_pdf(plan_id: int):
-        connection = sqlite3.connect(db_path)
+        connection = db()
         connection.row_factory = sqlite3.Row
         plan = connection.execute("SELECT id, name, start_date, weeks, status FROM plan WHERE id = ?", (plan_id,)).fetchone()
         if plan is None:
-            connection.close()
             return jsonify({"error": "plan_not_found"}), 404
         days = connection.execute(
             """
@@ -3159,13 +5751,13 @@ def create_app(port: int | None = None) -> Flask:
             """,
             (plan_id,),
         ).fetchall()
-        connection.close()
+        days = with_spec_days(template_index(connection, db_path), plan_spec(connection, plan_id), int(plan["weeks"]), [dict(row) for row in days])
 
         lines = [
             f"Plan: {plan['name']} (status: {plan['status']})",
             f"Start: {plan['start_date']} | Weeks: {plan['weeks']}",
             "",
-            "4-week schedule:",
+            f"{plan['weeks']}-week schedule:",
         ]
         for row in days:
             lines.append(
@@ -3177,12 +5769,12 @@ def create_app(port: int | None = None) -> Flask:
     @app.get("/api/export/session_summary/<int:completion_id>")
     @require_login
     def api_export_session_summary_pdf(completion_id: int):
-        connection = sqlite3.connect(db_path)
+        connection = db()
         connection.row_factory = sqlite3.Row
         row = connection.execute(
             """
             SELECT sc.id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done,
-                   pd.title, pd.week, pd.day_index, st.name AS template_name, st.json_blocks
+                   pd.title, pd.week, pd.day_index, st.id AS template_id, st.name AS template_name
             FROM session_completion sc
             JOIN plan_day pd ON pd.id = sc.plan_day_id
             LEFT JOIN session_template st ON st.id = pd.template_id
@@ -3190,11 +5782,10 @@ def create_app(port: int | None = None) -> Flask:
             """,
             (completion_id,),
         ).fetchone()
-        connection.close()
         if row is None:
             return jsonify({"error": "completion_not_found"}), 404
 
-        blocks = blocks_from_json(row["json_blocks"] or "")
+        blocks = template_blocks(connection, int(row["template_id"])) if row["template_id"] is not None else []
         lines = [
             f"Session title: {row['title'] or row['template_name'] or 'Session'}",
             f"Completed at: {row['completed_at']}",
@@ -3209,110 +5800,250 @@ def create_app(port: int | None = None) -> Flask:
         pdf = build_simple_pdf(lines, title="FlowForm Session Summary PDF")
         return send_file(io.BytesIO(pdf), mimetype="application/pdf", as_attachment=True, download_name=f"flowform_session_{completion_id}.pdf")
 
+    def export_job_payload(row: sqlite3.Row) -> dict:
+        payload = {
+            "ok": True,
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "params": json.loads(row["params"]),
+            "status": row["status"],
+            "data_version": row["data_version"],
+            "size_bytes": row["size_bytes"],
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+            "status_url": url_for("api_export_job_status", job_id=row["id"]),
+        }
+        if row["status"] == "done":
+            payload["download_url"] = url_for("api_export_job_download", job_id=row["id"])
+        return payload
+
+    def export_job_row(connection: sqlite3.Connection, job_id: str) -> sqlite3.Row | None:
+        connection.row_factory = sqlite3.Row
+        row = connection.execute("SELECT * FROM export_job WHERE id = ?", (job_id,)).fetchone()
+        if row is None or int(row["user_id"]) != current_user_id(connection):
+            return None
+        return row
+
+    @app.post("/api/export/jobs")
+    @require_login
+    def api_export_job_create():
+        body = request.get_json(silent=True) or {}
+        kind = str(body.get("kind") or "")
+        if kind not in EXPORT_JOB_KINDS:
+            return jsonify({"ok": False, "error": "unknown_export_kind", "kinds": sorted(EXPORT_JOB_KINDS)}), 400
+        try:
+            params = export_job_params(kind, body.get("params"))
+        except ValueError as exc:
+            return jsonify({"ok": False, "error": str(exc)}), 400
+
+        connection = db()
+        connection.row_factory = sqlite3.Row
+        user_id = current_user_id(connection)
+        params_json = json.dumps(params, sort_keys=True)
+        version = data_version(connection, None if EXPORT_JOB_KINDS[kind]["scope"] == "global" else user_id)
+        # A repeat click joins the job already in flight; an unchanged data version reuses the artifact.
+        for row in connection.execute(
+            """
+            SELECT * FROM export_job
+            WHERE user_id = ? AND kind = ? AND params = ? AND data_version = ? AND status IN ('queued', 'running', 'done')
+            ORDER BY created_at DESC
+            """,
+            (user_id, kind, params_json, version),
+        ):
+            if row["status"] != "done":
+                return jsonify({**export_job_payload(row), "cached": False}), 202
+            if export_job_cacheable(kind, params) and row["artifact"] and (EXPORT_DIR / row["artifact"]).is_file():
+                return jsonify({**export_job_payload(row), "cached": True})
+
+        pending = connection.execute(
+            "SELECT COUNT(*) FROM export_job WHERE user_id = ? AND status IN ('queued', 'running')", (user_id,)
+        ).fetchone()[0]
+        if pending >= EXPORT_JOB_MAX_PENDING:
+            return jsonify({"ok": False, "error": "too_many_export_jobs", "pending": pending}), 429
+
+        job_id = uuid.uuid4().hex
+        now = utc_now_iso()
+        connection.execute(
+            """
+            INSERT INTO export_job (id, user_id, kind, params, data_version, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)
+            """,
+            (job_id, user_id, kind, params_json, version, now, now),
+        )
+        connection.commit()
+        submit_export_job(app, job_id)
+        return jsonify({**export_job_payload(export_job_row(connection, job_id)), "cached": False}), 202
+
+    @app.get("/api/export/jobs/<job_id>")
+    @require_login
+    def api_export_job_status(job_id: str):
+        connection = db()
+        row = export_job_row(connection, job_id)
+        if row is None:
+            return jsonify({"ok": False, "error": "export_job_not_found"}), 404
+        # Jobs outlive the process that queued them: pick up queued work no worker here owns,
+        # and retry running work whose worker went away.
+        stale = (
+            row["status"] == "running"
+            and datetime.fromisoformat(row["updated_at"]) < datetime.now(timezone.utc) - timedelta(seconds=EXPORT_JOB_STALE_SECONDS)
+        )
+        if (row["status"] == "queued" or stale) and not export_job_in_flight(job_id):
+            connection.execute("UPDATE export_job SET status = 'queued', updated_at = ? WHERE id = ?", (utc_now_iso(), job_id))
+            connection.commit()
+            submit_export_job(app, job_id)
+            row = export_job_row(connection, job_id)
+        return jsonify(export_job_payload(row))
+
+    @app.get("/api/export/jobs/<job_id>/download")
+    @require_login
+    def api_export_job_download(job_id: str):
+        row = export_job_row(db(), job_id)
+        if row is None:
+            return jsonify({"ok": False, "error": "export_job_not_found"}), 404
+        if row["status"] != "done":
+            return jsonify({"ok": False, "error": "export_job_not_ready", "status": row["status"]}), 409
+        artifact = EXPORT_DIR / row["artifact"]
+        if not artifact.is_file():
+            return jsonify({"ok": False, "error": "export_artifact_missing"}), 410
+        return send_file(artifact, mimetype=row["mimetype"], as_attachment=True, download_name=row["download_name"], conditional=True)
+
     @app.post("/api/import/backup")
     @require_login
     def api_import_backup():
-        upload = request.files.get("file")
-        if upload is None or not upload.filename:
+        # One full backup, or a full backup plus the incrementals built on it (any order).
+        uploads = request.files.getlist("file")
+        if not uploads or any(not upload.filename for upload in uploads):
             return jsonify({"ok": False, "error": "file_required"}), 400
 
         should_confirm = str((request.form.get("confirm_overwrite") or "false")).lower() in {"true", "1", "yes"}
-        raw = upload.read()
+        # Uploads are spooled to disk and members are copied out in fixed-size chunks, so memory
+        # does not grow with the archive.
+        temp_dir = Path(tempfile.mkdtemp(prefix="flowform-restore-"))
+        archives = []
         try:
-            zf = zipfile.ZipFile(io.BytesIO(raw))
-        except zipfile.BadZipFile:
-            return jsonify({"ok": False, "error": "invalid_zip"}), 400
-
-        names = set(zf.namelist())
-        ok, error_code = validate_backup_zip_names(names)
-        if not ok:
-            return jsonify({"ok": False, "error": error_code, "message": "Backup ZIP contains invalid or unsafe paths."}), 400
-        if "flowform.db" not in names:
-            return jsonify({"ok": False, "error": "flowform.db_missing"}), 400
-
-        manifest = {}
-        if "manifest.json" in names:
-            try:
-                manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
-            except Exception:
-                manifest = {}
+            for index, upload in enumerate(uploads):
+                spooled = temp_dir / f"upload-{index}.zip"
+                upload.save(spooled, buffer_size=MEDIA_CHUNK_BYTES)
+                try:
+                    zf = zipfile.ZipFile(spooled)
+                except zipfile.BadZipFile:
+                    return jsonify({"ok": False, "error": "invalid_zip"}), 400
+                archives.append((zf, {}))
 
-        summary = {
-            "plans": int((manifest.get("counts") or {}).get("plans", 0)),
-            "templates": int((manifest.get("counts") or {}).get("templates", 0)),
-            "completions": int((manifest.get("counts") or {}).get("completions", 0)),
-            "recovery": int((manifest.get("counts") or {}).get("recovery", 0)),
-            "media_files": int(manifest.get("media_files", 0)),
-            "warning": "Restoring this backup will overwrite current data.",
-        }
+                names = set(zf.namelist())
+                ok, error_code = validate_backup_zip_names(names)
+                if not ok:
+                    return jsonify({"ok": False, "error": error_code, "message": "Backup ZIP contains invalid or unsafe paths."}), 400
 
-        if not should_confirm:
-            return jsonify({"ok": True, "requires_confirmation": True, "summary": summary})
+                manifest = {}
+                if "manifest.json" in names:
+                    try:
+                        manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
+                    except Exception:
+                        manifest = {}
+                archives[-1] = (zf, manifest if isinstance(manifest, dict) else {})
 
-        db_target = Path(app.config["DB_PATH"])
-        db_target.parent.mkdir(parents=True, exist_ok=True)
-        MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+            try:
+                chain = backup_chain(archives)
+            except ValueError as exc:
+                return jsonify({"ok": False, "error": str(exc)}), 400
+            manifest = chain[-1][1]
+
+            summary = {
+                "plans": int((manifest.get("counts") or {}).get("plans", 0)),
+                "templates": int((manifest.get("counts") or {}).get("templates", 0)),
+                "completions": int((manifest.get("counts") or {}).get("completions", 0)),
+                "recovery": int((manifest.get("counts") or {}).get("recovery", 0)),
+                "media_files": int(manifest.get("media_files", 0)),
+                "backups": len(chain),
+                "warning": "Restoring this backup will overwrite current data.",
+            }
 
-        temp_dir = Path(tempfile.mkdtemp(prefix="flowform-restore-"))
-        stage_db = temp_dir / "flowform.db"
-        stage_media = temp_dir / "media"
-        stage_media.mkdir(exist_ok=True)
-        old_db = db_target.with_suffix(".pre_restore.bak")
-        old_media = MEDIA_DIR.parent / "media_pre_restore"
+            if not should_confirm:
+                return jsonify({"ok": True, "requires_confirmation": True, "summary": summary})
 
-        try:
-            stage_db.write_bytes(zf.read("flowform.db"))
-            for name in names:
-                if name.startswith("media/") and not name.endswith("/"):
-                    out = stage_media / Path(name).name
-                    out.write_bytes(zf.read(name))
-
-            probe = sqlite3.connect(stage_db)
-            required = {"plan", "plan_day", "session_template", "session_completion", "recovery_checkin"}
-            existing = {r[0] for r in probe.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
-            probe.close()
-            if not required.issubset(existing):
-                raise ValueError("backup_database_schema_invalid")
+            db_target = Path(app.config["DB_PATH"])
+            db_target.parent.mkdir(parents=True, exist_ok=True)
+            MEDIA_DIR.mkdir(parents=True, exist_ok=True)
 
+            stage_db = temp_dir / "flowform.db"
+            stage_media = temp_dir / "media"
+            stage_media.mkdir(exist_ok=True)
             old_db = db_target.with_suffix(".pre_restore.bak")
-            if db_target.exists():
-                shutil.copy2(db_target, old_db)
-
-            tmp_live_db = db_target.with_suffix(".restore_tmp")
-            shutil.copy2(stage_db, tmp_live_db)
-            tmp_live_db.replace(db_target)
-
             old_media = MEDIA_DIR.parent / "media_pre_restore"
-            if old_media.exists():
-                shutil.rmtree(old_media)
-            if MEDIA_DIR.exists():
-                MEDIA_DIR.replace(old_media)
-            shutil.copytree(stage_media, MEDIA_DIR, dirs_exist_ok=True)
-            if old_media.exists():
-                shutil.rmtree(old_media)
-            if old_db.exists():
-                old_db.unlink(missing_ok=True)
 
-        except Exception as exc:
-            if old_db.exists():
-                try:
-                    shutil.copy2(old_db, db_target)
-                except Exception:
-                    pass
-            if old_media.exists():
-                try:
-                    if MEDIA_DIR.exists():
-                        shutil.rmtree(MEDIA_DIR)
-                    old_media.replace(MEDIA_DIR)
-                except Exception:
-                    pass
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            return jsonify({"ok": False, "error": "restore_failed", "message": str(exc)}), 400
+            try:
+                stage_backup_chain(chain, stage_db, stage_media)
+                mismatched = verify_staged_backup(manifest, stage_db, stage_media)
+                if mismatched:
+                    raise ValueError(f"backup_checksum_mismatch: {', '.join(mismatched)}")
+
+                probe = sqlite3.connect(stage_db)
+                required = {"plan", "plan_day", "session_template", "session_completion", "recovery_checkin"}
+                existing = {r[0] for r in probe.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()}
+                if not required.issubset(existing):
+                    probe.close()
+                    raise ValueError("backup_database_schema_invalid")
+                # Bring older backups up to the current schema (rollups, indexes) before they go live.
+                apply_schema_migrations(probe)
+                rebuild_template_media_refs(probe)
+                # Version counters restart from the backup's values, so no cached artifact is trustworthy.
+                probe.execute("DELETE FROM export_job")
+                probe.commit()
+                probe.close()
+
+                release_db()
+                pool.invalidate()
+                if db_target.exists():
+                    checkpoint = sqlite3.connect(db_target)
+                    checkpoint.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                    checkpoint.close()
+                    shutil.copy2(db_target, old_db)
+
+                tmp_live_db = db_target.with_suffix(".restore_tmp")
+                shutil.copy2(stage_db, tmp_live_db)
+                tmp_live_db.replace(db_target)
+                for sidecar in sqlite_sidecar_paths(db_target):
+                    sidecar.unlink(missing_ok=True)
+                invalidate_template_index(db_path)
+
+                if old_media.exists():
+                    shutil.rmtree(old_media)
+                if MEDIA_DIR.exists():
+                    MEDIA_DIR.replace(old_media)
+                shutil.copytree(stage_media, MEDIA_DIR, dirs_exist_ok=True)
+                if old_media.exists():
+                    shutil.rmtree(old_media)
+                if old_db.exists():
+                    old_db.unlink(missing_ok=True)
+                shutil.rmtree(EXPORT_DIR, ignore_errors=True)
+
+            except Exception as exc:
+                invalidate_template_index(db_path)
+                if old_db.exists():
+                    try:
+                        shutil.copy2(old_db, db_target)
+                    except Exception:
+                        pass
+                if old_media.exists():
+                    try:
+                        if MEDIA_DIR.exists():
+                            shutil.rmtree(MEDIA_DIR)
+                        old_media.replace(MEDIA_DIR)
+                    except Exception:
+                        pass
+                return jsonify({"ok": False, "error": "restore_failed", "message": str(exc)}), 400
+        finally:
+            for zf, _ in archives:
+                zf.close()
             shutil.rmtree(temp_dir, ignore_errors=True)
-            return jsonify({"ok": False, "error": str(exc)}), 400
 
-        shutil.rmtree(temp_dir, ignore_errors=True)
-        return jsonify({"ok": True, "restored": summary})
+        warnings = []
+        missing = missing_media_references(db(), MEDIA_DIR)
+        if missing:
+            warnings.append({"code": "missing_media_references", "items": missing})
+        return jsonify({"ok": True, "restored": summary, "warnings": warnings})
 
     @app.post("/api/export")
     def api_export():
@@ -3374,6 +6105,9 @@ def create_app(port: int | None = None) -> Flask:
             {"path": "/api/export/backup", "methods": ["GET"], "description": "Download full-fidelity backup ZIP"},
             {"path": "/api/export/plan_pdf/<plan_id>", "methods": ["GET"], "description": "Download plan PDF"},
             {"path": "/api/export/session_summary/<completion_id>", "methods": ["GET"], "description": "Download session summary PDF"},
+            {"path": "/api/export/jobs", "methods": ["POST"], "description": "Queue a background export job"},
+            {"path": "/api/export/jobs/<job_id>", "methods": ["GET"], "description": "Poll export job status"},
+            {"path": "/api/export/jobs/<job_id>/download", "methods": ["GET"], "description": "Download a finished export artifact"},
             {"path": "/api/import", "methods": ["POST"], "description": "Import project"},
             {"path": "/api/import/backup", "methods": ["POST"], "description": "Restore full-fidelity backup ZIP"},
             {"path": "/admin/users/<user_id>/toggle", "methods": ["POST"], "description": "Enable/disable user account"},
@@ -3469,25 +6203,187 @@ def create_app(port: int | None = None) -> Flask:
         if not check.get("ok", False):
             return render_template("first_run_error.html", error_message=check.get("message", "Unknown startup check failure")), 500
 
-        connection = sqlite3.connect(db_path)
+        connection = db()
         counts = {
             "templates": connection.execute("SELECT COUNT(*) FROM session_template").fetchone()[0],
             "plans": connection.execute("SELECT COUNT(*) FROM plan").fetchone()[0],
             "completions": connection.execute("SELECT COUNT(*) FROM session_completion").fetchone()[0],
             "recovery": connection.execute("SELECT COUNT(*) FROM recovery_checkin").fetchone()[0],
         }
-        connection.close()
         return render_template("ready.html", counts=counts)
         return render_template("ready.html")
 
     return app
 
 
+def report_pending_migrations(db_path: Path) -> int:
+    if db_path.exists():
+        connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        current = schema_version(connection)
+        pending = pending_migrations(connection)
+        connection.close()
+    else:
+        current = 0
+        pending = [(version, name) for version, name, _ in SCHEMA_MIGRATIONS]
+
+    print(f"db: {db_path}")
+    print(f"schema_version: {current} (latest {SCHEMA_VERSION})")
+    if not pending:
+        print("pending: none")
+        return 0
+    for version, name in pending:
+        print(f"pending: {version:04d} {name}")
+    return 1
+
+
+def report_counter_reconciliation(db_path: Path) -> int:
+    if not db_path.exists():
+        print(f"db not found: {db_path}")
+        return 1
+    connection = open_tuned_connection(db_path)
+    try:
+        apply_schema_migrations(connection)
+        connection.execute("BEGIN IMMEDIATE")
+        drift = reconcile_counters(connection)
+        connection.commit()
+    finally:
+        connection.close()
+
+    print(f"db: {db_path}")
+    for table, rows in drift.items():
+        print(f"{table}: {rows} drifted row(s) rebuilt")
+    return 0
+
+
+def report_cohort_plans(db_path: Path, source: Path, chunk_size: int = COHORT_CHUNK_SIZE) -> int:
+    payload = json.loads(source.read_text(encoding="utf-8"))
+    profiles = payload.get("profiles") if isinstance(payload, dict) else payload
+    if not isinstance(profiles, list) or not all(isinstance(item, dict) for item in profiles):
+        print(f"expected a JSON list of profiles (or {{\"profiles\": [...]}}) in {source}")
+        return 1
+
+    connection = open_tuned_connection(db_path)
+    try:
+        apply_schema_migrations(connection)
+        index = template_index(connection, db_path)
+        if not index:
+            print("session_template empty; cannot generate plan")
+            return 1
+        summary = create_cohort_plans(connection, index, profiles, chunk_size)
+    finally:
+        connection.close()
+
+    for result in summary["results"]:
+        who = result.get("email") or result.get("user_id")
+        if result.get("ok"):
+            print(f"ok   {who}: plan {result['plan_id']} ({result['days']} days, build {result['build_ms']} ms)")
+        else:
+            print(f"fail {who}: {result['error']}")
+    for chunk in summary["chunks"]:
+        print(f"chunk @{chunk['start']}: {chunk['users']} user(s), write {chunk['write_ms']} ms")
+    print(f"created: {summary['created']} failed: {summary['failed']}")
+    return 0 if summary["failed"] == 0 else 1
+
+
+def report_upload_gc(db_path: Path, max_age_hours: int) -> int:
+    if not db_path.exists():
+        print(f"db not found: {db_path}")
+        return 1
+    connection = open_tuned_connection(db_path)
+    try:
+        apply_schema_migrations(connection)
+        connection.execute("BEGIN IMMEDIATE")
+        removed = gc_stale_uploads(connection, max_age_hours)
+        connection.commit()
+    finally:
+        connection.close()
+    print(f"db: {db_path}")
+    print(f"removed {removed} stale upload session(s) older than {max_age_hours}h")
+    return 0
+
+
+def report_media_layout_migration(db_path: Path, batch_size: int) -> int:
+    if not db_path.exists():
+        print(f"db not found: {db_path}")
+        return 1
+    connection = open_tuned_connection(db_path)
+    try:
+        apply_schema_migrations(connection)
+        summary = migrate_media_layout(connection, batch_size)
+    finally:
+        connection.close()
+    print(f"db: {db_path}")
+    print(f"moved {summary['moved']} file(s) in {summary['batches']} batch(es); {summary['missing']} missing on disk")
+    return 0
+
+
+def report_media_jobs(db_path: Path) -> int:
+    if not db_path.exists():
+        print(f"db not found: {db_path}")
+        return 1
+    connection = open_tuned_connection(db_path)
+    try:
+        apply_schema_migrations(connection)
+    finally:
+        connection.close()
+    summary = run_media_jobs(db_path)
+    print(f"db: {db_path}")
+    print(f"media jobs: {summary['jobs']} run, {summary['done']} done, {summary['failed']} failed")
+    return 0 if summary["failed"] == 0 else 1
+
+
+def report_media_probe(db_path: Path, batch_size: int) -> int:
+    if not db_path.exists():
+        print(f"db not found: {db_path}")
+        return 1
+    connection = open_tuned_connection(db_path)
+    try:
+        apply_schema_migrations(connection)
+        summary = backfill_media_probe(connection, batch_size)
+    finally:
+        connection.close()
+    print(f"db: {db_path}")
+    print(f"probed {summary['probed']} file(s), filled {summary['updated']} row(s) in {summary['batches']} batch(es)")
+    return 0
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Run FlowForm Flask server")
     parser.add_argument("--port", type=int, default=None, help="Port to bind")
+    parser.add_argument("--pending-migrations", action="store_true", help="List schema migrations not yet applied and exit")
+    parser.add_argument("--reconcile-counters", action="store_true", help="Rebuild streak/rollup counters from raw rows and exit")
+    parser.add_argument("--cohort-plans", type=Path, default=None, help="Create plans for a JSON list of user profiles and exit")
+    parser.add_argument("--chunk-size", type=int, default=COHORT_CHUNK_SIZE, help="Users per transaction for --cohort-plans")
+    parser.add_argument("--gc-uploads", type=int, default=None, metavar="HOURS", help="Delete resumable uploads idle for HOURS and exit")
+    parser.add_argument("--migrate-media-layout", action="store_true", help="Move flat media files into the hashed fan-out layout and exit")
+    parser.add_argument("--batch-size", type=int, default=MEDIA_MIGRATION_BATCH, help="media_item rows per transaction for --migrate-media-layout and --probe-media")
+    parser.add_argument("--media-jobs", action="store_true", help="Generate missing media derivatives (thumbnails, metadata) and exit")
+    parser.add_argument("--probe-media", action="store_true", help="Fill missing media duration/dimensions from file headers and exit")
     args = parser.parse_args()
 
+    if args.pending_migrations:
+        load_env_file(ROOT_DIR / ".env")
+        raise SystemExit(report_pending_migrations(Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve()))
+    if args.reconcile_counters:
+        load_env_file(ROOT_DIR / ".env")
+        raise SystemExit(report_counter_reconciliation(Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve()))
+    if args.cohort_plans:
+        load_env_file(ROOT_DIR / ".env")
+        db_path = Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve()
+        raise SystemExit(report_cohort_plans(db_path, args.cohort_plans, args.chunk_size))
+    if args.migrate_media_layout:
+        load_env_file(ROOT_DIR / ".env")
+        raise SystemExit(report_media_layout_migration(Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve(), args.batch_size))
+    if args.probe_media:
+        load_env_file(ROOT_DIR / ".env")
+        raise SystemExit(report_media_probe(Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve(), args.batch_size))
+    if args.media_jobs:
+        load_env_file(ROOT_DIR / ".env")
+        raise SystemExit(report_media_jobs(Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve()))
+    if args.gc_uploads is not None:
+        load_env_file(ROOT_DIR / ".env")
+        raise SystemExit(report_upload_gc(Path(os.getenv("DB_PATH", str(DEFAULT_DB_PATH))).resolve(), args.gc_uploads))
+
     app = create_app(port=args.port)
     host = os.getenv("HOST", "127.0.0.1")
     app.run(host=host, port=app.config["PORT"], debug=False)
@@ -261,3 +261,64 @@ def test_template_edit_persists_fields_and_block_media_id(tmp_path):
     assert row["level"] == "intermediate"
     blocks = json.loads(row["json_blocks"])["blocks"]
     assert int(blocks[0]["media_id"]) == media_id
+
+
+def test_content_pack_import_remaps_media_and_maintains_reference_index(tmp_path):
+    source_db = tmp_path / "source.db"
+    source_media = tmp_path / "source_media"
+    source_media.mkdir()
+    source = create_app({"TESTING": True, "DB_PATH": str(source_db), "MEDIA_DIR": str(source_media)})
+    with sqlite3.connect(source_db) as conn:
+        for name in ("skip.mp4", "clip.mp4"):
+            conn.execute("INSERT INTO media_item (filename, media_type, tags) VALUES (?, ?, '')", (name, "video"))
+        blocks = json.dumps({"blocks": [{"name": "warmup", "minutes": 5, "media_id": 2}, {"name": "main", "minutes": 20, "media_item_id": 2}]})
+        conn.execute(
+            "INSERT INTO session_template (name, discipline, duration_minutes, json_blocks) VALUES ('Pack', 'strength', 25, ?)",
+            (blocks,),
+        )
+        template_id = int(conn.execute("SELECT last_insert_rowid()").fetchone()[0])
+        assert conn.execute("SELECT media_item_id, block_count FROM template_media_ref").fetchall() == [(2, 2)]
+    (source_media / "clip.mp4").write_bytes(b"clip")
+    pack = source.test_client().post("/content-packs/export", json={"template_ids": [template_id]})
+    assert pack.status_code == 200
+
+    target_db = tmp_path / "target.db"
+    target = create_app({"TESTING": True, "DB_PATH": str(target_db), "MEDIA_DIR": str(tmp_path / "target_media")})
+    response = target.test_client().post(
+        "/content-packs/import",
+        data={"file": (io.BytesIO(pack.data), "pack.zip")},
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 302
+    with sqlite3.connect(target_db) as conn:
+        assert conn.execute("SELECT id, filename FROM media_item").fetchall() == [(1, "clip.mp4")]
+        assert conn.execute("SELECT media_item_id, block_count FROM template_media_ref").fetchall() == [(1, 2)]
+
+
+def test_media_file_offloads_registered_files_to_proxy(tmp_path):
+    db_path = tmp_path / "offload.db"
+    media_dir = tmp_path / "media"
+    app = create_app(
+        {
+            "TESTING": True,
+            "DB_PATH": str(db_path),
+            "MEDIA_DIR": str(media_dir),
+            "MEDIA_OFFLOAD": "x-accel",
+            "MEDIA_OFFLOAD_PREFIX": "/internal-media",
+        }
+    )
+    client = app.test_client()
+    (media_dir / "demo.mp4").write_bytes(b"video-bytes")
+    (media_dir / "stray.mp4").write_bytes(b"unregistered")
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO media_item (filename, media_type, tags) VALUES ('demo.mp4', 'video', '')")
+
+    response = client.get("/media/file/demo.mp4")
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"] == "/internal-media/demo.mp4"
+    assert response.mimetype == "video/mp4"
+    assert response.data == b""
+    assert client.get("/media/file/stray.mp4").status_code == 404
+
+    app.config["MEDIA_OFFLOAD"] = ""
+    assert client.get("/media/file/demo.mp4").data == b"video-bytes"
@@ -0,0 +1,227 @@
+import sqlite3
+
+import pytest
+
+from app_server import create_app
+
+# Hot read paths and the shape they are issued in by app_server. Each one must be
+# answered by an index search; a plain "SCAN <table>" means a linear pass.
+HOT_QUERIES = {
+    "current_plan_record": (
+        "SELECT id, user_id, name, start_date, weeks, status FROM plan WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (1,),
+    ),
+    "latest_profile": (
+        "SELECT goal, days_per_week, minutes, equipment, constraints FROM profile WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (1,),
+    ),
+    "plan_current_days": (
+        """
+        SELECT
+            pd.id, pd.week, pd.day_index, pd.title, st.name AS template_name, st.discipline, st.duration_minutes,
+            MAX(sc.id) AS completion_id
+        FROM plan_day pd
+        LEFT JOIN session_template st ON st.id = pd.template_id
+        LEFT JOIN session_completion sc ON sc.plan_day_id = pd.id
+        WHERE pd.plan_id = ?
+        GROUP BY pd.id, pd.week, pd.day_index, pd.title, st.name, st.discipline, st.duration_minutes
+        ORDER BY pd.week ASC, pd.day_index ASC
+        """,
+        (1,),
+    ),
+    "export_snapshot_days": (
+        """
+        SELECT pd.id, pd.plan_id, pd.week, pd.day_index, pd.title, pd.created_at, pd.updated_at,
+               st.id AS template_id, st.name AS template_name, st.discipline, st.duration_minutes
+        FROM plan_day pd
+        LEFT JOIN session_template st ON st.id = pd.template_id
+        WHERE pd.plan_id = ?
+        ORDER BY pd.week ASC, pd.day_index ASC
+        """,
+        (1,),
+    ),
+    "export_snapshot_completions": (
+        """
+        SELECT sc.id, sc.plan_day_id, sc.completed_at, sc.rpe, sc.notes, sc.minutes_done, sc.created_at, sc.updated_at
+        FROM session_completion sc
+        JOIN plan_day pd ON pd.id = sc.plan_day_id
+        WHERE pd.plan_id = ?
+        ORDER BY sc.completed_at DESC
+        """,
+        (1,),
+    ),
+    "week_day_count": (
+        "SELECT COUNT(*) FROM plan_day WHERE plan_id = ? AND week = ?",
+        (1, 1),
+    ),
+    "week_completed_count": (
+        """
+        SELECT COUNT(DISTINCT pd.id)
+        FROM plan_day pd
+        JOIN session_completion sc ON sc.plan_day_id = pd.id
+        WHERE pd.plan_id = ? AND pd.week = ?
+        """,
+        (1, 1),
+    ),
+    "avg_rpe_window": (
+        "SELECT AVG(rpe) FROM session_completion WHERE completed_at >= datetime('now', ?)",
+        ("-7 days",),
+    ),
+    "assistant_completions_7d": (
+        """
+        SELECT COUNT(*)
+        FROM session_completion sc
+        JOIN plan_day pd ON pd.id = sc.plan_day_id
+        JOIN plan p ON p.id = pd.plan_id
+        WHERE p.user_id = ? AND sc.completed_at >= datetime('now', '-7 days')
+        """,
+        (1,),
+    ),
+    "daily_stats_streak_and_rpe": (
+        "SELECT day, rpe_sum, rpe_count FROM user_daily_stats WHERE user_id = ? AND completions > 0 ORDER BY day DESC",
+        (1,),
+    ),
+    "daily_stats_readiness_trend": (
+        """
+        SELECT day, readiness_score
+        FROM user_daily_stats
+        WHERE user_id = ? AND readiness_score IS NOT NULL
+        ORDER BY day DESC
+        LIMIT 14
+        """,
+        (1,),
+    ),
+    "recovery_trend": (
+        """
+        SELECT date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10
+        FROM recovery_checkin
+        WHERE user_id = ?
+        ORDER BY date DESC
+        LIMIT 14
+        """,
+        (1,),
+    ),
+    "recovery_checkin_upsert_lookup": (
+        "SELECT id FROM recovery_checkin WHERE user_id = ? AND date = ?",
+        (1, "2026-03-01"),
+    ),
+    "template_blocks": (
+        """
+        SELECT tb.position, tb.name, tb.minutes, tb.media_item_id, m.*
+        FROM template_block tb
+        LEFT JOIN media_item m ON m.id = tb.media_item_id
+        WHERE tb.template_id = ?
+        ORDER BY tb.position
+        """,
+        (1,),
+    ),
+    "media_usage": (
+        """
+        SELECT r.template_id, st.name, r.block_count
+        FROM template_media_ref r
+        JOIN session_template st ON st.id = r.template_id
+        WHERE r.media_item_id = ?
+        ORDER BY r.template_id
+        """,
+        (1,),
+    ),
+    "orphan_media": (
+        """
+        SELECT m.id, m.filename
+        FROM media_item m
+        WHERE m.user_id = ? AND NOT EXISTS (SELECT 1 FROM template_media_ref r WHERE r.media_item_id = m.id)
+        ORDER BY m.id
+        """,
+        (1,),
+    ),
+    "content_pack_media": (
+        """
+        SELECT DISTINCT m.id, m.filename, m.media_type, m.tags
+        FROM template_media_ref r
+        JOIN media_item m ON m.id = r.media_item_id
+        WHERE r.template_id IN (?, ?)
+        ORDER BY m.id ASC
+        """,
+        (1, 2),
+    ),
+    "media_library": (
+        """
+        SELECT m.id, m.filename, m.original_name, m.media_type, m.tags, m.duration_sec, m.uploaded_at,
+               (SELECT COUNT(*) FROM template_media_ref r WHERE r.media_item_id = m.id) AS used_by
+        FROM media_item m
+        WHERE m.user_id = ? AND m.id < ?
+        ORDER BY m.id DESC
+        LIMIT ?
+        """,
+        (1, 500, 51),
+    ),
+    "media_library_by_type": (
+        "SELECT m.id FROM media_item m WHERE m.user_id = ? AND m.media_type = ? AND m.id < ? ORDER BY m.id DESC LIMIT ?",
+        (1, "video", 500, 51),
+    ),
+    "media_library_by_tag": (
+        """
+        SELECT m.id, m.original_name, m.media_type, m.tags
+        FROM media_tag t JOIN media_item m ON m.id = t.media_item_id
+        WHERE t.user_id = ? AND t.tag = ? AND m.media_type = ? AND t.media_item_id < ?
+        ORDER BY t.media_item_id DESC
+        LIMIT ?
+        """,
+        (1, "mobility", "video", 500, 51),
+    ),
+    "media_tag_counts": (
+        "SELECT tag, COUNT(*) FROM media_tag WHERE user_id = ? GROUP BY tag ORDER BY tag",
+        (1,),
+    ),
+    "export_job_reuse": (
+        """
+        SELECT * FROM export_job
+        WHERE user_id = ? AND kind = ? AND params = ? AND data_version = ? AND status IN ('queued', 'running', 'done')
+        ORDER BY created_at DESC
+        """,
+        (1, "json", "{}", 3),
+    ),
+    "export_job_pending": (
+        "SELECT COUNT(*) FROM export_job WHERE user_id = ? AND status IN ('queued', 'running')",
+        (1,),
+    ),
+    "latest_subscription": (
+        "SELECT plan, status, start_date, end_date FROM subscriptions WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (1,),
+    ),
+    "assistant_history": (
+        "SELECT prompt, response, mode, created_at FROM assistant_message WHERE user_id = ? ORDER BY id DESC LIMIT 20",
+        (1,),
+    ),
+}
+
+
+@pytest.fixture()
+def migrated_db(tmp_path, monkeypatch):
+    db_path = tmp_path / "plans.db"
+    monkeypatch.setenv("DB_PATH", str(db_path))
+    create_app(port=5460)
+    connection = sqlite3.connect(db_path)
+    yield connection
+    connection.close()
+
+
+def full_scans(connection: sqlite3.Connection, sql: str, params: tuple) -> list[str]:
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+    return [row[3] for row in rows if str(row[3]).startswith("SCAN ")]
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_index(migrated_db, name):
+    sql, params = HOT_QUERIES[name]
+    assert full_scans(migrated_db, sql, params) == [], name
+
+
+def test_hot_queries_scan_without_indexes(migrated_db):
+    # Guards the check itself: dropping the indexes must make it fail.
+    names = [row[0] for row in migrated_db.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")]
+    assert names
+    for name in names:
+        migrated_db.execute(f"DROP INDEX {name}")
+    sql, params = HOT_QUERIES["current_plan_record"]
+    assert full_scans(migrated_db, sql, params)
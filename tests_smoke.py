@@ -378,7 +378,9 @@ def test_full_backup_endpoint_contains_manifest_and_settings(tmp_path, monkeypat
     import io
     import json as _json
     import zipfile
+    import app_server
 
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
     monkeypatch.setenv('DB_PATH', str(tmp_path / 'full-backup.db'))
     app = create_app(port=5423)
     client = app.test_client()
@@ -458,8 +460,10 @@ def test_restore_rejects_zip_path_traversal(tmp_path, monkeypatch):
 def test_restore_backup_preview_and_apply(tmp_path, monkeypatch):
     import io
     import sqlite3
+    import app_server
 
     source_db = tmp_path / 'source.db'
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
     monkeypatch.setenv('DB_PATH', str(source_db))
     app = create_app(port=5424)
     client = app.test_client()
@@ -778,8 +782,10 @@ def test_export_zip_after_approval_succeeds_without_force(tmp_path, monkeypatch)
 def test_backup_restore_drill_recovers_plan_completion_and_recovery(tmp_path, monkeypatch):
     import io
     import sqlite3
+    import app_server
 
     db_path = tmp_path / 'drill.db'
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
     monkeypatch.setenv('DB_PATH', str(db_path))
     app = create_app(port=5440)
     client = app.test_client()
@@ -905,3 +911,1626 @@ def test_media_upload_attach_to_template_and_visible_in_session_player(tmp_path,
     assert session_page.status_code == 200
     assert b'breathwork.png' in session_page.data
     assert b'media/file/' in session_page.data
+
+
+def test_requests_share_one_pooled_wal_connection(tmp_path, monkeypatch):
+    import app_server
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'pool.db'))
+    monkeypatch.setenv('ENABLE_AUTH', 'true')
+    # Derivative jobs from earlier uploads open their own connections when they finish.
+    assert app_server.drain_media_jobs()
+    opened = []
+    real_open = app_server.open_tuned_connection
+
+    def _counting_open(path):
+        connection = real_open(path)
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(app_server, 'open_tuned_connection', _counting_open)
+    app = create_app(port=5447)
+    client = app.test_client()
+    opened.clear()
+
+    client.post('/signup', data={'display_name': 'Pool', 'email': 'pool@example.com', 'password': 'pass1234'})
+    for _ in range(3):
+        assert client.get('/recovery').status_code == 200
+        assert client.post('/api/recovery/checkin', json={'sleep_hours': 7, 'stress_1_10': 4}).status_code == 200
+
+    assert len(opened) == 1
+    assert opened[0].execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert opened[0].execute('PRAGMA foreign_keys').fetchone()[0] == 1
+
+
+def test_pool_reuses_connections_across_short_lived_request_threads(tmp_path, monkeypatch):
+    import threading
+    import app_server
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'threads.db'))
+    assert app_server.drain_media_jobs()
+    opened = []
+    real_open = app_server.open_tuned_connection
+    monkeypatch.setattr(app_server, 'open_tuned_connection', lambda path: opened.append(path) or real_open(path))
+    app = create_app(port=5476)
+    pool = app.extensions['sqlite_pool']
+    opened.clear()
+
+    # Like the threaded dev server: every request on a new thread, some of them overlapping.
+    statuses = []
+
+    def serve():
+        statuses.append(app.test_client().get('/recovery').status_code)
+
+    for _ in range(5):
+        threads = [threading.Thread(target=serve) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert statuses == [200] * 20
+    assert len(opened) <= 4
+    assert 1 <= pool.idle_count() <= len(opened)
+
+    for _ in range(30):
+        thread = threading.Thread(target=serve)
+        thread.start()
+        thread.join()
+    assert len(opened) <= 4 and pool.idle_count() <= pool.max_idle
+
+
+def test_schema_migrations_are_versioned_and_skipped_when_current(tmp_path, monkeypatch):
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'migrations.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    create_app(port=5448)
+
+    con = sqlite3.connect(db_path)
+    assert con.execute('PRAGMA user_version').fetchone()[0] == app_server.SCHEMA_VERSION
+    assert app_server.pending_migrations(con) == []
+    assert app_server.apply_schema_migrations(con) == []
+    con.close()
+
+    create_app(port=5449)
+    con = sqlite3.connect(db_path)
+    assert con.execute('SELECT COUNT(*) FROM _healthcheck').fetchone()[0] == 0
+    con.close()
+
+    assert app_server.report_pending_migrations(db_path) == 0
+    assert app_server.report_pending_migrations(tmp_path / 'missing.db') == 1
+    assert not (tmp_path / 'missing.db').exists()
+
+
+def test_daily_stats_rollup_feeds_analytics_and_backfills(tmp_path, monkeypatch):
+    import sqlite3
+    from datetime import date
+    import app_server
+
+    db_path = tmp_path / 'rollup.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5450)
+    client = app.test_client()
+
+    client.post('/api/plan/create', json={
+        'goal': 'hybrid',
+        'days_per_week': 3,
+        'minutes_per_session': 45,
+        'disciplines': ['strength', 'cardio', 'mobility'],
+    })
+    con = sqlite3.connect(db_path)
+    user_id, = con.execute('SELECT user_id FROM plan ORDER BY id DESC LIMIT 1').fetchone()
+    day_ids = [row[0] for row in con.execute('SELECT id FROM plan_day ORDER BY id LIMIT 2')]
+    con.close()
+
+    for day_id, rpe in zip(day_ids, (6, 9)):
+        assert client.post('/api/session/finish', json={'plan_day_id': day_id, 'rpe': rpe, 'minutes_done': 30}).status_code == 200
+    today = date.today().isoformat()
+    assert client.post('/api/recovery/checkin', json={'date': today, 'sleep_hours': 8, 'stress_1_10': 3}).status_code == 200
+
+    con = sqlite3.connect(db_path)
+    day = con.execute('SELECT DATE(completed_at) FROM session_completion LIMIT 1').fetchone()[0]
+    row = con.execute(
+        'SELECT completions, minutes, rpe_sum, rpe_count FROM user_daily_stats WHERE user_id = ? AND day = ?',
+        (user_id, day),
+    ).fetchone()
+    assert row == (2, 60, 15, 2)
+
+    snapshot = app_server.analytics_snapshot(con, user_id)
+    assert snapshot['avg_rpe']['7'] == 7.5
+    assert snapshot['readiness_trend'][-1]['date'] == today
+
+    # Rebuilding the counters from history must reproduce the incrementally maintained ones.
+    assert app_server.reconcile_counters(con) == dict.fromkeys(app_server.COUNTER_TABLES, 0)
+    assert app_server.analytics_snapshot(con, user_id) == snapshot
+
+    for bad in (f'{today}T07:30', '9999-99-99', 'yesterday'):
+        rejected = client.post('/api/recovery/checkin', json={'date': bad, 'sleep_hours': 6, 'stress_1_10': 4})
+        assert rejected.status_code == 400 and rejected.get_json()['error'] == 'invalid_payload'
+
+    # Rows written before check-in dates were validated: analytics skips junk, the backfill keeps the day part.
+    yesterday = date.fromordinal(date.today().toordinal() - 1).isoformat()
+    con.executemany(
+        "INSERT INTO recovery_checkin (user_id, date, sleep_hours, stress_1_10, soreness_1_10, mood_1_10, notes, created_at, updated_at) VALUES (?, ?, 7, 3, 3, 7, '', 'x', 'x')",
+        [(user_id, f'{yesterday}T07:30'), (user_id, '9999-99-99')],
+    )
+    con.executemany(
+        "INSERT INTO user_daily_stats (user_id, day, rpe_sum, rpe_count, updated_at) VALUES (?, ?, 5, 1, 'x')",
+        [(user_id, f'{yesterday}T07:30'), (user_id, '9999-99-99')],
+    )
+    con.commit()
+    assert client.get('/analytics').status_code == 200
+    assert app_server.analytics_snapshot(con, user_id)['avg_rpe']['7'] == round((6 + 9 + 5) / 3, 2)
+    app_server.rebuild_user_daily_stats(con)
+    days = {row[0] for row in con.execute('SELECT day FROM user_daily_stats WHERE user_id = ?', (user_id,))}
+    assert yesterday in days and not [day for day in days if len(day) != 10 or day.startswith('9999')]
+    con.close()
+
+
+def test_streak_and_week_counters_are_maintained_on_finish(tmp_path, monkeypatch):
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'counters.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5451)
+    client = app.test_client()
+    client.post('/api/plan/create', json={'goal': 'hybrid', 'days_per_week': 3, 'minutes_per_session': 45})
+
+    con = sqlite3.connect(db_path)
+    plan_id, user_id = con.execute('SELECT id, user_id FROM plan ORDER BY id DESC LIMIT 1').fetchone()
+    day_ids = [row[0] for row in con.execute('SELECT id FROM plan_day WHERE plan_id = ? AND week = 1 ORDER BY day_index', (plan_id,))]
+    assert con.execute('SELECT total_days, completed_days FROM plan_week_progress WHERE plan_id = ? AND week = 1', (plan_id,)).fetchone() == (3, 0)
+
+    # Older activity: a two-day run ending yesterday, inserted behind the API's back, then reconciled.
+    from datetime import datetime, timedelta, timezone
+    today = datetime.now(timezone.utc)
+    for offset in (2, 1):
+        stamp = (today - timedelta(days=offset)).isoformat()
+        con.execute(
+            'INSERT INTO session_completion (plan_day_id, completed_at, rpe, notes, minutes_done, created_at, updated_at) VALUES (?, ?, 6, \'\', 30, ?, ?)',
+            (day_ids[0], stamp, stamp, stamp),
+        )
+    con.commit()
+    drift = app_server.reconcile_counters(con)
+    con.commit()
+    assert drift['user_streak'] == 1
+    assert drift['plan_week_progress'] == 2
+
+    for day_id in (day_ids[0], day_ids[1], day_ids[1]):
+        assert client.post('/api/session/finish', json={'plan_day_id': day_id, 'rpe': 6, 'minutes_done': 30}).status_code == 200
+
+    assert con.execute('SELECT total_days, completed_days FROM plan_week_progress WHERE plan_id = ? AND week = 1', (plan_id,)).fetchone() == (3, 2)
+    assert con.execute('SELECT current_streak, longest_streak FROM user_streak WHERE user_id = ?', (user_id,)).fetchone() == (3, 3)
+    assert app_server.reconcile_counters(con) == dict.fromkeys(app_server.COUNTER_TABLES, 0)
+    con.close()
+
+
+def test_template_index_matches_full_sort_and_invalidates_on_save(tmp_path, monkeypatch):
+    import random
+    import sqlite3
+    import app_server
+
+    rng = random.Random(7)
+    rows = [(i, f't{i}', rng.choice(['strength', 'cardio', 'mobility']), rng.randint(20, 80), 'all_levels') for i in range(1, 400)]
+    index = app_server.TemplateIndex(rows, version=1)
+    pool = [{'id': r[0], 'name': r[1], 'discipline': r[2], 'duration': r[3], 'level': r[4]} for r in rows]
+    for discipline in ('strength', 'cardio', 'yoga'):
+        candidates = [item for item in pool if item['discipline'] == discipline] or pool
+        for target in (19, 30, 45, 50, 81):
+            ranked = sorted(candidates, key=lambda item: (abs(item['duration'] - target), item['id']))
+            for offset in range(0, 12):
+                assert index.nearest(discipline, target, offset) == ranked[offset % len(ranked)]
+
+    db_path = tmp_path / 'index.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5452)
+    client = app.test_client()
+    assert client.post('/api/plan/create', json={'goal': 'hybrid', 'days_per_week': 3, 'minutes_per_session': 45}).status_code == 200
+    con = sqlite3.connect(db_path)
+    built = app_server.template_index(con, db_path.resolve())
+    assert client.post('/api/plan/create', json={'goal': 'hybrid', 'days_per_week': 3, 'minutes_per_session': 45}).status_code in (200, 403)
+    assert app_server.template_index(con, db_path.resolve()) is built
+
+    assert client.post('/templates/builder/1/save', data={}).status_code == 302
+    rebuilt = app_server.template_index(con, db_path.resolve())
+    con.close()
+    assert rebuilt is not built
+    assert rebuilt.version != built.version
+
+
+def test_cohort_plan_creation_bulk_endpoint_and_cli(tmp_path, monkeypatch):
+    import json
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'cohort.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5453)
+    client = app.test_client()
+
+    con = sqlite3.connect(db_path)
+    founder, = con.execute('SELECT id FROM users ORDER BY id LIMIT 1').fetchone()
+    now = '2026-01-01T00:00:00+00:00'
+    con.executemany(
+        'INSERT INTO users (email, display_name, created_at, updated_at) VALUES (?, ?, ?, ?)',
+        [(f'member{i}@corp.example', f'Member {i}', now, now) for i in range(40)],
+    )
+    con.commit()
+
+    profiles = [{'email': f'member{i}@corp.example', 'goal': 'strength', 'days_per_week': 2 + i % 4} for i in range(40)]
+    profiles += [{'email': 'nobody@corp.example'}, {'email': 'member0@corp.example'}]
+    assert client.post('/api/plan/cohort', json={'profiles': profiles}).status_code == 403
+
+    con.execute("UPDATE users SET role = 'admin' WHERE id = ?", (founder,))
+    con.commit()
+    response = client.post('/api/plan/cohort', json={'profiles': profiles, 'chunk_size': 16})
+    payload = response.get_json()
+    assert payload['created'] == 40
+    assert [r['error'] for r in payload['results'] if not r['ok']] == ['user_not_found', 'duplicate_user']
+    assert len(payload['chunks']) == 3
+    assert all('build_ms' in r for r in payload['results'] if r['ok'])
+
+    expected_days = sum(2 * (2 + i % 4) for i in range(40))
+    assert con.execute('SELECT COUNT(*) FROM plan_day').fetchone()[0] == expected_days
+    assert con.execute("SELECT COUNT(DISTINCT user_id) FROM plan WHERE status = 'active'").fetchone()[0] == 40
+    assert app_server.reconcile_counters(con)['plan_week_progress'] == 0
+    con.close()
+
+    # Re-running from the CLI archives the previous plans and reports per-user lines.
+    source = tmp_path / 'cohort.json'
+    source.write_text(json.dumps({'profiles': profiles[:5]}), encoding='utf-8')
+    assert app_server.report_cohort_plans(db_path.resolve(), source, chunk_size=2) == 0
+    con = sqlite3.connect(db_path)
+    assert con.execute("SELECT COUNT(*) FROM plan WHERE status = 'active'").fetchone()[0] == 40
+    assert con.execute("SELECT COUNT(*) FROM plan WHERE status = 'archived'").fetchone()[0] == 5
+    con.close()
+
+
+def test_replan_applies_minimal_diff_with_dry_run(tmp_path, monkeypatch):
+    import sqlite3
+
+    db_path = tmp_path / 'replan.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5454)
+    client = app.test_client()
+    assert client.post('/api/plan/create', json={'goal': 'strength', 'days_per_week': 3, 'minutes_per_session': 45}).status_code == 200
+
+    unchanged = client.post('/api/plan/replan', json={'from_week': 1, 'to_week': 4, 'dry_run': True}).get_json()
+    assert (unchanged['inserted'], unchanged['updated'], unchanged['deleted'], unchanged['unchanged']) == (0, 0, 0, 6)
+
+    con = sqlite3.connect(db_path)
+    snapshot = con.execute('SELECT id, week, day_index, template_id, title FROM plan_day ORDER BY id').fetchall()
+    week2_day3 = con.execute('SELECT id FROM plan_day WHERE week = 2 AND day_index = 3').fetchone()[0]
+    con.execute(
+        "INSERT INTO session_completion (plan_day_id, completed_at, rpe, notes, minutes_done, created_at, updated_at) VALUES (?, ?, 6, '', 30, ?, ?)",
+        (week2_day3, '2026-01-01T00:00:00+00:00', '2026-01-01T00:00:00+00:00', '2026-01-01T00:00:00+00:00'),
+    )
+    con.execute('UPDATE profile SET days_per_week = 2')
+    con.commit()
+
+    preview = client.post('/api/plan/replan', json={'from_week': 1, 'to_week': 3, 'dry_run': True}).get_json()
+    assert preview['dry_run'] is True
+    assert preview['deleted'] == 1
+    assert preview['kept_completed'] == 1
+    assert con.execute('SELECT id, week, day_index, template_id, title FROM plan_day ORDER BY id').fetchall() == snapshot
+
+    applied = client.post('/api/plan/replan', json={'from_week': 1, 'to_week': 3}).get_json()
+    assert applied['deleted'] == 1
+    assert con.execute('SELECT COUNT(*) FROM plan_day WHERE week = 1').fetchone()[0] == 2
+    assert con.execute('SELECT COUNT(*) FROM plan_day WHERE week = 2').fetchone()[0] == 3
+    assert con.execute('SELECT COUNT(*) FROM plan_day WHERE week = 3').fetchone()[0] == 0
+    assert con.execute('SELECT COUNT(*) FROM plan_day WHERE id = ?', (week2_day3,)).fetchone()[0] == 1
+    assert con.execute('SELECT total_days, completed_days FROM plan_week_progress WHERE week = 2').fetchone() == (3, 1)
+    assert con.execute('SELECT days_per_week FROM plan_spec').fetchone()[0] == 2
+
+    again = client.post('/api/plan/replan', json={'from_week': 1, 'to_week': 3}).get_json()
+    assert (again['inserted'], again['updated'], again['deleted']) == (0, 0, 0)
+    con.close()
+
+
+def test_long_plans_materialize_lazily_from_spec(tmp_path, monkeypatch):
+    import json
+    import sqlite3
+    from datetime import date, timedelta
+
+    db_path = tmp_path / 'lazy.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5455)
+    client = app.test_client()
+    assert client.post('/api/plan/create', json={'goal': 'hybrid', 'days_per_week': 3, 'minutes_per_session': 45, 'weeks': 12}).status_code == 200
+
+    con = sqlite3.connect(db_path)
+    plan_id, weeks = con.execute('SELECT id, weeks FROM plan').fetchone()
+    assert weeks == 12
+    assert con.execute('SELECT MAX(week), COUNT(*) FROM plan_day').fetchone() == (2, 6)
+    assert con.execute('SELECT days_per_week, materialized_through FROM plan_spec WHERE plan_id = ?', (plan_id,)).fetchone() == (3, 2)
+
+    page = client.get('/plan/current')
+    assert b'Week 12' in page.data
+    exported = json.loads(client.get('/api/export/json').data)
+    assert len(exported['plan_days']) == 36
+    assert [d['id'] for d in exported['plan_days'] if d['week'] > 2] == [None] * 30
+    assert con.execute('SELECT COUNT(*) FROM plan_day').fetchone()[0] == 6
+
+    # Starting a future day stores just that day.
+    started = client.get('/plan/current/week/10/day/2/start')
+    assert started.status_code == 302
+    day_id = con.execute('SELECT id FROM plan_day WHERE week = 10 AND day_index = 2').fetchone()[0]
+    assert started.headers['Location'].endswith(f'/session/start/{day_id}')
+    assert con.execute('SELECT COUNT(*) FROM plan_day').fetchone()[0] == 7
+    future_titles = {d['title'] for d in exported['plan_days'] if d['week'] == 10 and d['day_index'] == 2}
+    assert con.execute('SELECT title FROM plan_day WHERE id = ?', (day_id,)).fetchone()[0] in future_titles
+
+    # Three weeks in, viewing the plan stores the current and next week.
+    con.execute('UPDATE plan SET start_date = ?', ((date.today() - timedelta(days=21)).isoformat(),))
+    con.commit()
+    assert client.get('/plan/current').status_code == 200
+    assert con.execute('SELECT materialized_through FROM plan_spec').fetchone()[0] == 5
+    assert con.execute('SELECT COUNT(*) FROM plan_day WHERE week <= 5').fetchone()[0] == 15
+    con.close()
+
+
+def test_plan_preview_is_cached_and_matches_created_plan(tmp_path, monkeypatch):
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'preview.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5456)
+    client = app.test_client()
+    wizard = {'goal': 'strength', 'days_per_week': 4, 'minutes_per_session': 60, 'weeks': 8, 'seed': 11}
+
+    app_server.plan_preview_cache_clear()
+    con = sqlite3.connect(db_path)
+    before = con.execute('SELECT (SELECT COUNT(*) FROM plan) + (SELECT COUNT(*) FROM plan_day) + (SELECT COUNT(*) FROM audit_log)').fetchone()[0]
+    first = client.post('/api/plan/preview', json=wizard).get_json()
+    second = client.post('/api/plan/preview', json=dict(wizard, goal='Strength')).get_json()
+    assert first == second
+    assert app_server.plan_preview_cache_info()['hits'] == 1
+    after = con.execute('SELECT (SELECT COUNT(*) FROM plan) + (SELECT COUNT(*) FROM plan_day) + (SELECT COUNT(*) FROM audit_log)').fetchone()[0]
+    assert after == before
+    assert len(first['weeks']) == 8 and all(len(week['days']) == 4 for week in first['weeks'])
+
+    # Non-numeric settings are a 400 on both routes, before anything is written.
+    for bad in ({'weeks': 'abc'}, {'seed': 'x'}, {'days_per_week': [4]}):
+        for route in ('/api/plan/preview', '/api/plan/create'):
+            rejected = client.post(route, json=dict(wizard, **bad))
+            assert rejected.status_code == 400 and rejected.get_json() == {'ok': False, 'error': 'invalid_payload'}
+    assert con.execute('SELECT COUNT(*) FROM plan').fetchone()[0] == 0
+
+    # Committing the previewed settings (same seed) stores exactly the previewed first weeks.
+    assert client.post('/api/plan/create', json=wizard).status_code == 200
+    stored = con.execute('SELECT week, day_index, template_id FROM plan_day ORDER BY week, day_index').fetchall()
+    previewed = [(week['week'], day['day_index'], day['template_id']) for week in first['weeks'][:2] for day in week['days']]
+    assert stored == previewed
+
+    # A template write bumps the catalog version, so the cached preview is not reused.
+    assert client.post('/templates/builder/1/save', data={}).status_code == 302
+    third = client.post('/api/plan/preview', json=wizard).get_json()
+    assert third['template_version'] != first['template_version']
+
+    # Without a seed the preview draws one and returns it, so create can be called with the same one.
+    unseeded = {key: value for key, value in wizard.items() if key != 'seed'}
+    shown = client.post('/api/plan/preview', json=unseeded).get_json()
+    assert isinstance(shown['seed'], int)
+    assert client.post('/api/plan/preview', json=dict(unseeded, seed=shown['seed'])).get_json() == shown
+    assert b'name="seed"' in client.get('/plan/wizard').data
+
+    # Cache entries hold serialized bodies keyed by catalog version, not index objects.
+    assert all(isinstance(key[0], int) for key in app_server._PLAN_PREVIEW_CACHE)
+    con.close()
+
+
+def test_template_blocks_table_is_authoritative_and_json_is_a_copy(tmp_path, monkeypatch):
+    import json
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'blocks.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5457)
+    client = app.test_client()
+    con = sqlite3.connect(db_path)
+    seeded = sum(len(json.loads(raw)['blocks']) for (raw,) in con.execute('SELECT json_blocks FROM session_template'))
+    assert con.execute('SELECT COUNT(*) FROM template_block').fetchone()[0] == seeded
+
+    con.execute("INSERT INTO media_item (user_id, filename, original_name, media_type, tags, uploaded_at, created_at, updated_at) VALUES (1, 'cue.mp3', 'cue.mp3', 'audio', '', '2026-01-01', '2026-01-01', '2026-01-01')")
+    media_id = con.execute('SELECT MAX(id) FROM media_item').fetchone()[0]
+    # Templates inserted with JSON (content packs, direct SQL) are read into the table once; both
+    # the current and the older media key are accepted.
+    raw = json.dumps({'blocks': [{'name': ' ', 'minutes': '12', 'media_item_id': media_id}, 'junk', {'name': 'Cooldown', 'minutes': -3}]})
+    con.execute("INSERT INTO session_template (name, discipline, duration_minutes, level, json_blocks, created_at, updated_at) VALUES ('Imported', 'strength', 15, 'all', ?, '2026-01-01', '2026-01-01')", (raw,))
+    imported = con.execute('SELECT MAX(id) FROM session_template').fetchone()[0]
+    con.commit()
+    assert con.execute('SELECT position, name, minutes, media_item_id FROM template_block WHERE template_id = ?', (imported,)).fetchall() == [
+        (1, 'Block 1', 12, media_id),
+        (3, 'Cooldown', 0, None),
+    ]
+    blocks = app_server.template_blocks(con, imported, with_media=True)
+    assert blocks[0]['media']['filename'] == 'cue.mp3' and blocks[1]['media'] is None
+
+    # Builder saves write the table; json_blocks is rewritten from it in the one serializer format.
+    assert client.post('/templates/builder/1/save', data={'media_item_id_1': str(media_id)}).status_code == 302
+    assert con.execute('SELECT media_item_id FROM template_block WHERE template_id = 1 ORDER BY position').fetchall() == [(None,), (media_id,), (None,)]
+    saved = json.loads(con.execute('SELECT json_blocks FROM session_template WHERE id = 1').fetchone()[0])['blocks']
+    assert [block['media_id'] for block in saved] == [None, media_id, None]
+    assert all(set(block) == {'name', 'minutes', 'media_id'} for block in saved)
+
+    # Updating the compatibility copy directly no longer re-parses it into the table.
+    con.execute("UPDATE session_template SET json_blocks = 'not json' WHERE id = 2")
+    con.execute('DELETE FROM session_template WHERE id = 3')
+    con.commit()
+    assert con.execute('SELECT COUNT(*) FROM template_block WHERE template_id = 2').fetchone()[0] > 0
+    assert con.execute('SELECT COUNT(*) FROM template_block WHERE template_id = 3').fetchone()[0] == 0
+    assert con.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'session_template_blocks_update'").fetchone()[0] == 0
+
+    # Databases from before the table existed are backfilled when the migrations run.
+    con.execute('DROP TABLE template_block')
+    con.execute('DROP TRIGGER session_template_blocks_insert')
+    con.execute('DROP TRIGGER session_template_blocks_delete')
+    con.execute('PRAGMA user_version = 6')
+    con.commit()
+    create_app(port=5457)
+    assert con.execute('SELECT COUNT(*) FROM template_block WHERE template_id = 1').fetchone()[0] == 3
+    assert con.execute('SELECT COUNT(*) FROM template_block WHERE template_id = ?', (imported,)).fetchone()[0] == 2
+    con.close()
+
+
+def test_media_reference_index_guards_delete_and_finds_orphans(tmp_path, monkeypatch):
+    import io
+    import json
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'refs.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5458)
+    client = app.test_client()
+    for name in ('used.png', 'spare.png'):
+        upload = client.post(
+            '/media/upload',
+            data={'file': (io.BytesIO(b"\x89PNG\r\n\x1a\nbytes"), name)},
+            content_type='multipart/form-data',
+        )
+        assert upload.status_code == 302
+    con = sqlite3.connect(db_path)
+    used_id, spare_id = [row[0] for row in con.execute('SELECT id FROM media_item ORDER BY id')]
+    assert client.post('/templates/builder/1/save', data={'media_item_id_0': str(used_id), 'media_item_id_2': str(used_id)}).status_code == 302
+    assert client.post('/templates/builder/2/save', data={'media_item_id_1': str(used_id)}).status_code == 302
+    assert con.execute('SELECT template_id, block_count FROM template_media_ref WHERE media_item_id = ?', (used_id,)).fetchall() == [(1, 2), (2, 1)]
+
+    usage = client.get(f'/api/media/{used_id}/usage').get_json()
+    assert [(item['template_id'], item['blocks']) for item in usage['templates']] == [(1, 2), (2, 1)]
+    assert [item['id'] for item in client.get('/api/media/orphans').get_json()['orphans']] == [spare_id]
+
+    blocked = client.post(f'/media/{used_id}/delete')
+    assert blocked.status_code == 409
+    assert blocked.get_json()['error'] == 'media_in_use'
+    assert con.execute('SELECT COUNT(*) FROM media_item WHERE id = ?', (used_id,)).fetchone()[0] == 1
+
+    assert client.post(f'/media/{used_id}/delete', data={'force': '1'}).status_code == 302
+    assert con.execute('SELECT COUNT(*) FROM template_media_ref').fetchone()[0] == 0
+    blocks = json.loads(con.execute('SELECT json_blocks FROM session_template WHERE id = 1').fetchone()[0])['blocks']
+    assert all(block['media_id'] is None for block in blocks)
+    assert client.post(f'/media/{spare_id}/delete').status_code == 302
+    assert app_server.reconcile_counters(con)['template_media_ref'] == 0
+    con.close()
+
+
+def test_media_upload_streams_with_limit_and_dedups_by_content(tmp_path, monkeypatch):
+    import hashlib
+    import io
+    import sqlite3
+    import app_server
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    db_path = tmp_path / 'dedup.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5459)
+    client = app.test_client()
+    payload = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 20
+    monkeypatch.setattr(app_server, 'MEDIA_CHUNK_BYTES', 1000)
+    for name in ('first.png', 'second.png'):
+        response = client.post(
+            '/media/upload',
+            data={'file': (io.BytesIO(payload), name)},
+            content_type='multipart/form-data',
+        )
+        assert response.status_code == 302
+
+    con = sqlite3.connect(db_path)
+    rows = con.execute('SELECT id, filename, original_name, content_sha256 FROM media_item ORDER BY id').fetchall()
+    digest = hashlib.sha256(payload).hexdigest()
+    assert [row[2] for row in rows] == ['first.png', 'second.png']
+    assert {row[1] for row in rows} == {app_server.media_relpath(f'{digest}.png')} and {row[3] for row in rows} == {digest}
+    assert con.execute('SELECT size_bytes FROM media_blob WHERE sha256 = ?', (digest,)).fetchone()[0] == len(payload)
+    blob_path = app_server.MEDIA_DIR / digest[:2] / digest[2:4] / f'{digest}.png'
+    assert blob_path.read_bytes() == payload
+
+    assert client.post(f'/media/{rows[0][0]}/delete').status_code == 302
+    assert blob_path.exists()
+    assert client.post(f'/media/{rows[1][0]}/delete').status_code == 302
+    assert not blob_path.exists()
+    assert con.execute('SELECT COUNT(*) FROM media_blob').fetchone()[0] == 0
+
+    monkeypatch.setattr(app_server, 'MEDIA_MAX_BYTES', 4000)
+    too_big = client.post(
+        '/media/upload',
+        data={'file': (io.BytesIO(payload), 'huge.png')},
+        content_type='multipart/form-data',
+    )
+    assert too_big.status_code == 400
+    assert too_big.get_json()['error'] == 'file_too_large'
+    assert con.execute('SELECT COUNT(*) FROM media_item').fetchone()[0] == 0
+    assert not list(app_server.MEDIA_DIR.glob('.upload-*'))
+
+    # A body past the cap is refused by the request limit, before the view reads the file at all.
+    def _never(*args, **kwargs):
+        raise AssertionError('oversized body reached stream_to_temp')
+
+    stream_to_temp = app_server.stream_to_temp
+    monkeypatch.setattr(app_server, 'stream_to_temp', _never)
+    refused = client.post(
+        '/media/upload',
+        data={'file': (io.BytesIO(bytes(4000 + app_server.MEDIA_FORM_OVERHEAD_BYTES + 1)), 'huge.png')},
+        content_type='multipart/form-data',
+    )
+    assert refused.status_code == 400 and refused.get_json()['error'] == 'file_too_large'
+    monkeypatch.setattr(app_server, 'stream_to_temp', stream_to_temp)
+    monkeypatch.setattr(app_server, 'MEDIA_MAX_BYTES', 250 * 1024 * 1024)
+
+    # The blob is unlinked only after the delete commits, and not if an upload re-registered it meanwhile.
+    assert client.post('/media/upload', data={'file': (io.BytesIO(payload), 'again.png')}, content_type='multipart/form-data').status_code == 302
+    media_id, filename = con.execute('SELECT id, filename FROM media_item').fetchone()
+    con.execute('DELETE FROM media_item WHERE id = ?', (media_id,))
+    released = app_server.release_media_file(con, filename)
+    assert released == [filename] and blob_path.exists()
+    con.commit()
+    assert client.post('/media/upload', data={'file': (io.BytesIO(payload), 'racer.png')}, content_type='multipart/form-data').status_code == 302
+    app_server.unlink_released_media(con, released)
+    assert blob_path.read_bytes() == payload
+    con.close()
+
+
+def test_resumable_upload_session_resumes_verifies_and_gcs(tmp_path, monkeypatch):
+    import hashlib
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'resumable.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    monkeypatch.setattr(app_server, 'UPLOAD_DIR', tmp_path / 'uploads')
+    app = create_app(port=5461)
+    client = app.test_client()
+    video = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 40
+    digest = hashlib.sha256(video).hexdigest()
+
+    created = client.post('/api/media/uploads', json={'filename': 'class.mp4', 'size': len(video), 'sha256': digest, 'tags': 'class, flow'})
+    assert created.status_code == 201
+    upload_id = created.get_json()['upload_id']
+    assert client.put(f'/api/media/uploads/{upload_id}?offset=0', data=video[:4000]).get_json()['offset'] == 4000
+    assert client.post(f'/api/media/uploads/{upload_id}/finalize').status_code == 409
+
+    # A gap is refused; the client asks where to resume and continues from there.
+    gap = client.put(f'/api/media/uploads/{upload_id}?offset=6000', data=video[6000:])
+    assert gap.status_code == 409 and gap.get_json()['offset'] == 4000
+    offset = client.get(f'/api/media/uploads/{upload_id}').get_json()['offset']
+    assert client.put(f'/api/media/uploads/{upload_id}', data=video[offset:8000], headers={'Upload-Offset': str(offset)}).status_code == 200
+    assert client.put(f'/api/media/uploads/{upload_id}?offset=8000', data=video[8000:] + b'extra').status_code == 400
+    done = client.put(f'/api/media/uploads/{upload_id}?offset=8000', data=video[8000:]).get_json()
+    assert done['offset'] == done['size'] == len(video)
+
+    finalized = client.post(f'/api/media/uploads/{upload_id}/finalize').get_json()
+    assert finalized['ok'] and finalized['sha256'] == digest
+    con = sqlite3.connect(db_path)
+    row = con.execute('SELECT original_name, media_type, tags, filename FROM media_item WHERE id = ?', (finalized['media_id'],)).fetchone()
+    assert row == ('class.mp4', 'video', 'class, flow', f'{digest[:2]}/{digest[2:4]}/{digest}.mp4')
+    assert (app_server.MEDIA_DIR / row[3]).read_bytes() == video
+    assert con.execute('SELECT COUNT(*) FROM upload_session').fetchone()[0] == 0
+    assert not (tmp_path / 'uploads' / f'{upload_id}.part').exists()
+
+    bad = client.post('/api/media/uploads', json={'filename': 'bad.mp4', 'size': 4, 'sha256': '0' * 64}).get_json()['upload_id']
+    client.put(f'/api/media/uploads/{bad}?offset=0', data=b'abcd')
+    mismatch = client.post(f'/api/media/uploads/{bad}/finalize')
+    assert mismatch.status_code == 400 and mismatch.get_json()['error'] == 'checksum_mismatch'
+    assert client.get(f'/api/media/uploads/{bad}').get_json()['offset'] == 0
+
+    con.execute("UPDATE upload_session SET updated_at = '2000-01-01T00:00:00+00:00'")
+    con.commit()
+    assert app_server.gc_stale_uploads(con) == 1
+    con.commit()
+    assert not (tmp_path / 'uploads' / f'{bad}.part').exists()
+    assert client.get(f'/api/media/uploads/{bad}').status_code == 404
+    assert client.post(f'/media/{finalized["media_id"]}/delete').status_code == 302
+    con.close()
+
+
+def test_resumable_upload_accepts_large_sessions_and_finalizes_once(tmp_path, monkeypatch):
+    import hashlib
+    import sqlite3
+    import threading
+    import time
+    import app_server
+
+    db_path = tmp_path / 'finalize.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    monkeypatch.setattr(app_server, 'UPLOAD_DIR', tmp_path / 'uploads')
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    app = create_app(port=5477)
+    client = app.test_client()
+
+    # Class recordings run past the 250 MB form-upload cap; only the resumable cap applies here.
+    assert app_server.MEDIA_RESUMABLE_MAX_BYTES >= 2 * 1024 ** 3
+    large = client.post('/api/media/uploads', json={'filename': 'class.mp4', 'size': 1_800_000_000, 'sha256': '0' * 64})
+    assert large.status_code == 201 and large.get_json()['size'] == 1_800_000_000
+    too_large = client.post('/api/media/uploads', json={'filename': 'huge.mp4', 'size': app_server.MEDIA_RESUMABLE_MAX_BYTES + 1})
+    assert too_large.status_code == 400 and too_large.get_json()['error'] == 'file_too_large'
+
+    video = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 64
+    digest = hashlib.sha256(video).hexdigest()
+    upload_id = client.post('/api/media/uploads', json={'filename': 'twice.mp4', 'size': len(video), 'sha256': digest}).get_json()['upload_id']
+    assert client.put(f'/api/media/uploads/{upload_id}?offset=0', data=video).get_json()['offset'] == len(video)
+
+    # Two finalize calls racing: hashing is slowed so both pass the completeness check first.
+    real_sha256 = app_server.file_sha256
+    monkeypatch.setattr(app_server, 'file_sha256', lambda path: time.sleep(0.2) or real_sha256(path))
+    results = []
+
+    def finalize():
+        response = app.test_client().post(f'/api/media/uploads/{upload_id}/finalize')
+        results.append((response.status_code, response.get_json()))
+
+    threads = [threading.Thread(target=finalize) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    # While one finalize holds the session, chunk writes are refused too.
+    assert client.put(f'/api/media/uploads/{upload_id}?offset=0', data=video).status_code == 409
+    for thread in threads:
+        thread.join()
+    assert sorted(status for status, _ in results) == [200, 409]
+    assert [body['error'] for status, body in results if status == 409] == ['upload_finalizing']
+    assert client.post(f'/api/media/uploads/{upload_id}/finalize').status_code == 404
+
+    con = sqlite3.connect(db_path)
+    assert con.execute("SELECT COUNT(*) FROM media_item WHERE original_name = 'twice.mp4'").fetchone()[0] == 1
+    con.close()
+
+
+def test_media_delivery_supports_conditional_and_range_requests(tmp_path, monkeypatch):
+    import hashlib
+    import io
+    import sqlite3
+    from email.utils import format_datetime
+    from datetime import datetime, timedelta, timezone
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'ranges.db'))
+    app = create_app(port=5462)
+    client = app.test_client()
+    video = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 8
+    digest = hashlib.sha256(video).hexdigest()
+    assert client.post('/media/upload', data={'file': (io.BytesIO(video), 'flow.mp4')}, content_type='multipart/form-data').status_code == 302
+    con = sqlite3.connect(app.config['DB_PATH'])
+    media_id, filename = con.execute('SELECT id, filename FROM media_item').fetchone()
+    con.close()
+
+    for url in (f'/media/{media_id}', f'/media/file/{filename}'):
+        full = client.get(url)
+        assert full.status_code == 200 and full.data == video
+        assert full.headers['ETag'] == f'"{digest}"'
+        assert full.headers['Accept-Ranges'] == 'bytes'
+        assert 'immutable' in full.headers['Cache-Control'] and 'max-age=31536000' in full.headers['Cache-Control']
+        assert client.get(url, headers={'If-None-Match': f'W/"other", "{digest}"'}).status_code == 304
+        later = format_datetime(datetime.now(timezone.utc) + timedelta(days=1), usegmt=True)
+        assert client.get(url, headers={'If-Modified-Since': later}).status_code == 304
+
+        single = client.get(url, headers={'Range': 'bytes=100-199'})
+        assert single.status_code == 206
+        assert single.data == video[100:200]
+        assert single.headers['Content-Range'] == f'bytes 100-199/{len(video)}'
+        assert client.get(url, headers={'Range': 'bytes=-10'}).data == video[-10:]
+        assert client.get(url, headers={'Range': 'bytes=100-199', 'If-Range': '"stale"'}).status_code == 200
+
+        multi = client.get(url, headers={'Range': 'bytes=0-9, 50-59, 55-69'})
+        assert multi.status_code == 206
+        assert multi.mimetype == 'multipart/byteranges'
+        assert int(multi.headers['Content-Length']) == len(multi.data)
+        assert f'Content-Range: bytes 0-9/{len(video)}'.encode() in multi.data
+        assert f'Content-Range: bytes 50-69/{len(video)}'.encode() in multi.data
+        assert video[50:70] in multi.data
+
+        unsatisfiable = client.get(url, headers={'Range': f'bytes={len(video) + 5}-'})
+        assert unsatisfiable.status_code == 416
+        assert unsatisfiable.headers['Content-Range'] == f'bytes */{len(video)}'
+    assert client.post(f'/media/{media_id}/delete').status_code == 302
+
+
+class OffloadProxy:
+    # Stand-in for the nginx/Apache front: serves X-Accel-Redirect/X-Sendfile answers from disk.
+    def __init__(self, app, internal_prefix, media_dir):
+        self.app = app
+        self.internal_prefix = internal_prefix
+        self.media_dir = media_dir
+        self.offloaded = []
+
+    def __call__(self, environ, start_response):
+        from pathlib import Path
+        from urllib.parse import unquote
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'], captured['headers'] = status, headers
+            return lambda data: None
+
+        body = b''.join(self.app(environ, capture))
+        headers = dict(captured['headers'])
+        target = None
+        if 'X-Accel-Redirect' in headers:
+            target = self.media_dir / unquote(headers['X-Accel-Redirect'][len(self.internal_prefix):])
+        elif 'X-Sendfile' in headers:
+            target = Path(headers['X-Sendfile'])
+        if target is None:
+            start_response(captured['status'], captured['headers'])
+            return [body]
+        assert body == b''
+        self.offloaded.append(target)
+        data = target.read_bytes()
+        kept = [(k, v) for k, v in captured['headers'] if k not in ('X-Accel-Redirect', 'X-Sendfile', 'Content-Length')]
+        start_response('200 OK', kept + [('Content-Length', str(len(data)))])
+        return [data]
+
+
+def test_media_offload_hands_files_to_front_proxy(tmp_path, monkeypatch):
+    import io
+    import sqlite3
+    import app_server
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'offload.db'))
+    monkeypatch.setenv('MEDIA_OFFLOAD', 'x-accel')
+    monkeypatch.setenv('MEDIA_OFFLOAD_PREFIX', '/internal-media/')
+    app = create_app(port=5463)
+    proxy = OffloadProxy(app.wsgi_app, '/internal-media/', app_server.MEDIA_DIR)
+    app.wsgi_app = proxy
+    client = app.test_client()
+    clip = b'ID3' + bytes(range(200)) * 5
+    assert client.post('/media/upload', data={'file': (io.BytesIO(clip), 'cue.mp3')}, content_type='multipart/form-data').status_code == 302
+    con = sqlite3.connect(app.config['DB_PATH'])
+    media_id, filename = con.execute('SELECT id, filename FROM media_item').fetchone()
+    con.close()
+
+    served = client.get(f'/media/{media_id}')
+    assert served.status_code == 200 and served.data == clip
+    assert 'X-Accel-Redirect' not in served.headers and served.headers['ETag']
+    assert proxy.offloaded == [app_server.MEDIA_DIR / filename]
+    assert client.get(f'/media/{media_id}', headers={'If-None-Match': served.headers['ETag']}).status_code == 304
+    assert client.get('/media/999999').status_code == 404
+    assert len(proxy.offloaded) == 1
+
+    app.config['MEDIA_OFFLOAD'] = 'x-sendfile'
+    assert client.get(f'/media/file/{filename}').data == clip
+    assert proxy.offloaded[-1] == (app_server.MEDIA_DIR / filename).resolve()
+    assert client.post(f'/media/{media_id}/delete').status_code == 302
+
+
+def test_media_fanout_layout_and_online_migration(tmp_path, monkeypatch):
+    import io
+    import json
+    import sqlite3
+    import zipfile
+    import app_server
+
+    media_dir = tmp_path / 'media'
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', media_dir)
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'fanout.db'))
+    app = create_app(port=5464)
+    client = app.test_client()
+    con = sqlite3.connect(app.config['DB_PATH'])
+    for index in range(5):
+        name = f'1700000000_clip{index}.png'
+        (media_dir / name).write_bytes(b'\x89PNG' + bytes([index]) * 50)
+        con.execute(
+            "INSERT INTO media_item (user_id, filename, original_name, media_type, tags, uploaded_at, created_at, updated_at) "
+            "VALUES (1, ?, ?, 'image', '', 'x', 'x', 'x')",
+            (name, name),
+        )
+    con.execute("INSERT INTO media_item (user_id, filename, original_name, media_type, tags, uploaded_at, created_at, updated_at) VALUES (1, 'gone.png', 'gone.png', 'image', '', 'x', 'x', 'x')")
+    con.commit()
+
+    summary = app_server.migrate_media_layout(con, batch_size=2)
+    assert summary == {'moved': 5, 'missing': 1, 'batches': 3}
+    rows = con.execute("SELECT id, filename FROM media_item WHERE filename != 'gone.png' ORDER BY id").fetchall()
+    for index, (media_id, filename) in enumerate(rows):
+        assert filename == app_server.media_relpath(f'1700000000_clip{index}.png')
+        assert (media_dir / filename).is_file()
+        assert client.get(f'/media/{media_id}').data == b'\x89PNG' + bytes([index]) * 50
+        assert client.get(f'/media/file/{filename}').status_code == 200
+    assert sorted(path.name for path in media_dir.iterdir()) == sorted({filename.split('/')[0] for _, filename in rows})
+    assert app_server.migrate_media_layout(con) == {'moved': 0, 'missing': 1, 'batches': 1}
+
+    # Readers holding a pre-migration name still resolve it; unsafe names are refused.
+    assert client.get('/media/file/1700000000_clip0.png').status_code == 200
+    assert client.get('/media/file/a/b/c/d.png').status_code == 400
+
+    upload = client.post('/media/upload', data={'file': (io.BytesIO(b'\x89PNGnew'), 'new.png')}, content_type='multipart/form-data')
+    assert upload.status_code == 302
+    new_name = con.execute('SELECT filename FROM media_item ORDER BY id DESC LIMIT 1').fetchone()[0]
+    assert new_name.count('/') == 2 and (media_dir / new_name).is_file()
+
+    backup = client.get('/api/export/backup')
+    with zipfile.ZipFile(io.BytesIO(backup.data)) as zf:
+        media_names = sorted(name for name in zf.namelist() if name.startswith('media/'))
+        manifest = json.loads(zf.read('manifest.json'))
+    assert media_names == sorted(f'media/{name}' for (name,) in con.execute("SELECT filename FROM media_item WHERE filename != 'gone.png'"))
+    assert manifest['media_files'] == 6
+    con.close()
+
+    restore = client.post(
+        '/api/import/backup',
+        data={'file': (io.BytesIO(backup.data), 'backup.zip'), 'confirm_overwrite': 'true'},
+        content_type='multipart/form-data',
+    )
+    assert restore.status_code == 200 and restore.get_json()['ok']
+    assert (media_dir / new_name).is_file()
+
+
+def _png_with_all_filters(width, height):
+    import zlib
+
+    def pixel(x, y):
+        return bytes([(x * 7) % 256, (y * 5) % 256, (x + y) % 256])
+
+    rows = [b''.join(pixel(x, y) for x in range(width)) for y in range(height)]
+    raw = bytearray()
+    previous = bytes(len(rows[0]))
+    for y, row in enumerate(rows):
+        kind = y % 5
+        out = bytearray()
+        for i, value in enumerate(row):
+            a = row[i - 3] if i >= 3 else 0
+            b = previous[i]
+            c = previous[i - 3] if i >= 3 else 0
+            if kind == 0:
+                predictor = 0
+            elif kind == 1:
+                predictor = a
+            elif kind == 2:
+                predictor = b
+            elif kind == 3:
+                predictor = (a + b) >> 1
+            else:
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                predictor = a if pa <= pb and pa <= pc else b if pb <= pc else c
+            out.append((value - predictor) & 0xFF)
+        raw += bytes([kind]) + out
+        previous = row
+
+    def chunk(kind, data):
+        return len(data).to_bytes(4, 'big') + kind + data + zlib.crc32(kind + data).to_bytes(4, 'big')
+
+    header = width.to_bytes(4, 'big') + height.to_bytes(4, 'big') + bytes([8, 2, 0, 0, 0])
+    png = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(bytes(raw))) + chunk(b'IEND', b'')
+    return png, pixel
+
+
+def test_media_derivatives_are_built_in_background_pool(tmp_path, monkeypatch):
+    import io
+    import sqlite3
+    import app_server
+    from PIL import Image
+
+    png, pixel = _png_with_all_filters(640, 200)
+
+    media_dir = tmp_path / 'media'
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', media_dir)
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'derivatives.db'))
+    app = create_app(port=5465)
+    client = app.test_client()
+    for name in ('wide.png', 'copy.png'):
+        upload = client.post('/media/upload', data={'file': (io.BytesIO(png), name)}, content_type='multipart/form-data')
+        assert upload.status_code == 302
+    assert app_server.drain_media_jobs(timeout=60)
+
+    con = sqlite3.connect(app.config['DB_PATH'])
+    jobs = con.execute('SELECT media_item_id, status, attempts FROM media_job').fetchall()
+    items = con.execute('SELECT id, filename, thumb_filename, width, height, size_bytes FROM media_item ORDER BY id').fetchall()
+    con.close()
+    # The second upload shares the first one's blob, so it reuses its derivatives when they exist.
+    assert jobs[0] == (items[0][0], 'done', 1)
+    assert all(status == 'done' for _, status, _ in jobs)
+    for media_id, filename, thumb_filename, width, height, size_bytes in items:
+        assert thumb_filename == app_server.media_thumb_relpath(filename)
+        assert (width, height, size_bytes) == (640, 200, len(png))
+        served = client.get(f'/media/{media_id}?variant=thumb')
+        assert served.status_code == 200 and served.data == (media_dir / thumb_filename).read_bytes()
+        assert len(served.data) < len(png) / 4
+        with Image.open(io.BytesIO(served.data)) as image:
+            assert image.size == (320, 100)
+            assert max(abs(a - b) for a, b in zip(image.convert('RGB').getpixel((11, 37)), pixel(22, 74))) < 64
+        # The thumbnail is validated by its own ETag, not the original's immutable content hash.
+        original = client.get(f'/media/{media_id}')
+        assert served.headers['ETag'] != original.headers['ETag']
+        assert 'immutable' in original.headers['Cache-Control'] and 'immutable' not in served.headers['Cache-Control']
+        assert client.get(f'/media/{media_id}?variant=thumb', headers={'If-None-Match': served.headers['ETag']}).status_code == 304
+        assert client.get(f'/media/file/{thumb_filename}').headers['ETag'] == served.headers['ETag']
+
+    library = client.get('/media')
+    assert f'/media/{items[0][0]}?variant=thumb'.encode() in library.data
+    assert b'640\xc3\x97200' in library.data
+
+    assert client.post(f'/media/{items[0][0]}/delete').status_code == 302
+    assert client.post(f'/media/{items[1][0]}/delete').status_code == 302
+    assert not (media_dir / items[0][2]).exists()
+
+
+def _mp4_box(kind, payload):
+    return (8 + len(payload)).to_bytes(4, 'big') + kind + payload
+
+
+def test_media_probe_reads_container_headers_for_duration(tmp_path, monkeypatch):
+    import io
+    import sqlite3
+    import app_server
+
+    mvhd = _mp4_box(b'mvhd', bytes(12) + (600).to_bytes(4, 'big') + (600 * 95).to_bytes(4, 'big') + bytes(80))
+    tkhd = _mp4_box(b'tkhd', bytes(76) + (1280 << 16).to_bytes(4, 'big') + (720 << 16).to_bytes(4, 'big'))
+    mp4 = _mp4_box(b'ftyp', b'isom\x00\x00\x02\x00') + _mp4_box(b'mdat', bytes(4096)) + _mp4_box(b'moov', mvhd + _mp4_box(b'trak', tkhd))
+
+    fmt = (1).to_bytes(2, 'little') + (1).to_bytes(2, 'little') + (8000).to_bytes(4, 'little') + (16000).to_bytes(4, 'little') + (2).to_bytes(2, 'little') + (16).to_bytes(2, 'little')
+    body = b'WAVE' + b'fmt ' + len(fmt).to_bytes(4, 'little') + fmt + b'data' + (48000).to_bytes(4, 'little') + bytes(48000)
+    wav = b'RIFF' + len(body).to_bytes(4, 'little') + body
+
+    # 128 kbit/s MPEG-1 layer III behind an ID3v2 tag: duration follows from the payload size.
+    id3 = b'ID3\x04\x00\x00' + bytes([0, 0, 0, 20]) + bytes(20)
+    mp3 = id3 + (b'\xff\xfb\x90\x00' + bytes(413)) * 384
+    xing = bytearray(b'\xff\xfb\x90\x00' + bytes(413))
+    xing[36:48] = b'Xing' + (1).to_bytes(4, 'big') + (1148).to_bytes(4, 'big')
+    vbr = bytes(xing) + (b'\xff\xfb\x90\x00' + bytes(413)) * 10
+
+    def ogg_page(granule, packet):
+        return b'OggS\x00\x00' + granule.to_bytes(8, 'little', signed=True) + bytes(12) + bytes([1, len(packet)]) + packet
+
+    vorbis = b'\x01vorbis' + bytes(4) + b'\x02' + (44100).to_bytes(4, 'little') + bytes(12)
+    ogg = ogg_page(0, vorbis) + bytes(5000) + ogg_page(44100 * 7, b'audio')
+
+    samples = {'clip.mp4': mp4, 'tone.wav': wav, 'song.mp3': mp3, 'vbr.mp3': bytes(vbr), 'loop.ogg': ogg}
+    for name, data in samples.items():
+        (tmp_path / name).write_bytes(data)
+    probe = {name: app_server.probe_media(tmp_path / name) for name in samples}
+    assert probe['clip.mp4'] == {'duration_sec': 95, 'width': 1280, 'height': 720}
+    assert probe['tone.wav']['duration_sec'] == 3
+    assert probe['song.mp3']['duration_sec'] == round(384 * 417 * 8 / 128000)
+    assert probe['vbr.mp3']['duration_sec'] == round(1148 * 1152 / 44100)
+    assert probe['loop.ogg']['duration_sec'] == 7
+    assert app_server.probe_media(None)['duration_sec'] is None
+    (tmp_path / 'cut.mp4').write_bytes(mp4[:40])
+    assert app_server.probe_media(tmp_path / 'cut.mp4') == {'duration_sec': None, 'width': None, 'height': None}
+
+    # Header-only: the payload between the headers is never read.
+    reads = []
+    real_open = open
+
+    def _tracking_open(path, mode='r', *args, **kwargs):
+        handle = real_open(path, mode, *args, **kwargs)
+        real_read = handle.read
+
+        class Tracked:
+            def __getattr__(self, name):
+                return getattr(handle, name)
+
+            def read(self, size=-1):
+                data = real_read(size)
+                reads.append(len(data))
+                return data
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                handle.close()
+
+        return Tracked()
+
+    big = _mp4_box(b'ftyp', b'isom\x00\x00\x02\x00') + _mp4_box(b'mdat', bytes(4 * 1024 * 1024)) + _mp4_box(b'moov', mvhd)
+    (tmp_path / 'big.mp4').write_bytes(big)
+    monkeypatch.setattr(app_server, 'open', _tracking_open, raising=False)
+    assert app_server.probe_media(tmp_path / 'big.mp4')['duration_sec'] == 95
+    monkeypatch.delattr(app_server, 'open')
+    assert sum(reads) < 1024
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'probe.db'))
+    app = create_app(port=5466)
+    client = app.test_client()
+    client.post('/media/upload', data={'file': (io.BytesIO(mp4), 'clip.mp4')}, content_type='multipart/form-data')
+    client.post('/media/upload', data={'file': (io.BytesIO(wav), 'tone.wav'), 'duration_sec': '30'}, content_type='multipart/form-data')
+    assert app_server.drain_media_jobs(timeout=60)
+
+    con = sqlite3.connect(app.config['DB_PATH'])
+    assert con.execute('SELECT original_name, duration_sec, width, height FROM media_item ORDER BY id').fetchall() == [
+        ('clip.mp4', 95, 1280, 720),
+        ('tone.wav', 30, None, None),
+    ]
+
+    # Rows from before the probe existed are filled in batches; typed values are kept.
+    con.execute('UPDATE media_item SET duration_sec = NULL, width = NULL, height = NULL WHERE original_name = ?', ('clip.mp4',))
+    con.commit()
+    summary = app_server.backfill_media_probe(con, batch_size=1)
+    assert summary == {'probed': 1, 'updated': 1, 'batches': 1}
+    assert con.execute('SELECT duration_sec, width, height FROM media_item ORDER BY id').fetchall() == [(95, 1280, 720), (30, None, None)]
+    assert app_server.backfill_media_probe(con) == {'probed': 0, 'updated': 0, 'batches': 0}
+    con.close()
+
+
+def test_media_library_pages_by_keyset_with_tag_and_type_filters(tmp_path, monkeypatch):
+    import re
+    import sqlite3
+    import app_server
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'library.db'))
+    app = create_app(port=5467)
+    client = app.test_client()
+    assert client.get('/media').status_code == 200
+
+    con = sqlite3.connect(app.config['DB_PATH'])
+    user_id = con.execute('SELECT id FROM users ORDER BY id LIMIT 1').fetchone()[0]
+    now = '2026-03-01T00:00:00+00:00'
+    rows = []
+    for index in range(1, 131):
+        media_type = ('image', 'video', 'audio')[index % 3]
+        tags = app_server.parse_tags('mobility, warmup' if index % 2 else 'breathwork, "deep" breath')
+        rows.append((user_id, f'clip{index}.bin', f'clip{index:03d}', media_type, tags, now, now, now))
+    con.executemany(
+        'INSERT INTO media_item (user_id, filename, original_name, media_type, tags, uploaded_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        rows,
+    )
+    con.commit()
+    assert con.execute('SELECT COUNT(*) FROM media_tag WHERE tag = ?', ('"deep" breath',)).fetchone()[0] == 65
+    con.row_factory = sqlite3.Row
+
+    seen, before = [], None
+    while True:
+        page, before = app_server.media_page(con, user_id, 'm.id', before=before, limit=50)
+        seen += [row['id'] for row in page]
+        if before is None:
+            break
+    assert seen == sorted(seen, reverse=True) and len(seen) == 130
+
+    page, cursor = app_server.media_page(con, user_id, 'm.id, m.media_type, m.tags', tag='mobility', media_type='video', limit=10)
+    assert len(page) == 10 and cursor == page[-1]['id']
+    assert all(row['media_type'] == 'video' and 'mobility' in row['tags'].split(', ') for row in page)
+    rest, _ = app_server.media_page(con, user_id, 'm.id', tag='mobility', media_type='video', before=cursor, limit=100)
+    assert len(page) + len(rest) == len([r for r in rows if r[3] == 'video' and 'mobility' in r[4]])
+    con.close()
+
+    first = client.get('/media')
+    assert first.data.count(b'Save metadata') == app_server.MEDIA_PAGE_SIZE
+    assert b'clip130' in first.data and b'clip080' not in first.data
+    older = re.search(rb'href="(/media\?before=\d+)"', first.data).group(1).decode()
+    assert b'clip080' in client.get(older).data
+    filtered = client.get('/media?tag=breathwork&type=audio')
+    names = re.findall(rb'<strong>(clip\d+)</strong>', filtered.data)
+    assert names and all(int(name[4:]) % 6 == 2 for name in names)
+    assert b'breathwork (65)' in filtered.data
+
+    # Editing tags re-projects them; deleting the item drops its tag rows.
+    media_id = int(names[0][4:])
+    assert client.post(f'/media/{media_id}/tags', data={'tags': 'Cooldown, breathwork'}).status_code == 302
+    con = sqlite3.connect(app.config['DB_PATH'])
+    assert {row[0] for row in con.execute('SELECT tag FROM media_tag WHERE media_item_id = ?', (media_id,))} == {'cooldown', 'breathwork'}
+    con.close()
+    assert b'clip' in client.get('/media?tag=cooldown').data
+    assert client.post(f'/media/{media_id}/delete').status_code == 302
+    con = sqlite3.connect(app.config['DB_PATH'])
+    assert con.execute('SELECT COUNT(*) FROM media_tag WHERE media_item_id = ?', (media_id,)).fetchone()[0] == 0
+    con.close()
+
+    builder = client.get('/templates/builder/1?tag=warmup&type=image')
+    assert builder.status_code == 200
+    options = {int(value) for value in re.findall(rb'<option value="(\d+)"', builder.data)}
+    assert len(options) == 22 and all(value % 6 == 3 for value in options)
+    assert b'Older media' not in builder.data
+
+
+def test_backup_export_streams_zip_with_bounded_chunks(tmp_path, monkeypatch):
+    import io
+    import os
+    import zipfile
+    import app_server
+
+    video = os.urandom(3 * 1024 * 1024 + 17)
+    notes = b'warm up, breathe, repeat\n' * 20000
+    (tmp_path / 'clip.mp4').write_bytes(video)
+    (tmp_path / 'notes.txt').write_bytes(notes)
+    entries = [('small.json', b'{"ok": true}'), ('media/clip.mp4', tmp_path / 'clip.mp4'), ('media/notes.txt', tmp_path / 'notes.txt')]
+
+    chunks = list(app_server.stream_zip(entries, chunk_size=64 * 1024))
+    assert len(chunks) > 40
+    assert max(len(chunk) for chunk in chunks) < 96 * 1024
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as zf:
+        assert zf.testzip() is None
+        assert zf.read('media/clip.mp4') == video and zf.read('media/notes.txt') == notes
+        assert zf.getinfo('media/clip.mp4').compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo('media/notes.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo('media/notes.txt').compress_size < len(notes) / 20
+
+    # Entries past the ZIP64 limit get ZIP64 extra fields and still read back.
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1024 * 1024)
+    archive = b''.join(app_server.stream_zip(entries, chunk_size=64 * 1024))
+    assert b'PK\x06\x06' in archive
+    with zipfile.ZipFile(io.BytesIO(archive)) as zf:
+        assert zf.read('media/clip.mp4') == video
+    monkeypatch.undo()
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'stream.db'))
+    app = create_app(port=5468)
+    client = app.test_client()
+    client.post('/media/upload', data={'file': (io.BytesIO(video), 'clip.mp4')}, content_type='multipart/form-data')
+    assert app_server.drain_media_jobs(timeout=60)
+    response = client.get('/api/export/backup', buffered=False)
+    assert response.status_code == 200
+    assert response.is_streamed
+    assert 'flowform_full_backup.zip' in response.headers['Content-Disposition']
+    with zipfile.ZipFile(io.BytesIO(b''.join(response.response))) as zf:
+        names = set(zf.namelist())
+        assert {'flowform.db', 'flowform_backup.json', 'settings.json', 'manifest.json'} <= names
+        media_names = [name for name in names if name.startswith('media/')]
+        assert len(media_names) == 1 and zf.read(media_names[0]) == video
+    response.close()
+    completed = app_server.load_backup_manifest(tmp_path / 'stream.db')
+    assert completed['backup_id'] == response.headers['X-Backup-Id']
+
+    # A download abandoned mid-stream never becomes the base of the next incremental.
+    aborted = client.get('/api/export/backup', buffered=False)
+    next(iter(aborted.response))
+    aborted.close()
+    assert app_server.load_backup_manifest(tmp_path / 'stream.db')['backup_id'] == completed['backup_id']
+    assert app_server.load_backup_manifest(tmp_path / 'other.db') is None
+
+
+def test_database_snapshot_is_consistent_under_concurrent_writes(tmp_path, monkeypatch):
+    import io
+    import sqlite3
+    import threading
+    import zipfile
+    import app_server
+
+    source_path = tmp_path / 'live.db'
+    con = app_server.open_tuned_connection(source_path)
+    con.execute('CREATE TABLE ledger (id INTEGER PRIMARY KEY, amount INTEGER, pad BLOB)')
+    con.execute('CREATE TABLE balance (id INTEGER PRIMARY KEY, total INTEGER)')
+    con.execute('INSERT INTO balance (id, total) VALUES (1, 0)')
+    con.executemany('INSERT INTO ledger (amount, pad) VALUES (1, ?)', [(b'x' * 400,)] * 5000)
+    con.execute('UPDATE balance SET total = 5000')
+    con.commit()
+
+    stop = threading.Event()
+    commits = []
+
+    def writer():
+        connection = app_server.open_tuned_connection(source_path)
+        while not stop.is_set():
+            connection.execute('INSERT INTO ledger (amount, pad) VALUES (1, ?)', (b'y' * 400,))
+            connection.execute('UPDATE balance SET total = total + 1')
+            connection.commit()
+            commits.append(1)
+        connection.close()
+
+    steps = []
+    real_sleep = app_server.time.sleep
+
+    def _pause(seconds):
+        steps.append(len(commits))
+        real_sleep(0.001)
+
+    monkeypatch.setattr(app_server.time, 'sleep', _pause)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        app_server.snapshot_database(source_path, tmp_path / 'snap.db', pages=8)
+    finally:
+        stop.set()
+        thread.join()
+        monkeypatch.undo()
+
+    # Writers kept committing between backup steps, yet the copy is one point in time.
+    assert len(steps) > 50 and steps[-1] > steps[0]
+    snap = sqlite3.connect(tmp_path / 'snap.db')
+    assert snap.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    assert snap.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    count, total = snap.execute('SELECT (SELECT COUNT(*) FROM ledger), (SELECT total FROM balance)').fetchone()
+    assert count == total >= 5000
+    snap.close()
+    con.close()
+
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'export.db'))
+    app = create_app(port=5469)
+    client = app.test_client()
+    response = client.get('/api/export/backup')
+    with zipfile.ZipFile(io.BytesIO(response.data)) as zf:
+        (tmp_path / 'archived.db').write_bytes(zf.read('flowform.db'))
+    archived = sqlite3.connect(tmp_path / 'archived.db')
+    assert archived.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    assert archived.execute('PRAGMA user_version').fetchone()[0] == app_server.SCHEMA_VERSION
+    archived.close()
+    assert not list(tmp_path.glob('archived.db-wal'))
+
+
+def test_incremental_backups_emit_changes_and_restore_from_chain(tmp_path, monkeypatch):
+    import io
+    import json
+    import os
+    import sqlite3
+    import zipfile
+    import app_server
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'source.db'))
+    app = create_app(port=5470)
+    client = app.test_client()
+    first_clip, second_clip = os.urandom(200_000), os.urandom(150_000)
+
+    def upload(data, name):
+        client.post('/media/upload', data={'file': (io.BytesIO(data), name)}, content_type='multipart/form-data')
+        assert app_server.drain_media_jobs(timeout=60)
+
+    upload(first_clip, 'first.mp4')
+    con = sqlite3.connect(app.config['DB_PATH'])
+    user_id = con.execute('SELECT id FROM users ORDER BY id LIMIT 1').fetchone()[0]
+    con.executemany(
+        'INSERT INTO assistant_message (user_id, prompt, response, mode, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+        [(user_id, f'prompt {i}', 'r' * 500, 'coach', '2026-03-01', '2026-03-01') for i in range(4000)],
+    )
+    con.commit()
+    con.close()
+
+    def backup(**params):
+        response = client.get('/api/export/backup', query_string=params)
+        assert response.status_code == 200
+        data = response.data
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            return data, set(zf.namelist()), json.loads(zf.read('manifest.json'))
+
+    full, full_names, full_manifest = backup()
+    assert full_manifest['kind'] == 'full' and full_manifest['base_id'] is None
+    assert 'flowform.db' in full_names and len(full_manifest['db']['chunks']) > 20
+
+    assert client.post('/api/recovery/checkin', json={'sleep_hours': 6, 'stress_1_10': 7}).status_code == 200
+    upload(second_clip, 'second.mp4')
+    first_inc, first_names, first_manifest = backup(mode='incremental')
+    assert first_manifest['kind'] == 'incremental' and first_manifest['base_id'] == full_manifest['backup_id']
+    assert 'flowform.db' not in first_names
+    chunks = [name for name in first_names if name.startswith('db_chunks/')]
+    assert 0 < len(chunks) < len(first_manifest['db']['chunks']) / 4
+    assert [name for name in first_names if name.startswith('media/')] == [f'media/{app_server.media_relpath(app_server.hashlib.sha256(second_clip).hexdigest() + ".mp4")}']
+    # Apart from the new clip, the archive carries only the changed slices of the database.
+    assert len(first_inc) - len(second_clip) < (len(full) - len(first_clip)) / 3
+
+    con = sqlite3.connect(app.config['DB_PATH'])
+    first_id = con.execute("SELECT id FROM media_item WHERE original_name = 'first.mp4'").fetchone()[0]
+    con.close()
+    assert client.post(f'/media/{first_id}/delete').status_code == 302
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_KEEP', 1)
+    second_inc, second_names, second_manifest = backup(mode='incremental')
+    assert second_manifest['base_id'] == first_manifest['backup_id']
+    assert not [name for name in second_names if name.startswith('media/')]
+    assert client.get('/api/export/backup?mode=incremental&base=0123abcd').status_code == 404
+    # Pruning keeps the newest manifest and every ancestor its chain restores from.
+    manifest_dir = app_server.backup_manifest_dir(tmp_path / 'source.db')
+    chain_ids = {full_manifest['backup_id'], first_manifest['backup_id'], second_manifest['backup_id']}
+    assert {path.stem for path in manifest_dir.glob('*.json')} == chain_ids
+
+    source = sqlite3.connect(app.config['DB_PATH'])
+    expected = source.execute('SELECT COUNT(*), MAX(sleep_hours) FROM recovery_checkin').fetchone()
+    source.close()
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'restored.db'))
+    restored_app = create_app(port=5471)
+    restore_client = restored_app.test_client()
+
+    def restore(archives, **form):
+        files = [(io.BytesIO(data), f'backup{index}.zip') for index, data in enumerate(archives)]
+        return restore_client.post('/api/import/backup', data={'file': files, **form}, content_type='multipart/form-data')
+
+    assert restore([full, second_inc]).get_json()['error'] == 'backup_chain_incomplete'
+    assert restore([first_inc, second_inc]).get_json()['error'] == 'backup_chain_incomplete'
+    preview = restore([second_inc, full, first_inc]).get_json()
+    assert preview['requires_confirmation'] is True and preview['summary']['backups'] == 3
+    restored = restore([second_inc, full, first_inc], confirm_overwrite='true')
+    assert restored.status_code == 200 and restored.get_json()['ok'] is True
+
+    con = sqlite3.connect(tmp_path / 'restored.db')
+    assert con.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+    assert con.execute('SELECT COUNT(*), MAX(sleep_hours) FROM recovery_checkin').fetchone() == expected
+    assert con.execute('SELECT COUNT(*) FROM assistant_message').fetchone()[0] == 4000
+    assert [row[0] for row in con.execute('SELECT original_name FROM media_item')] == ['second.mp4']
+    con.close()
+    restored_files = [path for path in (tmp_path / 'media').rglob('*') if path.is_file() and '.thumb.' not in path.name]
+    assert [path.read_bytes() for path in restored_files] == [second_clip]
+
+    # A new full backup needs no earlier chain, so the old manifests go.
+    _, _, fresh_manifest = backup()
+    assert {path.stem for path in manifest_dir.glob('*.json')} == {fresh_manifest['backup_id']}
+
+
+def test_backup_media_hashes_reuse_previous_manifest_for_unchanged_legacy_files(tmp_path, monkeypatch):
+    import os
+    import sqlite3
+    import app_server
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    legacy = tmp_path / 'media' / '1700000000_legacy.png'
+    legacy.parent.mkdir()
+    legacy.write_bytes(b'\x89PNGlegacy')
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE media_item (filename TEXT, content_sha256 TEXT)')
+    con.executemany('INSERT INTO media_item VALUES (?, ?)', [(legacy.name, None), ('ab/cd/missing.png', 'f' * 64)])
+    reads = []
+    real_sha256 = app_server.file_sha256
+    monkeypatch.setattr(app_server, 'file_sha256', lambda path: reads.append(path.name) or real_sha256(path))
+
+    hashes, stats = app_server.media_file_hashes(con)
+    assert hashes == {legacy.name: real_sha256(legacy)} and list(stats) == [legacy.name]
+    assert app_server.media_file_hashes(con, {'media': hashes, 'media_stat': stats}) == (hashes, stats)
+    assert reads == [legacy.name]
+
+    legacy.write_bytes(b'\x89PNGlegacy, edited')
+    os.utime(legacy, ns=(stats[legacy.name][0] + 10**9, stats[legacy.name][0] + 10**9))
+    assert app_server.media_file_hashes(con, {'media': hashes, 'media_stat': stats})[0] == {legacy.name: real_sha256(legacy)}
+    assert reads == [legacy.name, legacy.name]
+
+
+def test_backup_restore_streams_members_and_verifies_hashes_in_pool(tmp_path, monkeypatch):
+    import io
+    import os
+    import sqlite3
+    import threading
+    import zipfile
+    import app_server
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'verified.db'))
+    app = create_app(port=5472)
+    client = app.test_client()
+    clips = [os.urandom(120_000 + index) for index in range(3)]
+    for index, clip in enumerate(clips):
+        client.post('/media/upload', data={'file': (io.BytesIO(clip), f'clip{index}.mp4')}, content_type='multipart/form-data')
+    assert app_server.drain_media_jobs(timeout=60)
+    backup = client.get('/api/export/backup').data
+
+    # Same manifest, one media member altered: the restore must refuse it before touching live data.
+    tampered = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(backup)) as zin, zipfile.ZipFile(tampered, 'w') as zout:
+        victim = sorted(name for name in zin.namelist() if name.startswith('media/'))[0]
+        for info in zin.infolist():
+            data = zin.read(info.filename)
+            zout.writestr(info, data[:-1] + bytes([data[-1] ^ 1]) if info.filename == victim else data)
+
+    client.post('/api/recovery/checkin', json={'sleep_hours': 5, 'stress_1_10': 3})
+    failed = client.post(
+        '/api/import/backup',
+        data={'file': (io.BytesIO(tampered.getvalue()), 'tampered.zip'), 'confirm_overwrite': 'true'},
+        content_type='multipart/form-data',
+    )
+    assert failed.status_code == 400
+    assert 'backup_checksum_mismatch' in failed.get_json()['message'] and victim in failed.get_json()['message']
+    con = sqlite3.connect(tmp_path / 'verified.db')
+    assert con.execute('SELECT COUNT(*) FROM recovery_checkin').fetchone()[0] == 1
+    con.close()
+
+    # A media file the manifest lists but the archive dropped is a mismatch, not a silent skip.
+    truncated = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(backup)) as zin, zipfile.ZipFile(truncated, 'w') as zout:
+        for info in zin.infolist():
+            if info.filename != victim:
+                zout.writestr(info, zin.read(info.filename))
+    missing = client.post(
+        '/api/import/backup',
+        data={'file': (io.BytesIO(truncated.getvalue()), 'truncated.zip'), 'confirm_overwrite': 'true'},
+        content_type='multipart/form-data',
+    )
+    assert missing.status_code == 400
+    assert 'backup_checksum_mismatch' in missing.get_json()['message'] and victim in missing.get_json()['message']
+
+    # Members are copied out through open(); only the small manifest is read whole.
+    read_names, hash_threads = [], set()
+    real_read, real_sha = zipfile.ZipFile.read, app_server.file_sha256
+
+    def _read(self, name, pwd=None):
+        read_names.append(name)
+        return real_read(self, name, pwd)
+
+    def _sha(path):
+        hash_threads.add(threading.current_thread().name)
+        return real_sha(path)
+
+    monkeypatch.setattr(zipfile.ZipFile, 'read', _read)
+    monkeypatch.setattr(app_server, 'file_sha256', _sha)
+    restored = client.post(
+        '/api/import/backup',
+        data={'file': (io.BytesIO(backup), 'backup.zip'), 'confirm_overwrite': 'true'},
+        content_type='multipart/form-data',
+    )
+    assert restored.status_code == 200 and restored.get_json()['ok'] is True
+    assert read_names == ['manifest.json']
+    assert hash_threads and threading.current_thread().name not in hash_threads
+    con = sqlite3.connect(tmp_path / 'verified.db')
+    assert con.execute('SELECT COUNT(*) FROM recovery_checkin').fetchone()[0] == 0
+    con.close()
+    assert sorted(path.read_bytes() for path in (tmp_path / 'media').rglob('*.mp4')) == sorted(clips)
+    assert not list(tmp_path.glob('*.restore_tmp'))
+
+
+def test_export_jobs_run_in_background_and_reuse_artifacts(tmp_path, monkeypatch):
+    import io
+    import os
+    import sqlite3
+    import zipfile
+    import app_server
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    monkeypatch.setattr(app_server, 'BACKUP_MANIFEST_DIR', tmp_path / 'backups')
+    monkeypatch.setattr(app_server, 'EXPORT_DIR', tmp_path / 'exports')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'jobs.db'))
+    app = create_app(port=5473)
+    client = app.test_client()
+    client.post('/api/recovery/checkin', json={'sleep_hours': 7, 'stress_1_10': 2})
+
+    assert client.post('/api/export/jobs', json={'kind': 'nope'}).status_code == 400
+    assert client.post('/api/export/jobs', json={'kind': 'plan_pdf', 'params': {'plan_id': 'x'}}).status_code == 400
+    assert client.post('/api/export/jobs', json={'kind': 'json', 'params': {'force': 'true'}}).status_code == 400
+
+    first = client.post('/api/export/jobs', json={'kind': 'json'})
+    assert first.status_code == 202
+    job = first.get_json()
+    assert job['status'] in {'queued', 'running', 'done'} and job['cached'] is False
+    assert app_server.drain_export_jobs(timeout=60)
+
+    status = client.get(job['status_url']).get_json()
+    assert status['status'] == 'done' and status['size_bytes'] > 0
+    download = client.get(status['download_url'])
+    assert download.status_code == 200
+    assert 'flowform_backup.json' in download.headers['Content-Disposition']
+    assert download.get_json()['recovery'][0]['sleep_hours'] == 7
+    assert download.get_json()['recovery'] == client.get('/api/export/json').get_json()['recovery']
+
+    # Unchanged data: the finished artifact is handed back without new work.
+    again = client.post('/api/export/jobs', json={'kind': 'json'})
+    assert again.status_code == 200 and again.get_json()['cached'] is True and again.get_json()['job_id'] == job['job_id']
+
+    # A write bumps the user's data version, so the next request builds a fresh artifact.
+    client.post('/api/recovery/checkin', json={'date': '2026-01-02', 'sleep_hours': 4, 'stress_1_10': 8})
+    fresh = client.post('/api/export/jobs', json={'kind': 'json'}).get_json()
+    assert fresh['job_id'] != job['job_id'] and fresh['data_version'] > job['data_version']
+    assert app_server.drain_export_jobs(timeout=60)
+    assert client.get(fresh['status_url']).get_json()['status'] == 'done'
+    assert client.get(job['status_url']).get_json()['status'] == 'expired'
+    assert client.get(f"{job['status_url']}/download").status_code == 409
+
+    # Route errors surface as failed jobs rather than artifacts.
+    missing = client.post('/api/export/jobs', json={'kind': 'plan_pdf', 'params': {'plan_id': 999}}).get_json()
+    assert app_server.drain_export_jobs(timeout=60)
+    failed = client.get(missing['status_url']).get_json()
+    assert failed['status'] == 'failed' and failed['error'] == 'plan_not_found'
+
+    backup_job = client.post('/api/export/jobs', json={'kind': 'backup'}).get_json()
+    assert app_server.drain_export_jobs(timeout=60)
+    archive = client.get(client.get(backup_job['status_url']).get_json()['download_url'])
+    with zipfile.ZipFile(io.BytesIO(archive.data)) as zf:
+        assert 'flowform.db' in zf.namelist() and 'manifest.json' in zf.namelist()
+    # Backups cover tables no data version tracks, so they are rebuilt every time.
+    monkeypatch.setattr(app_server, 'EXPORT_JOB_HEARTBEAT_SECONDS', 0)
+    rebuilt = client.post('/api/export/jobs', json={'kind': 'backup'})
+    assert rebuilt.status_code == 202 and rebuilt.get_json()['job_id'] != backup_job['job_id']
+    assert app_server.drain_export_jobs(timeout=60)
+    assert client.get(rebuilt.get_json()['status_url']).get_json()['status'] == 'done'
+    assert not list((tmp_path / 'exports').glob('*.part'))
+
+    # Past the TTL, finished and failed jobs go with their artifacts, whatever their params;
+    # so do stray files no job points at.
+    con = sqlite3.connect(tmp_path / 'jobs.db')
+    old = '2000-01-01T00:00:00+00:00'
+    con.execute('UPDATE export_job SET updated_at = ? WHERE id IN (?, ?)', (old, fresh['job_id'], missing['job_id']))
+    fresh_artifact = con.execute('SELECT artifact FROM export_job WHERE id = ?', (fresh['job_id'],)).fetchone()[0]
+    con.commit()
+    stray = tmp_path / 'exports' / 'deadbeef.0123abcd.part'
+    stray.write_bytes(b'partial')
+    os.utime(stray, (0, 0))
+    client.post('/api/export/jobs', json={'kind': 'history_csv'})
+    assert app_server.drain_export_jobs(timeout=60)
+    remaining = {row[0] for row in con.execute('SELECT id FROM export_job')}
+    con.close()
+    assert fresh['job_id'] not in remaining and missing['job_id'] not in remaining
+    assert rebuilt.get_json()['job_id'] in remaining
+    assert not (tmp_path / 'exports' / fresh_artifact).exists() and not stray.exists()
+    assert client.get(fresh['status_url']).status_code == 404
+
+    # Double clicks join the job in flight; the per-user queue is bounded.
+    monkeypatch.setattr(app_server, 'submit_export_job', lambda app, job_id: None)
+    queued = [client.post('/api/export/jobs', json={'kind': 'plan_pdf', 'params': {'plan_id': n}}) for n in (1, 1, 2, 3)]
+    assert [r.status_code for r in queued] == [202, 202, 202, 202]
+    assert queued[0].get_json()['job_id'] == queued[1].get_json()['job_id']
+    assert client.post('/api/export/jobs', json={'kind': 'plan_pdf', 'params': {'plan_id': 4}}).status_code == 429
+    assert client.get('/api/export/jobs/unknown').status_code == 404
+
+
+def test_plan_spec_pins_template_picks_against_catalog_changes(tmp_path, monkeypatch):
+    import json
+    import sqlite3
+    import app_server
+
+    db_path = tmp_path / 'pinned.db'
+    monkeypatch.setenv('DB_PATH', str(db_path))
+    app = create_app(port=5474)
+    client = app.test_client()
+    assert client.post('/api/plan/create', json={'goal': 'hybrid', 'days_per_week': 3, 'minutes_per_session': 45, 'weeks': 12}).status_code == 200
+
+    def future_picks():
+        days = json.loads(client.get('/api/export/json').data)['plan_days']
+        return [(d['week'], d['day_index'], d['template_id']) for d in days if d['week'] > 2]
+
+    before = future_picks()
+    con = sqlite3.connect(db_path)
+    version = con.execute('SELECT template_version FROM plan_spec').fetchone()[0]
+    index = app_server.template_index(con, db_path)
+    assert index.version == version
+    # Rebuilding from the same rows, as another worker would, yields the same version.
+    app_server.invalidate_template_index(db_path)
+    assert app_server.template_index(con, db_path).version == version
+
+    # New templates at every duration would win most nearest-duration picks if weeks were re-chosen.
+    disciplines = [row[0] for row in con.execute('SELECT DISTINCT discipline FROM session_template')]
+    con.executemany(
+        "INSERT INTO session_template (name, discipline, duration_minutes, level, json_blocks, created_at, updated_at) VALUES (?, ?, ?, 'all', '{\"blocks\": []}', '2026-01-01', '2026-01-01')",
+        [(f'New {discipline} {minutes}', discipline, minutes) for discipline in disciplines for minutes in range(30, 76)],
+    )
+    con.commit()
+    app_server.invalidate_template_index(db_path)
+    assert app_server.template_index(con, db_path).version != version
+    assert future_picks() == before
+    assert client.get('/plan/current/week/9/day/1/start').status_code == 302
+    stored = con.execute('SELECT template_id FROM plan_day WHERE week = 9 AND day_index = 1').fetchone()[0]
+    assert (9, 1, stored) in before
+    con.close()
+
+
+def test_media_file_route_only_serves_the_callers_media(tmp_path, monkeypatch):
+    import io
+    import sqlite3
+    import app_server
+
+    monkeypatch.setattr(app_server, 'MEDIA_DIR', tmp_path / 'media')
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'owned.db'))
+    monkeypatch.setenv('MEDIA_OFFLOAD', 'x-accel')
+    app = create_app(port=5475)
+    client = app.test_client()
+    assert client.post('/media/upload', data={'file': (io.BytesIO(b'\x89PNGmine'), 'mine.png')}, content_type='multipart/form-data').status_code == 302
+    con = sqlite3.connect(tmp_path / 'owned.db')
+    mine = con.execute('SELECT filename FROM media_item').fetchone()[0]
+
+    # A file another account uploaded exists on disk, but is not the founder's to read.
+    other = app_server.media_relpath('other.png')
+    (app_server.MEDIA_DIR / other).parent.mkdir(parents=True, exist_ok=True)
+    (app_server.MEDIA_DIR / other).write_bytes(b'\x89PNGtheirs')
+    con.execute("INSERT INTO users (email, display_name, created_at, updated_at) VALUES ('other@example.com', 'Other', 'x', 'x')")
+    other_user = con.execute('SELECT MAX(id) FROM users').fetchone()[0]
+    con.execute(
+        "INSERT INTO media_item (user_id, filename, original_name, media_type, tags, uploaded_at, created_at, updated_at) VALUES (?, ?, 'other.png', 'image', '', 'x', 'x', 'x')",
+        (other_user, other),
+    )
+    con.commit()
+    con.close()
+
+    assert 'X-Accel-Redirect' in client.get(f'/media/file/{mine}').headers
+    for name in (other, 'other.png'):
+        denied = client.get(f'/media/file/{name}')
+        assert denied.status_code == 404 and 'X-Accel-Redirect' not in denied.headers
@@ -16,6 +16,8 @@ def main() -> int:
     steps = [
         [sys.executable, "tools/check_structure.py"],
         [sys.executable, "-m", "pytest", "tests_smoke.py"],
+        [sys.executable, "-m", "pytest", "tests_query_plans.py"],
+        [sys.executable, "-m", "pytest", "tests"],
         [sys.executable, "-m", "pytest", "smoke_test.py"],
     ]
 